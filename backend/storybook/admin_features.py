@@ -2,21 +2,26 @@
 Enhanced Admin Features for PixelTales Platform Management
 """
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db.models import Count, Q, Sum, Avg, F
+from django.http import HttpResponse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from datetime import timedelta, datetime
 from .models import (
     UserProfile, Story, Character, Comment, Like, Rating,
     ParentChildRelationship, TeacherStudentRelationship,
     Achievement, UserAchievement, Notification, Message, 
-    Friendship, CollaborationSession, SavedStory, StoryRead
+    Friendship, CollaborationSession, SavedStory, StoryRead, Announcement
 )
 from .serializers import UserProfileSerializer, StorySerializer
 from .admin_decorators import admin_required
+from .announcement_service import AnnouncementService
+from .ws_metrics import MessageMetrics
 
 
 # ============================================================
@@ -453,28 +458,25 @@ def send_announcement(request):
             'error': 'Title and message are required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Get target users
-    if target_type == 'all':
-        users = User.objects.filter(is_active=True)
-    else:
-        profiles = UserProfile.objects.filter(user_type=target_type)
-        users = User.objects.filter(id__in=profiles.values_list('user_id', flat=True), is_active=True)
-    
-    # Create notifications
-    notifications = [
-        Notification(
-            user=user,
-            notification_type='announcement',
-            title=title,
-            message=message
-        ) for user in users
-    ]
+    valid_targets = [choice[0] for choice in Announcement.TARGET_TYPES]
+    if target_type not in valid_targets:
+        return Response({
+            'success': False,
+            'error': f'target_type must be one of: {", ".join(valid_targets)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    Notification.objects.bulk_create(notifications)
+    # Stored once and broadcast once - users see it in their inbox (fan-out on read)
+    announcement = AnnouncementService.publish(
+        title=title,
+        message=message,
+        target_type=target_type,
+        created_by=getattr(request, 'admin_user', None)
+    )
     
     return Response({
         'success': True,
-        'message': f'Announcement sent to {len(notifications)} users'
+        'message': 'Announcement published',
+        'announcement_id': announcement.id
     })
 
 
@@ -535,12 +537,33 @@ def get_system_health(request):
             'total_stories': Story.objects.count(),
             'django_version': django.get_version(),
             'python_version': f'{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}',
-        }
+        },
+        # Per message type, for the worker process that served this request
+        'websocket_messages': MessageMetrics.snapshot(),
     }
     
     return Response(health_data)
 
 
+def _prometheus_metrics(request):
+    return HttpResponse(MessageMetrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def get_prometheus_metrics(request):
+    """
+    WebSocket message metrics of this worker in the Prometheus text format
+
+    Scrapers send 'Authorization: Bearer <METRICS_TOKEN>'; admins can use their admin token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return _prometheus_metrics(request)
+    return admin_required(_prometheus_metrics)(request)
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @admin_required
@@ -0,0 +1,116 @@
+"""
+Shared HTTP clients for the AI providers
+One keep-alive connection pool per provider host, in blocking (requests) and async (httpx) flavours
+"""
+import asyncio
+import threading
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class ProviderHTTP:
+    """
+    Pooled HTTP clients for calls to AI providers
+
+    Calls to the same scheme://host reuse one requests.Session (sync views,
+    services, management commands) or one httpx.AsyncClient per event loop
+    (async views under daphne), so repeat calls skip the TCP and TLS
+    handshakes. The timeout callers pass is the read timeout; connecting is
+    capped at AI_HTTP_CONNECT_TIMEOUT so an unreachable provider fails fast.
+    """
+
+    _sessions = {}  # origin -> requests.Session
+    _async_clients = weakref.WeakKeyDictionary()  # event loop -> {origin: httpx.AsyncClient}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def origin(url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    @classmethod
+    def connect_timeout(cls):
+        return getattr(settings, 'AI_HTTP_CONNECT_TIMEOUT', 5)
+
+    @classmethod
+    def pool_size(cls):
+        return getattr(settings, 'AI_HTTP_POOL_SIZE', 20)
+
+    # ---------- Blocking ----------
+
+    @classmethod
+    def session(cls, url):
+        """The keep-alive session of the URL's host"""
+        origin = cls.origin(url)
+        session = cls._sessions.get(origin)
+        if session is None:
+            with cls._lock:
+                session = cls._sessions.get(origin)
+                if session is None:
+                    session = requests.Session()
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # Shared by all users
+                    session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=cls.pool_size()))
+                    cls._sessions[origin] = session
+        return session
+
+    @classmethod
+    def request(cls, method, url, timeout=60, **kwargs):
+        """requests-style call through the host's pooled session"""
+        return cls.session(url).request(method, url, timeout=(cls.connect_timeout(), timeout), **kwargs)
+
+    @classmethod
+    def get(cls, url, timeout=60, **kwargs):
+        return cls.request('GET', url, timeout=timeout, **kwargs)
+
+    @classmethod
+    def post(cls, url, timeout=60, **kwargs):
+        return cls.request('POST', url, timeout=timeout, **kwargs)
+
+    # ---------- Async ----------
+
+    @classmethod
+    def async_client(cls, url):
+        """The keep-alive httpx client of the URL's host on the running event loop"""
+        clients = cls._async_clients.setdefault(asyncio.get_running_loop(), {})
+        origin = cls.origin(url)
+        client = clients.get(origin)
+        if client is None or client.is_closed:
+            pool = cls.pool_size()
+            client = clients[origin] = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool)
+            )
+        return client
+
+    @classmethod
+    async def arequest(cls, method, url, timeout=60, **kwargs):
+        """httpx call through the host's pooled client; raises httpx.TimeoutException on timeouts"""
+        return await cls.async_client(url).request(
+            method, url, timeout=httpx.Timeout(timeout, connect=cls.connect_timeout()), **kwargs
+        )
+
+    @classmethod
+    def astream(cls, method, url, timeout=60, **kwargs):
+        """Streaming httpx call (async context manager yielding the response) through the pooled client"""
+        return cls.async_client(url).stream(
+            method, url, timeout=httpx.Timeout(timeout, connect=cls.connect_timeout()), **kwargs
+        )
+
+    @classmethod
+    async def aget(cls, url, timeout=60, **kwargs):
+        return await cls.arequest('GET', url, timeout=timeout, **kwargs)
+
+    @classmethod
+    async def apost(cls, url, timeout=60, **kwargs):
+        return await cls.arequest('POST', url, timeout=timeout, **kwargs)
+
+    @classmethod
+    async def aclose(cls):
+        """Close the async clients of the running event loop"""
+        clients = cls._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
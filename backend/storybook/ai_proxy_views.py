@@ -4,14 +4,25 @@ Secure proxy endpoints for external AI services (Gemini, OCR, Image Generation)
 API keys are kept secure on the backend and never exposed to frontend
 """
 from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 import requests
+import httpx
 import json
 import base64
+import logging
+import math
+from functools import wraps
 from io import BytesIO
+from .ai_http import ProviderHTTP
+from .ai_rate_limit import AIRateLimiter, KEY_SETTINGS, RateLimited
+from .image_cache import ImageCache, ImageFetchError, ImageFetchTimeout
+
+logger = logging.getLogger(__name__)
 
 
 # Gemini API Configuration
@@ -19,7 +30,7 @@ from io import BytesIO
 GEMINI_API_URL = 'https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent'
 GEMINI_VISION_API_URL = 'https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent'
 GEMINI_IMAGE_API_URL = 'https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash-image:generateContent'
-GEMINI_API_KEY = settings.GOOGLE_AI_API_KEY
+# Provider keys (single key settings or AI_KEY_POOLS) are read through AIRateLimiter.keys()
 
 # OCR.space API Configuration
 OCR_SPACE_API_KEY = getattr(settings, 'OCR_SPACE_API_KEY', None)
@@ -29,15 +40,10 @@ OCR_SPACE_API_URL = 'https://api.ocr.space/parse/image'
 POLLINATIONS_API_KEY = getattr(settings, 'POLLINATIONS_API_KEY', None)
 POLLINATIONS_API_URL = 'https://image.pollinations.ai/prompt'
 
-# Replicate API Configuration
-REPLICATE_API_TOKEN = getattr(settings, 'REPLICATE_API_TOKEN', None)
-
 # Groq API Configuration
-GROQ_API_KEY = getattr(settings, 'GROQ_API_KEY', None)
 GROQ_API_URL = 'https://api.groq.com/openai/v1/chat/completions'
 
 # OpenRouter API Configuration
-OPENROUTER_API_KEY = getattr(settings, 'OPENROUTER_API_KEY', None)
 OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 
 # Import Replicate (optional dependency)
@@ -49,6 +55,36 @@ except ImportError:
     print("⚠️ Replicate library not installed. Install with: pip install replicate")
 
 
+def _gemini_post(url, **kwargs):
+    """POST to a Gemini endpoint with a pooled key that has capacity (raises RateLimited)"""
+    api_key = AIRateLimiter.acquire('gemini')
+    response = ProviderHTTP.post(f'{url}?key={api_key}', **kwargs)
+    AIRateLimiter.observe('gemini', api_key, response.status_code, response.headers)
+    return response
+
+
+# What a 429 tells the user, by the kind of request that hit the limit
+BUSY_MESSAGES = {
+    'story': 'Wow, a lot of people are writing stories right now! Please try again in a few seconds.',
+    'image': 'Lots of pictures are being drawn right now! Please try again in a few seconds.',
+    'reading': 'Lots of pages are being read right now! Please try again in a few seconds.',
+}
+
+
+def _rate_limited_response(error, kind='story'):
+    """429 telling the client when capacity frees up"""
+    response = Response(
+        {
+            'error': BUSY_MESSAGES[kind],
+            'code': 'RATE_LIMIT',
+            'retry_after': round(error.retry_after, 1),
+        },
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = error.retry_after_header
+    return response
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_story_with_gemini(request):
@@ -56,7 +92,7 @@ def generate_story_with_gemini(request):
     Proxy endpoint for Gemini AI story generation
     Keeps API key secure on backend
     """
-    if not GEMINI_API_KEY:
+    if not AIRateLimiter.keys('gemini'):
         return Response(
             {'error': 'Gemini API not configured on server'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -73,8 +109,8 @@ def generate_story_with_gemini(request):
             )
         
         # Make request to Gemini API
-        response = requests.post(
-            f'{GEMINI_API_URL}?key={GEMINI_API_KEY}',
+        response = _gemini_post(
+            GEMINI_API_URL,
             headers={'Content-Type': 'application/json'},
             json={
                 'contents': [{'parts': [{'text': prompt}]}],
@@ -91,6 +127,8 @@ def generate_story_with_gemini(request):
         
         return Response(response.json(), status=status.HTTP_200_OK)
         
+    except RateLimited as e:
+        return _rate_limited_response(e)
     except requests.exceptions.Timeout:
         return Response(
             {'error': 'Request timeout - please try again'},
@@ -109,7 +147,7 @@ def generate_character_with_gemini(request):
     """
     Proxy endpoint for Gemini AI character generation
     """
-    if not GEMINI_API_KEY:
+    if not AIRateLimiter.keys('gemini'):
         return Response(
             {'error': 'Gemini API not configured on server'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -125,8 +163,8 @@ def generate_character_with_gemini(request):
             )
         
         # Make request to Gemini API
-        response = requests.post(
-            f'{GEMINI_API_URL}?key={GEMINI_API_KEY}',
+        response = _gemini_post(
+            GEMINI_API_URL,
             headers={'Content-Type': 'application/json'},
             json={
                 'contents': [{'parts': [{'text': prompt}]}],
@@ -148,6 +186,8 @@ def generate_character_with_gemini(request):
         
         return Response(response.json(), status=status.HTTP_200_OK)
         
+    except RateLimited as e:
+        return _rate_limited_response(e)
     except Exception as e:
         return Response(
             {'error': f'Server error: {str(e)}'},
@@ -161,7 +201,7 @@ def analyze_image_with_gemini(request):
     """
     Proxy endpoint for Gemini Vision API (OCR and image analysis)
     """
-    if not GEMINI_API_KEY:
+    if not AIRateLimiter.keys('gemini'):
         return Response(
             {'error': 'Gemini API not configured on server'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -182,8 +222,8 @@ def analyze_image_with_gemini(request):
             image_data = image_data.split(',')[1]
         
         # Make request to Gemini Vision API
-        response = requests.post(
-            f'{GEMINI_VISION_API_URL}?key={GEMINI_API_KEY}',
+        response = _gemini_post(
+            GEMINI_VISION_API_URL,
             headers={'Content-Type': 'application/json'},
             json={
                 'contents': [{
@@ -209,6 +249,8 @@ def analyze_image_with_gemini(request):
         
         return Response(response.json(), status=status.HTTP_200_OK)
         
+    except RateLimited as e:
+        return _rate_limited_response(e, 'reading')
     except Exception as e:
         return Response(
             {'error': f'Server error: {str(e)}'},
@@ -243,7 +285,7 @@ def ocr_image(request):
                     image_data = f'data:image/jpeg;base64,{image_data}'
                 
                 # Make request to OCR.space API
-                response = requests.post(
+                response = ProviderHTTP.post(
                     OCR_SPACE_API_URL,
                     data={
                         'apikey': OCR_SPACE_API_KEY,
@@ -279,7 +321,7 @@ def ocr_image(request):
                 # Fall back to Gemini
         
         # Fall back to Gemini Vision API
-        if not GEMINI_API_KEY:
+        if not AIRateLimiter.keys('gemini'):
             return Response(
                 {'error': 'OCR service not configured on server'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -299,8 +341,8 @@ def ocr_image(request):
         )
         
         # Make request to Gemini Vision API
-        response = requests.post(
-            f'{GEMINI_VISION_API_URL}?key={GEMINI_API_KEY}',
+        response = _gemini_post(
+            GEMINI_VISION_API_URL,
             headers={'Content-Type': 'application/json'},
             json={
                 'contents': [{
@@ -341,6 +383,8 @@ def ocr_image(request):
             'success': bool(extracted_text)
         }, status=status.HTTP_200_OK)
         
+    except RateLimited as e:
+        return _rate_limited_response(e, 'reading')
     except Exception as e:
         return Response(
             {'error': f'Server error: {str(e)}'},
@@ -362,7 +406,7 @@ def generate_image_with_replicate(request):
             status=status.HTTP_503_SERVICE_UNAVAILABLE
         )
     
-    if not REPLICATE_API_TOKEN:
+    if not AIRateLimiter.keys('replicate'):
         return Response(
             {'error': 'REPLICATE_API_TOKEN not configured in settings'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -438,7 +482,8 @@ def generate_image_with_replicate(request):
         
         # ASYNC MODE: Create prediction and return immediately
         if use_async:
-            client = replicate.Client(api_token=REPLICATE_API_TOKEN)
+            api_token = AIRateLimiter.acquire('replicate')
+            client = replicate.Client(api_token=api_token)
             
             # Create prediction (returns immediately)
             # Handle two formats:
@@ -458,6 +503,8 @@ def generate_image_with_replicate(request):
                 )
 
             
+            # Status polls must use the token (account) that created the prediction
+            cache.set(f'replicate_prediction_key_{prediction.id}', AIRateLimiter.key_id(api_token), 86400)
             print(f"✅ Prediction created: {prediction.id}")
             print(f"📊 Status: {prediction.status}")
             
@@ -508,6 +555,8 @@ def generate_image_with_replicate(request):
                 'async': False
             })
         
+    except RateLimited as e:
+        return _rate_limited_response(e, 'image')
     except Exception as e:
         error_msg = str(e)
         print(f"❌ Replicate error: {error_msg}")
@@ -603,6 +652,7 @@ def fetch_pollinations_image(request):
     Fetch and stream image from Pollinations with API key authentication
     This endpoint acts as a proxy to add Authorization header
     Now uses Flux model (no rate limits)
+    Images are cached on disk per prompt/seed/size/model and served immutable with an ETag
     """
     if not POLLINATIONS_API_KEY:
         return Response(
@@ -643,6 +693,7 @@ def fetch_pollinations_image(request):
             params['negative'] = negative
         
         from urllib.parse import urlencode, quote
+        from django.http import FileResponse, HttpResponseNotModified
         
         # Pollinations API accepts the key via X-API-Key header
         # According to docs: Use X-API-Key header for authentication
@@ -656,57 +707,55 @@ def fetch_pollinations_image(request):
             'User-Agent': 'PixelTales/1.0'
         }
         
-        print(f"[Pollinations] ========================================")
-        print(f"[Pollinations] Fetching image from Pollinations AI...")
-        print(f"[Pollinations] Model: {model} (Flux = Always Free!)")
-        print(f"[Pollinations] Size: {width}x{height}")
-        print(f"[Pollinations] API Key: {POLLINATIONS_API_KEY[:20]}..." if POLLINATIONS_API_KEY else "None")
-        print(f"[Pollinations] URL (truncated): {pollinations_url[:150]}...")
-        print(f"[Pollinations] ========================================")
-        
-        response = requests.get(pollinations_url, headers=headers, timeout=60, stream=True)
-        
-        print(f"[Pollinations] Response Status: {response.status_code}")
-        print(f"[Pollinations] Content-Type: {response.headers.get('Content-Type', 'unknown')}")
-        
-        # If not successful, log error details
-        if response.status_code != 200:
-            try:
-                error_body = response.text[:500]
-                print(f"[Pollinations] ❌ Error Response: {error_body}")
-            except:
-                print(f"[Pollinations] ❌ Could not read error response")
-        
-        if response.status_code == 200:
-            # Stream the image data back to the client
-            from django.http import StreamingHttpResponse
-            
-            def image_generator():
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        yield chunk
-            
+        def fetch():
+            logger.info('Pollinations cache miss, fetching %sx%s %s image: %.150s', width, height, model, pollinations_url)
+            response = ProviderHTTP.get(pollinations_url, headers=headers, timeout=60, stream=True)
             content_type = response.headers.get('Content-Type', 'image/jpeg')
-            streaming_response = StreamingHttpResponse(image_generator(), content_type=content_type)
-            streaming_response['Cache-Control'] = 'max-age=3600'  # Cache for 1 hour
             
-            print(f"[Pollinations] ✅ Image fetched and streaming to client")
-            return streaming_response
+            if response.status_code != 200:
+                try:
+                    logger.warning('Pollinations returned %s: %.500s', response.status_code, response.text)
+                except Exception:
+                    logger.warning('Pollinations returned %s (unreadable body)', response.status_code)
+                raise ImageFetchError(response.status_code)
+            if not content_type.startswith('image/'):
+                response.close()
+                raise ImageFetchError(response.status_code, f'Pollinations returned {content_type} instead of an image')
+            return response.iter_content(chunk_size=8192), content_type
+        
+        # Same parameters, same image: stories reopened later are served from the disk cache
+        image, meta, hit = ImageCache.get_or_fetch(ImageCache.key({'prompt': prompt, **params}), fetch)
+        
+        if meta['etag'] in request.headers.get('If-None-Match', ''):
+            image.close()
+            image_response = HttpResponseNotModified()
         else:
-            print(f"[Pollinations] ❌ Failed: {response.status_code}")
-            return Response(
-                {'error': f'Failed to fetch image: {response.status_code}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            image_response = FileResponse(image, content_type=meta['content_type'])
+        image_response['ETag'] = meta['etag']
+        image_response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        image_response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return image_response
     
+    except ImageFetchTimeout as e:
+        logger.warning('Pollinations image still locked by another worker: %s', prompt[:80])
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
+    except ImageFetchError as e:
+        logger.warning('Pollinations image fetch failed: %s', e)
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
     except requests.Timeout:
-        print(f"[Pollinations] ⏱️ Timeout fetching image")
+        logger.warning('Pollinations image fetch timed out')
         return Response(
             {'error': 'Image generation timeout - please try again'},
             status=status.HTTP_504_GATEWAY_TIMEOUT
         )
     except Exception as e:
-        print(f"[Pollinations] ❌ Error: {str(e)}")
+        logger.exception('Pollinations image fetch failed')
         return Response(
             {'error': f'Failed to fetch image: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -720,7 +769,7 @@ def generate_image_with_gemini(request):
     Generate image using Gemini 2.5 Flash Image model
     Returns base64 encoded image data
     """
-    if not GEMINI_API_KEY:
+    if not AIRateLimiter.keys('gemini'):
         return Response(
             {'error': 'Gemini API not configured on server'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -741,8 +790,8 @@ def generate_image_with_gemini(request):
         print(f"[Gemini Image] ========================================")
         
         # Make request to Gemini Image API
-        response = requests.post(
-            f'{GEMINI_IMAGE_API_URL}?key={GEMINI_API_KEY}',
+        response = _gemini_post(
+            GEMINI_IMAGE_API_URL,
             headers={'Content-Type': 'application/json'},
             json={
                 'contents': [{
@@ -792,6 +841,8 @@ def generate_image_with_gemini(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
         
+    except RateLimited as e:
+        return _rate_limited_response(e, 'image')
     except requests.Timeout:
         print(f"[Gemini Image] ⏱️ Timeout")
         return Response(
@@ -819,7 +870,7 @@ def get_replicate_prediction_status(request):
             status=status.HTTP_503_SERVICE_UNAVAILABLE
         )
     
-    if not REPLICATE_API_TOKEN:
+    if not AIRateLimiter.keys('replicate'):
         return Response(
             {'error': 'REPLICATE_API_TOKEN not configured'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -834,8 +885,10 @@ def get_replicate_prediction_status(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get prediction status
-        client = replicate.Client(api_token=REPLICATE_API_TOKEN)
+        # Get prediction status with the token that created it
+        key_id = cache.get(f'replicate_prediction_key_{prediction_id}')
+        api_token = AIRateLimiter.key_for_id('replicate', key_id) or AIRateLimiter.keys('replicate')[0]
+        client = replicate.Client(api_token=api_token)
         prediction = client.predictions.get(prediction_id)
         
         print(f"📊 Prediction {prediction_id[:8]}... status: {prediction.status}")
@@ -891,28 +944,140 @@ def get_replicate_prediction_status(request):
 def check_ai_service_status(request):
     """
     Check if AI services are configured and available
+    (with key pool usage and the circuit breaker state of each text provider)
     """
+    from .ai_router import AIRouter
+
+    gemini_available = bool(AIRateLimiter.keys('gemini'))
     return Response({
-        'gemini_available': bool(GEMINI_API_KEY),
-        'gemini_image_available': bool(GEMINI_API_KEY),
-        'ocr_available': bool(GEMINI_API_KEY),
+        'gemini_available': gemini_available,
+        'gemini_image_available': gemini_available,
+        'ocr_available': gemini_available,
         'pollinations_available': bool(POLLINATIONS_API_KEY),
-        'replicate_available': bool(REPLICATE_API_TOKEN and REPLICATE_AVAILABLE),
+        'replicate_available': bool(AIRateLimiter.keys('replicate') and REPLICATE_AVAILABLE),
+        'rate_limits': {provider: AIRateLimiter.status(provider) for provider in KEY_SETTINGS},
+        'text_providers': AIRouter.status(),
     }, status=status.HTTP_200_OK)
 
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def generate_story_with_groq(request):
+def async_api_view(view):
+    """
+    Plain Django async view behind the same JWT auth as the DRF views
+
+    DRF's @api_view only wraps sync views, which daphne runs on a shared
+    worker thread - a slow provider call there stalls every other sync
+    request. These views hold a coroutine instead. POST only; the JSON body
+    is available as request.data.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        from channels.db import database_sync_to_async
+        from rest_framework.exceptions import AuthenticationFailed
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+
+        if request.method != 'POST':
+            return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            auth = await database_sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED)
+        if auth is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+        request.user = auth[0]
+        try:
+            request.data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Request body must be JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        return await view(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+async def _relay_chat_completion(provider, url, headers, payload, timeout, stream=False):
+    """
+    POST a chat completion through the pooled async client with a pooled API key
+    and map the provider's answer to our response (fails fast while its circuit breaker is open)
+
+    With stream, the response is a server-sent event stream of the provider's
+    tokens ending in the validated story (see ai_streaming.stream_story).
+    """
+    import time
+    from .ai_router import ProviderHealth
+
+    slug = provider.lower()
+    if not await ProviderHealth.aallow(slug):
+        return JsonResponse(
+            {'error': f'{provider} is temporarily unavailable. Please try again soon.', 'code': 'CIRCUIT_OPEN'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    start = time.monotonic()
+    streaming = False
+    try:
+        api_key = await AIRateLimiter.aacquire(slug)
+        if stream:
+            from django.http import StreamingHttpResponse
+            from .ai_streaming import stream_story
+
+            # Groq's JSON mode can't stream; the story JSON is validated when the stream ends instead
+            payload = {key: value for key, value in payload.items() if key != 'response_format'}
+            response = StreamingHttpResponse(
+                stream_story(slug, api_key, url, {**headers, 'Authorization': f'Bearer {api_key}'}, payload, timeout),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # Proxies must not buffer the stream
+            streaming = True  # stream_story reports the outcome and frees the probe
+            return response
+        response = await ProviderHTTP.apost(
+            url, headers={**headers, 'Authorization': f'Bearer {api_key}'}, json=payload, timeout=timeout
+        )
+        await AIRateLimiter.aobserve(slug, api_key, response.status_code, response.headers)
+        if response.status_code >= 500:
+            await ProviderHealth.arecord_failure(slug, time.monotonic() - start)
+        elif response.is_success:
+            await ProviderHealth.arecord_success(slug, time.monotonic() - start)
+
+        if response.status_code == 401:
+            return JsonResponse({'error': f'{provider} API key is invalid.'}, status=status.HTTP_401_UNAUTHORIZED)
+        if response.status_code == 429:
+            return JsonResponse({'error': f'{provider} rate limit hit. Please wait a moment and try again.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if not response.is_success:
+            return JsonResponse({'error': f'{provider} API error {response.status_code}: {response.text}'}, status=response.status_code)
+
+        return JsonResponse(response.json(), status=status.HTTP_200_OK)
+
+    except RateLimited as e:
+        response = JsonResponse(
+            {'error': f'{provider} is busy right now. Please try again in a few seconds.', 'code': 'RATE_LIMIT', 'retry_after': round(e.retry_after, 1)},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response['Retry-After'] = e.retry_after_header
+        return response
+    except httpx.TimeoutException:
+        await ProviderHealth.arecord_failure(slug, time.monotonic() - start)
+        return JsonResponse({'error': f'{provider} request timed out. Please try again.'}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except Exception as e:
+        return JsonResponse({'error': f'Server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        if not streaming:
+            # 4xx, 429 and local errors give no verdict on the provider; a half-open probe must not stay held
+            await ProviderHealth.arelease_probe(slug)
+
+
+@async_api_view
+async def generate_story_with_groq(request):
     """
     Secure proxy for Groq AI text generation.
     API key stays on the backend — never exposed to the browser.
-    Expects: { messages: [...], temperature: float, max_tokens: int }
-    Returns: the raw Groq JSON response (choices[0].message.content)
+    Expects: { messages: [...], temperature: float, max_tokens: int, stream: bool }
+    Returns: the raw Groq JSON response (choices[0].message.content), or with
+    stream an SSE stream of token events ending in done (the parsed story) or error
     """
-    if not GROQ_API_KEY:
-        return Response(
-            {'error': 'Groq API key not configured on the server. Add GROQ_API_KEY to backend/.env.'},
+    if not AIRateLimiter.keys('groq'):
+        return JsonResponse(
+            {'error': 'Groq API key not configured on the server. Add GROQ_API_KEY (or a GROQ_API_KEYS pool) to backend/.env.'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
         )
 
@@ -922,52 +1087,38 @@ def generate_story_with_groq(request):
     model = request.data.get('model', 'llama-3.3-70b-versatile')
 
     if not messages:
-        return Response({'error': 'messages array is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': 'messages array is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        response = requests.post(
-            GROQ_API_URL,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {GROQ_API_KEY}',
-            },
-            json={
-                'model': model,
-                'messages': messages,
-                'temperature': temperature,
-                'max_tokens': max_tokens,
-                'response_format': {'type': 'json_object'},
-            },
-            timeout=60,
-        )
-
-        if response.status_code == 401:
-            return Response({'error': 'Groq API key is invalid.'}, status=status.HTTP_401_UNAUTHORIZED)
-        if response.status_code == 429:
-            return Response({'error': 'Groq rate limit hit. Please wait a moment and try again.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
-        if not response.ok:
-            return Response({'error': f'Groq API error {response.status_code}: {response.text}'}, status=response.status_code)
-
-        return Response(response.json(), status=status.HTTP_200_OK)
-
-    except requests.exceptions.Timeout:
-        return Response({'error': 'Groq request timed out. Please try again.'}, status=status.HTTP_504_GATEWAY_TIMEOUT)
-    except Exception as e:
-        return Response({'error': f'Server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return await _relay_chat_completion(
+        'Groq',
+        GROQ_API_URL,
+        headers={
+            'Content-Type': 'application/json',
+        },
+        payload={
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'response_format': {'type': 'json_object'},
+        },
+        timeout=60,
+        stream=bool(request.data.get('stream')),
+    )
 
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def generate_story_with_openrouter(request):
+@async_api_view
+async def generate_story_with_openrouter(request):
     """
     Secure proxy for OpenRouter AI text generation.
     API key stays on the backend — never exposed to the browser.
-    Expects: { messages: [...], temperature: float, max_tokens: int, model: str }
-    Returns: the raw OpenRouter JSON response
+    Expects: { messages: [...], temperature: float, max_tokens: int, model: str, stream: bool }
+    Returns: the raw OpenRouter JSON response, or with stream an SSE stream of
+    token events ending in done (the parsed story) or error
     """
-    if not OPENROUTER_API_KEY:
-        return Response(
-            {'error': 'OpenRouter API key not configured on the server. Add OPENROUTER_API_KEY to backend/.env.'},
+    if not AIRateLimiter.keys('openrouter'):
+        return JsonResponse(
+            {'error': 'OpenRouter API key not configured on the server. Add OPENROUTER_API_KEY (or an OPENROUTER_API_KEYS pool) to backend/.env.'},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
         )
 
@@ -977,36 +1128,110 @@ def generate_story_with_openrouter(request):
     model = request.data.get('model', 'google/gemma-3-27b-it:free')
 
     if not messages:
+        return JsonResponse({'error': 'messages array is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return await _relay_chat_completion(
+        'OpenRouter',
+        OPENROUTER_API_URL,
+        headers={
+            'Content-Type': 'application/json',
+            'HTTP-Referer': 'https://pixeltales.app',
+            'X-Title': 'PixelTales',
+        },
+        payload={
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+        },
+        timeout=90,
+        stream=bool(request.data.get('stream')),
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def enqueue_story_job(request):
+    """
+    Queue an AI story generation for the run_story_jobs worker
+    Expects: { provider: 'groq' | 'openrouter', messages: [...], temperature, max_tokens, model }
+    Returns: { task_id } right away - poll get_story_job or wait for story_job_update on the notifications socket
+    """
+    from .story_jobs import StoryJobQueue
+
+    provider = request.data.get('provider', 'groq')
+    messages = request.data.get('messages', [])
+
+    if provider not in StoryJobQueue.providers():
+        return Response({'error': f'Unknown provider: {provider}'}, status=status.HTTP_400_BAD_REQUEST)
+    if not messages or not isinstance(messages, list):
         return Response({'error': 'messages array is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        response = requests.post(
-            OPENROUTER_API_URL,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-                'HTTP-Referer': 'https://pixeltales.app',
-                'X-Title': 'PixelTales',
-            },
-            json={
-                'model': model,
-                'messages': messages,
-                'temperature': temperature,
-                'max_tokens': max_tokens,
-            },
-            timeout=90,
-        )
+    payload = {
+        'messages': messages,
+        'temperature': request.data.get('temperature', 0.85),
+        'max_tokens': request.data.get('max_tokens', 2048),
+        'model': request.data.get('model'),
+    }
+    job = StoryJobQueue.enqueue(request.user, provider, payload)
 
-        if response.status_code == 401:
-            return Response({'error': 'OpenRouter API key is invalid.'}, status=status.HTTP_401_UNAUTHORIZED)
-        if response.status_code == 429:
-            return Response({'error': 'OpenRouter rate limit hit. Please wait a moment and try again.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
-        if not response.ok:
-            return Response({'error': f'OpenRouter API error {response.status_code}: {response.text}'}, status=response.status_code)
+    return Response({
+        'success': True,
+        'task_id': str(job.task_id),
+        'status': job.status,
+    }, status=status.HTTP_202_ACCEPTED)
 
-        return Response(response.json(), status=status.HTTP_200_OK)
 
-    except requests.exceptions.Timeout:
-        return Response({'error': 'OpenRouter request timed out. Please try again.'}, status=status.HTTP_504_GATEWAY_TIMEOUT)
-    except Exception as e:
-        return Response({'error': f'Server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_story_job(request, task_id):
+    """
+    Status of a queued story generation (the result is included once it succeeded)
+    """
+    from .models import StoryGenerationJob
+    from .story_jobs import StoryJobQueue
+
+    job = StoryGenerationJob.objects.filter(task_id=task_id, user=request.user).first()
+    if not job:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({'success': True, **StoryJobQueue.status(job)}, status=status.HTTP_200_OK)
+
+
+@async_api_view
+async def generate_story(request):
+    """
+    Story generation routed to the healthiest configured provider (Groq, OpenRouter, Gemini)
+    Fails over to the next provider on timeouts and outages; open circuit breakers are skipped.
+    Expects: { messages: [...], temperature, max_tokens, json: bool, provider: preferred, model: for the preferred provider }
+    Returns: { success, provider, model, content, finish_reason, usage, latency_ms, attempts }
+    """
+    from .ai_router import AIRouter, NoProviderAvailable
+
+    messages = request.data.get('messages', [])
+    if not messages or not isinstance(messages, list):
+        return JsonResponse({'error': 'messages array is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if not AIRouter.providers():
+        return JsonResponse({'error': 'No AI text provider configured on the server'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    try:
+        result = await AIRouter.generate({
+            'messages': messages,
+            'temperature': request.data.get('temperature', 0.85),
+            'max_tokens': request.data.get('max_tokens', 2048),
+            'model': request.data.get('model'),
+            'json': bool(request.data.get('json', True)),
+        }, prefer=request.data.get('provider'))
+    except NoProviderAvailable as e:
+        rate_limited = all(attempt['error'] == 'rate limited' for attempt in e.attempts)
+        response = JsonResponse({
+            'error': 'Wow, a lot of people are writing stories right now! Please try again in a few seconds.'
+            if rate_limited else 'Story generation is temporarily unavailable. Please try again soon.',
+            'code': 'RATE_LIMIT' if rate_limited else 'PROVIDERS_UNAVAILABLE',
+            'attempts': e.attempts,
+        }, status=status.HTTP_429_TOO_MANY_REQUESTS if rate_limited else status.HTTP_503_SERVICE_UNAVAILABLE)
+        if e.retry_after is not None:
+            response['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+        return response
+
+    return JsonResponse({'success': True, **result}, status=status.HTTP_200_OK)
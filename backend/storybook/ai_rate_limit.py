@@ -0,0 +1,269 @@
+"""
+Distributed rate limiting and API key pools for the AI providers
+One token bucket per (provider, key) in Redis, tuned live from the providers' rate limit headers
+"""
+import asyncio
+import hashlib
+import math
+import re
+import time
+from email.utils import parsedate_to_datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .redis_store import get_store
+
+# Setting holding each provider's single API key (used when no key pool is configured)
+KEY_SETTINGS = {
+    'groq': 'GROQ_API_KEY',
+    'openrouter': 'OPENROUTER_API_KEY',
+    'gemini': 'GOOGLE_AI_API_KEY',
+    'replicate': 'REPLICATE_API_TOKEN',
+}
+
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+class RateLimited(Exception):
+    """Every key of the provider is out of capacity for longer than the caller will wait"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f'{provider} rate limit reached, retry in {retry_after:.1f}s')
+        self.provider = provider
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_duration(value):
+    """Seconds from '2m59.56s', '850ms', '7.66s' (Groq's reset headers) or a plain number"""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(headers):
+    """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def quota_from_headers(headers):
+    """
+    (requests remaining, seconds until the window resets) from x-ratelimit-* headers
+
+    Groq sends x-ratelimit-remaining-requests / x-ratelimit-reset-requests
+    ('2m59.56s'); OpenRouter sends X-RateLimit-Remaining / X-RateLimit-Reset
+    (epoch milliseconds). Missing values are None.
+    """
+    remaining = headers.get('x-ratelimit-remaining-requests') or headers.get('x-ratelimit-remaining')
+    reset = headers.get('x-ratelimit-reset-requests') or headers.get('x-ratelimit-reset')
+    try:
+        remaining = int(float(remaining)) if remaining is not None else None
+    except ValueError:
+        remaining = None
+
+    seconds = parse_duration(reset) if reset is not None else None
+    if seconds is not None and seconds > 1e12:  # Epoch milliseconds
+        seconds = seconds / 1000 - time.time()
+    elif seconds is not None and seconds > 1e9:  # Epoch seconds
+        seconds = seconds - time.time()
+    return remaining, max(0.0, seconds) if seconds is not None else None
+
+
+class AIRateLimiter:
+    """
+    Token buckets per provider API key, shared by every worker through Redis
+
+    Each key of a provider's pool (the comma-separated <PROVIDER>_API_KEYS
+    entry of AI_KEY_POOLS, or the single key setting) gets a bucket refilling
+    at AI_RATE_LIMITS[provider] requests per minute, with bursts up to a
+    quarter of that. acquire() picks a key with capacity - least loaded or
+    round robin per AI_KEY_SELECTION - and waits up to
+    AI_RATE_LIMIT_MAX_WAIT seconds for one when all are drained, so being
+    slightly over the limit queues the request instead of failing it.
+    observe() feeds the provider's Retry-After and quota headers back into
+    the key's bucket.
+    """
+
+    BUCKET_KEY = 'ai_bucket_{provider}_{key_id}'
+    ROTATION_KEY = 'ai_key_rotation'
+    BUCKET_TTL = 3600
+
+    @classmethod
+    def keys(cls, provider):
+        """The provider's API key pool"""
+        pool = getattr(settings, 'AI_KEY_POOLS', {}).get(provider) or ''
+        keys = [key.strip() for key in pool.split(',') if key.strip()]
+        if not keys:
+            single = getattr(settings, KEY_SETTINGS.get(provider, ''), None)
+            keys = [single] if single else []
+        return keys
+
+    @classmethod
+    def requests_per_minute(cls, provider):
+        return getattr(settings, 'AI_RATE_LIMITS', {}).get(provider, 60)
+
+    @classmethod
+    def max_wait(cls):
+        return getattr(settings, 'AI_RATE_LIMIT_MAX_WAIT', 5)
+
+    @staticmethod
+    def key_id(api_key):
+        """Bucket name part of a key (the key itself never leaves the process)"""
+        return hashlib.sha1(api_key.encode()).hexdigest()[:12]
+
+    @classmethod
+    def key_for_id(cls, provider, key_id):
+        """The pooled key with this key_id (None if it left the pool)"""
+        return next((api_key for api_key in cls.keys(provider) if cls.key_id(api_key) == key_id), None)
+
+    @classmethod
+    def _bucket(cls, provider, api_key):
+        return cls.BUCKET_KEY.format(provider=provider, key_id=cls.key_id(api_key))
+
+    @classmethod
+    def _rate(cls, provider):
+        """(tokens per second, bucket capacity)"""
+        rpm = cls.requests_per_minute(provider)
+        return rpm / 60, max(1, rpm // 4)
+
+    @classmethod
+    def _candidates(cls, provider, keys):
+        """The pool in the order keys should be tried"""
+        if len(keys) < 2:
+            return keys
+        store = get_store()
+        if getattr(settings, 'AI_KEY_SELECTION', 'least_loaded') == 'round_robin':
+            start = store.hincrby(cls.ROTATION_KEY, provider, 1, ttl=cls.BUCKET_TTL) % len(keys)
+            return keys[start:] + keys[:start]
+
+        rate, capacity = cls._rate(provider)
+        now = time.time()
+
+        def available(api_key):
+            tokens, ts, blocked = store.hmget(cls._bucket(provider, api_key), ['tokens', 'ts', 'blocked_until'])
+            if blocked and float(blocked) > now:
+                return -1
+            if tokens is None:
+                return capacity
+            return min(capacity, float(tokens) + max(0.0, now - float(ts)) * rate)
+
+        return sorted(keys, key=available, reverse=True)
+
+    @classmethod
+    def try_acquire(cls, provider):
+        """
+        One pass over the pool
+
+        Returns:
+            (api_key, None) when a key had capacity, (None, seconds until one
+            should) otherwise; (None, None) when the provider has no keys
+        """
+        keys = cls.keys(provider)
+        if not keys:
+            return None, None
+        store = get_store()
+        rate, capacity = cls._rate(provider)
+        shortest = None
+        for api_key in cls._candidates(provider, keys):
+            granted, wait = store.take_token(cls._bucket(provider, api_key), rate, capacity, ttl=cls.BUCKET_TTL)
+            if granted:
+                return api_key, None
+            shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+    @classmethod
+    def acquire(cls, provider, max_wait=None):
+        """
+        An API key with capacity, waiting briefly for one if needed
+
+        Returns:
+            the key, or None when the provider has no keys configured
+
+        Raises:
+            RateLimited: no capacity within max_wait (default AI_RATE_LIMIT_MAX_WAIT)
+        """
+        deadline = time.monotonic() + (cls.max_wait() if max_wait is None else max_wait)
+        while True:
+            api_key, wait = cls.try_acquire(provider)
+            if api_key or wait is None:
+                return api_key
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise RateLimited(provider, wait)
+            time.sleep(max(wait, 0.01))
+
+    @classmethod
+    async def aacquire(cls, provider, max_wait=None):
+        """acquire() for async views - waiting holds a coroutine, not a thread"""
+        deadline = time.monotonic() + (cls.max_wait() if max_wait is None else max_wait)
+        while True:
+            api_key, wait = await sync_to_async(cls.try_acquire)(provider)
+            if api_key or wait is None:
+                return api_key
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise RateLimited(provider, wait)
+            await asyncio.sleep(max(wait, 0.01))
+
+    @classmethod
+    def observe(cls, provider, api_key, status_code, headers):
+        """
+        Adjust the key's bucket to what the provider reported
+
+        A 429 blocks the key for Retry-After (or until the quota window
+        resets); otherwise the bucket drops to the provider's remaining
+        request count, and an exhausted quota blocks the key until reset.
+        """
+        if not api_key:
+            return
+        retry_after = retry_after_seconds(headers)
+        remaining, reset = quota_from_headers(headers)
+        bucket = cls._bucket(provider, api_key)
+        store = get_store()
+        now = time.time()
+
+        if status_code == 429 or remaining == 0:
+            rate, _ = cls._rate(provider)
+            block = retry_after if retry_after is not None else reset if reset is not None else 1 / rate
+            store.hset(bucket, {'blocked_until': now + block, 'tokens': 0, 'ts': now + block}, ttl=cls.BUCKET_TTL)
+        elif remaining is not None:
+            _, capacity = cls._rate(provider)
+            store.hset(bucket, {'tokens': min(remaining, capacity), 'ts': now}, ttl=cls.BUCKET_TTL)
+
+    @classmethod
+    async def aobserve(cls, provider, api_key, status_code, headers):
+        """observe() for async callers (its Redis writes run off the event loop)"""
+        await sync_to_async(cls.observe)(provider, api_key, status_code, headers)
+
+    @classmethod
+    def status(cls, provider):
+        """Pool size and blocked keys, for the AI status endpoint"""
+        store = get_store()
+        now = time.time()
+        keys = cls.keys(provider)
+        blocked = 0
+        for api_key in keys:
+            until = store.hget(cls._bucket(provider, api_key), 'blocked_until')
+            blocked += bool(until and float(until) > now)
+        return {
+            'keys': len(keys),
+            'blocked_keys': blocked,
+            'requests_per_minute_per_key': cls.requests_per_minute(provider),
+        }
@@ -0,0 +1,364 @@
+"""
+Latency-aware routing of text generation across AI providers
+Per-provider EWMA latency and error rate, circuit breakers, and one response shape for every provider
+"""
+import logging
+import time
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from .ai_http import ProviderHTTP
+from .ai_rate_limit import AIRateLimiter, RateLimited
+from .redis_store import get_store
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderFailure(Exception):
+    """A provider could not answer; trips_breaker for outages (timeouts, 5xx), not for client errors"""
+
+    def __init__(self, message, trips_breaker=True):
+        super().__init__(message)
+        self.trips_breaker = trips_breaker
+
+
+class ProviderHealth:
+    """
+    Health of each text provider, shared by every worker through Redis
+
+    Latency and error rate are exponentially weighted moving averages.
+    AI_BREAKER_FAILURES consecutive timeouts or 5xx responses open the
+    provider's breaker: it gets no traffic for AI_BREAKER_COOLDOWN seconds,
+    then one request is let through (half-open) - success closes the
+    breaker, failure opens it for another cooldown.
+
+    The a* variants are for async callers: they run the Redis and cache
+    calls off the event loop.
+    """
+
+    KEY = 'ai_health_{provider}'
+    PROBE_KEY = 'ai_breaker_probe_{provider}'
+    ALPHA = 0.3  # Weight of the newest sample
+    TTL = 86400
+
+    @classmethod
+    def failure_threshold(cls):
+        return getattr(settings, 'AI_BREAKER_FAILURES', 3)
+
+    @classmethod
+    def cooldown(cls):
+        return getattr(settings, 'AI_BREAKER_COOLDOWN', 30)
+
+    @classmethod
+    def get(cls, provider):
+        raw = get_store().hgetall(cls.KEY.format(provider=provider))
+        return {
+            'latency_ms': float(raw['latency_ms']) if raw.get('latency_ms') else None,
+            'error_rate': float(raw.get('error_rate', 0)),
+            'consecutive_failures': int(raw.get('consecutive_failures', 0)),
+            'opened_at': float(raw.get('opened_at', 0)),
+        }
+
+    @classmethod
+    def state(cls, provider, health=None):
+        """'closed', 'open' or 'half_open' (cooldown over, waiting for a probe)"""
+        health = health or cls.get(provider)
+        if not health['opened_at']:
+            return 'closed'
+        if time.time() - health['opened_at'] < cls.cooldown():
+            return 'open'
+        return 'half_open'
+
+    @classmethod
+    def allow(cls, provider):
+        """May a request go to this provider now? (claims the probe of a half-open breaker)"""
+        state = cls.state(provider)
+        if state == 'closed':
+            return True
+        if state == 'half_open':
+            return cache.add(cls.PROBE_KEY.format(provider=provider), 1, cls.cooldown())
+        return False
+
+    @classmethod
+    def release_probe(cls, provider):
+        """Give back a half-open probe whose request ended without a verdict (4xx, rate limited)"""
+        cache.delete(cls.PROBE_KEY.format(provider=provider))
+
+    @classmethod
+    def record_success(cls, provider, seconds):
+        """
+        Fold a successful request into the averages and close the breaker
+
+        Read-modify-write of the health hash, not atomic: concurrent reports
+        can drop a sample, which the moving averages shrug off.
+        """
+        health = cls.get(provider)
+        latency = seconds * 1000
+        if health['latency_ms'] is not None:
+            latency = cls.ALPHA * latency + (1 - cls.ALPHA) * health['latency_ms']
+        get_store().hset(cls.KEY.format(provider=provider), {
+            'latency_ms': round(latency, 1),
+            'error_rate': round((1 - cls.ALPHA) * health['error_rate'], 4),
+            'consecutive_failures': 0,
+            'opened_at': 0,
+        }, ttl=cls.TTL)
+        cache.delete(cls.PROBE_KEY.format(provider=provider))
+
+    @classmethod
+    def record_failure(cls, provider, seconds, trips_breaker=True):
+        """
+        Fold a failed request into the averages, opening the breaker at the threshold
+
+        Not atomic either (see record_success): two workers failing at once
+        may count one consecutive failure.
+        """
+        health = cls.get(provider)
+        failures = health['consecutive_failures'] + trips_breaker
+        fields = {
+            'error_rate': round(cls.ALPHA + (1 - cls.ALPHA) * health['error_rate'], 4),
+            'consecutive_failures': failures,
+        }
+        if trips_breaker:
+            # Timeouts count toward latency too, so a slow provider sinks in the ranking
+            latency = seconds * 1000
+            if health['latency_ms'] is not None:
+                latency = cls.ALPHA * latency + (1 - cls.ALPHA) * health['latency_ms']
+            fields['latency_ms'] = round(latency, 1)
+            if failures >= cls.failure_threshold() or cls.state(provider, health) != 'closed':
+                fields['opened_at'] = time.time()
+                logger.warning('Circuit breaker opened for %s after %s failures', provider, failures)
+        get_store().hset(cls.KEY.format(provider=provider), fields, ttl=cls.TTL)
+        cache.delete(cls.PROBE_KEY.format(provider=provider))
+
+    @classmethod
+    async def aallow(cls, provider):
+        return await sync_to_async(cls.allow)(provider)
+
+    @classmethod
+    async def arelease_probe(cls, provider):
+        await sync_to_async(cls.release_probe)(provider)
+
+    @classmethod
+    async def arecord_success(cls, provider, seconds):
+        await sync_to_async(cls.record_success)(provider, seconds)
+
+    @classmethod
+    async def arecord_failure(cls, provider, seconds, trips_breaker=True):
+        await sync_to_async(cls.record_failure)(provider, seconds, trips_breaker)
+
+    @classmethod
+    def score(cls, provider):
+        """Lower is better: expected latency inflated by the error rate (unmeasured providers look average)"""
+        health = cls.get(provider)
+        latency = health['latency_ms'] if health['latency_ms'] is not None else 5000
+        return latency * (1 + 4 * health['error_rate'])
+
+    @classmethod
+    def report(cls, provider):
+        health = cls.get(provider)
+        state = cls.state(provider, health)
+        report = {
+            'state': state,
+            'latency_ms': health['latency_ms'],
+            'error_rate': health['error_rate'],
+            'consecutive_failures': health['consecutive_failures'],
+        }
+        if state == 'open':
+            report['retry_in_seconds'] = round(cls.cooldown() - (time.time() - health['opened_at']), 1)
+        return report
+
+
+# ---------- Provider adapters: normalized request -> normalized response ----------
+
+async def _post(provider, url, timeout, **kwargs):
+    try:
+        response = await ProviderHTTP.apost(url, timeout=timeout, **kwargs)
+    except httpx.TimeoutException:
+        raise ProviderFailure(f'{provider} timed out after {timeout}s')
+    except httpx.HTTPError as e:
+        raise ProviderFailure(f'{provider} request failed: {e}')
+    return response
+
+
+async def _check(provider, api_key, response):
+    await AIRateLimiter.aobserve(provider, api_key, response.status_code, response.headers)
+    if response.status_code >= 500:
+        raise ProviderFailure(f'{provider} API error {response.status_code}')
+    if response.status_code == 429:
+        raise ProviderFailure(f'{provider} rate limit hit', trips_breaker=False)
+    if not response.is_success:
+        raise ProviderFailure(f'{provider} API error {response.status_code}: {response.text[:300]}', trips_breaker=False)
+    return response.json()
+
+
+async def _openai_compatible(provider, url, request, model, timeout, extra_headers=None):
+    api_key = await AIRateLimiter.aacquire(provider, max_wait=0)
+    payload = {
+        'model': request.get('model') or model,
+        'messages': request['messages'],
+        'temperature': request.get('temperature', 0.85),
+        'max_tokens': request.get('max_tokens', 2048),
+    }
+    if request.get('json') and provider == 'groq':
+        payload['response_format'] = {'type': 'json_object'}
+    response = await _post(provider, url, timeout, json=payload, headers={
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}',
+        **(extra_headers or {}),
+    })
+    data = await _check(provider, api_key, response)
+    choice = (data.get('choices') or [{}])[0]
+    usage = data.get('usage') or {}
+    return {
+        'provider': provider,
+        'model': data.get('model', payload['model']),
+        'content': (choice.get('message') or {}).get('content') or '',
+        'finish_reason': choice.get('finish_reason'),
+        'usage': {
+            'prompt_tokens': usage.get('prompt_tokens'),
+            'completion_tokens': usage.get('completion_tokens'),
+        },
+    }
+
+
+async def _groq(request):
+    from .ai_proxy_views import GROQ_API_URL
+    return await _openai_compatible('groq', GROQ_API_URL, request, 'llama-3.3-70b-versatile', timeout=60)
+
+
+async def _openrouter(request):
+    from .ai_proxy_views import OPENROUTER_API_URL
+    return await _openai_compatible(
+        'openrouter', OPENROUTER_API_URL, request, 'google/gemma-3-27b-it:free', timeout=90,
+        extra_headers={'HTTP-Referer': 'https://pixeltales.app', 'X-Title': 'PixelTales'}
+    )
+
+
+async def _gemini(request):
+    from .ai_proxy_views import GEMINI_API_URL
+
+    api_key = await AIRateLimiter.aacquire('gemini', max_wait=0)
+    # Gemini has no system role on v1: system text leads the first user turn
+    system = '\n\n'.join(m['content'] for m in request['messages'] if m.get('role') == 'system')
+    contents = []
+    for message in request['messages']:
+        if message.get('role') == 'system':
+            continue
+        text = message.get('content', '')
+        if system and not contents:
+            text = f'{system}\n\n{text}'
+        contents.append({'role': 'model' if message.get('role') == 'assistant' else 'user', 'parts': [{'text': text}]})
+
+    response = await _post('gemini', f'{GEMINI_API_URL}?key={api_key}', 90, json={
+        'contents': contents,
+        'generationConfig': {
+            'temperature': request.get('temperature', 0.85),
+            'maxOutputTokens': request.get('max_tokens', 2048),
+        },
+    }, headers={'Content-Type': 'application/json'})
+    data = await _check('gemini', api_key, response)
+    candidate = (data.get('candidates') or [{}])[0]
+    usage = data.get('usageMetadata') or {}
+    return {
+        'provider': 'gemini',
+        'model': data.get('modelVersion', 'gemini-2.5-flash'),
+        'content': ''.join(part.get('text', '') for part in (candidate.get('content') or {}).get('parts', [])),
+        'finish_reason': (candidate.get('finishReason') or '').lower() or None,
+        'usage': {
+            'prompt_tokens': usage.get('promptTokenCount'),
+            'completion_tokens': usage.get('candidatesTokenCount'),
+        },
+    }
+
+
+TEXT_PROVIDERS = {
+    'groq': _groq,
+    'openrouter': _openrouter,
+    'gemini': _gemini,
+}
+
+
+class NoProviderAvailable(Exception):
+    def __init__(self, attempts, retry_after=None):
+        super().__init__('No AI provider could generate the story')
+        self.attempts = attempts
+        self.retry_after = retry_after
+
+
+class AIRouter:
+    """
+    Sends a text generation request to the healthiest provider, failing over to the next
+
+    Providers with keys are ranked by ProviderHealth.score (EWMA latency
+    inflated by error rate); a client's preferred provider goes first while
+    it is healthy. Providers whose breaker is open, or whose keys are all
+    rate limited, are skipped without a request, so one provider's outage
+    costs at most the breaker threshold in timeouts instead of every request.
+    """
+
+    @classmethod
+    def providers(cls):
+        """Text providers with at least one API key"""
+        return [name for name in TEXT_PROVIDERS if AIRateLimiter.keys(name)]
+
+    @classmethod
+    def ranked(cls, prefer=None):
+        ranked = sorted(cls.providers(), key=ProviderHealth.score)
+        if prefer in ranked and ProviderHealth.state(prefer) == 'closed':
+            ranked.remove(prefer)
+            ranked.insert(0, prefer)
+        return ranked
+
+    @classmethod
+    async def generate(cls, request, prefer=None):
+        """
+        Args:
+            request: {'messages': [...], 'temperature', 'max_tokens', 'model', 'json'}
+                ('model' only applies to the preferred provider)
+
+        Returns:
+            normalized response {'provider', 'model', 'content', 'finish_reason',
+            'usage', 'latency_ms', 'attempts'}
+
+        Raises:
+            NoProviderAvailable: every provider failed or was skipped
+        """
+        attempts = []
+        retry_after = None
+        for provider in await sync_to_async(cls.ranked)(prefer):
+            if not await ProviderHealth.aallow(provider):
+                attempts.append({'provider': provider, 'error': 'circuit open'})
+                continue
+            provider_request = request if provider == prefer else {**request, 'model': None}
+            start = time.monotonic()
+            try:
+                result = await TEXT_PROVIDERS[provider](provider_request)
+            except RateLimited as e:
+                await ProviderHealth.arelease_probe(provider)
+                retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                attempts.append({'provider': provider, 'error': 'rate limited'})
+                continue
+            except ProviderFailure as e:
+                await ProviderHealth.arecord_failure(provider, time.monotonic() - start, e.trips_breaker)
+                attempts.append({'provider': provider, 'error': str(e)})
+                logger.warning('%s - failing over', e)
+                continue
+            except Exception as e:
+                await ProviderHealth.arecord_failure(provider, time.monotonic() - start, trips_breaker=False)
+                attempts.append({'provider': provider, 'error': f'Server error: {e}'})
+                continue
+
+            elapsed = time.monotonic() - start
+            await ProviderHealth.arecord_success(provider, elapsed)
+            return {**result, 'latency_ms': round(elapsed * 1000), 'attempts': attempts}
+
+        raise NoProviderAvailable(attempts, retry_after)
+
+    @classmethod
+    def status(cls):
+        """Breaker state and health of every text provider, for check_ai_service_status"""
+        return {
+            provider: {'configured': bool(AIRateLimiter.keys(provider)), **ProviderHealth.report(provider)}
+            for provider in TEXT_PROVIDERS
+        }
@@ -0,0 +1,132 @@
+"""
+Streaming story generation over server-sent events
+Provider tokens are relayed as they arrive; the story JSON is assembled and validated at the end
+"""
+import json
+import re
+import time
+import httpx
+from .ai_http import ProviderHTTP
+from .ai_rate_limit import AIRateLimiter
+
+
+def _last_json_object(text):
+    """The last top-level {...} of text (free models may think out loud first), or None"""
+    close = text.rfind('}')
+    depth = 0
+    for i in range(close, -1, -1):
+        if text[i] == '}':
+            depth += 1
+        elif text[i] == '{':
+            depth -= 1
+            if depth == 0:
+                return text[i:close + 1]
+    return None
+
+
+def parse_story_json(content):
+    """
+    The story object of a completion (what the frontend's generateStoryWith* parse)
+
+    Accepts bare JSON, or JSON wrapped in markdown fences or preceded by prose,
+    with trailing commas tolerated.
+
+    Raises:
+        ValueError: no JSON object, or one without a pages array
+    """
+    try:
+        story = json.loads(content)
+    except ValueError:
+        fence = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
+        candidate = fence.group(1) if fence else _last_json_object(content)
+        if not candidate:
+            raise ValueError('Response was not valid JSON')
+        story = json.loads(re.sub(r',\s*([}\]])', r'\1', candidate))
+    if not isinstance(story, dict) or not isinstance(story.get('pages'), list):
+        raise ValueError('Response missing pages array')
+    return story
+
+
+def sse_event(event, data):
+    """One server-sent event frame"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+async def iter_completion_deltas(response):
+    """
+    Text deltas of an OpenAI-style streaming completion (Groq, OpenRouter)
+
+    Yields (text, finish_reason) per chunk; SSE comments such as OpenRouter's
+    ': OPENROUTER PROCESSING' keep-alives are skipped.
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        if chunk.get('error'):
+            raise RuntimeError(chunk['error'].get('message', 'Provider stream error'))
+        choice = (chunk.get('choices') or [{}])[0]
+        text = (choice.get('delta') or {}).get('content') or ''
+        if text or choice.get('finish_reason'):
+            yield text, choice.get('finish_reason')
+
+
+async def stream_story(provider, api_key, url, headers, payload, timeout):
+    """
+    Relay a streaming completion as SSE: token events, then done (or error)
+
+    token: {"text"} per provider chunk
+    done:  {"story", "content", "finish_reason", "provider", "latency_ms"} once the
+           assembled content parses as a story
+    error: {"error", "content"} when the stream fails or the story doesn't validate
+    """
+    from .ai_router import ProviderHealth
+
+    start = time.monotonic()
+    parts = []
+    finish_reason = None
+    try:
+        async with ProviderHTTP.astream('POST', url, timeout=timeout, headers=headers, json={**payload, 'stream': True}) as response:
+            await AIRateLimiter.aobserve(provider, api_key, response.status_code, response.headers)
+            if not response.is_success:
+                body = (await response.aread()).decode(errors='replace')[:300]
+                if response.status_code >= 500:
+                    await ProviderHealth.arecord_failure(provider, time.monotonic() - start)
+                else:
+                    await ProviderHealth.arelease_probe(provider)
+                yield sse_event('error', {'error': f'{provider} API error {response.status_code}: {body}', 'status': response.status_code})
+                return
+            async for text, reason in iter_completion_deltas(response):
+                if text:
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+                finish_reason = reason or finish_reason
+    except httpx.TimeoutException:
+        await ProviderHealth.arecord_failure(provider, time.monotonic() - start)
+        yield sse_event('error', {'error': f'{provider} request timed out. Please try again.', 'content': ''.join(parts)})
+        return
+    except Exception as e:
+        await ProviderHealth.arelease_probe(provider)
+        yield sse_event('error', {'error': f'Stream failed: {e}', 'content': ''.join(parts)})
+        return
+
+    await ProviderHealth.arecord_success(provider, time.monotonic() - start)
+    content = ''.join(parts)
+    try:
+        story = parse_story_json(content)
+    except ValueError as e:
+        yield sse_event('error', {'error': f'{e}. Please try again.', 'content': content, 'finish_reason': finish_reason})
+        return
+    yield sse_event('done', {
+        'story': story,
+        'content': content,
+        'finish_reason': finish_reason,
+        'provider': provider,
+        'latency_ms': round((time.monotonic() - start) * 1000),
+    })
@@ -0,0 +1,175 @@
+"""
+Announcement Service for platform-wide broadcasts
+Announcements are stored once; per-user read markers are only created when a user reads one
+"""
+import logging
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from .models import Announcement, AnnouncementRead
+
+logger = logging.getLogger(__name__)
+
+
+class AnnouncementService:
+    """Service for publishing announcements and tracking who has read them"""
+
+    # Bumped on every publish so cached per-user counts know they are stale
+    GENERATION_KEY = 'announcement_generation'
+    # (generation, unread count) for one user
+    UNREAD_KEY = 'announce_unread_{user_id}'
+    UNREAD_TTL = 604800  # 7 days
+
+    # Channel groups joined by every NotificationConsumer
+    GROUP_NAME = 'announcements_{target_type}'
+
+    READ_BATCH_SIZE = 500
+
+    @classmethod
+    def groups_for(cls, user_type):
+        """Channel groups a connected user of this type listens on"""
+        groups = [cls.GROUP_NAME.format(target_type='all')]
+        if user_type:
+            groups.append(cls.GROUP_NAME.format(target_type=user_type))
+        return groups
+
+    # ---------- Publishing ----------
+
+    @classmethod
+    def publish(cls, title, message, target_type='all', created_by=None):
+        """
+        Store an announcement and notify online users with a single broadcast
+
+        Cost does not depend on the number of users: one row is written and one
+        group message is sent. Offline users see it in their inbox next time.
+        """
+        announcement = Announcement.objects.create(
+            title=title,
+            message=message,
+            target_type=target_type,
+            created_by=created_by
+        )
+        cls._bump_generation()
+        cls.broadcast(announcement)
+        return announcement
+
+    @classmethod
+    def _bump_generation(cls):
+        try:
+            cache.incr(cls.GENERATION_KEY)
+        except ValueError:
+            cache.set(cls.GENERATION_KEY, 1, None)
+
+    @classmethod
+    def broadcast(cls, announcement):
+        """Send the announcement to every connected user in the target group"""
+        try:
+            from channels.layers import get_channel_layer
+            from asgiref.sync import async_to_sync
+
+            channel_layer = get_channel_layer()
+            if channel_layer:
+                async_to_sync(channel_layer.group_send)(
+                    cls.GROUP_NAME.format(target_type=announcement.target_type),
+                    {
+                        'type': 'announcement',
+                        'announcement': {
+                            'id': announcement.id,
+                            'title': announcement.title,
+                            'message': announcement.message,
+                            'target_type': announcement.target_type,
+                            'created_at': announcement.created_at.isoformat(),
+                        }
+                    }
+                )
+        except Exception:
+            logger.exception('Broadcasting announcement failed')
+
+    # ---------- Reading ----------
+
+    @classmethod
+    def _user_type(cls, user):
+        try:
+            return user.profile.user_type
+        except Exception:
+            return None
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Announcements visible to a user, annotated with is_read
+
+        Only announcements published after the user joined are included.
+        """
+        targets = Q(target_type='all')
+        user_type = cls._user_type(user)
+        if user_type:
+            targets |= Q(target_type=user_type)
+
+        return Announcement.objects.filter(
+            targets,
+            created_at__gte=user.date_joined
+        ).annotate(
+            is_read=Exists(AnnouncementRead.objects.filter(announcement=OuterRef('pk'), user=user))
+        )
+
+    @classmethod
+    def unread_count(cls, user_id, user=None):
+        """
+        Get the number of unread announcements for a user
+
+        Cached per user and recomputed only after a new announcement is
+        published or the user marks announcements read.
+        """
+        values = cache.get_many([cls.GENERATION_KEY, cls.UNREAD_KEY.format(user_id=user_id)])
+        return cls._unread_from_cache(user_id, values, user)
+
+    @classmethod
+    def _unread_from_cache(cls, user_id, values, user=None):
+        """Resolve the unread count from already fetched cache values"""
+        generation = values.get(cls.GENERATION_KEY, 0)
+        cached = values.get(cls.UNREAD_KEY.format(user_id=user_id))
+        if cached and cached[0] == generation:
+            return cached[1]
+
+        if user is None:
+            user = User.objects.select_related('profile').filter(id=user_id).first()
+            if user is None:
+                return 0
+
+        count = cls.for_user(user).filter(is_read=False).count()
+        cache.set(cls.UNREAD_KEY.format(user_id=user_id), (generation, count), cls.UNREAD_TTL)
+        return count
+
+    @classmethod
+    def mark_read(cls, user, ids=None, up_to=None, mark_all=False):
+        """
+        Create read markers for announcements
+
+        Args:
+            user: User object
+            ids: Iterable of announcement ids to mark read
+            up_to: Mark every announcement published at or before this datetime read
+            mark_all: Mark every visible announcement read
+
+        Returns:
+            Number of announcements that changed from unread to read
+        """
+        queryset = cls.for_user(user).filter(is_read=False)
+        if not mark_all:
+            if not ids and up_to is None:
+                return 0
+            if ids:
+                queryset = queryset.filter(id__in=[int(i) for i in ids])
+            if up_to is not None:
+                queryset = queryset.filter(created_at__lte=up_to)
+
+        unread_ids = list(queryset.values_list('id', flat=True))
+        if unread_ids:
+            AnnouncementRead.objects.bulk_create(
+                [AnnouncementRead(announcement_id=announcement_id, user=user) for announcement_id in unread_ids],
+                batch_size=cls.READ_BATCH_SIZE,
+                ignore_conflicts=True
+            )
+            cache.delete(cls.UNREAD_KEY.format(user_id=user.id))
+        return len(unread_ids)
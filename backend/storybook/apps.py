@@ -6,5 +6,7 @@ class StorybookConfig(AppConfig):
     name = 'storybook'
     
     def ready(self):
-        # Import signals if needed
-        pass
+        # Keep cached unread counters in sync with notification writes
+        from . import signals  # noqa: F401
+        # Count DB queries of WebSocket handlers on every connection from the first one
+        from . import ws_metrics  # noqa: F401
@@ -0,0 +1,116 @@
+"""
+Badge Service for the app's unread / pending badges
+Keeps per-user counters in the cache (Redis) so the badge poll never touches the database
+"""
+import logging
+from django.core.cache import cache
+from .inbox_service import NotificationInbox
+
+logger = logging.getLogger(__name__)
+
+
+class BadgeService:
+    """
+    Service for the four app badges
+
+    - messages: unread direct messages
+    - notifications: unread notifications + announcements (kept by NotificationInbox)
+    - friend_requests: pending friend requests received
+    - collab_invites: pending collaboration invites received
+
+    Counters are adjusted incrementally by model signals and bulk updates and
+    pushed to the user's notifications WebSocket as 'badge_update' deltas.
+    Notification changes keep using the 'unread_count' event.
+    """
+
+    COUNTERS = ['messages', 'notifications', 'friend_requests', 'collab_invites']
+
+    # Counters stored here (notifications live in NotificationInbox)
+    KEY = 'badge_{counter}_{user_id}'
+    TTL = 604800  # 7 days - recomputed from the database on a miss
+
+    @classmethod
+    def _key(cls, counter, user_id):
+        return cls.KEY.format(counter=counter, user_id=user_id)
+
+    @classmethod
+    def _count_from_db(cls, counter, user_id):
+        """Count a badge in the database (only used when the counter is cold)"""
+        from .models import Message, Friendship, CollaborationInvite
+
+        if counter == 'messages':
+            return Message.objects.filter(receiver_id=user_id, is_read=False).count()
+        if counter == 'friend_requests':
+            return Friendship.objects.filter(receiver_id=user_id, status='pending').count()
+        if counter == 'collab_invites':
+            return CollaborationInvite.objects.filter(receiver_id=user_id, status='pending').count()
+        raise ValueError(f'Unknown badge counter: {counter}')
+
+    @classmethod
+    def summary(cls, user_id):
+        """
+        Get all four badge counts with a single cache round trip
+
+        Returns:
+            dict of counter name -> count
+        """
+        own_keys = {counter: cls._key(counter, user_id) for counter in cls.COUNTERS if counter != 'notifications'}
+        values = cache.get_many(list(own_keys.values()) + NotificationInbox.cache_keys(user_id))
+
+        badges = {}
+        for counter, key in own_keys.items():
+            count = values.get(key)
+            if count is None:
+                count = cls._count_from_db(counter, user_id)
+                cache.add(key, count, cls.TTL)
+            badges[counter] = max(count, 0)
+
+        badges['notifications'] = NotificationInbox._unread_from_cache(user_id, values)
+        return {counter: badges[counter] for counter in cls.COUNTERS}
+
+    @classmethod
+    def adjust(cls, user_id, counter, delta, push=True):
+        """
+        Atomically add delta to one of the user's badge counters and push it
+
+        A cold counter is left cold - the next read recomputes it.
+        """
+        if counter == 'notifications':
+            return NotificationInbox.adjust_unread(user_id, delta, push=push)
+        if not delta:
+            return
+
+        key = cls._key(counter, user_id)
+        try:
+            count = cache.incr(key, delta)
+        except ValueError:
+            count = None  # Counter not warmed yet
+
+        if count is not None and count < 0:
+            cache.set(key, 0, cls.TTL)
+            count = 0
+
+        if push:
+            cls.push_delta(user_id, counter, delta, count)
+
+    @classmethod
+    def push_delta(cls, user_id, counter, delta, count=None):
+        """Push a badge change over the user's notifications WebSocket"""
+        try:
+            from channels.layers import get_channel_layer
+            from asgiref.sync import async_to_sync
+
+            channel_layer = get_channel_layer()
+            if channel_layer:
+                async_to_sync(channel_layer.group_send)(
+                    f'notifications_{user_id}',
+                    {
+                        'type': 'badge_update',
+                        'counter': counter,
+                        'delta': delta,
+                        'count': count,
+                    }
+                )
+        except Exception:
+            logger.exception('Pushing badge update failed')
+
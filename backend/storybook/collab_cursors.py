@@ -0,0 +1,60 @@
+"""
+Cursor coalescing for collaboration rooms
+Cursor moves are collected per room and broadcast once per tick as a single cursor_batch event
+"""
+import asyncio
+from django.conf import settings
+
+
+class CursorCoalescer:
+    """
+    Per-process latest cursor positions, flushed COLLAB_CURSOR_TICK_HZ times a second
+
+    Only the newest position of each user survives a tick, and every target
+    group gets one event per tick, so channel layer traffic grows with
+    tick rate x rooms instead of mouse events x participants. A room's ticker
+    only runs while its cursors are moving.
+    """
+
+    _latest = {}   # session_id -> {(group, ...): {user_id: cursor}}
+    _tickers = {}  # session_id -> asyncio.Task
+
+    @classmethod
+    def interval(cls):
+        return 1.0 / max(getattr(settings, 'COLLAB_CURSOR_TICK_HZ', 20), 1)
+
+    @classmethod
+    def update(cls, channel_layer, session_id, groups, cursor):
+        """Remember a user's latest cursor for the next tick"""
+        room = cls._latest.setdefault(session_id, {})
+        room.setdefault(tuple(groups), {})[cursor['user_id']] = cursor
+        if session_id not in cls._tickers:
+            cls._tickers[session_id] = asyncio.ensure_future(cls._tick(channel_layer, session_id))
+
+    @classmethod
+    async def _tick(cls, channel_layer, session_id):
+        try:
+            await asyncio.sleep(cls.interval())
+        finally:
+            if cls._tickers.get(session_id) is asyncio.current_task():
+                del cls._tickers[session_id]
+        await cls.flush(channel_layer, session_id)
+
+    @classmethod
+    async def flush(cls, channel_layer, session_id):
+        """Send one cursor_batch event per target group"""
+        timer = cls._tickers.pop(session_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+        room = cls._latest.pop(session_id, None)
+        for groups, cursors in (room or {}).items():
+            event = {'type': 'cursor_batch', 'cursors': list(cursors.values())}
+            for group in groups:
+                await channel_layer.group_send(group, event)
+
+    @classmethod
+    def forget(cls, session_id, user_id):
+        """Drop a user's unsent cursor (e.g. when they leave)"""
+        for cursors in cls._latest.get(session_id, {}).values():
+            cursors.pop(user_id, None)
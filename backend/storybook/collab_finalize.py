@@ -0,0 +1,180 @@
+"""
+Background finalization of collaborative stories
+Pages are assembled one at a time off the event loop while progress is pushed to the room
+"""
+import asyncio
+import io
+import json
+import logging
+from channels.db import database_sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from .collab_state import CanvasStore, CollabSessionState
+from .models import CollaborationSession, SessionParticipant, Story
+
+logger = logging.getLogger(__name__)
+
+PAGE_BREAK = '\n\n---PAGE BREAK---\n\n'  # What the frontend's convertFromApiFormat splits on
+
+
+class StoryFinalizer:
+    """
+    Turns a session's live state into a Story without blocking the consumer
+
+    start() returns immediately; the job runs in a database thread, streams
+    the page snapshots into the canvas JSON one page at a time, writes every
+    co-author with one bulk insert into the authors through table, and sends
+    finalize_progress events to the room as it goes. A cache lock keeps two
+    workers (or a double click) from creating the story twice.
+    """
+
+    LOCK_KEY = 'collab_finalize_{session_id}'
+    LOCK_TTL = 600
+    _jobs = {}  # session_id -> asyncio.Task
+
+    @classmethod
+    def start(cls, channel_layer, session_id, group_name, reply_channel=None):
+        """
+        Finalize in the background
+
+        Returns:
+            False if this session is already being finalized
+        """
+        if session_id in cls._jobs or not cache.add(cls.LOCK_KEY.format(session_id=session_id), 1, cls.LOCK_TTL):
+            return False
+        cls._jobs[session_id] = asyncio.ensure_future(
+            cls._run(channel_layer, session_id, group_name, reply_channel)
+        )
+        return True
+
+    @classmethod
+    async def _run(cls, channel_layer, session_id, group_name, reply_channel):
+        from asgiref.sync import async_to_sync
+
+        def progress(stage, done, total):
+            async_to_sync(channel_layer.group_send)(group_name, {
+                'type': 'finalize_progress',
+                'stage': stage,
+                'done': done,
+                'total': total,
+            })
+
+        try:
+            result = await database_sync_to_async(cls.finalize)(session_id, progress)
+            await channel_layer.group_send(group_name, {
+                'type': 'story_finalized',
+                'story_id': result['story_id'],
+                'message': 'Story saved to all participants!'
+            })
+            await channel_layer.group_send(group_name, {
+                'type': 'session_ended',
+                'session_id': session_id,
+                'story_id': result['story_id'],
+                'story_title': result['title'],
+                'ended_by': 'vote'
+            })
+        except Exception as e:
+            logger.exception('Finalizing collaborative story %s failed', session_id)
+            if reply_channel:
+                await channel_layer.send(reply_channel, {
+                    'type': 'finalize_failed',
+                    'message': f'Failed to finalize story: {str(e)}'
+                })
+        finally:
+            cls._jobs.pop(session_id, None)
+            cache.delete(cls.LOCK_KEY.format(session_id=session_id))
+
+    @classmethod
+    async def wait(cls, session_id):
+        """Wait for a running finalization of this process to finish"""
+        job = cls._jobs.get(session_id)
+        if job:
+            await asyncio.shield(job)
+
+    @classmethod
+    def finalize(cls, session_id, progress=None):
+        """
+        Create the Story of a session and end the session
+
+        Args:
+            progress: optional callable(stage, done, total) - stages are
+                'pages' (once per page written), 'authors' and 'done'
+
+        Returns:
+            {'story_id', 'title'}
+        """
+        progress = progress or (lambda stage, done, total: None)
+
+        # Write the live draft first so the session row is current
+        CollabSessionState.persist(session_id)
+        session = CollaborationSession.objects.select_related('host').get(session_id=session_id)
+        if not session.is_active and session.story_id:
+            story = Story.objects.filter(id=session.story_id).only('id', 'title').first()
+            if story:
+                return {'story_id': story.id, 'title': story.title}
+
+        story_data = session.story_draft or {}
+        pages = story_data.get('pages', [])
+        content_string = PAGE_BREAK.join(
+            str(p.get('text', '')) if isinstance(p, dict) else p
+            for p in pages if isinstance(p, (dict, str))
+        )
+        if not content_string.strip():
+            content_string = 'Untitled story content'
+
+        # Canvas JSON array written a page at a time: cover (order -1), then pages in draft order
+        page_ids = [p['id'] for p in pages if isinstance(p, dict) and p.get('id')]
+        total = CanvasStore.snapshot_count(session_id)
+        canvas_json = io.StringIO()
+        canvas_json.write('[')
+        cover_data = None
+        done = order = 0
+        for field, page_data in CanvasStore.iter_ordered_snapshots(session_id, page_ids, session):
+            if field == CanvasStore.COVER_FIELD:
+                cover_data = page_data
+                entry = {'id': 'cover', 'order': -1, 'canvasData': page_data}
+            else:
+                entry = {'id': field.split(':', 1)[1], 'order': order, 'canvasData': page_data}
+                order += 1
+            if done:
+                canvas_json.write(', ')
+            canvas_json.write(json.dumps(entry))
+            done += 1
+            progress('pages', done, max(total, done))
+        canvas_json.write(']')
+
+        genres = story_data.get('genres', [])
+        # Story, co-authors and the ended session together: a failure part-way leaves none of them
+        with transaction.atomic():
+            story = Story.objects.create(
+                title=story_data.get('title', 'Untitled Collaborative Story'),
+                content=content_string,
+                canvas_data=canvas_json.getvalue(),
+                summary=story_data.get('summary', ''),
+                category=story_data.get('category', 'other'),
+                language=story_data.get('language', 'en'),
+                cover_image=story_data.get('cover_image', '') or cover_data or '',
+                genres=genres if isinstance(genres, list) else [],
+                creation_type='collaborative',
+                is_collaborative=True,
+                collaboration_session=session,
+                author=session.host,  # Primary author is the host
+                is_published=False
+            )
+
+            # Every participant as a co-author in one INSERT
+            user_ids = set(SessionParticipant.objects.filter(session=session).values_list('user_id', flat=True))
+            Authors = Story.authors.through
+            Authors.objects.bulk_create(
+                [Authors(story_id=story.id, user_id=user_id) for user_id in user_ids],
+                ignore_conflicts=True
+            )
+
+            CollaborationSession.objects.filter(pk=session.pk).update(is_active=False, story_id=story.id)
+        progress('authors', len(user_ids), len(user_ids))
+
+        CollabSessionState.discard(session_id)
+        CanvasStore.discard(session_id)
+        progress('done', 1, 1)
+
+        return {'story_id': story.id, 'title': story.title}
@@ -0,0 +1,376 @@
+"""
+Operation sequencing and write-behind buffering for collaborative drawing
+Sequence numbers come from an atomic cache (Redis) counter; rows are written with bulk_create
+"""
+import asyncio
+import json
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from .models import DrawingOperation
+from .redis_store import get_store
+
+logger = logging.getLogger(__name__)
+
+class OperationSequencer:
+    """Atomic per-session sequence numbers shared by every worker"""
+
+    KEY = 'collab_op_seq_{session_id}'
+    TTL = 2592000  # 30 days - reseeded from the database on a miss
+
+    @classmethod
+    def next(cls, session_id, session_pk, count=1):
+        """
+        Reserve count sequence numbers for a session
+
+        Returns:
+            The last reserved sequence number (the range is last-count+1 .. last)
+        """
+        key = cls.KEY.format(session_id=session_id)
+        try:
+            return cache.incr(key, count)
+        except ValueError:
+            # Cold counter: seed it from the database. add() is atomic, so when
+            # several workers race only one seed wins and INCR keeps numbers unique.
+            last = DrawingOperation.objects.filter(session_id=session_pk).aggregate(
+                last=Max('sequence_number')
+            )['last']
+            cache.add(key, -1 if last is None else last, cls.TTL)
+            return cache.incr(key, count)
+
+    @classmethod
+    def current(cls, session_id):
+        """Last sequence number handed out (None if the counter is cold)"""
+        return cache.get(cls.KEY.format(session_id=session_id))
+
+
+class RecentOperations:
+    """
+    Bounded ring buffer (Redis list) of a session's most recent operations
+
+    Lets a reconnecting client catch up on just the operations it missed. When
+    the gap is larger than the buffer the caller falls back to a full snapshot.
+    """
+
+    KEY = 'collab_op_ring_{session_id}'
+    TTL = 3600  # 1 hour after the last operation
+
+    @classmethod
+    def size(cls):
+        return getattr(settings, 'COLLAB_RESYNC_BUFFER_SIZE', 200)
+
+    @classmethod
+    def record(cls, session_id, operation):
+        """Append a serialized operation (see OperationCompactor.serialize)"""
+        get_store().push_trimmed(
+            cls.KEY.format(session_id=session_id),
+            [json.dumps(operation)],
+            cls.size(),
+            cls.TTL
+        )
+
+    @classmethod
+    def since(cls, session_id, last_sequence_number):
+        """
+        Get the operations after last_sequence_number, oldest first
+
+        Returns:
+            (operations, current_sequence_number), or (None, current) when the
+            buffer no longer holds every missed operation
+        """
+        current = OperationSequencer.current(session_id)
+        if current is None:
+            return None, None
+
+        last_sequence_number = int(last_sequence_number)
+        if last_sequence_number >= current:
+            return [], current
+        if current - last_sequence_number > cls.size():
+            return None, current
+
+        operations = [
+            op for op in (json.loads(item) for item in get_store().lrange(cls.KEY.format(session_id=session_id)))
+            if op['sequence_number'] > last_sequence_number
+        ]
+        operations.sort(key=lambda op: op['sequence_number'])
+
+        # Every missed number must be present (trimmed or still in flight -> snapshot)
+        expected = list(range(last_sequence_number + 1, current + 1))
+        if [op['sequence_number'] for op in operations] != expected:
+            return None, current
+        return operations, current
+
+
+class OperationBuffer:
+    """
+    In-process write-behind queue of DrawingOperation rows
+
+    Operations are numbered when they are queued and written in that order with
+    one bulk_create per flush. A session's queue is flushed when it holds
+    COLLAB_OP_FLUSH_BATCH_SIZE operations, COLLAB_OP_FLUSH_INTERVAL_MS after its
+    first pending operation, or explicitly (e.g. when a participant disconnects).
+
+    A failed write puts the batch back in front of the queue and retries it on
+    a timer, backing off while the database stays unavailable.
+    """
+
+    _pending = {}  # session_id -> [DrawingOperation]
+    _timers = {}   # session_id -> asyncio.Task
+    _failures = {}  # session_id -> consecutive failed flushes
+    MAX_BACKOFF_SECONDS = 30
+
+    @classmethod
+    def batch_size(cls):
+        return getattr(settings, 'COLLAB_OP_FLUSH_BATCH_SIZE', 50)
+
+    @classmethod
+    def interval(cls):
+        return getattr(settings, 'COLLAB_OP_FLUSH_INTERVAL_MS', 250) / 1000.0
+
+    @classmethod
+    async def add(cls, session_id, session_pk, user_id, operation_type, operation_data, page_number=0):
+        """
+        Number an operation and queue it for writing
+
+        Returns:
+            The operation's sequence number
+        """
+        operation = DrawingOperation(
+            session_id=session_pk,
+            user_id=user_id,
+            operation_type=operation_type,
+            operation_data=operation_data,
+            page_number=page_number,
+            timestamp=timezone.now()
+        )
+        sequence_number = await database_sync_to_async(cls._number_and_record)(session_id, operation)
+
+        pending = cls._pending.setdefault(session_id, [])
+        pending.append(operation)
+
+        # While writes are failing, only the retry timer flushes
+        if len(pending) >= cls.batch_size() and session_id not in cls._failures:
+            await cls.flush(session_id)
+        elif session_id not in cls._timers:
+            cls._schedule(session_id, cls.interval())
+
+        return sequence_number
+
+    @staticmethod
+    def _number_and_record(session_id, operation):
+        operation.sequence_number = OperationSequencer.next(session_id, operation.session_id)
+        RecentOperations.record(session_id, OperationCompactor.serialize(operation))
+        return operation.sequence_number
+
+    @classmethod
+    def _schedule(cls, session_id, delay):
+        cls._timers[session_id] = asyncio.ensure_future(cls._flush_later(session_id, delay))
+
+    @classmethod
+    async def _flush_later(cls, session_id, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            if cls._timers.get(session_id) is asyncio.current_task():
+                del cls._timers[session_id]
+        await cls.flush(session_id)
+
+    @classmethod
+    async def flush(cls, session_id):
+        """Write every pending operation of a session with one bulk_create"""
+        timer = cls._timers.pop(session_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+        # Swap the queue out before awaiting so new operations start a fresh batch
+        pending = cls._pending.pop(session_id, None)
+        if not pending:
+            return 0
+
+        pending.sort(key=lambda op: op.sequence_number)
+        try:
+            await database_sync_to_async(DrawingOperation.objects.bulk_create)(
+                pending, batch_size=cls.batch_size()
+            )
+        except Exception:
+            failures = cls._failures[session_id] = cls._failures.get(session_id, 0) + 1
+            # Back in front of anything queued meanwhile, retried with exponential backoff
+            cls._pending[session_id] = pending + cls._pending.get(session_id, [])
+            delay = min(cls.interval() * 2 ** failures, cls.MAX_BACKOFF_SECONDS)
+            logger.exception(
+                "Failed to flush %s operations for session %s (attempt %s), retrying in %.1fs",
+                len(pending), session_id, failures, delay
+            )
+            if session_id not in cls._timers:
+                cls._schedule(session_id, delay)
+            return 0
+        cls._failures.pop(session_id, None)
+        return len(pending)
+
+    @classmethod
+    def pending_count(cls, session_id):
+        return len(cls._pending.get(session_id, []))
+
+
+class OperationCompactor:
+    """
+    Folds old operations of a session into per-page OperationSnapshot checkpoints
+
+    Folding keeps replay equivalent for clients while dropping what a late joiner
+    never needs: strokes drawn before a page's last 'clear', superseded 'text_edit'
+    operations (only the latest text of a page matters) and navigation
+    ('page_change' rows other than each user's latest, which stay in place for
+    page lookups). Folded rows are deleted, so replay = snapshot operations +
+    operations after its sequence number.
+    """
+
+    # Operations newer than this are never folded - other workers may still have
+    # lower sequence numbers waiting in their write-behind queue
+    SETTLE_SECONDS = 60
+
+    # What a clear wipes: the strokes on that canvas. Structural operations
+    # (add_page, delete_page, transform, delete, ...) survive it.
+    CLEARED_TYPES = {'draw', 'erase'}
+
+    @staticmethod
+    def serialize(op):
+        """Plain dict form of an operation, as stored in snapshots and sent to clients"""
+        return {
+            'id': op.id,
+            'user_id': op.user_id,
+            'operation_type': op.operation_type,
+            'operation_data': op.operation_data,
+            'page_number': op.page_number,
+            'sequence_number': op.sequence_number,
+            'timestamp': op.timestamp.isoformat() if op.timestamp else None,
+        }
+
+    @classmethod
+    def fold(cls, base, operations):
+        """
+        Fold serialized operations (in sequence order) onto a snapshot's operations
+
+        Returns:
+            The folded operation list
+        """
+        folded = list(base)
+        for op in operations:
+            op_type = op['operation_type']
+            data = op['operation_data'] if isinstance(op['operation_data'], dict) else {}
+
+            if op_type == 'clear':
+                # Everything drawn before on the same canvas (page or cover) is gone
+                is_cover = bool(data.get('is_cover_image'))
+                folded = [
+                    prev for prev in folded
+                    if prev['operation_type'] not in cls.CLEARED_TYPES
+                    or not isinstance(prev['operation_data'], dict)
+                    or bool(prev['operation_data'].get('is_cover_image')) != is_cover
+                ]
+                continue
+            if op_type == 'page_change':
+                continue  # Navigation history doesn't change page content
+            if op_type == 'text_edit':
+                folded = [prev for prev in folded if prev['operation_type'] != 'text_edit']
+            folded.append(op)
+        return folded
+
+    @classmethod
+    def compact_session(cls, session, settle_seconds=None):
+        """
+        Fold every settled operation of a session into its page snapshots
+
+        Returns:
+            Number of operation rows folded (and deleted)
+        """
+        from datetime import timedelta
+        from django.db import transaction
+        from django.utils import timezone
+        from .models import OperationSnapshot
+
+        if settle_seconds is None:
+            settle_seconds = cls.SETTLE_SECONDS
+        cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+
+        folded_total = 0
+        with transaction.atomic():
+            snapshots = {
+                snapshot.page_number: snapshot
+                for snapshot in OperationSnapshot.objects.select_for_update().filter(session=session)
+            }
+            operations = DrawingOperation.objects.filter(
+                session=session,
+                timestamp__lt=cutoff
+            ).order_by('sequence_number')
+
+            # Each user's latest page_change row is kept - it records where they are
+            latest_page_changes = set()
+            seen_users = set()
+            for op_id, user_id in DrawingOperation.objects.filter(
+                session=session, operation_type='page_change'
+            ).order_by('-sequence_number').values_list('id', 'user_id'):
+                if user_id not in seen_users:
+                    seen_users.add(user_id)
+                    latest_page_changes.add(op_id)
+            if latest_page_changes:
+                operations = operations.exclude(id__in=latest_page_changes)
+
+            by_page = {}
+            for op in operations.iterator(chunk_size=1000):
+                by_page.setdefault(op.page_number, []).append(op)
+
+            for page_number, page_ops in by_page.items():
+                snapshot = snapshots.get(page_number) or OperationSnapshot(
+                    session=session, page_number=page_number
+                )
+                snapshot.operations = cls.fold(
+                    snapshot.operations or [],
+                    [cls.serialize(op) for op in page_ops]
+                )
+                snapshot.sequence_number = max(snapshot.sequence_number, page_ops[-1].sequence_number)
+                snapshot.folded_count += len(page_ops)
+                snapshot.save()
+
+                DrawingOperation.objects.filter(id__in=[op.id for op in page_ops]).delete()
+                folded_total += len(page_ops)
+
+        return folded_total
+
+    @classmethod
+    def get_replay(cls, session, page_number=None):
+        """
+        Get what a client needs to rebuild a session (or one page)
+
+        Returns:
+            (snapshots, operations) - snapshot dicts per page and the serialized
+            operations recorded after each page's snapshot
+        """
+        from .models import OperationSnapshot
+
+        snapshots = OperationSnapshot.objects.filter(session=session)
+        operations = DrawingOperation.objects.filter(session=session)
+        if page_number is not None:
+            snapshots = snapshots.filter(page_number=page_number)
+            operations = operations.filter(page_number=page_number)
+
+        snapshot_list = list(snapshots)
+        checkpoints = {snapshot.page_number: snapshot.sequence_number for snapshot in snapshot_list}
+
+        tail = [
+            cls.serialize(op)
+            for op in operations.order_by('sequence_number')
+            if op.sequence_number > checkpoints.get(op.page_number, -1)
+        ]
+        snapshot_data = [
+            {
+                'page_number': snapshot.page_number,
+                'sequence_number': snapshot.sequence_number,
+                'operations': snapshot.operations,
+                'folded_count': snapshot.folded_count,
+            }
+            for snapshot in snapshot_list
+        ]
+        return snapshot_data, tail
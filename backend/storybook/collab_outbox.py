@@ -0,0 +1,110 @@
+"""
+Outbound frame batching for collaboration connections
+Messages queued within a short window leave as one array frame
+"""
+import asyncio
+from django.conf import settings
+
+# Latest-wins messages: a newer one replaces the queued one, and they are shed first under backpressure
+EPHEMERAL_TYPES = {'cursor', 'cursor_batch', 'presence_update'}
+
+
+class FrameBatcher:
+    """
+    Outbound queue of one connection, flushed every COLLAB_FRAME_BATCH_MS
+
+    A lone message is sent as a normal frame; several go out as one array
+    frame (codec.encode_batch). A queued cursor or presence update of a user
+    is replaced by that user's newer one instead of queueing both. If the
+    queue still grows past COLLAB_FRAME_MAX_PENDING, the cursor and presence
+    updates are dropped, and if that isn't enough the queue is flushed early.
+    """
+
+    def __init__(self, codec, send_frame):
+        """
+        Args:
+            codec: wire format of the connection (collab_protocol)
+            send_frame: async callable(frame, messages) doing the actual send
+        """
+        self.codec = codec
+        self.send_frame = send_frame
+        self.window = getattr(settings, 'COLLAB_FRAME_BATCH_MS', 16) / 1000
+        self.max_pending = getattr(settings, 'COLLAB_FRAME_MAX_PENDING', 256)
+        self.pending = []
+        self.slots = {}  # latest-wins key -> index in pending
+        self.dropped = 0
+        self._timer = None
+
+    @staticmethod
+    def _slot_key(message):
+        message_type = message.get('type')
+        if message_type == 'cursor_batch':
+            return (message_type,)
+        if message_type in EPHEMERAL_TYPES:
+            return (message_type, message.get('user_id'))
+        return None
+
+    def push(self, message):
+        """Queue a message for the next frame"""
+        key = self._slot_key(message)
+        index = self.slots.get(key) if key else None
+        if index is None:
+            if key:
+                self.slots[key] = len(self.pending)
+            self.pending.append(message)
+        else:
+            if key[0] == 'cursor_batch':
+                cursors = {cursor['user_id']: cursor for cursor in self.pending[index]['cursors']}
+                cursors.update((cursor['user_id'], cursor) for cursor in message['cursors'])
+                message = {**message, 'cursors': list(cursors.values())}
+            self.pending[index] = message
+            self.dropped += 1
+
+        if len(self.pending) > self.max_pending:
+            self._shed()
+        if len(self.pending) > self.max_pending:
+            self._schedule(0)  # Only messages that matter are left - send them now
+        else:
+            self._schedule(self.window)
+
+    def _shed(self):
+        """Backpressure: drop queued cursor and presence updates before anything else"""
+        kept = [message for message in self.pending if message.get('type') not in EPHEMERAL_TYPES]
+        self.dropped += len(self.pending) - len(kept)
+        self.pending = kept
+        self.slots = {}  # Every latest-wins message was ephemeral
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            if delay:
+                return  # Already coming
+            self._timer.cancel()  # Still sleeping - replace it with an immediate flush
+        self._timer = asyncio.ensure_future(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            if self._timer is asyncio.current_task():
+                self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Send everything queued now"""
+        timer, self._timer = self._timer, None
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+        messages, self.pending, self.slots = self.pending, [], {}
+        if not messages:
+            return
+        if len(messages) == 1:
+            await self.send_frame(self.codec.encode(messages[0]), messages)
+        else:
+            await self.send_frame(self.codec.encode_batch(messages), messages)
+
+    def close(self):
+        """Drop the queue (the connection is gone)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.pending, self.slots = [], {}
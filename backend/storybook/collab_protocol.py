@@ -0,0 +1,151 @@
+"""
+Wire formats of the collaboration WebSocket
+JSON text frames by default; clients offering the msgpack subprotocol get binary frames
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - JSON only
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = 'pixeltales.msgpack.v1'
+
+# Stroke points are sent as integers in tenths of a pixel
+POINT_SCALE = 10
+
+# Message types whose points/cursor positions are compacted in binary frames;
+# every other message (and every JSON frame) is sent unchanged
+COMPACT_TYPES = {'draw_batch', 'cursor', 'cursor_batch'}
+
+# msgpack extension types of the compacted values
+POINTS_EXT = 1
+POSITION_EXT = 2
+
+
+# ---------- Compact points ----------
+# Only binary frames carry these, as msgpack extension values under the original
+# key, so no key is renamed and nothing else in a message can be mistaken for them:
+# points: [{'x': 10.0, 'y': 20.5}, {'x': 10.4, 'y': 21.0}]
+#     -> ext 1 of [100, 205, 4, 5]   (first point absolute, then deltas)
+# position: {'x': 10.0, 'y': 20.5}  ->  ext 2 of [100, 205]
+# Points holding anything besides x and y are sent as they are.
+
+def pack_points(points):
+    flat = []
+    last_x = last_y = 0
+    for point in points:
+        x = round(point['x'] * POINT_SCALE)
+        y = round(point['y'] * POINT_SCALE)
+        flat.append(x - last_x)
+        flat.append(y - last_y)
+        last_x, last_y = x, y
+    return flat
+
+
+def unpack_points(flat):
+    points = []
+    x = y = 0
+    for i in range(0, len(flat) - 1, 2):
+        x += flat[i]
+        y += flat[i + 1]
+        points.append({'x': x / POINT_SCALE, 'y': y / POINT_SCALE})
+    return points
+
+
+def _is_point(value):
+    """A bare {'x': number, 'y': number} point"""
+    return (
+        isinstance(value, dict) and value.keys() == {'x', 'y'}
+        and all(isinstance(value[axis], (int, float)) and not isinstance(value[axis], bool) for axis in 'xy')
+    )
+
+
+def compact(value):
+    """Replace 'points' / 'position' values with their msgpack extension forms, recursively"""
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    result = {}
+    for key, item in value.items():
+        if key == 'points' and isinstance(item, list) and item and all(_is_point(p) for p in item):
+            result[key] = msgpack.ExtType(POINTS_EXT, msgpack.packb(pack_points(item)))
+        elif key == 'position' and _is_point(item):
+            result[key] = msgpack.ExtType(POSITION_EXT, msgpack.packb(pack_points([item])))
+        else:
+            result[key] = compact(item)
+    return result
+
+
+def expand_ext(code, data):
+    """msgpack ext_hook restoring compacted values"""
+    if code == POINTS_EXT:
+        return unpack_points(msgpack.unpackb(data))
+    if code == POSITION_EXT:
+        return unpack_points(msgpack.unpackb(data))[0]
+    return msgpack.ExtType(code, data)
+
+
+# ---------- Codecs ----------
+
+class JSONCodec:
+    """Text frames with the original verbose JSON messages"""
+
+    name = 'json'
+    subprotocol = None
+    binary = False
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message)
+
+    @staticmethod
+    def encode_batch(messages):
+        """One array frame of several messages"""
+        return json.dumps(messages)
+
+    @staticmethod
+    def decode(text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    """
+    Binary msgpack frames; stroke points and cursors travel compacted
+
+    Compaction happens here, per connection, and rounds points to 0.1px - the
+    precision clients accept by offering the subprotocol.
+    """
+
+    name = 'msgpack'
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    @staticmethod
+    def encode(message):
+        if message.get('type') in COMPACT_TYPES:
+            message = compact(message)
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def encode_batch(messages):
+        """One array frame of several messages"""
+        return msgpack.packb([
+            compact(message) if message.get('type') in COMPACT_TYPES else message
+            for message in messages
+        ], use_bin_type=True)
+
+    @staticmethod
+    def decode(text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)  # A text frame is still accepted
+        return msgpack.unpackb(bytes_data, raw=False, ext_hook=expand_ext)
+
+
+def negotiate(subprotocols):
+    """Pick the codec for the subprotocols a client offered (JSON unless it asks for msgpack)"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in (subprotocols or []):
+        return MsgpackCodec
+    return JSONCodec
@@ -0,0 +1,129 @@
+"""
+Registry of live collaboration connections
+One Redis sorted set of channel names per session (scored by last heartbeat) plus a hash of their metadata
+"""
+import json
+import time
+from django.conf import settings
+from .redis_store import get_store
+
+
+class CollabConnectionRegistry:
+    """
+    Who is connected to a session, and on which page
+
+    Joining is an atomic capacity check (Lua script on Redis), so simultaneous
+    joins can't overfill a session. Connections heartbeat every
+    HEARTBEAT_SECONDS; entries of a dead worker stop heartbeating and are
+    reaped once older than STALE_SECONDS, so the count never drifts.
+    Page viewers and presence are read from here without touching the database.
+    """
+
+    KEY = 'collab_conns_{session_id}'
+    META_KEY = 'collab_conn_meta_{session_id}'
+    HEARTBEAT_SECONDS = 30
+    STALE_SECONDS = 90  # Three missed heartbeats
+    TTL = 7200
+
+    @classmethod
+    def max_connections(cls):
+        return getattr(settings, 'COLLAB_MAX_CONNECTIONS', 10)
+
+    @classmethod
+    def _keys(cls, session_id):
+        return cls.KEY.format(session_id=session_id), cls.META_KEY.format(session_id=session_id)
+
+    @classmethod
+    def register(cls, session_id, channel_name, meta, now=None):
+        """
+        Add a connection if the session has room for it
+
+        Returns:
+            True if registered, False if the session is full
+        """
+        now = time.time() if now is None else now
+        key, meta_key = cls._keys(session_id)
+        added, _ = get_store().zadd_capped(
+            key, channel_name, now, cls.max_connections(),
+            now - cls.STALE_SECONDS, meta_key, json.dumps(meta), cls.TTL
+        )
+        return added
+
+    @classmethod
+    def heartbeat(cls, session_id, channel_name, now=None):
+        """Mark a connection alive; False if it was reaped meanwhile (re-register it)"""
+        key, _ = cls._keys(session_id)
+        store = get_store()
+        alive = store.zadd_existing(key, channel_name, time.time() if now is None else now)
+        if alive:
+            store.expire(key, cls.TTL)
+            store.expire(cls.META_KEY.format(session_id=session_id), cls.TTL)
+        return alive
+
+    @classmethod
+    def update(cls, session_id, channel_name, **fields):
+        """Change a connection's metadata (only its own consumer writes it)"""
+        _, meta_key = cls._keys(session_id)
+        store = get_store()
+        meta = json.loads(store.hget(meta_key, channel_name) or '{}')
+        meta.update(fields)
+        store.hset(meta_key, {channel_name: json.dumps(meta)}, cls.TTL)
+
+    @classmethod
+    def unregister(cls, session_id, channel_name):
+        """
+        Remove a connection
+
+        Returns:
+            Number of live connections left in the session
+        """
+        key, meta_key = cls._keys(session_id)
+        store = get_store()
+        store.zrem(key, channel_name)
+        store.hdel(meta_key, channel_name)
+        return len(cls._live_channels(session_id))
+
+    @classmethod
+    def _live_channels(cls, session_id, now=None):
+        now = time.time() if now is None else now
+        key, meta_key = cls._keys(session_id)
+        store = get_store()
+        stale = store.zrangebyscore(key, '-inf', now - cls.STALE_SECONDS)
+        if stale:
+            store.zrem(key, *stale)
+            store.hdel(meta_key, *stale)
+        return store.zrangebyscore(key, now - cls.STALE_SECONDS, '+inf')
+
+    @classmethod
+    def connections(cls, session_id, now=None):
+        """Metadata of every live connection (stale ones are reaped on the way)"""
+        channels = cls._live_channels(session_id, now)
+        if not channels:
+            return []
+        _, meta_key = cls._keys(session_id)
+        values = get_store().hmget(meta_key, channels)
+        return [
+            {**json.loads(value), 'channel_name': channel}
+            for channel, value in zip(channels, values) if value is not None
+        ]
+
+    @classmethod
+    def users(cls, session_id, now=None):
+        """One entry per connected user (a user with two tabs counts once)"""
+        users = {}
+        for connection in cls.connections(session_id, now):
+            users.setdefault(connection['user_id'], connection)
+        return list(users.values())
+
+    @classmethod
+    def page_viewers(cls, session_id, now=None):
+        """{page: [user info]} of connected users"""
+        viewers = {}
+        for user in cls.users(session_id, now):
+            viewers.setdefault(user.get('page', 0), []).append({
+                'user_id': user['user_id'],
+                'username': user['username'],
+                'display_name': user.get('display_name', user['username']),
+                'cursor_color': user.get('cursor_color') or '#808080',
+            })
+        return viewers
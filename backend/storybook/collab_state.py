@@ -0,0 +1,600 @@
+"""
+Live state of collaboration sessions (draft, page, votes, canvases) kept in Redis hashes
+Edits change single hash fields; the CollaborationSession row is written by persist()
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import CollaborationSession
+from .redis_store import get_store
+
+logger = logging.getLogger(__name__)
+
+
+class StateLockTimeout(Exception):
+    """The session's state lock stayed held past the wait timeout"""
+
+
+class CollabSessionState:
+    """
+    Field-level session state shared by every worker
+
+    Hash layout (key collab_state_{session_id}):
+        title, meta (JSON of the other draft keys), pages (JSON list of page
+        dicts without their text), text:{page_id}, current_page,
+        voting_active, vote_initiator, vote:{user_id}, version, persisted_version,
+        epoch, rev:{page_id} (text revisions, see collab_text)
+
+    Typing only touches its page's text field. Every mutation bumps version, so
+    persist() can skip sessions that have not changed since the last write.
+    """
+
+    KEY = 'collab_state_{session_id}'
+    LOCK_KEY = 'collab_state_lock_{session_id}'
+    TTL = 86400  # 1 day after the last change - reloaded from the database on a miss
+    DEFAULT_TITLE = 'Collaborative Story'
+
+    @classmethod
+    def _key(cls, session_id):
+        return cls.KEY.format(session_id=session_id)
+
+    @classmethod
+    @contextmanager
+    def _lock(cls, session_id, timeout=5):
+        """
+        Short cross-worker lock for loads and page list changes
+
+        The lock expires after timeout seconds, so one left by a crashed worker
+        frees itself within the wait; release only deletes our own token, never
+        a lock another worker took after ours expired.
+
+        Raises:
+            StateLockTimeout: the lock was still held after waiting timeout seconds
+        """
+        store = get_store()
+        lock_key = cls.LOCK_KEY.format(session_id=session_id)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not store.acquire_lock(lock_key, token, timeout):
+            if time.monotonic() > deadline:
+                raise StateLockTimeout(f'Session {session_id} state is locked')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            store.release_lock(lock_key, token)
+
+    # ---------- Loading ----------
+
+    @classmethod
+    def load(cls, session_id, session=None):
+        """Load a session's state from the database unless it is already live"""
+        store = get_store()
+        key = cls._key(session_id)
+        if store.exists(key):
+            return
+        with cls._lock(session_id):
+            if store.exists(key):
+                return
+            if session is None:
+                session = CollaborationSession.objects.get(session_id=session_id)
+            mapping = cls._draft_fields(session.story_draft or {})
+            mapping.update({
+                'current_page': session.current_page,
+                'voting_active': int(session.voting_active),
+                'version': 0,
+                'persisted_version': 0,
+                'epoch': uuid.uuid4().hex[:12],  # Identifies this load (see CollaborativeText)
+            })
+            for user_id, vote in (session.voting_data or {}).items():
+                mapping[f'vote:{user_id}'] = int(bool(vote))
+            store.hset(key, mapping, cls.TTL)
+
+    @staticmethod
+    def _draft_fields(draft):
+        """Split a story_draft dict into hash fields"""
+        meta = {k: v for k, v in draft.items() if k not in ('title', 'pages')}
+        fields = {'meta': json.dumps(meta)}
+        if 'title' in draft:
+            fields['title'] = draft['title'] or ''
+
+        pages = []
+        raw_pages = draft.get('pages')
+        for page in raw_pages if isinstance(raw_pages, list) else []:
+            if not isinstance(page, dict):
+                page = {'text': str(page)}
+            page = dict(page)
+            page.setdefault('id', str(uuid.uuid4()))
+            fields[f"text:{page['id']}"] = page.pop('text', '') or ''
+            pages.append(page)
+        fields['pages'] = json.dumps(pages)
+        return fields
+
+    @classmethod
+    def _mutate(cls, session_id, mapping):
+        """Set fields of a live session and bump its version"""
+        cls.load(session_id)
+        return get_store().hset(cls._key(session_id), mapping, cls.TTL, incr='version')
+
+    # ---------- Draft ----------
+
+    @classmethod
+    def get_draft(cls, session_id):
+        """Assemble the story_draft dict from the hash (None if not live)"""
+        return cls._assemble(get_store().hgetall(cls._key(session_id)))
+
+    @staticmethod
+    def _assemble(values):
+        if not values:
+            return None
+        draft = json.loads(values.get('meta') or '{}')
+        if 'title' in values:
+            draft['title'] = values['title']
+        draft['pages'] = [
+            {**page, 'text': values.get(f"text:{page['id']}", '')}
+            for page in json.loads(values.get('pages') or '[]')
+        ]
+        return draft
+
+    @classmethod
+    def get_pages(cls, session_id):
+        """Page dicts (with ids, without text) of a live session"""
+        return json.loads(get_store().hget(cls._key(session_id), 'pages') or '[]')
+
+    @classmethod
+    def set_title(cls, session_id, title):
+        cls._mutate(session_id, {'title': title or ''})
+
+    @classmethod
+    def ensure_page(cls, session_id, page_index):
+        """Grow the page list of a live session until page_index exists; returns the pages"""
+        cls.load(session_id)
+        store = get_store()
+        key = cls._key(session_id)
+
+        pages = json.loads(store.hget(key, 'pages') or '[]')
+        if page_index >= len(pages):
+            with cls._lock(session_id):
+                pages = json.loads(store.hget(key, 'pages') or '[]')
+                while len(pages) <= page_index:
+                    pages.append({'id': str(uuid.uuid4())})
+                store.hset(key, {'pages': json.dumps(pages)}, cls.TTL)
+        return pages
+
+    @classmethod
+    def set_page_text(cls, session_id, page_index, text):
+        """Set one page's text (grows the page list when page_index is past the end)"""
+        pages = cls.ensure_page(session_id, page_index)
+        mapping = {f"text:{pages[page_index]['id']}": text}
+        if not get_store().hget(cls._key(session_id), 'title'):
+            mapping['title'] = cls.DEFAULT_TITLE
+        cls._mutate(session_id, mapping)
+
+    @classmethod
+    def add_page(cls, session_id, requested_index=None):
+        """
+        Insert an empty page (at requested_index when in range, else at the end)
+
+        Returns:
+            {'index': actual index, 'id': generated page id}
+        """
+        cls.load(session_id)
+        store = get_store()
+        key = cls._key(session_id)
+        page_id = str(uuid.uuid4())
+        with cls._lock(session_id):
+            pages = json.loads(store.hget(key, 'pages') or '[]')
+            if isinstance(requested_index, int) and 0 <= requested_index <= len(pages):
+                pages.insert(requested_index, {'id': page_id})
+                actual_index = requested_index
+            else:
+                pages.append({'id': page_id})
+                actual_index = len(pages) - 1
+            cls._mutate(session_id, {'pages': json.dumps(pages), f'text:{page_id}': ''})
+        return {'index': actual_index, 'id': page_id}
+
+    @classmethod
+    def delete_page(cls, session_id, page_index):
+        """Remove a page by index; returns False when out of range"""
+        cls.load(session_id)
+        store = get_store()
+        key = cls._key(session_id)
+        with cls._lock(session_id):
+            pages = json.loads(store.hget(key, 'pages') or '[]')
+            if not 0 <= page_index < len(pages):
+                return False
+            removed = pages.pop(page_index)
+            cls._mutate(session_id, {'pages': json.dumps(pages)})
+            store.hdel(key, f"text:{removed['id']}")
+        return True
+
+    # ---------- Navigation ----------
+
+    @classmethod
+    def set_current_page(cls, session_id, page_number):
+        cls._mutate(session_id, {'current_page': page_number})
+
+    # ---------- Voting ----------
+
+    @classmethod
+    def start_voting(cls, session_id, initiator_id):
+        cls.load(session_id)
+        store = get_store()
+        key = cls._key(session_id)
+        old_votes = [field for field in store.hkeys(key) if field.startswith('vote:')]
+        if old_votes:
+            store.hdel(key, *old_votes)
+        cls._mutate(session_id, {'voting_active': 1, 'vote_initiator': initiator_id})
+
+    @classmethod
+    def record_vote(cls, session_id, user_id, vote):
+        """Record a vote and return every vote cast so far ({user_id: bool})"""
+        cls._mutate(session_id, {f'vote:{user_id}': int(bool(vote))})
+        return cls.get_votes(session_id)
+
+    @classmethod
+    def get_votes(cls, session_id):
+        values = get_store().hgetall(cls._key(session_id))
+        return {
+            field.split(':', 1)[1]: value == '1'
+            for field, value in values.items() if field.startswith('vote:')
+        }
+
+    @classmethod
+    def vote_initiator(cls, session_id):
+        return get_store().hget(cls._key(session_id), 'vote_initiator')
+
+    @classmethod
+    def reset_voting(cls, session_id):
+        cls.load(session_id)
+        store = get_store()
+        key = cls._key(session_id)
+        old_votes = [field for field in store.hkeys(key) if field.startswith('vote:')]
+        store.hdel(key, 'vote_initiator', *old_votes)
+        cls._mutate(session_id, {'voting_active': 0})
+
+    # ---------- Persistence ----------
+
+    @classmethod
+    def persist(cls, session_id):
+        """
+        Write the live state to the CollaborationSession row (one UPDATE, no read)
+
+        Returns:
+            True if a write happened, False if the state was not live or unchanged
+        """
+        store = get_store()
+        key = cls._key(session_id)
+        values = store.hgetall(key)
+        if not values or values.get('version') == values.get('persisted_version'):
+            return False
+
+        CollaborationSession.objects.filter(session_id=session_id).update(
+            story_draft=cls._assemble(values),
+            current_page=int(values.get('current_page') or 0),
+            voting_active=values.get('voting_active') == '1',
+            voting_data={
+                field.split(':', 1)[1]: value == '1'
+                for field, value in values.items() if field.startswith('vote:')
+            },
+            operation_count=0,  # Counts operations since the last save
+            last_autosave=timezone.now(),
+        )
+        store.hset(key, {'persisted_version': values['version']}, cls.TTL)
+        return True
+
+    @classmethod
+    def discard(cls, session_id):
+        """Drop the live state (the next access reloads it from the database)"""
+        get_store().delete(cls._key(session_id))
+
+
+class CollabStatePersister:
+    """
+    Autosave of live sessions (draft, page, votes and canvases)
+
+    One worker per session owns the autosave through a Redis lease and runs
+    its timer: every COLLAB_STATE_PERSIST_SECONDS it writes whatever changed
+    (unchanged state costs no write) and gives the lease up once the session
+    is idle. Other workers only try to take the lease when they change
+    something, so their edits are picked up by the owner's next tick.
+    Operations are counted in memory; after COLLAB_AUTOSAVE_OPERATIONS of them
+    the counting worker saves at once. Persisting is version-checked, so a
+    save from a worker that doesn't hold the lease is harmless.
+    """
+
+    LEASE_KEY = 'collab_autosave_lease_{session_id}'
+    WORKER_ID = uuid.uuid4().hex
+    _timers = {}  # session_id -> asyncio.Task
+    _operations = {}  # session_id -> operations counted here since the last save
+
+    @classmethod
+    def interval(cls):
+        return getattr(settings, 'COLLAB_STATE_PERSIST_SECONDS', 5)
+
+    @classmethod
+    def max_operations(cls):
+        return getattr(settings, 'COLLAB_AUTOSAVE_OPERATIONS', 50)
+
+    @classmethod
+    def _lease_key(cls, session_id):
+        return cls.LEASE_KEY.format(session_id=session_id)
+
+    @classmethod
+    def _lease_ttl(cls):
+        return max(int(cls.interval() * 3), 1)  # Outlives a few ticks, not a dead worker
+
+    @classmethod
+    def schedule(cls, session_id):
+        """Make sure an autosave tick is coming for a changed session"""
+        if session_id not in cls._timers:
+            cls._timers[session_id] = asyncio.ensure_future(cls._autosave(session_id))
+
+    @classmethod
+    def record_operation(cls, session_id):
+        """Count an edit towards the next save (no database or Redis round trip)"""
+        count = cls._operations.get(session_id, 0) + 1
+        if count >= cls.max_operations():
+            cls._operations.pop(session_id, None)
+            asyncio.ensure_future(cls.save(session_id))
+        else:
+            cls._operations[session_id] = count
+        cls.schedule(session_id)
+
+    @classmethod
+    async def _autosave(cls, session_id):
+        lease_key = cls._lease_key(session_id)
+        try:
+            while True:
+                await asyncio.sleep(cls.interval())
+                owner = await database_sync_to_async(cls._claim)(lease_key)
+                if not owner:
+                    return  # Another worker's timer saves this session
+                if not await cls.save(session_id):
+                    # Idle: give the lease up, then catch edits made while releasing
+                    await database_sync_to_async(cache.delete)(lease_key)
+                    if not await cls.save(session_id):
+                        return
+        finally:
+            if cls._timers.get(session_id) is asyncio.current_task():
+                del cls._timers[session_id]
+
+    @classmethod
+    def _claim(cls, lease_key):
+        """Take or renew the lease; False if another worker holds it"""
+        if cache.add(lease_key, cls.WORKER_ID, cls._lease_ttl()):
+            return True
+        if cache.get(lease_key) == cls.WORKER_ID:
+            cache.touch(lease_key, cls._lease_ttl())
+            return True
+        return False
+
+    @classmethod
+    async def save(cls, session_id):
+        """Persist whatever changed; True if anything was written"""
+        cls._operations.pop(session_id, None)
+        try:
+            return await database_sync_to_async(cls._persist)(session_id)
+        except Exception:
+            logger.exception('Failed to persist state of session %s', session_id)
+            return False
+
+    @staticmethod
+    def _persist(session_id):
+        draft_written = CollabSessionState.persist(session_id)
+        canvas_written = CanvasStore.persist(session_id)
+        return draft_written or canvas_written
+
+    @classmethod
+    async def flush(cls, session_id):
+        """Persist now and stop the session's timer (e.g. when the last client leaves)"""
+        timer = cls._timers.pop(session_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+            await database_sync_to_async(cls._release)(session_id)
+        return await cls.save(session_id)
+
+    @classmethod
+    def _release(cls, session_id):
+        lease_key = cls._lease_key(session_id)
+        if cache.get(lease_key) == cls.WORKER_ID:
+            cache.delete(lease_key)
+
+
+class CanvasStore:
+    """
+    Per-page canvas data of a session, one hash field per page
+
+    Two hashes: snapshots (collab_canvas_pages_{session_id}, the rendered page
+    images used by late joiners and finalization) and states
+    (collab_canvas_states_{session_id}, full canvas states for page resyncs).
+    Fields are 'cover' or 'page:{page_id}' holding JSON, so a write costs one
+    page and concurrent writers to different pages never overwrite each other.
+    Every write bumps a version, so persist() only copies changed canvases
+    back to the session row (where the fallback reads find them after a
+    Redis restart).
+    """
+
+    SNAPSHOT_KEY = 'collab_canvas_pages_{session_id}'
+    STATE_KEY = 'collab_canvas_states_{session_id}'
+    VERSION_KEY = 'collab_canvas_version_{session_id}'  # version, persisted_version
+    TTL = 86400  # 1 day after the last write
+    COVER_FIELD = 'cover'
+
+    @classmethod
+    def field(cls, page_id, is_cover_image=False):
+        return cls.COVER_FIELD if is_cover_image else f'page:{page_id}'
+
+    @staticmethod
+    def _legacy_fields(canvas_dict):
+        """Hash fields from the old {'cover_image': ..., 'pages': {id: data}} row format"""
+        fields = {}
+        if (canvas_dict or {}).get('cover_image'):
+            fields[CanvasStore.COVER_FIELD] = canvas_dict['cover_image']
+        for page_id, data in ((canvas_dict or {}).get('pages') or {}).items():
+            fields[f'page:{page_id}'] = data
+        return fields
+
+    # ---------- Writes ----------
+
+    @classmethod
+    def set_snapshot(cls, session_id, page_id, is_cover_image, data):
+        store = get_store()
+        store.hset(
+            cls.SNAPSHOT_KEY.format(session_id=session_id),
+            {cls.field(page_id, is_cover_image): json.dumps(data)},
+            cls.TTL
+        )
+        store.hincrby(cls.VERSION_KEY.format(session_id=session_id), 'version', 1, cls.TTL)
+
+    @classmethod
+    def set_state(cls, session_id, page_id, is_cover_image, data):
+        store = get_store()
+        store.hset(
+            cls.STATE_KEY.format(session_id=session_id),
+            {cls.field(page_id, is_cover_image): json.dumps(data)},
+            cls.TTL
+        )
+        store.hincrby(cls.VERSION_KEY.format(session_id=session_id), 'version', 1, cls.TTL)
+
+    # ---------- Reads ----------
+
+    @classmethod
+    def get_state(cls, session_id, page_id, is_cover_image=False, session=None):
+        """One page's canvas state (falls back to the session row for old sessions)"""
+        field = cls.field(page_id, is_cover_image)
+        value = get_store().hget(cls.STATE_KEY.format(session_id=session_id), field)
+        if value is not None:
+            return json.loads(value)
+        if session is None:
+            session = CollaborationSession.objects.filter(session_id=session_id).only('canvas_state').first()
+        return cls._legacy_fields(session.canvas_state if session else {}).get(field)
+
+    @classmethod
+    def get_states(cls, session_id, fields):
+        """Canvas states of several pages in one round trip ({field: state or None})"""
+        values = get_store().hmget(cls.STATE_KEY.format(session_id=session_id), list(fields))
+        return {
+            field: json.loads(value) if value is not None else None
+            for field, value in zip(fields, values)
+        }
+
+    @classmethod
+    def iter_snapshots(cls, session_id, session=None):
+        """
+        Stream (field, snapshot) pairs of every page
+
+        Pages are read from the hash in batches; sessions that predate the hash
+        are read from the session row's canvas_data.
+        """
+        found = False
+        for field, value in get_store().hscan(cls.SNAPSHOT_KEY.format(session_id=session_id)):
+            found = True
+            yield field, json.loads(value)
+        if found:
+            return
+        if session is None:
+            session = CollaborationSession.objects.filter(session_id=session_id).only('canvas_data').first()
+        yield from cls._legacy_fields(session.canvas_data if session else {}).items()
+
+    @classmethod
+    def snapshot_count(cls, session_id):
+        """Number of page snapshots in the hash (0 for sessions that predate it)"""
+        return len(get_store().hkeys(cls.SNAPSHOT_KEY.format(session_id=session_id)))
+
+    @classmethod
+    def iter_ordered_snapshots(cls, session_id, page_ids, session=None):
+        """
+        Stream (field, snapshot) pairs one page at a time: the cover, then
+        page_ids in order, then pages not in page_ids
+
+        Only the field names are listed up front, so a single page image is
+        held in memory at a time.
+        """
+        key = cls.SNAPSHOT_KEY.format(session_id=session_id)
+        store = get_store()
+        fields = store.hkeys(key)
+        if not fields:
+            legacy = dict(cls.iter_snapshots(session_id, session))
+            fields, store = list(legacy), None
+
+        position = {cls.field(page_id): index for index, page_id in enumerate(page_ids)}
+        position[cls.COVER_FIELD] = -1
+        for field in sorted(fields, key=lambda f: position.get(f, len(position))):
+            value = legacy[field] if store is None else store.hget(key, field)
+            if value is None:
+                continue  # Removed since the listing
+            yield field, value if store is None else json.loads(value)
+
+    @classmethod
+    def get_canvas_data(cls, session_id, session=None):
+        """All snapshots in the {'cover_image', 'pages': {page_id: data}} shape clients expect"""
+        return cls._row_fields(cls.iter_snapshots(session_id, session))
+
+    # ---------- Persistence ----------
+
+    @staticmethod
+    def _row_fields(pairs):
+        """(field, data) pairs in the {'cover_image', 'pages': {page_id: data}} row format"""
+        row = {}
+        for field, data in pairs:
+            if field == CanvasStore.COVER_FIELD:
+                row['cover_image'] = data
+            else:
+                row.setdefault('pages', {})[field.split(':', 1)[1]] = data
+        return row
+
+    @classmethod
+    def persist(cls, session_id):
+        """
+        Copy the canvases to the session row if they changed since the last copy
+
+        Returns:
+            True if a write happened
+        """
+        store = get_store()
+        version_key = cls.VERSION_KEY.format(session_id=session_id)
+        version, persisted = store.hmget(version_key, ['version', 'persisted_version'])
+        if version is None or version == persisted:
+            return False
+
+        snapshots = cls.get_canvas_data(session_id)
+        states = cls._row_fields(
+            (field, json.loads(value))
+            for field, value in store.hscan(cls.STATE_KEY.format(session_id=session_id))
+        )
+        with transaction.atomic():
+            # canvas_state also carries host_disconnected_at - keep keys that aren't canvases
+            row = CollaborationSession.objects.select_for_update().filter(
+                session_id=session_id
+            ).values('pk', 'canvas_state').first()
+            if row is None:
+                return False
+            kept = {
+                key: value for key, value in (row['canvas_state'] or {}).items()
+                if key not in ('cover_image', 'pages')
+            }
+            CollaborationSession.objects.filter(pk=row['pk']).update(
+                canvas_data=snapshots,
+                canvas_state={**kept, **states},
+            )
+        store.hset(version_key, {'persisted_version': version}, cls.TTL)
+        return True
+
+    @classmethod
+    def discard(cls, session_id):
+        get_store().delete(
+            cls.SNAPSHOT_KEY.format(session_id=session_id),
+            cls.STATE_KEY.format(session_id=session_id),
+            cls.VERSION_KEY.format(session_id=session_id)
+        )
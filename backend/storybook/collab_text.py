@@ -0,0 +1,291 @@
+"""
+Operational transformation for collaborative story text
+Clients send insert/delete operations against a page revision; the server transforms and applies them
+"""
+import json
+from .collab_state import CollabSessionState
+from .redis_store import get_store
+
+
+# ---------- Text operations ----------
+# An operation walks the whole page text (lengths in UTF-16 code units, like
+# JavaScript strings): positive int = retain, negative int = delete, str = insert.
+# Typing "!" at the end of "Hi" is [2, "!"]; deleting "i" is [1, -1].
+
+class InvalidOperation(ValueError):
+    pass
+
+
+def text_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _is_retain(op):
+    return isinstance(op, int) and not isinstance(op, bool) and op > 0
+
+
+def _is_delete(op):
+    return isinstance(op, int) and not isinstance(op, bool) and op < 0
+
+
+def _is_insert(op):
+    return isinstance(op, str)
+
+
+class _Builder:
+    """Accumulates components, merging neighbours like ot.js does"""
+
+    def __init__(self):
+        self.ops = []
+
+    def retain(self, n):
+        if n <= 0:
+            return
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+
+    def insert(self, s):
+        if not s:
+            return
+        if self.ops and _is_insert(self.ops[-1]):
+            self.ops[-1] += s
+        elif self.ops and _is_delete(self.ops[-1]):
+            # Keep inserts before deletes so equal operations look the same
+            if len(self.ops) > 1 and _is_insert(self.ops[-2]):
+                self.ops[-2] += s
+            else:
+                self.ops.insert(len(self.ops) - 1, s)
+        else:
+            self.ops.append(s)
+
+    def delete(self, n):
+        if n <= 0:
+            return
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+
+
+def normalize(ops):
+    """Validate a client operation and merge its components"""
+    if not isinstance(ops, list):
+        raise InvalidOperation('operation must be a list')
+    builder = _Builder()
+    for op in ops:
+        if _is_retain(op):
+            builder.retain(op)
+        elif _is_delete(op):
+            builder.delete(-op)
+        elif _is_insert(op):
+            builder.insert(op)
+        else:
+            raise InvalidOperation(f'invalid component {op!r}')
+    return builder.ops
+
+
+def base_length(ops):
+    return sum(op if _is_retain(op) else -op for op in ops if not _is_insert(op))
+
+
+def apply(text, ops):
+    """Apply an operation to text"""
+    source = text.encode('utf-16-le')
+    if base_length(ops) * 2 != len(source):
+        raise InvalidOperation('operation length does not match the text')
+    parts = []
+    index = 0
+    for op in ops:
+        if _is_retain(op):
+            parts.append(source[index:index + op * 2])
+            index += op * 2
+        elif _is_delete(op):
+            index += -op * 2
+        else:
+            parts.append(op.encode('utf-16-le'))
+    return b''.join(parts).decode('utf-16-le')
+
+
+def transform(a, b):
+    """
+    Transform concurrent operations a and b (same base text)
+
+    Returns:
+        (a', b') such that apply(apply(t, a), b') == apply(apply(t, b), a').
+        When both insert at the same spot, a's text comes first.
+    """
+    if base_length(a) != base_length(b):
+        raise InvalidOperation('concurrent operations have different base lengths')
+
+    a_prime, b_prime = _Builder(), _Builder()
+    ops1, ops2 = iter(a), iter(b)
+    op1, op2 = next(ops1, None), next(ops2, None)
+
+    while op1 is not None or op2 is not None:
+        if op1 is not None and _is_insert(op1):
+            a_prime.insert(op1)
+            b_prime.retain(text_length(op1))
+            op1 = next(ops1, None)
+            continue
+        if op2 is not None and _is_insert(op2):
+            a_prime.retain(text_length(op2))
+            b_prime.insert(op2)
+            op2 = next(ops2, None)
+            continue
+        if op1 is None or op2 is None:
+            raise InvalidOperation('operations do not cover the same text')
+
+        if _is_retain(op1) and _is_retain(op2):
+            length = min(op1, op2)
+            a_prime.retain(length)
+            b_prime.retain(length)
+            op1, op2 = op1 - length, op2 - length
+        elif _is_delete(op1) and _is_delete(op2):
+            # Both deleted the same text - nothing left to do for either
+            length = min(-op1, -op2)
+            op1, op2 = op1 + length, op2 + length
+        elif _is_delete(op1) and _is_retain(op2):
+            length = min(-op1, op2)
+            a_prime.delete(length)
+            op1, op2 = op1 + length, op2 - length
+        else:  # retain op1, delete op2
+            length = min(op1, -op2)
+            b_prime.delete(length)
+            op1, op2 = op1 - length, op2 + length
+
+        if op1 == 0:
+            op1 = next(ops1, None)
+        if op2 == 0:
+            op2 = next(ops2, None)
+
+    return a_prime.ops, b_prime.ops
+
+
+# ---------- Server-side page documents ----------
+
+class RevisionGone(Exception):
+    """The client's base revision is older than the kept history - it must resync"""
+
+
+class CollaborativeText:
+    """
+    Page text documents merged on the server
+
+    A page's text and revision live in the session state hash (text:{page_id},
+    rev:{page_id}); the operations of its last HISTORY_SIZE revisions are kept
+    in a Redis list for transforming late operations. The session state timer
+    writes the merged text into story_draft. Histories are keyed by the state's
+    load epoch, so a reload from the database starts them afresh.
+    """
+
+    HISTORY_KEY = 'collab_text_ops_{session_id}_{epoch}_{page_id}'
+    HISTORY_SIZE = 200
+    HISTORY_TTL = 86400
+
+    @classmethod
+    def _page_id(cls, session_id, page_index):
+        pages = CollabSessionState.get_pages(session_id)
+        if not isinstance(page_index, int) or not 0 <= page_index < len(pages):
+            raise InvalidOperation('unknown page')
+        return pages[page_index]['id']
+
+    @classmethod
+    def get(cls, session_id, page_index):
+        """(text, revision) of a page"""
+        CollabSessionState.load(session_id)
+        page_id = cls._page_id(session_id, page_index)
+        text, revision = get_store().hmget(
+            CollabSessionState.KEY.format(session_id=session_id),
+            [f'text:{page_id}', f'rev:{page_id}']
+        )
+        return text or '', int(revision or 0)
+
+    @classmethod
+    def revisions(cls, session_id):
+        """Revision of every page, in page order"""
+        pages = CollabSessionState.get_pages(session_id)
+        if not pages:
+            return []
+        values = get_store().hmget(
+            CollabSessionState.KEY.format(session_id=session_id),
+            [f"rev:{page['id']}" for page in pages]
+        )
+        return [int(value or 0) for value in values]
+
+    @classmethod
+    def submit(cls, session_id, page_index, revision, ops):
+        """
+        Merge a client operation made against revision of a page
+
+        Returns:
+            (new revision, operation as applied) - broadcast the latter to the others
+
+        Raises:
+            InvalidOperation: malformed operation or unknown page
+            RevisionGone: the client is too far behind and must resync
+        """
+        ops = normalize(ops)
+        CollabSessionState.load(session_id)
+        store = get_store()
+        state_key = CollabSessionState.KEY.format(session_id=session_id)
+
+        with CollabSessionState._lock(session_id):
+            page_id = cls._page_id(session_id, page_index)
+            text, current, epoch = store.hmget(state_key, [f'text:{page_id}', f'rev:{page_id}', 'epoch'])
+            text, current = text or '', int(current or 0)
+            history_key = cls.HISTORY_KEY.format(session_id=session_id, epoch=epoch, page_id=page_id)
+            revision = int(revision)
+            if revision > current:
+                raise RevisionGone()  # State was reloaded since the client synced
+
+            if revision < current:
+                concurrent = [
+                    entry for entry in (json.loads(item) for item in store.lrange(history_key))
+                    if entry['rev'] > revision
+                ]
+                if [entry['rev'] for entry in concurrent] != list(range(revision + 1, current + 1)):
+                    raise RevisionGone()
+                for entry in concurrent:
+                    ops, _ = transform(ops, entry['ops'])
+
+            new_text = apply(text, ops)
+            new_revision = current + 1
+            CollabSessionState._mutate(session_id, {
+                f'text:{page_id}': new_text,
+                f'rev:{page_id}': new_revision,
+            })
+            store.push_trimmed(
+                history_key,
+                [json.dumps({'rev': new_revision, 'ops': ops})],
+                cls.HISTORY_SIZE,
+                cls.HISTORY_TTL
+            )
+        return new_revision, ops
+
+    @classmethod
+    def replace(cls, session_id, page_index, text):
+        """
+        Replace a page's whole text (legacy full-text edits)
+
+        Bumps the revision and drops the history, so clients with pending
+        operations resync instead of merging against text they never saw.
+        Runs under the state lock like submit(), and the text and revision
+        are written together, so the two never interleave.
+        """
+        CollabSessionState.ensure_page(session_id, page_index)  # Past the end: new pages (takes the lock itself)
+        store = get_store()
+        state_key = CollabSessionState.KEY.format(session_id=session_id)
+
+        with CollabSessionState._lock(session_id):
+            page_id = cls._page_id(session_id, page_index)
+            current, epoch, title = store.hmget(state_key, [f'rev:{page_id}', 'epoch', 'title'])
+            mapping = {
+                f'text:{page_id}': text,
+                f'rev:{page_id}': int(current or 0) + 1,
+            }
+            if not title:
+                mapping['title'] = CollabSessionState.DEFAULT_TITLE
+            CollabSessionState._mutate(session_id, mapping)
+            store.delete(cls.HISTORY_KEY.format(session_id=session_id, epoch=epoch, page_id=page_id))
@@ -2,14 +2,22 @@
 WebSocket consumers for real-time collaborative drawing
 Optimized for memory efficiency on limited resources
 """
+import asyncio
 import json
 import time
-import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from django.core.cache import cache
-from .models import CollaborationSession, SessionParticipant, DrawingOperation
+from .models import CollaborationSession, SessionParticipant
+from .collab_ops import OperationBuffer, OperationSequencer, RecentOperations
+from .collab_state import CanvasStore, CollabSessionState, CollabStatePersister
+from .collab_protocol import negotiate
+from .collab_cursors import CursorCoalescer
+from .collab_outbox import FrameBatcher
+from .collab_registry import CollabConnectionRegistry
+from .collab_text import CollaborativeText, InvalidOperation, RevisionGone
+from .collab_finalize import StoryFinalizer
+from .ws_metrics import MessageMetrics
 
 
 class CollaborationConsumer(AsyncWebsocketConsumer):
@@ -17,6 +25,39 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     WebSocket consumer for handling real-time collaborative drawing
     """
     
+    outbox = None  # FrameBatcher when the client accepts batched frames
+    
+    # Inbound message type -> handler method (dispatched and measured in receive)
+    MESSAGE_HANDLERS = {
+        'draw': 'handle_draw',  # Drawing operation
+        'draw_batch': 'handle_draw_batch',  # Batched drawing operations
+        'cursor': 'handle_cursor',  # Cursor movement
+        'clear': 'handle_clear',  # Canvas clear
+        'transform': 'handle_transform',  # Object transformation
+        'delete': 'handle_delete',  # Object deletion
+        'text_edit': 'handle_text_edit',  # Text editing
+        'text_op': 'handle_text_op',  # Incremental text edit (operational transform)
+        'text_sync': 'handle_text_sync',  # Request for a page's merged text and revision
+        'page_change': 'handle_page_change',  # Page navigation
+        'view_page': 'handle_view_page',  # Canvas screen opened/closed (page group only)
+        'presence_update': 'handle_presence_update',  # Presence/tool/activity update
+        'title_edit': 'handle_title_edit',  # Live title editing
+        'kick_user': 'handle_kick_user',  # Host kicking a user
+        'initiate_vote': 'handle_initiate_vote',  # Initiating save vote
+        'vote_save': 'handle_vote_save',  # User voting
+        'finalize_collaborative_story': 'handle_finalize_collaborative_story',  # Finalizing story after vote initiator saves with genres
+        'add_page': 'handle_add_page',  # Adding a new page
+        'delete_page': 'handle_delete_page',  # Deleting a page
+        'text_edit_advanced': 'handle_text_edit_advanced',  # Advanced text editing with full formatting
+        'layer_operation': 'handle_layer_operation',  # Layer operations (create, update, delete, reorder)
+        'transform_operation': 'handle_transform_operation',  # Object transformation operations
+        'delete_item': 'handle_delete_item',  # Item deletion
+        'canvas_snapshot': 'handle_canvas_snapshot',  # Full canvas snapshot (for saving state)
+        'request_sync': 'handle_request_sync',  # Request for canvas sync after reconnection
+        'canvas_state': 'handle_canvas_state',  # Canvas state being sent to a specific user
+        'get_page_viewers': 'handle_get_page_viewers',  # Request for page viewer information
+    }
+    
     async def connect(self):
         """Handle WebSocket connection"""
         self.session_id = self.scope['url_route']['kwargs']['session_id']
@@ -35,6 +76,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             print(f"[ERROR] Session {self.session_id} not found")
             await self.close()
             return
+        self.session_pk = session.id
         
         # Check if user can join (new user) or reconnect (existing participant)
         is_existing_participant = await self.is_existing_participant(session)
@@ -60,28 +102,42 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             await self.mark_host_reconnected()
             print(f"[YAY] Host {self.user.username} reconnected to session {self.session_id}")
         
-        # Memory optimization: Track active connections for this session
-        collab_conn_key = f'collab_connections_{self.session_id}'
-        current_connections = cache.get(collab_conn_key, 0)
-        
-        if current_connections >= 10:  # Max 10 concurrent connections per session
-            print(f"[WARN] Session {self.session_id} has reached max connections ({current_connections})")
+        # Register the connection - an atomic capacity check (max COLLAB_MAX_CONNECTIONS)
+        registered = await database_sync_to_async(CollabConnectionRegistry.register)(
+            self.session_id,
+            self.channel_name,
+            {'user_id': self.user.id, 'username': self.user.username, 'page': 0}
+        )
+        if not registered:
+            print(f"[WARN] Session {self.session_id} has reached max connections")
             await self.close(code=4002)  # Session is full
             return
+        self.registered = True
         
-        # Join room group
+        # Join room group (room-wide events) and the page group for clients that
+        # haven't said which page they are on yet
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
-        await self.accept()
-        
-        # Increment connection count
-        cache.set(collab_conn_key, current_connections + 1, 7200)  # 2 hour timeout
-        
-        # Add user as participant
+        self.page_group_name = self.unscoped_group_name
+        self.viewed_page = None  # Index behind page_group_name (None: unscoped or cover)
+        await self.channel_layer.group_add(self.page_group_name, self.channel_name)
+        
+        # Wire format: msgpack binary frames when the client offers the subprotocol, else JSON
+        self.codec = negotiate(self.scope.get('subprotocols'))
+        await self.accept(subprotocol=self.codec.subprotocol)
+        # Clients connecting with ?batch=1 accept array frames (events of ~16 ms per frame)
+        if self.get_query_param('batch') == '1':
+            self.outbox = FrameBatcher(self.codec, self.send_frame)
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat_loop())
+        
+        # Add user as participant (metadata cached on the connection for hot paths)
         participant = await self.add_participant(session)
+        self.cursor_color = participant['cursor_color']
+        await database_sync_to_async(CollabConnectionRegistry.update)(
+            self.session_id, self.channel_name, cursor_color=self.cursor_color
+        )
         
         # Notify others that user joined
         await self.channel_layer.group_send(
@@ -94,29 +150,186 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             }
         )
         
+        # Reconnecting clients pass ?last_seq=<last applied sequence number> and
+        # only receive the operations they missed (full canvas only if the gap is too big)
+        missed_operations, current_sequence = await self.get_missed_operations(self.get_last_seq_param())
+        
         # Send current canvas state and draft to the new user
-        canvas_data = await self.get_canvas_data(session)
+        canvas_data = None if missed_operations is not None else await self.get_canvas_data(session)
         story_draft = await self.get_story_draft(session)
+        text_revisions = await database_sync_to_async(CollaborativeText.revisions)(self.session_id)
         participants = await self.get_participants(session)
         
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'init',
             'canvas_data': canvas_data,
             'story_draft': story_draft,
+            'text_revisions': text_revisions,  # Base revision per page for text_op
             'participants': participants,
             'your_color': participant['cursor_color'],
             'current_user_id': self.user.id,
-            'current_username': self.user.username
-        }))
+            'current_username': self.user.username,
+            'sequence_number': current_sequence,
+            'delta': missed_operations is not None,
+            'missed_operations': missed_operations or []
+        })
+    
+    # ---------- Per-page groups ----------
+    # Canvas traffic (strokes, cursors, layer edits) goes to collab_{id}_page_{n}
+    # (or _page_cover) so each client only gets the page it renders. Clients
+    # move on every page_change / view_page and when they edit a page; those
+    # that haven't said (or closed their canvas) sit in the unscoped group,
+    # which receives every page. add_page/delete_page shift page indices, so
+    # every member re-homes when it hears of them. Everything else stays room-wide.
+    
+    @property
+    def unscoped_group_name(self):
+        return f'{self.room_group_name}_unscoped'
+    
+    def page_group_for(self, page_index, is_cover_image=False):
+        """Group of one page, or None when the event carries no usable page"""
+        if is_cover_image:
+            return f'{self.room_group_name}_page_cover'
+        try:
+            return f'{self.room_group_name}_page_{int(page_index)}'
+        except (TypeError, ValueError):
+            return None
+    
+    async def view_page(self, page_index, is_cover_image=False):
+        """Move this connection to the group of the page it is viewing"""
+        group = self.page_group_for(page_index, is_cover_image)
+        if group is None:
+            return
+        await self.join_page_group(group, None if is_cover_image else int(page_index))
+    
+    async def join_page_group(self, group, page_index=None):
+        if group != self.page_group_name:
+            await self.channel_layer.group_discard(self.page_group_name, self.channel_name)
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.page_group_name = group
+        self.viewed_page = page_index
+    
+    async def shift_viewed_page(self, changed_index, delta):
+        """
+        Follow the page being viewed after a page was added (delta 1) or deleted
+        (delta -1) at changed_index; viewers of a deleted page become unscoped
+        """
+        if not isinstance(changed_index, int):
+            return
+        current_page = getattr(self, 'current_page', None)
+        for attr in ('viewed_page', 'current_page'):
+            page = getattr(self, attr, None)
+            if not isinstance(page, int):
+                continue
+            if delta < 0 and page == changed_index:
+                page = None if attr == 'viewed_page' else max(page - 1, 0)
+            elif page >= changed_index + (delta < 0):
+                page += delta
+            setattr(self, attr, page)
+        if self.viewed_page is None:
+            if self.page_group_name != f'{self.room_group_name}_page_cover':
+                await self.join_page_group(self.unscoped_group_name)
+        else:
+            await self.view_page(self.viewed_page)
+        if getattr(self, 'current_page', None) != current_page:
+            await database_sync_to_async(CollabConnectionRegistry.update)(
+                self.session_id, self.channel_name, page=self.current_page
+            )
+    
+    async def group_send_page(self, page_index, is_cover_image, event):
+        """
+        Send a canvas event to the viewers of its page (and unscoped clients)
+        
+        The sender is viewing the page it edits, so it moves there too - this
+        covers canvas screens that never send page_change.
+        """
+        for group in await self.page_targets(page_index, is_cover_image):
+            await self.channel_layer.group_send(group, event)
+    
+    async def page_targets(self, page_index, is_cover_image=False):
+        """Groups a canvas event of a page goes to (moving the sender to that page)"""
+        group = self.page_group_for(page_index, is_cover_image)
+        if group is None:
+            return [self.room_group_name]
+        await self.view_page(page_index, is_cover_image)
+        return [group, self.unscoped_group_name]
+    
+    async def heartbeat_loop(self):
+        """Keep this connection's registry entry fresh (stale entries of dead workers get reaped)"""
+        while True:
+            await asyncio.sleep(CollabConnectionRegistry.HEARTBEAT_SECONDS)
+            alive = await database_sync_to_async(CollabConnectionRegistry.heartbeat)(
+                self.session_id, self.channel_name
+            )
+            if not alive:
+                # Reaped after a long stall - rejoin (the session may have filled up meanwhile)
+                registered = await database_sync_to_async(CollabConnectionRegistry.register)(
+                    self.session_id, self.channel_name, self.registry_meta()
+                )
+                if not registered:
+                    await self.close(code=4002)
+                    return
+    
+    def registry_meta(self):
+        return {
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'cursor_color': getattr(self, 'cursor_color', None),
+            'page': getattr(self, 'current_page', 0),
+        }
+    
+    def get_query_param(self, name):
+        from urllib.parse import parse_qs
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get(name)
+        return values[0] if values else None
+    
+    def get_last_seq_param(self):
+        """Read the client's last applied sequence number from the query string"""
+        try:
+            return int(self.get_query_param('last_seq'))
+        except (TypeError, ValueError):
+            return None
+    
+    async def get_missed_operations(self, last_sequence_number):
+        """
+        Operations after last_sequence_number from the recent-operations buffer
+        
+        Returns:
+            (operations or None when a full snapshot is needed, current sequence number)
+        """
+        if last_sequence_number is None:
+            current = await database_sync_to_async(OperationSequencer.current)(self.session_id)
+            return None, current
+        return await database_sync_to_async(RecentOperations.since)(self.session_id, last_sequence_number)
+    
+    async def close(self, code=None):
+        """Close from the server end - after the frames still queued (kick / host_left notices)"""
+        if self.outbox is not None:
+            await self.outbox.flush()
+        await super().close(code=code)
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection with memory cleanup"""
-        # Decrement connection count for this session
-        if hasattr(self, 'session_id'):
-            collab_conn_key = f'collab_connections_{self.session_id}'
-            current_connections = cache.get(collab_conn_key, 1)
-            if current_connections > 0:
-                cache.set(collab_conn_key, current_connections - 1, 7200)
+        # Server-side closes flushed the queue already; what is left can't reach the client
+        if self.outbox is not None:
+            self.outbox.close()
+        
+        # Write out operations still waiting in the write-behind queue
+        if hasattr(self, 'session_pk'):
+            await OperationBuffer.flush(self.session_id)
+            CursorCoalescer.forget(self.session_id, self.user.id)
+        
+        # Leave the connection registry
+        if getattr(self, 'registered', False):
+            if getattr(self, 'heartbeat_task', None):
+                self.heartbeat_task.cancel()
+            remaining = await database_sync_to_async(CollabConnectionRegistry.unregister)(
+                self.session_id, self.channel_name
+            )
+            
+            # Last one out writes the live draft/page/vote state to the database
+            if remaining == 0:
+                await CollabStatePersister.flush(self.session_id)
         
         if hasattr(self, 'room_group_name'):
             # Determine if this user is the host before removing
@@ -161,96 +374,52 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            if getattr(self, 'page_group_name', None):
+                await self.channel_layer.group_discard(self.page_group_name, self.channel_name)
+    
+    async def send_message(self, message):
+        """Send a message in the connection's wire format (queued for the next frame when batching)"""
+        if self.outbox is not None:
+            self.outbox.push(message)
+            return
+        await self.send_frame(self.codec.encode(message), [message])
+    
+    async def send_frame(self, frame, messages):
+        """Write an encoded frame of one message or a batch"""
+        if len(messages) == 1:
+            MessageMetrics.sent('collaboration', messages[0].get('type'), len(frame))
+        else:
+            for message in messages:
+                MessageMetrics.sent('collaboration', message.get('type'), 0)
+            MessageMetrics.sent('collaboration', 'batch', len(frame))  # Frames and bytes of batches
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data, bytes_data)
             message_type = data.get('type')
-            
-            if message_type == 'draw':
-                # Handle drawing operation
-                await self.handle_draw(data)
-            elif message_type == 'draw_batch':
-                # Handle batched drawing operations
-                await self.handle_draw_batch(data)
-            elif message_type == 'cursor':
-                # Handle cursor movement
-                await self.handle_cursor(data)
-            elif message_type == 'clear':
-                # Handle canvas clear
-                await self.handle_clear(data)
-            elif message_type == 'transform':
-                # Handle object transformation
-                await self.handle_transform(data)
-            elif message_type == 'delete':
-                # Handle object deletion
-                await self.handle_delete(data)
-            elif message_type == 'text_edit':
-                # Handle text editing
-                await self.handle_text_edit(data)
-            elif message_type == 'page_change':
-                # Handle page navigation
-                await self.handle_page_change(data)
-            elif message_type == 'presence_update':
-                # Handle presence/tool/activity update
-                await self.handle_presence_update(data)
-            elif message_type == 'title_edit':
-                # Handle live title editing
-                await self.handle_title_edit(data)
-            elif message_type == 'kick_user':
-                # Handle host kicking a user
-                await self.handle_kick_user(data)
-            elif message_type == 'initiate_vote':
-                # Handle initiating save vote
-                await self.handle_initiate_vote(data)
-            elif message_type == 'vote_save':
-                # Handle user voting
-                await self.handle_vote_save(data)
-            elif message_type == 'finalize_collaborative_story':
-                # Handle finalizing story after vote initiator saves with genres
-                await self.handle_finalize_collaborative_story(data)
-            elif message_type == 'add_page':
-                # Handle adding a new page
-                await self.handle_add_page(data)
-            elif message_type == 'delete_page':
-                # Handle deleting a page
-                await self.handle_delete_page(data)
-            elif message_type == 'text_edit_advanced':
-                # Handle advanced text editing with full formatting
-                await self.handle_text_edit_advanced(data)
-            elif message_type == 'layer_operation':
-                # Handle layer operations (create, update, delete, reorder)
-                await self.handle_layer_operation(data)
-            elif message_type == 'transform_operation':
-                # Handle object transformation operations
-                await self.handle_transform_operation(data)
-            elif message_type == 'delete_item':
-                # Handle item deletion
-                await self.handle_delete_item(data)
-            elif message_type == 'canvas_snapshot':
-                # Handle full canvas snapshot (for saving state)
-                await self.handle_canvas_snapshot(data)
-            elif message_type == 'request_sync':
-                # Handle request for canvas sync after reconnection
-                await self.handle_request_sync(data)
-            elif message_type == 'canvas_state':
-                # Handle canvas state being sent to a specific user
-                await self.handle_canvas_state(data)
-            elif message_type == 'get_page_viewers':
-                # Handle request for page viewer information
-                await self.handle_get_page_viewers(data)
-                
+            handler = self.MESSAGE_HANDLERS.get(message_type)
+            await MessageMetrics.dispatch(
+                'collaboration',
+                message_type if handler else 'unknown',
+                handler and getattr(self, handler),
+                data,
+                len(text_data if text_data is not None else bytes_data)
+            )
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Invalid JSON'
-            }))
+            })
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
     
     async def handle_draw(self, data):
         """Handle drawing operations with page information for cross-page collaboration"""
@@ -261,7 +430,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         canvas_snapshot = data.get('canvas_snapshot')  # Optional full canvas state
         
         # Save operation to database with page context
-        await self.save_operation('draw', {
+        sequence_number = await self.save_operation('draw', {
             'drawing_data': data.get('data', {}),
             'page_id': page_id,
             'page_index': page_index,
@@ -273,10 +442,11 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             await self.update_canvas_snapshot(page_id, is_cover_image, canvas_snapshot)
         
         # Broadcast to all users in the room with page information
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'drawing_update',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'operation': 'draw',
@@ -296,8 +466,8 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
 
         # Broadcast the batch directly to other clients without DB save for every tiny point.
         # DB save happens on full snapshot or completed stroke.
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'drawing_batch_update',
                 'user_id': self.user.id,
@@ -315,7 +485,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         if event.get('user_id') == self.user.id:
             return
             
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'draw_batch',
             'user_id': event['user_id'],
             'username': event['username'],
@@ -323,7 +493,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             'page_id': event.get('page_id'),
             'page_index': event.get('page_index'),
             'is_cover_image': event.get('is_cover_image', False)
-        }))
+        })
     
     async def handle_cursor(self, data):
         """Handle cursor position updates with canvas context"""
@@ -338,15 +508,15 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             self._last_cursor_db_write = now
             await self.update_cursor_position(position)
         
-        cursor_color = await self.get_user_cursor_color()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        # Coalesced with the room's other cursors and sent on the next tick
+        CursorCoalescer.update(
+            self.channel_layer,
+            self.session_id,
+            await self.page_targets(page_index, is_cover_image),
             {
-                'type': 'cursor_update',
                 'user_id': self.user.id,
                 'username': self.user.username,
-                'cursor_color': cursor_color,
+                'cursor_color': self.cursor_color,
                 'position': position,
                 'page_id': page_id,
                 'page_index': page_index,
@@ -361,16 +531,17 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         page_index = data.get('page_index')
         is_cover_image = data.get('is_cover_image', False)
         
-        await self.save_operation('clear', {
+        sequence_number = await self.save_operation('clear', {
             'page_id': page_id,
             'page_index': page_index,
             'is_cover_image': is_cover_image
         }, page_index if page_index is not None else 0)
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'canvas_cleared',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'page_id': page_id,
@@ -381,12 +552,15 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     
     async def handle_transform(self, data):
         """Handle object transformation"""
-        await self.save_operation('transform', data.get('data', {}))
+        sequence_number = await self.save_operation(
+            'transform', data.get('data', {}), self.operation_page(data)
+        )
         
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'object_transformed',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'data': data.get('data', {})
@@ -395,12 +569,15 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     
     async def handle_delete(self, data):
         """Handle object deletion"""
-        await self.save_operation('delete', data.get('data', {}))
+        sequence_number = await self.save_operation(
+            'delete', data.get('data', {}), self.operation_page(data)
+        )
         
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'object_deleted',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'data': data.get('data', {})
@@ -442,7 +619,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             page_index = 0
         
         # Save operation (for history)
-        await self.save_operation('text_edit', {
+        sequence_number = await self.save_operation('text_edit', {
             'page_id': page_id,
             'page_index': page_index,
             'text': text_content
@@ -451,14 +628,15 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         # Update the session draft (server-side source of truth)
         await self.update_story_draft_text(page_index, text_content)
         
-        # Increment operation count and check for auto-save
-        await self.increment_operation_count()
+        # Count towards the next autosave
+        CollabStatePersister.record_operation(self.session_id)
         
         # Broadcast to all users (reflect new text)
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'text_updated',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'page_id': page_id,
@@ -467,12 +645,80 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             }
         )
     
+    async def handle_text_op(self, data):
+        """
+        Handle an incremental text edit against a page revision
+        
+        ops walks the page text: positive int = retain, negative = delete,
+        string = insert (see collab_text). The server transforms it past edits
+        the client hasn't seen yet, acks the new revision to the sender and
+        broadcasts the applied operation to everyone else.
+        """
+        page_index = data.get('page_index')
+        try:
+            revision, ops = await database_sync_to_async(CollaborativeText.submit)(
+                self.session_id, page_index, data.get('revision', 0), data.get('ops')
+            )
+        except RevisionGone:
+            await self.handle_text_sync({'page_index': page_index})
+            return
+        except (InvalidOperation, TypeError, ValueError) as e:
+            await self.send_message({
+                'type': 'error',
+                'message': f'Invalid text operation: {e}'
+            })
+            return
+        
+        CollabStatePersister.record_operation(self.session_id)
+        
+        await self.send_message({
+            'type': 'text_op_ack',
+            'page_index': page_index,
+            'revision': revision
+        })
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'text_op_update',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'page_index': page_index,
+                'revision': revision,
+                'ops': ops
+            }
+        )
+    
+    async def handle_text_sync(self, data):
+        """Send a page's merged text and revision (initial sync or after falling behind)"""
+        page_index = data.get('page_index')
+        try:
+            text, revision = await database_sync_to_async(CollaborativeText.get)(self.session_id, page_index)
+        except InvalidOperation:
+            await self.send_message({
+                'type': 'error',
+                'message': 'Invalid page for text sync'
+            })
+            return
+        await self.send_message({
+            'type': 'text_resync',
+            'page_index': page_index,
+            'revision': revision,
+            'text': text
+        })
+    
     async def handle_page_change(self, data):
         """Handle page navigation"""
         page_number = data.get('page_number', 0)
         
+        # Only receive canvas traffic for the page now on screen
+        await self.view_page(page_number, data.get('is_cover_image', False))
+        self.current_page = page_number
+        await database_sync_to_async(CollabConnectionRegistry.update)(
+            self.session_id, self.channel_name, page=page_number
+        )
+        
         # Persist page change for guard checks and history
-        await self.save_operation('page_change', { 'page_number': page_number })
+        sequence_number = await self.save_operation('page_change', { 'page_number': page_number }, page_number)
         
         # Update session's current page (global, for backward compatibility)
         await self.update_current_page(page_number)
@@ -482,12 +728,22 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'page_changed',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'page_number': page_number
             }
         )
     
+    async def handle_view_page(self, data):
+        """A canvas screen opened on a page (or closed: no page) - only changes groups"""
+        page_index = data.get('page_index')
+        is_cover_image = data.get('is_cover_image', False)
+        if page_index is None and not is_cover_image:
+            await self.join_page_group(self.unscoped_group_name)
+        else:
+            await self.view_page(page_index, is_cover_image)
+    
     async def handle_presence_update(self, data):
         """Handle user presence updates (cursor, tool, activity)"""
         cursor_position = data.get('cursor_position')
@@ -517,10 +773,10 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         # Verify sender is host
         is_host = await self.is_user_host()
         if not is_host:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Only host can kick users'
-            }))
+            })
             return
         
         kicked_user_id = data.get('user_id')
@@ -560,45 +816,13 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     
     async def handle_finalize_collaborative_story(self, data):
         """Handle finalizing collaborative story after vote initiator saves with genres"""
-        try:
-            print(f" Finalizing collaborative story for session {self.session_id}")
-            
-            # Finalize the story
-            story_data = await self.finalize_story()
-            print(f"[OK] Story finalized: {story_data}")
-            
-            # Notify all participants that story is saved
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'story_finalized',
-                    'story_id': story_data['story_id'],
-                    'message': 'Story saved to all participants!'
-                }
-            )
-            print(f"[SEND] Broadcasted story_finalized to {self.room_group_name}")
-            
-            # End the session for all participants
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'session_ended',
-                    'session_id': self.session_id,
-                    'story_id': story_data.get('story_id'),
-                    'story_title': story_data['title'],
-                    'ended_by': 'vote'
-                }
-            )
-            print(f"[SEND] Broadcasted session_ended to {self.room_group_name}")
-        except Exception as e:
-            print(f"[ERROR] Error in handle_finalize_collaborative_story: {e}")
-            import traceback
-            traceback.print_exc()
-            # Send error to client
-            await self.send(text_data=json.dumps({
+        print(f" Finalizing collaborative story for session {self.session_id}")
+        # Runs in the background; the room gets finalize_progress, then story_finalized and session_ended
+        if not StoryFinalizer.start(self.channel_layer, self.session_id, self.room_group_name, self.channel_name):
+            await self.send_message({
                 'type': 'error',
-                'message': f'Failed to finalize story: {str(e)}'
-            }))
+                'message': 'This story is already being saved'
+            })
     
     async def handle_vote_save(self, data):
         """Handle user voting to save"""
@@ -636,7 +860,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                         'yes_votes': len([v for v in votes if v]),
                         'no_votes': len([v for v in votes if not v]),
                         'total_participants': participant_count,
-                        'vote_initiator_id': list(voting_data.keys())[0]  # First voter is initiator
+                        'vote_initiator_id': await self.get_vote_initiator(voting_data)
                     }
                 )
             else:
@@ -665,12 +889,13 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             'id': result['id']
         }
         
-        await self.save_operation('add_page', page_data)
+        sequence_number = await self.save_operation('add_page', page_data, result['index'])
         
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'page_added',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'page_data': page_data
@@ -687,36 +912,39 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             page_index = await self.resolve_page_index_from_id(page_id)
         
         if page_index is None or page_index < 0:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Invalid page index for deletion'
-            }))
+            })
             return
         
         # Prevent deletion if any active participant is on that page
         if await self.is_anyone_on_page(page_index):
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Cannot delete a page currently being viewed by another participant'
-            }))
+            })
             return
         
         # Update server-side draft and check if successful
         deleted = await self.delete_page_from_draft(page_index)
         
         if not deleted:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Failed to delete page - page may not exist'
-            }))
+            })
             return
         
-        await self.save_operation('delete_page', {'page_id': page_id, 'page_index': page_index})
+        sequence_number = await self.save_operation(
+            'delete_page', {'page_id': page_id, 'page_index': page_index}, page_index
+        )
         
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'page_deleted',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'page_id': page_id,
@@ -732,7 +960,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         is_cover_image = text_data.get('isCoverImage', False)
         
         # Save operation for history
-        await self.save_operation('text_edit_advanced', {
+        sequence_number = await self.save_operation('text_edit_advanced', {
             'text_data': text_data,
             'page_id': page_id,
             'page_index': page_index,
@@ -740,10 +968,11 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         }, page_index if page_index is not None else 0)
         
         # Broadcast to all users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'text_edit_advanced_update',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'data': text_data
@@ -759,7 +988,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         is_cover_image = layer_data.get('isCoverImage', False)
         
         # Save operation for history
-        await self.save_operation('layer_operation', {
+        sequence_number = await self.save_operation('layer_operation', {
             'operation': operation,
             'layer_data': layer_data,
             'page_id': page_id,
@@ -768,10 +997,11 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         }, page_index if page_index is not None else 0)
         
         # Broadcast to all users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'layer_operation_update',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'operation': operation,
@@ -787,7 +1017,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         is_cover_image = transform_data.get('isCoverImage', False)
         
         # Save operation for history
-        await self.save_operation('transform_operation', {
+        sequence_number = await self.save_operation('transform_operation', {
             'transform_data': transform_data,
             'page_id': page_id,
             'page_index': page_index,
@@ -795,10 +1025,11 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         }, page_index if page_index is not None else 0)
         
         # Broadcast to all users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'transform_operation_update',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'data': transform_data
@@ -813,7 +1044,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         is_cover_image = delete_data.get('isCoverImage', False)
         
         # Save operation for history
-        await self.save_operation('delete_item', {
+        sequence_number = await self.save_operation('delete_item', {
             'delete_data': delete_data,
             'page_id': page_id,
             'page_index': page_index,
@@ -821,10 +1052,11 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         }, page_index if page_index is not None else 0)
         
         # Broadcast to all users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.group_send_page(
+            page_index, is_cover_image,
             {
                 'type': 'delete_item_update',
+                'sequence_number': sequence_number,
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'data': delete_data
@@ -839,6 +1071,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         
         if canvas_data_url:
             await self.update_canvas_snapshot(page_id, is_cover_image, canvas_data_url)
+            CollabStatePersister.record_operation(self.session_id)
     
     async def handle_request_sync(self, data):
         """Handle request for canvas sync after reconnection"""
@@ -846,6 +1079,24 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         page_index = data.get('page_index')
         is_cover_image = data.get('is_cover_image', False)
         
+        # Delta resync: replay only what the client missed when the buffer still has it
+        last_sequence_number = data.get('last_sequence_number')
+        if last_sequence_number is not None:
+            try:
+                operations, current = await self.get_missed_operations(int(last_sequence_number))
+            except (TypeError, ValueError):
+                operations, current = None, None
+            if operations is not None:
+                await self.send_message({
+                    'type': 'sync_delta',
+                    'operations': operations,
+                    'sequence_number': current,
+                    'page_id': page_id,
+                    'page_index': page_index,
+                    'is_cover_image': is_cover_image
+                })
+                return
+        
         print(f" User {self.user.username} requesting canvas sync for page_id={page_id}, is_cover={is_cover_image}")
         
         # First, try to get canvas state from the database
@@ -854,19 +1105,19 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         if canvas_state:
             print(f"[OK] Found canvas state in database, sending directly to user")
             # Send canvas state directly from database
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'canvas_state',
                 'canvas_data': canvas_state,
                 'page_id': page_id,
                 'page_index': page_index,
                 'is_cover_image': is_cover_image,
                 'sender_user_id': 'server'  # Indicate it came from server
-            }))
+            })
         else:
             print(f"[WARN] No canvas state in database, requesting from other participants")
             # Request canvas state from other participants as fallback
-            await self.channel_layer.group_send(
-                self.session_group_name,
+            await self.group_send_page(
+                page_index, is_cover_image,
                 {
                     'type': 'request_canvas_state',
                     'requesting_user_id': self.user.id,
@@ -887,6 +1138,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         # Save canvas state to database for future reconnections
         if canvas_data:
             await self.save_canvas_state_to_db(page_id, is_cover_image, canvas_data)
+            CollabStatePersister.record_operation(self.session_id)
         
         # If target_user_id is 0, this is just an autosave, don't send to other users
         if target_user_id == 0:
@@ -897,7 +1149,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         
         # Send canvas state to the specific user
         await self.channel_layer.group_send(
-            self.session_group_name,
+            self.room_group_name,
             {
                 'type': 'receive_canvas_state',
                 'target_user_id': target_user_id,
@@ -914,144 +1166,159 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         """Notify clients that someone is requesting canvas sync"""
         # Don't send to the requesting user
         if event['requesting_user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'request_canvas_state',
                 'requesting_user_id': event['requesting_user_id'],
                 'page_id': event.get('page_id'),
                 'page_index': event.get('page_index'),
                 'is_cover_image': event.get('is_cover_image', False)
-            }))
+            })
     
     async def receive_canvas_state(self, event):
         """Send canvas state to the target user only"""
         # Only send to the target user
         if event['target_user_id'] == self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'canvas_state',
                 'canvas_data': event.get('canvas_data'),
                 'page_id': event.get('page_id'),
                 'page_index': event.get('page_index'),
                 'is_cover_image': event.get('is_cover_image', False),
                 'sender_user_id': event.get('sender_user_id')
-            }))
+            })
     
     async def user_joined(self, event):
         """Send user joined notification"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'user_joined',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'cursor_color': event['cursor_color']
-            }))
+            })
     
     async def user_left(self, event):
         """Send user left notification"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'user_left',
                 'user_id': event['user_id'],
                 'username': event['username']
-            }))
+            })
 
     async def host_left(self, event):
         """Notify clients that host left - force disconnect on clients"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'host_left',
             'session_id': event['session_id'],
             'username': event['username']
-        }))
+        })
         # Close connection for everyone still in the room
         await self.close()
     
     async def drawing_update(self, event):
         """Send drawing update to client with page information"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'draw',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data'],
                 'page_id': event.get('page_id'),
                 'page_index': event.get('page_index'),
                 'is_cover_image': event.get('is_cover_image', False)
-            }))
+            })
     
-    async def cursor_update(self, event):
-        """Send cursor update to client with canvas context"""
-        if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'cursor',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'cursor_color': event.get('cursor_color', '#FF0000'),
-                'position': event['position'],
-                'page_id': event.get('page_id'),
-                'page_index': event.get('page_index'),
-                'is_cover_image': event.get('is_cover_image', False)
-            }))
+    async def cursor_batch(self, event):
+        """Send a tick's cursor positions (one frame for binary clients, per-cursor frames for JSON)"""
+        cursors = [cursor for cursor in event['cursors'] if cursor['user_id'] != self.user.id]
+        if not cursors:
+            return
+        if self.codec.binary:
+            await self.send_message({'type': 'cursor_batch', 'cursors': cursors})
+            return
+        for cursor in cursors:
+            await self.send_message({'type': 'cursor', **cursor})
     
     async def canvas_cleared(self, event):
         """Send canvas clear notification with page information"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'clear',
+            'sequence_number': event.get('sequence_number'),
             'user_id': event['user_id'],
             'username': event['username'],
             'page_id': event.get('page_id'),
             'page_index': event.get('page_index'),
             'is_cover_image': event.get('is_cover_image', False)
-        }))
+        })
     
     async def object_transformed(self, event):
         """Send object transformation"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'transform',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data']
-            }))
+            })
     
     async def object_deleted(self, event):
         """Send object deletion"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'delete',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data']
-            }))
+            })
     
     async def text_updated(self, event):
         """Send text update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'text_edit',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'page_id': event.get('page_id'),
                 'page_index': event.get('page_index'),
                 'text': event['text']
-            }))
+            })
 
+    async def text_op_update(self, event):
+        """Send an applied text operation to the other participants"""
+        if event['user_id'] != self.user.id:
+            await self.send_message({
+                'type': 'text_op',
+                'user_id': event['user_id'],
+                'username': event['username'],
+                'page_index': event['page_index'],
+                'revision': event['revision'],
+                'ops': event['ops']
+            })
+    
     async def title_updated(self, event):
         """Send title update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'title_edit',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'title': event['title']
-            }))
+            })
     
     async def page_changed(self, event):
         """Send page change notification"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'page_change',
+            'sequence_number': event.get('sequence_number'),
             'user_id': event['user_id'],
             'username': event['username'],
             'page_number': event['page_number']
-        }))
+        })
     
     async def presence_updated(self, event):
         """Send presence update to client"""
@@ -1072,15 +1339,15 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                 'activity': event.get('activity')
             }
             
-            await self.send(text_data=json.dumps(message_data))
+            await self.send_message(message_data)
     
     async def user_kicked(self, event):
         """Send user kicked notification"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'user_kicked',
             'kicked_user_id': event['kicked_user_id'],
             'by_user': event['by_user']
-        }))
+        })
         
         # If this user was kicked, disconnect them
         if event['kicked_user_id'] == self.user.id:
@@ -1098,12 +1365,12 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             'question': event.get('question', 'Save and end the collaboration session?')
         }
         print(f"[SEND] Sending vote_initiated message to WebSocket: {message}")
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(message)
         print(f"[OK] vote_initiated message sent successfully")
     
     async def vote_updated(self, event):
         """Send vote update"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'vote_update',
             'vote_id': event.get('vote_id'),
             'voting_data': event.get('voting_data', {}),
@@ -1111,159 +1378,154 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             'no_count': event.get('no_count', 0),
             'current_votes': event.get('current_votes', 0),
             'total_participants': event.get('total_participants', 0)
-        }))
+        })
     
     async def story_finalized(self, event):
         """Send story finalized notification"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'story_finalized',
             'story_id': event['story_id'],
             'message': event['message']
-        }))
+        })
+    
+    async def finalize_progress(self, event):
+        """Send story saving progress"""
+        await self.send_message({
+            'type': 'finalize_progress',
+            'stage': event['stage'],
+            'done': event['done'],
+            'total': event['total']
+        })
+    
+    async def finalize_failed(self, event):
+        """Tell the participant who asked to save that it failed"""
+        await self.send_message({
+            'type': 'error',
+            'message': event['message']
+        })
     
     async def vote_failed(self, event):
         """Send vote failed notification"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'vote_failed',
             'message': event['message']
-        }))
+        })
     
     async def vote_result(self, event):
         """Send vote result notification"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'vote_result',
             'vote_id': event.get('vote_id'),
             'approved': event.get('approved', False),
             'yes_votes': event.get('yes_votes', 0),
             'no_votes': event.get('no_votes', 0),
             'total_participants': event.get('total_participants', 0)
-        }))
+        })
     
     async def session_started(self, event):
         """Send session started notification to all participants"""
         print(f"[OK] session_started handler called: {event}")
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'session_started',
             'session_id': event.get('session_id'),
             'story_title': event.get('story_title')
-        }))
+        })
     
     async def session_ended(self, event):
         """Send session ended notification"""
         print(f" session_ended handler called: {event}")
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'session_ended',
             'session_id': event.get('session_id'),
             'story_id': event.get('story_id'),
             'story_title': event.get('story_title'),
             'ended_by': event.get('ended_by')
-        }))
+        })
     
     async def page_added(self, event):
         """Send page added notification"""
-        await self.send(text_data=json.dumps({
+        await self.shift_viewed_page(event['page_data'].get('page_index'), 1)
+        await self.send_message({
             'type': 'page_added',
+            'sequence_number': event.get('sequence_number'),
             'user_id': event['user_id'],
             'username': event['username'],
             'page_data': event['page_data']
-        }))
+        })
     
     async def page_deleted(self, event):
         """Send page deleted notification"""
-        await self.send(text_data=json.dumps({
+        await self.shift_viewed_page(event.get('page_index'), -1)
+        await self.send_message({
             'type': 'page_deleted',
+            'sequence_number': event.get('sequence_number'),
             'user_id': event['user_id'],
             'username': event['username'],
             'page_id': event.get('page_id'),
             'page_index': event.get('page_index')
-        }))
+        })
     
     async def text_edit_advanced_update(self, event):
         """Send advanced text edit update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'text_edit_advanced',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data']
-            }))
+            })
     
     async def layer_operation_update(self, event):
         """Send layer operation update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'layer_operation',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'operation': event['operation'],
                 'data': event['data']
-            }))
+            })
     
     async def transform_operation_update(self, event):
         """Send transform operation update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'transform_operation',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data']
-            }))
+            })
     
     async def delete_item_update(self, event):
         """Send delete item update to client"""
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'delete_item',
+                'sequence_number': event.get('sequence_number'),
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'data': event['data']
-            }))
+            })
     
     # Database operations
 
-    @database_sync_to_async
-    def add_page_to_draft(self, requested_index=None):
-        """Append a new empty page to the server-side draft and return its index and generated ID.
+    async def add_page_to_draft(self, requested_index=None):
+        """Insert a new empty page into the live draft and return its index and generated ID.
         If requested_index is provided and within range, insert at that index; otherwise append.
         """
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        draft = session.story_draft or {}
-        pages = draft.get('pages')
-        if not isinstance(pages, list):
-            pages = []
-        
-        # Generate a unique page ID
-        page_id = str(uuid.uuid4())
-        
-        # Determine index
-        if isinstance(requested_index, int) and 0 <= requested_index <= len(pages):
-            pages.insert(requested_index, { 'text': '', 'id': page_id })
-            actual_index = requested_index
-        else:
-            pages.append({ 'text': '', 'id': page_id })
-            actual_index = len(pages) - 1
-        
-        draft['pages'] = pages
-        session.story_draft = draft
-        session.save(update_fields=['story_draft'])
-        
-        return {'index': actual_index, 'id': page_id}
+        result = await database_sync_to_async(CollabSessionState.add_page)(self.session_id, requested_index)
+        CollabStatePersister.schedule(self.session_id)
+        return result
 
-    @database_sync_to_async
-    def delete_page_from_draft(self, page_index: int):
-        """Delete a page from the server-side draft by index (no-op if out of range)."""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        draft = session.story_draft or {}
-        pages = draft.get('pages')
-        if not isinstance(pages, list):
-            return False
-        if 0 <= page_index < len(pages):
-            pages.pop(page_index)
-            draft['pages'] = pages
-            session.story_draft = draft
-            session.save(update_fields=['story_draft'])
-            return True
-        return False
+    async def delete_page_from_draft(self, page_index: int):
+        """Delete a page from the live draft by index (no-op if out of range)."""
+        deleted = await database_sync_to_async(CollabSessionState.delete_page)(self.session_id, page_index)
+        if deleted:
+            CollabStatePersister.schedule(self.session_id)
+        return deleted
 
     @database_sync_to_async
     def resolve_page_index_from_id(self, page_id):
@@ -1274,94 +1536,16 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def is_anyone_on_page(self, page_index: int):
-        """Return True if any active participant other than the requester is on the given page.
-        We infer per-user page using each participant's last 'page_change' operation.
-        """
-        from collections import defaultdict
-        
-        try:
-            session = CollaborationSession.objects.get(session_id=self.session_id)
-            
-            # Get all active participants except the current user
-            active_participants = SessionParticipant.objects.filter(
-                session=session, 
-                is_active=True
-            ).exclude(user=self.user)
-            
-            # Check each participant's last page_change operation
-            for participant in active_participants:
-                try:
-                    last_page_operation = DrawingOperation.objects.filter(
-                        session=session,
-                        user=participant.user,
-                        operation_type='page_change'
-                    ).order_by('-timestamp').first()
-                    
-                    if last_page_operation:
-                        operation_data = last_page_operation.operation_data or {}
-                        participant_page = operation_data.get('page_number', 0)
-                        
-                        if participant_page == page_index:
-                            return True
-                            
-                except Exception as e:
-                    print(f"Error checking page for participant {participant.user.username}: {e}")
-                    continue
-                    
-            return False
-            
-        except Exception as e:
-            print(f"Error in is_anyone_on_page: {e}")
-            return True  # Err on the side of caution
-
-    @database_sync_to_async  
+        """Return True if any connected participant other than the requester is on the given page."""
+        return any(
+            user['user_id'] != self.user.id and user.get('page', 0) == page_index
+            for user in CollabConnectionRegistry.users(self.session_id)
+        )
+    
+    @database_sync_to_async
     def get_page_viewers(self):
-        """Get a mapping of page indices to the users currently viewing them."""
-        from collections import defaultdict
-        
-        page_viewers = defaultdict(list)
-        
-        try:
-            session = CollaborationSession.objects.get(session_id=self.session_id)
-            
-            # Get all active participants
-            active_participants = SessionParticipant.objects.filter(
-                session=session, 
-                is_active=True
-            )
-            
-            # Check each participant's current page
-            for participant in active_participants:
-                try:
-                    last_page_operation = DrawingOperation.objects.filter(
-                        session=session,
-                        user=participant.user,
-                        operation_type='page_change'
-                    ).order_by('-timestamp').first()
-                    
-                    current_page = 0  # Default to page 0
-                    if last_page_operation:
-                        operation_data = last_page_operation.operation_data or {}
-                        current_page = operation_data.get('page_number', 0)
-                    
-                    # Add user info to the page viewers list
-                    # Ensure all values are JSON serializable
-                    user_info = {
-                        'user_id': int(participant.user.id),
-                        'username': str(participant.user.username),
-                        'display_name': str(getattr(participant.user, 'display_name', participant.user.username)),
-                        'cursor_color': str(participant.cursor_color) if participant.cursor_color else '#808080'
-                    }
-                    page_viewers[current_page].append(user_info)
-                    
-                except Exception as e:
-                    print(f"Error getting page for participant {participant.user.username}: {e}")
-                    continue
-                    
-        except Exception as e:
-            print(f"Error in get_page_viewers: {e}")
-            
-        return dict(page_viewers)
+        """Get a mapping of page indices to the users currently viewing them (from the connection registry)."""
+        return CollabConnectionRegistry.page_viewers(self.session_id)
     
     async def handle_get_page_viewers(self, data):
         """Handle request for page viewer information"""
@@ -1379,10 +1563,10 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         for page_idx, viewers in page_viewers_json.items():
             print(f"   Page {page_idx}: {[v['username'] for v in viewers]}")
         
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'page_viewers_response',
             'page_viewers': page_viewers_json
-        }))
+        })
 
     @database_sync_to_async
     def get_session(self):
@@ -1516,146 +1700,73 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_canvas_data(self, session):
         """Get current canvas data"""
-        cache_key = f'collab_canvas_data_{session.session_id}'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return cached_data
-        return session.canvas_data
+        return CanvasStore.get_canvas_data(session.session_id, session)
     
     @database_sync_to_async
     def update_canvas_snapshot(self, page_id, is_cover_image, canvas_data_url):
-        """Update canvas snapshot for a specific page or cover (using Redis cache)"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        
-        cache_key = f'collab_canvas_data_{self.session_id}'
-        canvas_data = cache.get(cache_key)
-        if not canvas_data:
-            canvas_data = session.canvas_data or {}
-        
-        if is_cover_image:
-            canvas_data['cover_image'] = canvas_data_url
-        else:
-            if 'pages' not in canvas_data:
-                canvas_data['pages'] = {}
-            canvas_data['pages'][str(page_id)] = canvas_data_url
-        
-        # Store in Redis temporarily (prevent DB choking)
-        cache.set(cache_key, canvas_data, 86400)
+        """Update canvas snapshot for a specific page or cover (one Redis hash field)"""
+        CanvasStore.set_snapshot(self.session_id, page_id, is_cover_image, canvas_data_url)
     
     @database_sync_to_async
     def save_canvas_state_to_db(self, page_id, is_cover_image, canvas_state_data):
-        """Save complete canvas state to Redis temporarily (prevent DB choking)"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        
-        cache_key = f'collab_canvas_state_{self.session_id}'
-        canvas_state = cache.get(cache_key)
-        if not canvas_state:
-            canvas_state = session.canvas_state or {}
-        
-        if is_cover_image:
-            canvas_state['cover_image'] = canvas_state_data
-        else:
-            if 'pages' not in canvas_state:
-                canvas_state['pages'] = {}
-            canvas_state['pages'][str(page_id)] = canvas_state_data
-        
-        # Store in Redis temporarily (prevent DB choking)
-        cache.set(cache_key, canvas_state, 86400)
+        """Save complete canvas state of one page to Redis (one hash field - prevents DB choking)"""
+        CanvasStore.set_state(self.session_id, page_id, is_cover_image, canvas_state_data)
         print(f" Cached canvas state to Redis for page_id={page_id}, is_cover={is_cover_image}")
     
     @database_sync_to_async
     def get_canvas_state_from_db(self, page_id, is_cover_image):
         """Get canvas state from Redis cache or database"""
         try:
-            cache_key = f'collab_canvas_state_{self.session_id}'
-            canvas_state = cache.get(cache_key)
-            
-            if not canvas_state:
-                session = CollaborationSession.objects.get(session_id=self.session_id)
-                canvas_state = session.canvas_state or {}
-            
-            if is_cover_image:
-                return canvas_state.get('cover_image')
-            else:
-                pages = canvas_state.get('pages', {})
-                return pages.get(str(page_id))
+            return CanvasStore.get_state(self.session_id, page_id, is_cover_image)
         except Exception as e:
             print(f"[ERROR] Error getting canvas state: {e}")
             return None
     
     @database_sync_to_async
     def get_story_draft(self, session):
-        """Get current story draft"""
-        return session.story_draft or {}
-    
-    @database_sync_to_async
-    def update_story_draft_title(self, title: str):
-        """Update the story draft title (server-side source of truth)"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        draft = session.story_draft or {}
-        draft['title'] = title or ''
-        session.story_draft = draft
-        session.save(update_fields=['story_draft'])
+        """Get current story draft (live state, loaded from the session row on first use)"""
+        CollabSessionState.load(self.session_id, session)
+        return CollabSessionState.get_draft(self.session_id) or session.story_draft or {}
+    
+    async def update_story_draft_title(self, title: str):
+        """Update the story draft title (one hash field; persisted by the state timer)"""
+        await database_sync_to_async(CollabSessionState.set_title)(self.session_id, title)
+        CollabStatePersister.schedule(self.session_id)
 
-    @database_sync_to_async
-    def update_story_draft_text(self, page_index: int, text: str):
-        """Update the story draft text for a specific page (server-side source of truth)"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        draft = session.story_draft or {}
-        
-        # Ensure pages array exists
-        pages = draft.get('pages')
-        if not isinstance(pages, list):
-            pages = []
-        
-        # Grow pages to required length
-        while len(pages) <= page_index:
-            pages.append({ 'text': '' })
-        
-        # Update text at index
-        pages[page_index]['text'] = text
-        draft['pages'] = pages
-        
-        # Optional: set a default title if missing
-        if not draft.get('title'):
-            draft['title'] = 'Collaborative Story'
-        
-        session.story_draft = draft
-        session.save(update_fields=['story_draft'])
+    async def update_story_draft_text(self, page_index: int, text: str):
+        """Update the story draft text for a specific page (one hash field; persisted by the state timer)"""
+        await database_sync_to_async(CollaborativeText.replace)(self.session_id, page_index, text)
+        CollabStatePersister.schedule(self.session_id)
     
     @database_sync_to_async
     def get_participants(self, session):
-        """Get list of active participants"""
-        participants = SessionParticipant.objects.filter(
-            session=session,
-            is_active=True
-        ).select_related('user')
-        
+        """Get list of connected participants"""
         return [
             {
-                'user_id': p.user.id,
-                'username': p.user.username,
-                'cursor_color': p.cursor_color
+                'user_id': user['user_id'],
+                'username': user['username'],
+                'cursor_color': user.get('cursor_color')
             }
-            for p in participants
+            for user in CollabConnectionRegistry.users(self.session_id)
         ]
     
-    @database_sync_to_async
-    def save_operation(self, operation_type, operation_data, page_number=0):
-        """Save drawing operation to database"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        
-        # Get next sequence number
-        last_op = DrawingOperation.objects.filter(session=session).order_by('-sequence_number').first()
-        sequence_number = (last_op.sequence_number + 1) if last_op else 0
-        
-        DrawingOperation.objects.create(
-            session=session,
-            user=self.user,
-            operation_type=operation_type,
-            operation_data=operation_data,
-            sequence_number=sequence_number,
-            page_number=page_number
+    @staticmethod
+    def operation_page(data):
+        """Page an object operation belongs to (page_index, or pageIndex inside its data)"""
+        page_index = data.get('page_index')
+        if page_index is None and isinstance(data.get('data'), dict):
+            page_index = data['data'].get('pageIndex')
+        return page_index if isinstance(page_index, int) else 0
+    
+    async def save_operation(self, operation_type, operation_data, page_number=0):
+        """Number a drawing operation atomically and queue it for a batched write"""
+        return await OperationBuffer.add(
+            self.session_id,
+            self.session_pk,
+            self.user.id,
+            operation_type,
+            operation_data,
+            page_number
         )
     
     @database_sync_to_async
@@ -1671,50 +1782,10 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         except SessionParticipant.DoesNotExist:
             pass
     
-    @database_sync_to_async
-    def get_user_cursor_color(self):
-        """Get user's cursor color"""
-        try:
-            participant = SessionParticipant.objects.get(
-                session__session_id=self.session_id,
-                user=self.user
-            )
-            return participant.cursor_color
-        except SessionParticipant.DoesNotExist:
-            return '#FF0000'  # Default red if not found
-    
-    @database_sync_to_async
-    def increment_operation_count(self):
-        """Increment operation count and auto-save if needed"""
-        from django.utils import timezone
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        session.operation_count += 1
-        
-        # Check if we should auto-save (every 10 operations or 30 seconds)
-        should_save = False
-        if session.operation_count >= 10:
-            should_save = True
-        elif session.last_autosave:
-            time_diff = timezone.now() - session.last_autosave
-            if time_diff.total_seconds() >= 30:
-                should_save = True
-        else:
-            should_save = True  # First save
-        
-        if should_save:
-            # Perform auto-save (save current canvas state)
-            # This will be implemented when we have the canvas data
-            session.last_autosave = timezone.now()
-            session.operation_count = 0
-        
-        session.save()
-    
-    @database_sync_to_async
-    def update_current_page(self, page_number):
+    async def update_current_page(self, page_number):
         """Update session's current page"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        session.current_page = page_number
-        session.save()
+        await database_sync_to_async(CollabSessionState.set_current_page)(self.session_id, page_number)
+        CollabStatePersister.schedule(self.session_id)
     
     @database_sync_to_async
     def update_presence(self, cursor_position, current_tool):
@@ -1756,135 +1827,32 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     
     @database_sync_to_async
     def get_active_participant_count(self):
-        """Get count of active participants - aligned with model property"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        active_count = session.participants.filter(is_active=True).count()
-        print(f" Active participant count for session {self.session_id}: {active_count}")
-        return active_count
+        """Get count of connected participants (a user with several tabs counts once)"""
+        return len(CollabConnectionRegistry.users(self.session_id))
     
-    @database_sync_to_async
-    def start_voting(self):
+    # Votes are rare and decide the session's fate - they are persisted right away
+
+    async def start_voting(self):
         """Start a voting session"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        session.voting_active = True
-        session.voting_data = {}
-        session.save()
+        await database_sync_to_async(CollabSessionState.start_voting)(self.session_id, self.user.id)
+        await CollabStatePersister.flush(self.session_id)
     
-    @database_sync_to_async
-    def record_vote(self, vote):
+    async def record_vote(self, vote):
         """Record a user's vote"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        voting_data = session.voting_data or {}
-        voting_data[str(self.user.id)] = vote
-        session.voting_data = voting_data
-        session.save()
+        voting_data = await database_sync_to_async(CollabSessionState.record_vote)(
+            self.session_id, self.user.id, vote
+        )
+        await CollabStatePersister.flush(self.session_id)
         return voting_data
     
-    @database_sync_to_async
-    def reset_voting(self):
+    async def reset_voting(self):
         """Reset voting state"""
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        session.reset_voting()
+        await database_sync_to_async(CollabSessionState.reset_voting)(self.session_id)
+        await CollabStatePersister.flush(self.session_id)
         return True
     
     @database_sync_to_async
-    def finalize_story(self):
-        """Finalize and save the collaborative story"""
-        from .models import Story
-        from django.utils import timezone
-        import json
-        from django.core.cache import cache
-        
-        session = CollaborationSession.objects.get(session_id=self.session_id)
-        
-        # Get story draft data
-        story_data = session.story_draft or {}
-        
-        # Extract pages and format them properly for 'content' field
-        # The frontend convertFromApiFormat expects pages to be joined by \n\n---PAGE BREAK---\n\n
-        pages = story_data.get('pages', [])
-        content_texts = []
-        for p in pages:
-            if isinstance(p, dict):
-                content_texts.append(str(p.get('text', '')))
-            elif isinstance(p, str):
-                content_texts.append(p)
-                
-        content_string = '\n\n---PAGE BREAK---\n\n'.join(content_texts)
-        if not content_string.strip():
-            content_string = 'Untitled story content'
-        
-        # Get canvas data from cache or session
-        cache_key = f'collab_canvas_data_{session.session_id}'
-        cached_data = cache.get(cache_key)
-        canvas_data_dict = cached_data if cached_data else (session.canvas_data or {})
-        
-        # Convert dictionary format to array format expected by frontend
-        canvas_array = []
-        
-        # 1. Add cover image if exists
-        cover_data = canvas_data_dict.get('cover_image')
-        if cover_data:
-            canvas_array.append({
-                'id': 'cover',
-                'order': -1,
-                'canvasData': cover_data
-            })
-            
-        # 2. Add pages
-        pages_dict = canvas_data_dict.get('pages', {})
-        for idx, (page_id, page_data) in enumerate(pages_dict.items()):
-            # Handle frontend page format vs backend page format
-            canvas_array.append({
-                'id': str(page_id),
-                'order': idx,
-                'canvasData': page_data
-            })
-            
-        canvas_data_json = json.dumps(canvas_array)
-        
-        # Extract cover image from canvas data array if not already set
-        cover_image_url = story_data.get('cover_image', '')
-        if not cover_image_url and cover_data:
-            cover_image_url = cover_data
-        
-        # Create the main story record (without genres - ManyToManyField)
-        story = Story.objects.create(
-            title=story_data.get('title', 'Untitled Collaborative Story'),
-            content=content_string,
-            canvas_data=canvas_data_json,
-            summary=story_data.get('summary', ''),
-            category=story_data.get('category', 'other'),
-            language=story_data.get('language', 'en'),
-            cover_image=cover_image_url,
-            creation_type='collaborative',
-            is_collaborative=True,
-            collaboration_session=session,
-            author=session.host,  # Primary author is the host
-            is_published=False
-        )
-        
-        # Set genres (JSONField - just a list) after creation
-        genres_list = story_data.get('genres', [])
-        if genres_list and isinstance(genres_list, list):
-            # genres_list should be a list of genre strings like ['adventure', 'fantasy']
-            story.genres = genres_list
-            story.save(update_fields=['genres'])
-        
-        # Add all participants as co-authors
-        participants = SessionParticipant.objects.filter(
-            session=session
-        ).select_related('user')
-        
-        for participant in participants:
-            story.authors.add(participant.user)
-        
-        # Mark session as inactive
-        session.is_active = False
-        session.story_id = story.id
-        session.save()
-        
-        return {
-            'story_id': story.id,
-            'title': story.title
-        }
+    def get_vote_initiator(self, voting_data):
+        """User who started the vote (falls back to the first voter)"""
+        return CollabSessionState.vote_initiator(self.session_id) or next(iter(voting_data), None)
+    
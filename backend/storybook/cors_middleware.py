@@ -2,6 +2,8 @@
 Custom CORS middleware to handle OPTIONS requests without authentication.
 This ensures CORS preflight requests work properly.
 """
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
 
 
 class CorsPreflightMiddleware:
@@ -10,22 +12,36 @@ class CorsPreflightMiddleware:
     Django REST Framework requires authentication by default, which blocks CORS preflight.
     """
     
+    # Runs in either mode, so async views under ASGI don't get pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         # If it's an OPTIONS request, let it pass through to get CORS headers
         # but don't require authentication
         if request.method == 'OPTIONS':
-            from django.http import HttpResponse
-            response = HttpResponse()
-            response.status_code = 200
-            # Manually add CORS headers since we're returning early
-            response['Access-Control-Allow-Origin'] = '*'
-            response['Access-Control-Allow-Methods'] = 'DELETE, GET, OPTIONS, PATCH, POST, PUT'
-            response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, origin, user-agent, x-csrftoken, x-requested-with'
-            response['Access-Control-Max-Age'] = '86400'
-            return response
-        
-        response = self.get_response(request)
+            return self.preflight_response()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method == 'OPTIONS':
+            return self.preflight_response()
+        return await self.get_response(request)
+
+    @staticmethod
+    def preflight_response():
+        response = HttpResponse()
+        response.status_code = 200
+        # Manually add CORS headers since we're returning early
+        response['Access-Control-Allow-Origin'] = '*'
+        response['Access-Control-Allow-Methods'] = 'DELETE, GET, OPTIONS, PATCH, POST, PUT'
+        response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, origin, user-agent, x-csrftoken, x-requested-with'
+        response['Access-Control-Max-Age'] = '86400'
         return response
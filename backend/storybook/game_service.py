@@ -137,11 +137,16 @@ class GameGenerationService:
     @classmethod
     def _call_groq_api(cls, prompt, is_json=True):
         """Helper to call Groq API for AI generation"""
-        import requests
         import os
         import json
+        from .ai_http import ProviderHTTP
+        from .ai_rate_limit import AIRateLimiter, RateLimited
         
-        api_key = os.environ.get('VITE_GROQ_API_KEY') or os.environ.get('GROQ_API_KEY')
+        try:
+            api_key = AIRateLimiter.acquire('groq') or os.environ.get('VITE_GROQ_API_KEY')
+        except RateLimited as e:
+            print(f"Groq API busy, skipping AI generation: {e}")
+            return None
         if not api_key:
             return None
             
@@ -168,12 +173,13 @@ class GameGenerationService:
             payload["response_format"] = {"type": "json_object"}
             
         try:
-            response = requests.post(
+            response = ProviderHTTP.post(
                 "https://api.groq.com/openai/v1/chat/completions", 
                 headers=headers, 
                 json=payload, 
                 timeout=15
             )
+            AIRateLimiter.observe('groq', api_key, response.status_code, response.headers)
             
             if response.status_code == 200:
                 data = response.json()
@@ -0,0 +1,262 @@
+"""
+Disk cache for generated images
+Each image is fetched from the provider once per set of parameters, then served from a size-bounded LRU on disk
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from django.conf import settings
+from .redis_store import get_store
+
+
+class ImageFetchError(Exception):
+    """The provider answered without an image"""
+
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f'Failed to fetch image: {status_code}')
+        self.status_code = status_code
+
+
+class ImageFetchTimeout(ImageFetchError):
+    """Another worker was still fetching the image when our wait ran out"""
+
+    def __init__(self):
+        super().__init__(504, 'Image is still being generated - please try again')
+
+
+class ImageCache:
+    """
+    Size-bounded LRU cache of generated images on local disk
+
+    Entries are keyed by the parameters that determine the image (prompt,
+    seed, size, model and the other upstream options), so reopening a story
+    serves its page images from disk. A hit bumps the entry's mtime; every
+    write evicts the least recently used entries once the directory is over
+    POLLINATIONS_CACHE_MAX_MB.
+
+    get_or_fetch() coalesces concurrent misses of the same key (singleflight):
+    one thread fetches while the others in the process wait for its outcome,
+    and a store lock does the same for other worker processes.
+    """
+
+    LOCK_KEY = 'image_cache_fetch_{key}'
+    LOCK_TIMEOUT = 90  # Longer than the provider's read timeout
+    WAIT_POLL_SECONDS = 0.25
+    EVICT_TO = 0.9  # Fraction of the cap left after an eviction pass
+    RESCAN_SECONDS = 300  # Walk the directory at least this often to count other workers' writes
+
+    _flights = {}  # key -> in-process fetch in progress
+    _usage = {}  # directory -> [bytes as of the last walk plus this process's writes, time of that walk]
+    _lock = threading.Lock()
+
+    @classmethod
+    def directory(cls):
+        return getattr(settings, 'POLLINATIONS_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'pollinations_cache'))
+
+    @classmethod
+    def max_bytes(cls):
+        return getattr(settings, 'POLLINATIONS_CACHE_MAX_MB', 512) * 1024 * 1024
+
+    @staticmethod
+    def key(params):
+        """Stable key of the image parameters (empty values ignored)"""
+        canonical = json.dumps(
+            {name: str(value) for name, value in params.items() if value not in (None, '')}, sort_keys=True
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @classmethod
+    def _paths(cls, key):
+        """(image path, metadata path) - entries are sharded by the first byte of the key"""
+        path = os.path.join(cls.directory(), key[:2], key)
+        return path, path + '.json'
+
+    @staticmethod
+    def _write_atomic(path, chunks):
+        """Write chunks to path through a temp file, so readers never see a partial file"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def get(cls, key):
+        """
+        (open image file, metadata) of a cached image, or None on a miss
+
+        A hit marks the entry as recently used.
+        """
+        path, meta_path = cls._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            image = open(path, 'rb')
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted meanwhile; the open file is still readable
+        return image, meta
+
+    @classmethod
+    def put(cls, key, chunks, content_type):
+        """Store an image; returns its metadata (the caller runs evict())"""
+        path, meta_path = cls._paths(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+
+        def hashed():
+            nonlocal size
+            for chunk in chunks:
+                if chunk:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+
+        cls._write_atomic(path, hashed())
+        meta = {'content_type': content_type, 'etag': f'"{digest.hexdigest()[:32]}"', 'size': size}
+        # Metadata last: an entry counts as cached once its .json exists
+        cls._write_atomic(meta_path, [json.dumps(meta).encode()])
+        with cls._lock:
+            usage = cls._usage.get(cls.directory())
+            if usage:
+                usage[0] += size
+        return meta
+
+    @classmethod
+    def evict(cls):
+        """
+        Delete least recently used images until the cache is under EVICT_TO of its cap
+
+        Walking the directory costs a stat() per cached image, so it only happens
+        when the tracked total is over the cap or RESCAN_SECONDS have passed (other
+        worker processes' writes are only seen by a walk, so the directory may
+        overshoot the cap by what they wrote in between).
+        """
+        directory = cls.directory()
+        limit = cls.max_bytes()
+        with cls._lock:
+            usage = cls._usage.get(directory)
+            if usage and usage[0] <= limit and time.monotonic() - usage[1] < cls.RESCAN_SECONDS:
+                return 0
+
+        entries = []
+        total = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(('.json', '.tmp')):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        scanned_at = time.monotonic()
+        evicted = 0
+        if total > limit:
+            for _, size, path in sorted(entries):
+                if total <= limit * cls.EVICT_TO:
+                    break
+                for victim in (path + '.json', path):
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+                total -= size
+                evicted += 1
+        with cls._lock:
+            cls._usage[directory] = [total, scanned_at]
+        return evicted
+
+    @classmethod
+    def get_or_fetch(cls, key, fetch):
+        """
+        The cached image, fetching it once on a miss
+
+        Args:
+            fetch: callable returning (chunk iterator, content type); raises on failure
+
+        Returns:
+            (open image file, metadata, hit)
+
+        Raises:
+            whatever fetch raised - for every caller waiting on that fetch
+        """
+        cached = cls.get(key)
+        if cached:
+            return (*cached, True)
+
+        with cls._lock:
+            flight = cls._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = cls._flights[key] = SimpleNamespace(done=threading.Event(), error=None)
+
+        if not leader:
+            flight.done.wait(cls.LOCK_TIMEOUT)
+            if flight.error is not None:
+                raise flight.error
+            cached = cls.get(key)
+            if cached:
+                return (*cached, True)
+            return cls.get_or_fetch(key, fetch)  # Evicted already or the leader timed out: go again
+
+        try:
+            return cls._fetch_once(key, fetch)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with cls._lock:
+                cls._flights.pop(key, None)
+            flight.done.set()
+
+    @classmethod
+    def _fetch_once(cls, key, fetch):
+        """
+        Fetch and store under the cross-process lock, unless another process stores it first
+
+        Raises:
+            ImageFetchTimeout: the lock's holder neither stored the image nor let go in time
+        """
+        store = get_store()
+        lock = cls.LOCK_KEY.format(key=key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + cls.LOCK_TIMEOUT
+        while not store.acquire_lock(lock, token, cls.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise ImageFetchTimeout()
+            time.sleep(cls.WAIT_POLL_SECONDS)
+            cached = cls.get(key)
+            if cached:
+                return (*cached, True)
+
+        try:
+            cached = cls.get(key)  # Stored between our miss and taking the lock
+            if cached:
+                return (*cached, True)
+            chunks, content_type = fetch()
+            meta = cls.put(key, chunks, content_type)
+            image = open(cls._paths(key)[0], 'rb')  # Opened before evicting, which may pick this very entry
+            cls.evict()
+            return image, meta, False
+        finally:
+            store.release_lock(lock, token)  # A no-op if the lock expired and someone else holds it
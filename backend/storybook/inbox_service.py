@@ -0,0 +1,263 @@
+"""
+Inbox Service for the notification list and unread badge
+Keeps a per-user unread counter in the cache (Redis) so badge polls never hit the database
+"""
+import logging
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from .models import Announcement, Notification
+from .announcement_service import AnnouncementService
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationInbox:
+    """Service for cursor-paginated notifications and cached unread counters"""
+
+    UNREAD_KEY = 'notif_unread_{user_id}'
+    UNREAD_TTL = 604800  # 7 days - recomputed from the database on a miss
+
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+
+    # ---------- Unread counter ----------
+
+    @classmethod
+    def unread_count(cls, user_id):
+        """
+        Get the unread count (notifications + announcements) for a user
+
+        Served from the cache in one round trip; the database is only counted
+        when a counter is cold.
+        """
+        return cls._unread_from_cache(user_id, cache.get_many(cls.cache_keys(user_id)))
+
+    @classmethod
+    def cache_keys(cls, user_id):
+        """Cache keys holding a user's unread count (for batched get_many reads)"""
+        return [
+            cls.UNREAD_KEY.format(user_id=user_id),
+            AnnouncementService.GENERATION_KEY,
+            AnnouncementService.UNREAD_KEY.format(user_id=user_id),
+        ]
+
+    @classmethod
+    def _unread_from_cache(cls, user_id, values):
+        """Resolve the unread count from already fetched cache values"""
+        key = cls.UNREAD_KEY.format(user_id=user_id)
+        count = values.get(key)
+        if count is None:
+            count = cls._count_unread(user_id)
+            cache.add(key, count, cls.UNREAD_TTL)
+        return max(count, 0) + AnnouncementService._unread_from_cache(user_id, values)
+
+    @classmethod
+    def _count_unread(cls, user_id):
+        """Count unread notifications in the database"""
+        return Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+
+    @classmethod
+    def adjust_unread(cls, user_id, delta, push=True):
+        """
+        Atomically add delta to the user's unread counter and push the new value
+
+        A cold counter is left cold - the next read recomputes it. Warming it here
+        would double count deltas from other commits that are still in flight.
+        """
+        if not delta:
+            return
+        key = cls.UNREAD_KEY.format(user_id=user_id)
+        try:
+            count = cache.incr(key, delta)
+        except ValueError:
+            count = None  # Counter not warmed yet
+
+        if count is not None and count < 0:
+            cache.set(key, 0, cls.UNREAD_TTL)
+            count = 0
+
+        if push:
+            cls.push_unread_count(user_id, count)
+
+    @classmethod
+    def reset_unread(cls, user_id, push=True):
+        """Set the unread counter to zero (everything was marked read)"""
+        cache.set(cls.UNREAD_KEY.format(user_id=user_id), 0, cls.UNREAD_TTL)
+        if push:
+            cls.push_unread_count(user_id, 0)
+
+    @classmethod
+    def push_unread_count(cls, user_id, count=None):
+        """
+        Push the current unread count over the user's notifications WebSocket
+
+        Args:
+            count: Unread notification count if already known (announcements are added)
+        """
+        try:
+            from channels.layers import get_channel_layer
+            from asgiref.sync import async_to_sync
+
+            if count is None:
+                count = cls._count_unread(user_id)
+            count = max(count, 0) + AnnouncementService.unread_count(user_id)
+
+            channel_layer = get_channel_layer()
+            if channel_layer:
+                async_to_sync(channel_layer.group_send)(
+                    f'notifications_{user_id}',
+                    {
+                        'type': 'unread_count',
+                        'count': count,
+                    }
+                )
+        except Exception:
+            logger.exception('Pushing unread count failed')
+
+    # ---------- Listing ----------
+
+    @staticmethod
+    def kind(item):
+        """'announcement' or 'notification' - ids of the two overlap, so clients need both"""
+        return 'announcement' if isinstance(item, Announcement) else 'notification'
+
+    @classmethod
+    def encode_cursor(cls, item):
+        return f'{item.created_at.isoformat()}|{cls.kind(item)}|{item.id}'
+
+    @classmethod
+    def decode_cursor(cls, user, cursor):
+        """
+        (created_at, kind, id) of a cursor
+
+        A bare integer is a notification id (cursors handed out by older app versions).
+
+        Raises:
+            ValueError: malformed cursor
+        """
+        if str(cursor).isdigit():
+            created_at = Notification.objects.filter(
+                id=int(cursor), recipient=user
+            ).values_list('created_at', flat=True).first()
+            if created_at is None:
+                raise ValueError('Unknown cursor')
+            return created_at, 'notification', int(cursor)
+
+        created_at, kind, item_id = str(cursor).split('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None or kind not in ('announcement', 'notification'):
+            raise ValueError('Malformed cursor')
+        return created_at, kind, int(item_id)
+
+    @staticmethod
+    def _after(queryset, kind, position):
+        """Items that sort after the cursor position in (created_at, kind, id) descending order"""
+        created_at, cursor_kind, item_id = position
+        older = Q(created_at__lt=created_at)
+        if kind == cursor_kind:
+            return queryset.filter(older | Q(created_at=created_at, id__lt=item_id))
+        if kind < cursor_kind:
+            # Same timestamp, lower kind: comes after every item of the cursor's kind
+            return queryset.filter(older | Q(created_at=created_at))
+        return queryset.filter(older)
+
+    @classmethod
+    def get_page(cls, user, cursor=None, limit=None, unread_only=False):
+        """
+        Get one page of the user's inbox, newest first
+
+        Notifications and announcements are merged on (created_at, kind, id)
+        and paged with one keyset cursor over that order, so each source is
+        read from where the last page left off and deep pages cost the same
+        as the first one.
+
+        Args:
+            user: User object
+            cursor: next_cursor of the previous page (exclusive)
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            unread_only: Only return unread items
+
+        Returns:
+            (items, next_cursor) - items are Notification and Announcement
+            objects; next_cursor is None on the last page
+
+        Raises:
+            ValueError: malformed cursor or limit
+        """
+        limit = min(max(int(limit or cls.DEFAULT_PAGE_SIZE), 1), cls.MAX_PAGE_SIZE)
+
+        notifications = Notification.objects.filter(recipient=user).select_related('sender__profile')
+        announcements = AnnouncementService.for_user(user)
+        if unread_only:
+            notifications = notifications.filter(is_read=False)
+            announcements = announcements.filter(is_read=False)
+
+        if cursor:
+            position = cls.decode_cursor(user, cursor)
+            notifications = cls._after(notifications, 'notification', position)
+            announcements = cls._after(announcements, 'announcement', position)
+
+        items = (
+            list(notifications.order_by('-created_at', '-id')[:limit + 1])
+            + list(announcements.order_by('-created_at', '-id')[:limit + 1])
+        )
+        items.sort(key=lambda item: (item.created_at, cls.kind(item), item.id), reverse=True)
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = cls.encode_cursor(items[-1])
+        return items, next_cursor
+
+    # ---------- Bulk operations ----------
+
+    @classmethod
+    def mark_read(cls, user, ids=None, up_to=None, announcement_ids=None):
+        """
+        Mark notifications as read with a single UPDATE
+
+        Args:
+            user: User object
+            ids: Iterable of notification ids to mark read
+            up_to: Mark every notification with id <= up_to read (the newest id
+                   the client has displayed, so newer arrivals stay unread).
+                   Announcements published up to that notification are included.
+            announcement_ids: Iterable of announcement ids to mark read
+
+        Returns:
+            Number of items that changed from unread to read
+        """
+        if ids is None and up_to is None and not announcement_ids:
+            return 0
+
+        updated = 0
+        if ids is not None or up_to is not None:
+            queryset = Notification.objects.filter(recipient=user, is_read=False)
+            if ids is not None:
+                queryset = queryset.filter(id__in=[int(i) for i in ids])
+            if up_to is not None:
+                queryset = queryset.filter(id__lte=int(up_to))
+            updated = queryset.update(is_read=True)
+
+        announcements_updated = 0
+        if announcement_ids:
+            announcements_updated += AnnouncementService.mark_read(user, ids=announcement_ids)
+        if up_to is not None:
+            up_to_time = Notification.objects.filter(id=int(up_to), recipient=user).values_list('created_at', flat=True).first()
+            if up_to_time is not None:
+                announcements_updated += AnnouncementService.mark_read(user, up_to=up_to_time)
+
+        if updated:
+            cls.adjust_unread(user.id, -updated)
+        elif announcements_updated:
+            cls.push_unread_count(user.id)
+        return updated + announcements_updated
+
+    @classmethod
+    def mark_all_read(cls, user):
+        """Mark all of the user's notifications and announcements as read"""
+        updated = Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        updated += AnnouncementService.mark_read(user, mark_all=True)
+        cls.reset_unread(user.id)
+        return updated
@@ -0,0 +1,80 @@
+"""
+Management command to compare the JSON and msgpack collaboration wire formats
+"""
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from storybook.collab_protocol import JSONCodec, MsgpackCodec, msgpack
+
+
+def make_stroke_batch(points_per_batch, seed=0):
+    """A draw_batch message shaped like the canvas page sends (points repeated under 'data')"""
+    rng = random.Random(seed)
+    x, y = rng.uniform(100, 900), rng.uniform(100, 700)
+    points = []
+    for _ in range(points_per_batch):
+        x += rng.uniform(-4, 4)
+        y += rng.uniform(-4, 4)
+        points.append({'x': x, 'y': y})
+    entry = {
+        'type': 'draw_batch_progress',
+        'strokeId': 'stroke_1700000000000_abc123',
+        'points': points,
+        'color': '#ff6b6b',
+        'strokeWidth': 8,
+        'tool': 'brush',
+        'layerId': 'layer_1',
+        'page_id': 'page-3',
+        'page_index': 2,
+        'is_cover_image': False,
+    }
+    return {
+        'type': 'draw_batch',
+        'user_id': 42,
+        'username': 'artist',
+        'batch': [{**entry, 'data': dict(entry)}],
+        'page_id': 'page-3',
+        'page_index': 2,
+        'is_cover_image': False,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark encode/decode cost and bytes per stroke of the collaboration wire formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=10, help='Points per draw batch (default: 10)')
+        parser.add_argument('--iterations', type=int, default=5000, help='Iterations per measurement (default: 5000)')
+
+    def time_per_call(self, func, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError('msgpack is not installed')
+
+        message = make_stroke_batch(options['points'])
+        iterations = options['iterations']
+
+        json_frame = JSONCodec.encode(message)
+        msgpack_frame = MsgpackCodec.encode(message)
+        rows = [
+            ('json', len(json_frame.encode('utf-8')),
+             self.time_per_call(lambda: JSONCodec.encode(message), iterations),
+             self.time_per_call(lambda: JSONCodec.decode(json_frame), iterations)),
+            ('msgpack', len(msgpack_frame),
+             self.time_per_call(lambda: MsgpackCodec.encode(message), iterations),
+             self.time_per_call(lambda: MsgpackCodec.decode(bytes_data=msgpack_frame), iterations)),
+        ]
+
+        self.stdout.write(f"Draw batch with {options['points']} points, {iterations} iterations\n")
+        self.stdout.write(f"{'format':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+        for name, size, encode_us, decode_us in rows:
+            self.stdout.write(f'{name:<10}{size:>8}{encode_us:>12.1f}{decode_us:>12.1f}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Binary frames are {len(msgpack_frame) / len(json_frame.encode("utf-8")):.0%} of JSON'
+        ))
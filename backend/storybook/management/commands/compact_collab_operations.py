@@ -0,0 +1,59 @@
+"""
+Management command to compact collaboration operation logs into page snapshots
+"""
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
+from django.utils import timezone
+from storybook.models import CollaborationSession
+from storybook.collab_ops import OperationCompactor
+
+
+class Command(BaseCommand):
+    help = 'Fold old collaboration drawing operations into per-page snapshots and trim them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-minutes',
+            type=int,
+            default=10,
+            help='Compact sessions with no new operations for this many minutes (default: 10)',
+        )
+        parser.add_argument(
+            '--max-tail',
+            type=int,
+            default=500,
+            help='Also compact busy sessions holding more than this many operations (default: 500)',
+        )
+        parser.add_argument(
+            '--session',
+            help='Compact a single session by session_id',
+        )
+
+    def handle(self, *args, **options):
+        sessions = CollaborationSession.objects.annotate(
+            op_count=Count('operations'),
+            last_op_at=Max('operations__timestamp')
+        ).filter(op_count__gt=0)
+
+        if options['session']:
+            sessions = sessions.filter(session_id=options['session'])
+
+        idle_cutoff = timezone.now() - timedelta(minutes=options['idle_minutes'])
+
+        compacted_sessions = 0
+        folded_total = 0
+        for session in sessions.iterator():
+            is_idle = session.last_op_at and session.last_op_at < idle_cutoff
+            if not (options['session'] or is_idle or session.op_count > options['max_tail']):
+                continue
+
+            folded = OperationCompactor.compact_session(session)
+            if folded:
+                compacted_sessions += 1
+                folded_total += folded
+                self.stdout.write(f'  ✓ {session.session_id}: folded {folded} of {session.op_count} operations')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {compacted_sessions} sessions ({folded_total} operations folded)'
+        ))
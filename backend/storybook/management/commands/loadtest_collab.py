@@ -0,0 +1,408 @@
+"""
+Management command to load-test collaboration sessions with simulated WebSocket clients
+--live runs against a real server and needs the optional websockets package
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from storybook.models import CollaborationSession, SessionParticipant
+
+try:
+    import websockets  # Only needed for --live
+except ImportError:  # pragma: no cover - in-memory mode only
+    websockets = None
+
+PREFIX = 'loadtest'
+DEFAULT_MIX = 'draw_batch=6,cursor=3,text_edit=1'
+OPERATION_TYPES = ('draw_batch', 'cursor', 'text_edit')
+
+# In-memory mode runs without Redis: local cache, in-process channel layer
+MEMORY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}}
+
+
+def parse_mix(value):
+    """'draw_batch=6,cursor=3,text_edit=1' -> {'draw_batch': 0.6, ...}"""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATION_TYPES:
+            raise CommandError(f"Unknown operation '{name}' (choose from {', '.join(OPERATION_TYPES)})")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight for '{name}': {weight!r}")
+    total = sum(weights.values())
+    if total <= 0:
+        raise CommandError('The mix needs at least one positive weight')
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+# ---------- Operations ----------
+# Every operation carries a key that survives the broadcast (stroke id, cursor
+# position, page text), so receivers can match it to its send time.
+
+def make_operation(kind, client_index, seq, rng, points=10):
+    if kind == 'draw_batch':
+        key = f'{PREFIX}-{client_index}-{seq}'
+        x, y = rng.uniform(100, 900), rng.uniform(100, 700)
+        stroke = []
+        for _ in range(points):
+            x += rng.uniform(-4, 4)
+            y += rng.uniform(-4, 4)
+            stroke.append({'x': round(x, 1), 'y': round(y, 1)})
+        entry = {
+            'type': 'draw_batch_progress', 'strokeId': key, 'points': stroke,
+            'color': '#ff6b6b', 'strokeWidth': 8, 'tool': 'brush',
+            'page_id': 'p1', 'page_index': 0, 'is_cover_image': False,
+        }
+        message = {'type': 'draw_batch', 'batch': [entry], 'page_id': 'p1', 'page_index': 0}
+    elif kind == 'cursor':
+        position = {'x': seq, 'y': client_index}
+        key = f'cursor-{client_index}-{seq}'
+        message = {'type': 'cursor', 'position': position, 'page_id': 'p1', 'page_index': 0}
+    else:
+        key = f'{PREFIX} text {client_index}-{seq}'
+        message = {'type': 'text_edit', 'page_id': 'p1', 'page_index': 0, 'text': key}
+    return key, message
+
+
+def received_keys(message, user_clients):
+    """(kind, key) pairs of the load operations a received frame carries"""
+    kind = message.get('type')
+    if kind == 'draw_batch':
+        return [('draw_batch', entry.get('strokeId')) for entry in message.get('batch') or []]
+    if kind in ('cursor', 'cursor_batch'):
+        cursors = message.get('cursors') if kind == 'cursor_batch' else [message]
+        keys = []
+        for cursor in cursors or []:
+            position = cursor.get('position') or {}
+            client_index = user_clients.get(cursor.get('user_id'))
+            if client_index is not None and 'x' in position:
+                keys.append(('cursor', f"cursor-{client_index}-{int(round(position['x']))}"))
+        return keys
+    if kind == 'text_edit':
+        return [('text_edit', message.get('text'))]
+    return []
+
+
+class LoadStats:
+    """Send times of operations and the fan-out latency of every delivery"""
+
+    def __init__(self):
+        self.sent = {}  # key -> perf_counter at send
+        self.sent_counts = {kind: 0 for kind in OPERATION_TYPES}
+        self.latencies = {kind: [] for kind in OPERATION_TYPES}
+        self.frames_received = 0
+        self.measuring = False
+
+    def mark_sent(self, kind, key):
+        self.sent[key] = time.perf_counter()
+        self.sent_counts[kind] += 1
+
+    def mark_received(self, message, user_clients):
+        if not self.measuring:
+            return
+        now = time.perf_counter()
+        self.frames_received += 1
+        for kind, key in received_keys(message, user_clients):
+            sent_at = self.sent.get(key)
+            if sent_at is not None:
+                self.latencies[kind].append(now - sent_at)
+
+
+class QueryCounter:
+    """Counts SQL statements on every database connection (all threads) while enabled"""
+
+    def __init__(self):
+        self.count = 0
+        self.enabled = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.enabled:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        for connection in connections.all():
+            self._attach(None, connection)
+        connection_created.connect(self._attach)
+
+    def uninstall(self):
+        connection_created.disconnect(self._attach)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+# ---------- Transports ----------
+
+class CommunicatorClient:
+    """Simulated participant talking to CollaborationConsumer in-process"""
+
+    def __init__(self, user, session_id):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from storybook.routing import websocket_urlpatterns
+
+        self.communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/collaborate/{session_id}/'
+        )
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def send(self, message):
+        await self.communicator.send_json_to(message)
+
+    async def receive(self):
+        # Never time out: a communicator timeout cancels the consumer; the task is cancelled instead
+        return await self.communicator.receive_json_from(timeout=86400)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class LiveClient:
+    """Simulated participant connected to a running server (daphne) over a real socket"""
+
+    def __init__(self, user, session_id, base_url):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        token = str(AccessToken.for_user(user))
+        self.url = f"{base_url.rstrip('/')}/ws/collaborate/{session_id}/?token={token}"
+        self.socket = None
+
+    async def connect(self):
+        try:
+            self.socket = await websockets.connect(self.url, max_size=None)
+        except Exception as e:
+            print(f"[WARN] Could not connect {self.url.split('?')[0]}: {e}")
+            return False
+        return True
+
+    async def send(self, message):
+        await self.socket.send(json.dumps(message))
+
+    async def receive(self):
+        return json.loads(await self.socket.recv())
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test collaboration: N simulated participants in each of M sessions replay a '
+        'draw_batch/cursor/text_edit mix and report fan-out latency, throughput and DB queries per operation'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=2, help='Concurrent sessions (default: 2)')
+        parser.add_argument('--participants', type=int, default=5, help='Participants per session (default: 5)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load (default: 10)')
+        parser.add_argument('--rate', type=float, default=10, help='Operations per second per participant (default: 10)')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Operation weights (default: {DEFAULT_MIX})')
+        parser.add_argument('--points', type=int, default=10, help='Points per draw batch (default: 10)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--live', metavar='WS_URL',
+            help='Run against a server instead of in-process, e.g. ws://localhost:8000 '
+                 '(daphne with the Redis channel layer; needs the websockets package)'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the generated users and sessions')
+
+    def handle(self, *args, **options):
+        if options['sessions'] < 1 or options['participants'] < 2:
+            raise CommandError('Use at least 1 session and 2 participants')
+        if options['live'] and websockets is None:
+            raise CommandError('--live needs the websockets package (pip install websockets)')
+        mix = parse_mix(options['mix'])
+
+        if options['live']:
+            self.run(options, mix)
+            return
+        with override_settings(
+            CACHES=MEMORY_CACHES,
+            CHANNEL_LAYERS=MEMORY_LAYERS,
+            COLLAB_MAX_CONNECTIONS=options['participants'],
+        ):
+            self.run(options, mix)
+
+    def run(self, options, mix):
+        sessions = self.create_fixtures(options['sessions'], options['participants'])
+        counter = None if options['live'] else QueryCounter()
+        try:
+            if counter:
+                counter.install()
+            stats, connected, elapsed = async_to_sync(self.simulate)(sessions, options, mix, counter)
+        finally:
+            if counter:
+                counter.uninstall()
+            if not options['keep']:
+                self.delete_fixtures()
+        self.report(options, mix, stats, connected, elapsed, counter)
+
+    # ---------- Fixtures ----------
+
+    def create_fixtures(self, session_count, participant_count):
+        """[(session_id, [users])] - one host and participant_count - 1 guests per session"""
+        self.delete_fixtures()
+        users = []
+        for i in range(session_count * participant_count):
+            user = User(username=f'{PREFIX}_user_{i}')
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith=f'{PREFIX}_user_').order_by('id'))
+
+        sessions = []
+        for s in range(session_count):
+            members = users[s * participant_count:(s + 1) * participant_count]
+            session = CollaborationSession.objects.create(
+                session_id=f'{PREFIX}_{s}',
+                host=members[0],
+                max_participants=participant_count,
+                story_draft={'title': 'Load test', 'pages': [{'id': 'p1', 'text': ''}]},
+            )
+            SessionParticipant.objects.bulk_create([
+                SessionParticipant(session=session, user=user, role='host' if i == 0 else 'participant')
+                for i, user in enumerate(members)
+            ])
+            sessions.append((session.session_id, members))
+        return sessions
+
+    def delete_fixtures(self):
+        CollaborationSession.objects.filter(session_id__startswith=f'{PREFIX}_').delete()
+        User.objects.filter(username__startswith=f'{PREFIX}_user_').delete()
+
+    # ---------- Simulation ----------
+
+    async def simulate(self, sessions, options, mix, counter):
+        stats = LoadStats()
+        rng = random.Random(options['seed'])
+        clients = []
+        user_clients = {}
+        for session_id, members in sessions:
+            for user in members:
+                user_clients[user.id] = len(clients)
+                if options['live']:
+                    clients.append(LiveClient(user, session_id, options['live']))
+                else:
+                    clients.append(CommunicatorClient(user, session_id))
+
+        # Connect one at a time like people joining, then let the join chatter settle
+        connected = []
+        for client in clients:
+            if await client.connect():
+                connected.append(client)
+
+        async def receive_loop(client):
+            while True:
+                stats.mark_received(await client.receive(), user_clients)
+
+        async def send_loop(index, client, deadline):
+            kinds, weights = zip(*mix.items())
+            seq = 0
+            interval = 1 / options['rate']
+            await asyncio.sleep(rng.uniform(0, interval))  # Spread the first sends
+            while time.perf_counter() < deadline:
+                seq += 1
+                kind = rng.choices(kinds, weights)[0]
+                key, message = make_operation(kind, index, seq, rng, options['points'])
+                stats.mark_sent(kind, key)
+                await client.send(message)
+                await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+
+        receivers = [asyncio.ensure_future(receive_loop(client)) for client in connected]
+        await asyncio.sleep(0.5)
+
+        stats.measuring = True
+        if counter:
+            counter.enabled = True
+        start = time.perf_counter()
+        deadline = start + options['duration']
+        await asyncio.gather(*(
+            send_loop(clients.index(client), client, deadline) for client in connected
+        ))
+        await asyncio.sleep(1.0)  # Deliveries still in flight (and the last cursor tick)
+        elapsed = time.perf_counter() - start
+        stats.measuring = False
+        if counter:
+            counter.enabled = False
+
+        for receiver in receivers:
+            receiver.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        for client in connected:
+            await client.close()
+        return stats, len(connected), elapsed
+
+    # ---------- Report ----------
+
+    def report(self, options, mix, stats, connected, elapsed, counter):
+        mode = f"live ({options['live']})" if options['live'] else 'in-memory'
+        total_clients = options['sessions'] * options['participants']
+        self.stdout.write(
+            f"Collaboration load test, {mode}: {options['sessions']} sessions x "
+            f"{options['participants']} participants, {options['rate']:g} ops/s each for {options['duration']:g}s"
+        )
+        self.stdout.write('Mix: ' + ', '.join(f'{kind} {share:.0%}' for kind, share in mix.items()))
+        self.stdout.write(f'Connected {connected}/{total_clients}\n')
+
+        def ms(value):
+            return f'{value * 1000:.1f}' if value is not None else '-'
+
+        self.stdout.write(f"{'operation':<12}{'sent':>8}{'delivered':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        everything = []
+        for kind in OPERATION_TYPES:
+            latencies = stats.latencies[kind]
+            everything.extend(latencies)
+            if not stats.sent_counts[kind]:
+                continue
+            self.stdout.write(
+                f'{kind:<12}{stats.sent_counts[kind]:>8}{len(latencies):>11}'
+                f'{ms(percentile(latencies, 50)):>10}{ms(percentile(latencies, 95)):>10}{ms(percentile(latencies, 99)):>10}'
+            )
+        sent = sum(stats.sent_counts.values())
+        self.stdout.write(
+            f"{'all':<12}{sent:>8}{len(everything):>11}"
+            f'{ms(percentile(everything, 50)):>10}{ms(percentile(everything, 95)):>10}{ms(percentile(everything, 99)):>10}'
+        )
+
+        self.stdout.write(
+            f'\nThroughput: {sent / elapsed:.0f} ops/s sent, {stats.frames_received / elapsed:.0f} msgs/s received'
+        )
+        if counter is None:
+            self.stdout.write('DB queries per operation: n/a (queries run in the server process)')
+        else:
+            self.stdout.write(f'DB queries per operation: {counter.count / sent if sent else 0:.2f} ({counter.count} total)')
+        if connected < total_clients:
+            self.stdout.write(self.style.WARNING(f'{total_clients - connected} participants could not connect'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,72 @@
+"""
+Management command running the queued AI story generation worker
+"""
+import os
+import socket
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from storybook.story_jobs import ProviderSlots, StoryJobQueue
+
+
+class Command(BaseCommand):
+    help = 'Run queued AI story generation jobs (no Celery needed - one process per host is enough)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'STORY_JOB_WORKERS', 4),
+            help='Worker threads in this process (default: STORY_JOB_WORKERS)',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before looking again when the queue is empty (default: 1.0)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when no job can be claimed instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        requeued, failed = StoryJobQueue.requeue_stale()
+        if requeued or failed:
+            self.stdout.write(f'  Recovered stale jobs: {requeued} requeued, {failed} failed')
+
+        limits = ', '.join(f'{p}={ProviderSlots.limit(p)}' for p in StoryJobQueue.providers())
+        self.stdout.write(f'Story job worker: {options["workers"]} threads, provider limits {limits}')
+
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+
+        def run(index, stop=None):
+            return StoryJobQueue.work(
+                worker_id=f'{prefix}:{index}', once=options['once'], poll_seconds=options['poll'], stop=stop
+            )
+
+        if options['workers'] <= 1:
+            processed = run(0)
+        else:
+            stop = threading.Event()
+            counts = [0] * options['workers']
+
+            def worker(index):
+                counts[index] = run(index, stop)
+
+            threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(timeout=1)
+            except KeyboardInterrupt:
+                stop.set()
+                self.stdout.write('Stopping after the running jobs finish...')
+                for thread in threads:
+                    thread.join()
+            processed = sum(counts)
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} story jobs'))
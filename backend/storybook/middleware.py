@@ -77,8 +77,10 @@ def JWTAuthMiddlewareStack(inner):
 
 
 # HTTP Middleware for tracking user activity
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
 from .models import UserProfile
 
 
@@ -105,3 +107,34 @@ class UpdateLastSeenMiddleware(MiddlewareMixin):
                 pass
         return None
 
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs as async middleware
+
+    WhiteNoise 6.x is sync-only, so under ASGI Django would adapt the whole chain
+    below it and run every async view on a thread. Requests that aren't for a
+    static file pass straight through; only static files touch a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storybook', '0030_announcement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.IntegerField(default=0)),
+                ('sequence_number', models.IntegerField(default=-1)),
+                ('operations', models.JSONField(blank=True, default=list)),
+                ('folded_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['page_number'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='drawingoperation',
+            index=models.Index(fields=['session', 'sequence_number'], name='storybook_d_session_10e63d_idx'),
+        ),
+        migrations.AddField(
+            model_name='operationsnapshot',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='storybook.collaborationsession'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='operationsnapshot',
+            unique_together={('session', 'page_number')},
+        ),
+    ]
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -495,6 +496,44 @@ class Notification(models.Model):
         return '/'
 
 
+class Announcement(models.Model):
+    """Platform announcement stored once and shown in every targeted user's inbox"""
+    TARGET_TYPES = [
+        ('all', 'All Users'),
+        ('child', 'Children'),
+        ('parent', 'Parents'),
+        ('teacher', 'Teachers'),
+    ]
+
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    target_type = models.CharField(max_length=10, choices=TARGET_TYPES, default='all')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='announcements')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['target_type', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"Announcement ({self.target_type}): {self.title}"
+
+
+class AnnouncementRead(models.Model):
+    """Per-user read marker for an announcement, created lazily when it is read"""
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='reads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='announcement_reads')
+    read_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('announcement', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} read {self.announcement.title}"
+
+
 # ========== Collaborative Drawing Models ==========
 
 class CollaborationSession(models.Model):
@@ -634,12 +673,35 @@ class DrawingOperation(models.Model):
         indexes = [
             models.Index(fields=['session', 'timestamp']),
             models.Index(fields=['session', 'page_number']),
+            models.Index(fields=['session', 'sequence_number']),
         ]
     
     def __str__(self):
         return f"{self.operation_type} by {self.user.username} at {self.timestamp}"
 
 
+class OperationSnapshot(models.Model):
+    """
+    Compacted checkpoint of a page's operation log
+    
+    Holds the folded operations up to sequence_number; DrawingOperation rows at or
+    below it have been trimmed, so replay = snapshot operations + newer rows.
+    """
+    session = models.ForeignKey(CollaborationSession, on_delete=models.CASCADE, related_name='snapshots')
+    page_number = models.IntegerField(default=0)
+    sequence_number = models.IntegerField(default=-1)  # Last operation folded into this snapshot
+    operations = models.JSONField(default=list, blank=True)  # Folded operations, in sequence order
+    folded_count = models.IntegerField(default=0)  # Total operations folded so far
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['session', 'page_number']
+        ordering = ['page_number']
+    
+    def __str__(self):
+        return f"Snapshot of page {self.page_number} in {self.session.session_id} @ {self.sequence_number}"
+
+
 class CollaborationInvite(models.Model):
     """
     Tracks collaboration invitations sent to users
@@ -994,3 +1056,45 @@ class NotificationPreferences(models.Model):
     
     def __str__(self):
         return f"Preferences for {self.user.username}"
+
+
+# ============================================================================
+# AI GENERATION JOBS
+# ============================================================================
+
+class StoryGenerationJob(models.Model):
+    """
+    Queued AI story generation, run by the run_story_jobs worker
+    
+    The client gets task_id right away and polls it (or listens for
+    story_job_update on the notifications socket) instead of holding a
+    request open while the provider writes the story.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    task_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='story_jobs')
+    provider = models.CharField(max_length=20)
+    payload = models.JSONField(default=dict)  # messages, temperature, max_tokens, model
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True)  # The provider's chat completion response
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not picked up before this (retry backoff)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.provider} story job {self.task_id} - {self.status}"
@@ -7,7 +7,10 @@ import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from django.core.cache import cache
+from .channel_utils import group_send_many
+from .presence_service import PresenceService
+from .announcement_service import AnnouncementService
+from .ws_metrics import MessageMetrics
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -15,6 +18,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     WebSocket consumer for handling real-time notifications and online presence
     """
     
+    # Inbound message type -> handler method (dispatched and measured in receive)
+    MESSAGE_HANDLERS = {
+        'ping': 'handle_ping',
+        'mark_read': 'handle_mark_read',
+    }
+    
     async def connect(self):
         """Handle WebSocket connection with memory-efficient checks"""
         self.user = self.scope.get('user')
@@ -25,10 +34,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return
         
         # Memory optimization: Limit concurrent connections per user
-        connection_key = f'ws_connections_{self.user.id}'
-        current_connections = cache.get(connection_key, 0)
-        
-        if current_connections >= 3:  # Max 3 connections per user
+        if PresenceService.connections(self.user.id) >= 3:  # Max 3 connections per user
             await self.close(code=4001)  # Custom close code for too many connections
             return
         
@@ -40,71 +46,100 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
+        # Join the shared announcement groups (one broadcast reaches every online user)
+        self.announcement_groups = AnnouncementService.groups_for(await self.get_user_type())
+        for group in self.announcement_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        
         await self.accept()
         
         # Track connection count
-        cache.set(connection_key, current_connections + 1, 300)  # 5 minute timeout
+        self.connection_counted = True
+        PresenceService.add_connection(self.user.id)
         
-        # Mark user as online
-        await self.set_user_online(True)
-        
-        # Broadcast user's online status to friends
-        await self.broadcast_online_status(True)
+        # Only announce real transitions - reconnecting within the grace window
+        # (or opening another tab) is invisible to friends
+        if PresenceService.mark_connected(self.user.id):
+            # Mark user as online
+            await self.set_user_online(True)
+            
+            # Broadcast user's online status to friends
+            await self.broadcast_online_status(True)
         
         # Send current online state of all friends to the newly connected user
         await self.send_initial_online_status()
         
         # Send initial connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection',
             'status': 'connected',
             'user_id': self.user.id
-        }))
+        })
+        
+        # Seed the app badges so clients don't need to poll on connect
+        await self.send_message({
+            'type': 'badge_summary',
+            'badges': await self.get_badge_summary()
+        })
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection with cleanup"""
         if hasattr(self, 'room_group_name'):
             # Decrement connection count
-            if hasattr(self, 'user') and self.user:
-                connection_key = f'ws_connections_{self.user.id}'
-                current_connections = cache.get(connection_key, 0)
-                if current_connections > 0:
-                    cache.set(connection_key, current_connections - 1, 300)
+            remaining_connections = 0
+            if getattr(self, 'connection_counted', False):
+                remaining_connections = PresenceService.remove_connection(self.user.id)
             
-            # Mark user as offline
-            await self.set_user_online(False)
-            
-            # Broadcast user's offline status to friends
-            await self.broadcast_online_status(False)
+            # Defer the offline broadcast - flaky mobile connections usually
+            # come back within the grace window
+            if remaining_connections == 0:
+                token = PresenceService.schedule_offline(self.user.id)
+                asyncio.ensure_future(self.broadcast_offline_after_grace(token))
             
             # Leave room group
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+            for group in getattr(self, 'announcement_groups', []):
+                await self.channel_layer.group_discard(group, self.channel_name)
+    
+    async def send_message(self, message):
+        """Send a message to this client"""
+        frame = json.dumps(message)
+        MessageMetrics.sent('notifications', message.get('type'), len(frame))
+        await self.send(text_data=frame)
     
     async def receive(self, text_data):
         """Handle incoming WebSocket messages"""
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
-            
-            if message_type == 'ping':
-                # Respond to ping with pong
-                await self.send(text_data=json.dumps({
-                    'type': 'pong'
-                }))
-            elif message_type == 'mark_read':
-                # Mark notification as read
-                notification_id = data.get('notification_id')
-                if notification_id:
-                    await self.mark_notification_read(notification_id)
-                    
+            handler = self.MESSAGE_HANDLERS.get(message_type)
+            await MessageMetrics.dispatch(
+                'notifications',
+                message_type if handler else 'unknown',
+                handler and getattr(self, handler),
+                data,
+                len(text_data)
+            )
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Invalid JSON'
-            }))
+            })
+    
+    async def handle_ping(self, data):
+        """Respond to ping with pong"""
+        await self.send_message({
+            'type': 'pong'
+        })
+    
+    async def handle_mark_read(self, data):
+        """Mark notification as read"""
+        notification_id = data.get('notification_id')
+        if notification_id:
+            await self.mark_notification_read(notification_id)
     
     # Event handlers for group messages
     async def collaboration_invite(self, event):
@@ -123,74 +158,101 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'message_type': 'collaboration_invite'
         }
         
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'collaboration_invite',
             'message': message_data
-        }))
+        })
     
     async def new_message(self, event):
         """Send new message notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'new_message',
             'message': event['message']
-        }))
+        })
     
     async def friend_request(self, event):
         """Send friend request notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'friend_request',
             'friendship': event['friendship']
-        }))
+        })
     
     async def friend_request_accepted(self, event):
         """Send friend request accepted notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'friend_request_accepted',
             'friendship': event['friendship']
-        }))
+        })
     
     async def friend_online(self, event):
         """Notify user that a friend came online"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'friend_online',
             'user_id': event['user_id'],
             'username': event['username']
-        }))
+        })
     
     async def friend_offline(self, event):
         """Notify user that a friend went offline"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'friend_offline',
             'user_id': event['user_id'],
             'username': event['username']
-        }))
+        })
     
     async def notification(self, event):
         """Send generic notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'notification',
             'notification': event['notification']
-        }))
+        })
+    
+    async def unread_count(self, event):
+        """Send updated unread notification count to client"""
+        await self.send_message({
+            'type': 'unread_count',
+            'count': event['count']
+        })
+    
+    async def badge_update(self, event):
+        """Send badge counter delta to client"""
+        await self.send_message({
+            'type': 'badge_update',
+            'counter': event['counter'],
+            'delta': event['delta'],
+            'count': event['count']
+        })
+    
+    async def announcement(self, event):
+        """Send platform announcement to client"""
+        await self.send_message({
+            'type': 'announcement',
+            'announcement': event['announcement']
+        })
     
     async def collaboration_session_started(self, event):
         """Notify participant that collaboration session has started"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'collaboration_session_started',
             'session_id': event['session_id'],
             'story_title': event['story_title']
-        }))
+        })
     
     async def collaboration_host_left(self, event):
         """Notify participant that host has left the session"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'collaboration_host_left',
             'session_id': event['session_id'],
             'story_title': event['story_title']
-        }))
+        })
+    
+    async def story_job_update(self, event):
+        """Status change of a queued AI story generation"""
+        await self.send_message(dict(event))  # Same shape as the polling endpoint
     
     async def xp_gained(self, event):
         """Send XP gain notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'xp_gained',
             'xp_amount': event['xp_amount'],
             'action': event['action'],
@@ -198,16 +260,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'level': event['level'],
             'current_level_xp': event['current_level_xp'],
             'next_level_xp': event['next_level_xp']
-        }))
+        })
     
     async def level_up(self, event):
         """Send level up notification to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'level_up',
             'new_level': event['new_level'],
             'total_xp': event['total_xp'],
             'unlocked_items': event['unlocked_items']
-        }))
+        })
     
     # Database operations
     @database_sync_to_async
@@ -221,6 +283,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         except UserProfile.DoesNotExist:
             pass
     
+    @database_sync_to_async
+    def get_user_type(self):
+        """Get user's profile type for targeted announcements"""
+        from .models import UserProfile
+        return UserProfile.objects.filter(user=self.user).values_list('user_type', flat=True).first()
+    
     @database_sync_to_async
     def get_friends(self):
         """Get list of user's friends"""
@@ -230,11 +298,11 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         friendships = Friendship.objects.filter(
             Q(sender=self.user, status='accepted') |
             Q(receiver=self.user, status='accepted')
-        )
+        ).values_list('sender_id', 'receiver_id')
         
         friend_ids = []
-        for friendship in friendships:
-            friend_id = friendship.sender_id if friendship.receiver_id == self.user.id else friendship.receiver_id
+        for sender_id, receiver_id in friendships:
+            friend_id = sender_id if receiver_id == self.user.id else receiver_id
             friend_ids.append(friend_id)
         
         return friend_ids
@@ -242,29 +310,48 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def mark_notification_read(self, notification_id):
         """Mark notification as read"""
+        from .inbox_service import NotificationInbox
         try:
-            from .models import Notification
-            notification = Notification.objects.get(id=notification_id, recipient=self.user)
-            notification.is_read = True
-            notification.save()
-        except Notification.DoesNotExist:
+            NotificationInbox.mark_read(self.user, ids=[notification_id])
+        except (TypeError, ValueError):
             pass
     
+    @database_sync_to_async
+    def get_badge_summary(self):
+        """Get the cached badge counters"""
+        from .badge_service import BadgeService
+        return BadgeService.summary(self.user.id)
+    
     async def broadcast_online_status(self, is_online):
-        """Broadcast online/offline status to all friends"""
+        """Broadcast online/offline status to all friends in one batched fan-out"""
         friend_ids = await self.get_friends()
         
         event_type = 'friend_online' if is_online else 'friend_offline'
         
-        for friend_id in friend_ids:
-            await self.channel_layer.group_send(
-                f'notifications_{friend_id}',
-                {
-                    'type': event_type,
-                    'user_id': self.user.id,
-                    'username': self.user.username
-                }
-            )
+        await group_send_many(
+            self.channel_layer,
+            [f'notifications_{friend_id}' for friend_id in friend_ids],
+            {
+                'type': event_type,
+                'user_id': self.user.id,
+                'username': self.user.username
+            }
+        )
+    
+    async def broadcast_offline_after_grace(self, token):
+        """Broadcast the offline transition unless the user reconnects within the grace window"""
+        try:
+            await asyncio.sleep(PresenceService.grace_seconds())
+            if not PresenceService.confirm_offline(self.user.id, token):
+                return
+            
+            # Mark user as offline
+            await self.set_user_online(False)
+            
+            # Broadcast user's offline status to friends
+            await self.broadcast_online_status(False)
+        except Exception as e:
+            print(f"Error broadcasting offline status: {str(e)}")
     
     async def send_initial_online_status(self):
         """Send the current online status of all friends to the newly connected user.
@@ -277,10 +364,10 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         
         online_friends = await self.get_online_friends(friend_ids)
         if online_friends:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'initial_online_status',
                 'online_friends': online_friends
-            }))
+            })
     
     @database_sync_to_async
     def get_online_friends(self, friend_ids):
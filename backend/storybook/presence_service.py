@@ -0,0 +1,101 @@
+"""
+Presence Service for debounced online/offline fan-out
+Suppresses flapping mobile connections so friends only hear about real transitions
+"""
+import uuid
+from django.conf import settings
+from .redis_store import get_store
+
+
+class PresenceService:
+    """
+    Tracks the presence state last announced to friends and debounces transitions
+
+    State lives in Redis hashes shared by every worker and each transition is
+    a single atomic operation, so two workers racing on the same user (a tab
+    closing while another opens) cannot both announce, or lose, a transition.
+    """
+
+    # Last state broadcast to friends ('online' / 'offline') and the token of the
+    # pending (not yet broadcast) offline transition
+    PRESENCE_KEY = 'presence_{user_id}'
+    # Open WebSocket connections (shared with NotificationConsumer)
+    CONNECTIONS_KEY = 'ws_connections_{user_id}'
+
+    STATE_TTL = 86400  # 24 hours
+    CONNECTIONS_TTL = 300  # Counts of crashed workers heal after 5 minutes
+
+    @classmethod
+    def grace_seconds(cls):
+        """Seconds a user may be disconnected before friends see them go offline"""
+        return getattr(settings, 'PRESENCE_OFFLINE_GRACE_SECONDS', 10)
+
+    # ---------- Connection counting ----------
+
+    @classmethod
+    def connections(cls, user_id):
+        return int(get_store().hget(cls.CONNECTIONS_KEY.format(user_id=user_id), 'count') or 0)
+
+    @classmethod
+    def add_connection(cls, user_id):
+        """Count a new WebSocket connection; returns the new total"""
+        return get_store().hincrby(cls.CONNECTIONS_KEY.format(user_id=user_id), 'count', 1, ttl=cls.CONNECTIONS_TTL)
+
+    @classmethod
+    def remove_connection(cls, user_id):
+        """Count a closed WebSocket connection; returns the connections left"""
+        key = cls.CONNECTIONS_KEY.format(user_id=user_id)
+        remaining = get_store().hincrby(key, 'count', -1, ttl=cls.CONNECTIONS_TTL)
+        if remaining < 0:
+            # The count expired while connected; restart from zero
+            get_store().hincrby(key, 'count', -remaining, ttl=cls.CONNECTIONS_TTL)
+            remaining = 0
+        return remaining
+
+    # ---------- Transitions ----------
+
+    @classmethod
+    def mark_connected(cls, user_id):
+        """
+        Record a new connection for the user
+
+        Cancels any pending offline transition (the offline->online flap is never seen
+        by friends).
+
+        Returns:
+            True if friends should be told the user came online
+        """
+        store = get_store()
+        key = cls.PRESENCE_KEY.format(user_id=user_id)
+        store.hdel(key, 'pending_offline')
+        return store.hgetset(key, 'state', 'online', ttl=cls.STATE_TTL) != 'online'
+
+    @classmethod
+    def schedule_offline(cls, user_id):
+        """
+        Start the grace window for an offline transition
+
+        Returns:
+            Token identifying this pending transition (pass it to confirm_offline)
+        """
+        token = uuid.uuid4().hex
+        get_store().hset(cls.PRESENCE_KEY.format(user_id=user_id), {'pending_offline': token}, ttl=cls.STATE_TTL)
+        return token
+
+    @classmethod
+    def confirm_offline(cls, user_id, token):
+        """
+        Finish a pending offline transition once the grace window has passed
+
+        Returns:
+            True if friends should be told the user went offline, False if the user
+            reconnected in the meantime (on this or any other worker)
+        """
+        if cls.connections(user_id) > 0:
+            return False
+
+        # Only the worker whose token is still pending flips the state
+        return get_store().hset_if(
+            cls.PRESENCE_KEY.format(user_id=user_id), 'pending_offline', token,
+            {'pending_offline': '', 'state': 'offline'}, ttl=cls.STATE_TTL
+        )
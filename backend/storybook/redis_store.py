@@ -0,0 +1,454 @@
+"""
+Shared Redis data structures (hashes, lists, sorted sets) for real-time features
+Uses the Redis server behind the default cache; falls back to an in-process store when
+the cache is not Redis (local development and tests)
+"""
+import threading
+import time
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+
+# Atomically: drop members scored below the stale cutoff (and their companion
+# hash fields), then add the member unless the set is already at its limit.
+# KEYS: zset, companion hash  ARGV: member, score, limit, min score, ttl, companion value
+ZADD_CAPPED_SCRIPT = """
+local reaped = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[4])
+if #reaped > 0 then
+    redis.call('ZREM', KEYS[1], unpack(reaped))
+    redis.call('HDEL', KEYS[2], unpack(reaped))
+end
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return {0, reaped}
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[6])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return {1, reaped}
+"""
+
+# Token bucket refilled at ARGV rate per second up to capacity; takes cost tokens if
+# available. blocked_until (set by block) refuses everything until then.
+# KEYS: bucket hash  ARGV: rate, capacity, now, cost, ttl
+# Returns {granted, seconds to wait} (wait as a string - Lua numbers become integers)
+TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until')
+local rate, capacity, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local blocked = tonumber(state[3]) or 0
+if blocked > now then
+    return {0, tostring(blocked - now)}
+end
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local granted = 0
+local wait = (cost - tokens) / rate
+if tokens >= cost then
+    tokens = tokens - cost
+    granted = 1
+    wait = 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return {granted, tostring(wait)}
+"""
+
+# Set a hash field and return its previous value
+# KEYS: hash  ARGV: field, value, ttl (0 = keep)
+HGETSET_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return old
+"""
+
+# Set hash fields only while one field still holds the expected value
+# KEYS: hash  ARGV: field, expected, ttl (0 = keep), then field/value pairs
+HSET_IF_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+# Delete a lock only while it still holds the caller's token
+# KEYS: lock  ARGV: token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStore:
+    """Field-level Redis commands on keys namespaced like the default cache"""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    @property
+    def client(self):
+        return self._cache._cache.get_client(None, write=True)
+
+    def key(self, name):
+        return self._cache.make_key(name)
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    # ---------- Hashes ----------
+
+    def hset(self, name, mapping, ttl=None, incr=None):
+        """Set hash fields; optionally HINCRBY the incr field in the same round trip"""
+        key = self.key(name)
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        if incr:
+            pipe.hincrby(key, incr, 1)
+        if ttl:
+            pipe.expire(key, ttl)
+        results = pipe.execute()
+        return results[1] if incr else None
+
+    def hget(self, name, field):
+        return self._decode(self.client.hget(self.key(name), field))
+
+    def hmget(self, name, fields):
+        return [self._decode(v) for v in self.client.hmget(self.key(name), fields)]
+
+    def hgetall(self, name):
+        return {
+            self._decode(k): self._decode(v)
+            for k, v in self.client.hgetall(self.key(name)).items()
+        }
+
+    def hkeys(self, name):
+        return [self._decode(k) for k in self.client.hkeys(self.key(name))]
+
+    def hscan(self, name, count=100):
+        """Iterate (field, value) pairs a batch at a time instead of one HGETALL reply"""
+        for k, v in self.client.hscan_iter(self.key(name), count=count):
+            yield self._decode(k), self._decode(v)
+
+    def hdel(self, name, *fields):
+        return self.client.hdel(self.key(name), *fields)
+
+    def hincrby(self, name, field, amount=1, ttl=None):
+        key = self.key(name)
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, field, amount)
+        if ttl:
+            pipe.expire(key, ttl)
+        return pipe.execute()[0]
+
+    def hgetset(self, name, field, value, ttl=None):
+        """Set a field and return its previous value (atomic)"""
+        return self._decode(self.client.eval(HGETSET_SCRIPT, 1, self.key(name), field, value, ttl or 0))
+
+    def hset_if(self, name, field, expected, mapping, ttl=None):
+        """Set mapping only if field still equals expected (atomic); returns whether it did"""
+        pairs = [item for pair in mapping.items() for item in pair]
+        return bool(self.client.eval(HSET_IF_SCRIPT, 1, self.key(name), field, expected, ttl or 0, *pairs))
+
+    # ---------- Lists ----------
+
+    def push_trimmed(self, name, values, maxlen, ttl=None):
+        """Append values and keep only the newest maxlen entries"""
+        key = self.key(name)
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *values)
+        pipe.ltrim(key, -maxlen, -1)
+        if ttl:
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+    def lrange(self, name, start=0, end=-1):
+        return [self._decode(v) for v in self.client.lrange(self.key(name), start, end)]
+
+    # ---------- Sorted sets ----------
+
+    def zadd_capped(self, name, member, score, limit, min_score, companion, value, ttl):
+        """
+        Add member (with value in the companion hash) unless the set holds limit members
+
+        Members scored below min_score are removed first, atomically.
+
+        Returns:
+            (added, reaped members)
+        """
+        added, reaped = self.client.eval(
+            ZADD_CAPPED_SCRIPT, 2, self.key(name), self.key(companion),
+            member, score, limit, min_score, ttl, value
+        )
+        return bool(added), [self._decode(m) for m in reaped]
+
+    def zadd_existing(self, name, member, score):
+        """Update an existing member's score; False if it is gone"""
+        return bool(self.client.zadd(self.key(name), {member: score}, xx=True, ch=True))
+
+    def zrangebyscore(self, name, min_score='-inf', max_score='+inf'):
+        return [self._decode(m) for m in self.client.zrangebyscore(self.key(name), min_score, max_score)]
+
+    def zrem(self, name, *members):
+        if members:
+            return self.client.zrem(self.key(name), *members)
+        return 0
+
+    def zcard(self, name):
+        return self.client.zcard(self.key(name))
+
+    # ---------- Token buckets ----------
+
+    def take_token(self, name, rate, capacity, cost=1, ttl=3600):
+        """
+        Take cost tokens from a bucket refilling at rate per second (atomic)
+
+        Returns:
+            (granted, seconds until enough tokens are available)
+        """
+        granted, wait = self.client.eval(
+            TOKEN_BUCKET_SCRIPT, 1, self.key(name), rate, capacity, time.time(), cost, ttl
+        )
+        return bool(granted), float(self._decode(wait))
+
+    # ---------- Locks ----------
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for token unless someone holds it; it expires after ttl seconds"""
+        return bool(self.client.set(self.key(name), token, nx=True, ex=ttl))
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it (never another holder's); returns whether it did"""
+        return bool(self.client.eval(RELEASE_LOCK_SCRIPT, 1, self.key(name), token))
+
+    # ---------- Keys ----------
+
+    def exists(self, name):
+        return bool(self.client.exists(self.key(name)))
+
+    def expire(self, name, ttl):
+        self.client.expire(self.key(name), ttl)
+
+    def delete(self, *names):
+        if names:
+            self.client.delete(*[self.key(name) for name in names])
+
+
+class LocalStore:
+    """In-process stand-in for RedisStore with the same semantics (single process only)"""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name, default_factory=None):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        if name not in self._data and default_factory is not None:
+            self._data[name] = default_factory()
+        return self._data.get(name)
+
+    def _touch(self, name, ttl):
+        if ttl:
+            self._expires[name] = time.monotonic() + ttl
+
+    # ---------- Hashes ----------
+
+    def hset(self, name, mapping, ttl=None, incr=None):
+        with self._lock:
+            data = self._get(name, dict)
+            data.update({k: str(v) for k, v in mapping.items()})
+            self._touch(name, ttl)
+            if incr:
+                data[incr] = str(int(data.get(incr, 0)) + 1)
+                return int(data[incr])
+
+    def hget(self, name, field):
+        with self._lock:
+            return (self._get(name) or {}).get(field)
+
+    def hmget(self, name, fields):
+        with self._lock:
+            data = self._get(name) or {}
+            return [data.get(field) for field in fields]
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._get(name) or {})
+
+    def hkeys(self, name):
+        with self._lock:
+            return list(self._get(name) or {})
+
+    def hscan(self, name, count=100):
+        with self._lock:
+            items = list((self._get(name) or {}).items())
+        yield from items
+
+    def hdel(self, name, *fields):
+        with self._lock:
+            data = self._get(name) or {}
+            return sum(1 for field in fields if data.pop(field, None) is not None)
+
+    def hincrby(self, name, field, amount=1, ttl=None):
+        with self._lock:
+            data = self._get(name, dict)
+            data[field] = str(int(data.get(field, 0)) + amount)
+            self._touch(name, ttl)
+            return int(data[field])
+
+    def hgetset(self, name, field, value, ttl=None):
+        with self._lock:
+            data = self._get(name, dict)
+            old = data.get(field)
+            data[field] = str(value)
+            self._touch(name, ttl)
+            return old
+
+    def hset_if(self, name, field, expected, mapping, ttl=None):
+        with self._lock:
+            data = self._get(name, dict)
+            if data.get(field) != str(expected):
+                return False
+            data.update({k: str(v) for k, v in mapping.items()})
+            self._touch(name, ttl)
+            return True
+
+    # ---------- Lists ----------
+
+    def push_trimmed(self, name, values, maxlen, ttl=None):
+        with self._lock:
+            items = self._get(name, list)
+            items.extend(str(v) for v in values)
+            del items[:-maxlen]
+            self._touch(name, ttl)
+
+    def lrange(self, name, start=0, end=-1):
+        with self._lock:
+            items = self._get(name) or []
+            return list(items[start:None if end == -1 else end + 1])
+
+    # ---------- Sorted sets ----------
+
+    def zadd_capped(self, name, member, score, limit, min_score, companion, value, ttl):
+        with self._lock:
+            members = self._get(name, dict)
+            values = self._get(companion, dict)
+            reaped = [m for m, s in members.items() if s < min_score]
+            for m in reaped:
+                del members[m]
+                values.pop(m, None)
+            if member not in members and len(members) >= limit:
+                return False, reaped
+            members[member] = float(score)
+            values[member] = str(value)
+            self._touch(name, ttl)
+            self._touch(companion, ttl)
+            return True, reaped
+
+    def zadd_existing(self, name, member, score):
+        with self._lock:
+            members = self._get(name) or {}
+            if member not in members:
+                return False
+            members[member] = float(score)
+            return True
+
+    def zrangebyscore(self, name, min_score='-inf', max_score='+inf'):
+        with self._lock:
+            low, high = float(min_score), float(max_score)
+            members = self._get(name) or {}
+            return [m for m, s in sorted(members.items(), key=lambda item: item[1]) if low <= s <= high]
+
+    def zrem(self, name, *members):
+        with self._lock:
+            data = self._get(name) or {}
+            return sum(1 for m in members if data.pop(m, None) is not None)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._get(name) or {})
+
+    # ---------- Token buckets ----------
+
+    def take_token(self, name, rate, capacity, cost=1, ttl=3600):
+        with self._lock:
+            state = self._get(name, dict)
+            now = time.time()
+            blocked = float(state.get('blocked_until', 0))
+            if blocked > now:
+                return False, blocked - now
+            tokens = float(state.get('tokens', capacity))
+            ts = float(state.get('ts', now))
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+            granted = tokens >= cost
+            wait = 0.0 if granted else (cost - tokens) / rate
+            if granted:
+                tokens -= cost
+            state.update({'tokens': str(tokens), 'ts': str(now)})
+            self._touch(name, ttl)
+            return granted, wait
+
+    # ---------- Locks ----------
+
+    def acquire_lock(self, name, token, ttl):
+        with self._lock:
+            if self._get(name) is not None:
+                return False
+            self._data[name] = str(token)
+            self._touch(name, ttl)
+            return True
+
+    def release_lock(self, name, token):
+        with self._lock:
+            if self._get(name) != str(token):
+                return False
+            self.delete(name)
+            return True
+
+    # ---------- Keys ----------
+
+    def exists(self, name):
+        with self._lock:
+            return self._get(name) is not None
+
+    def expire(self, name, ttl):
+        with self._lock:
+            if self._get(name) is not None:
+                self._touch(name, ttl)
+
+    def delete(self, *names):
+        with self._lock:
+            for name in names:
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+
+_local_store = LocalStore()
+
+
+def get_store():
+    """Store backed by the default cache's Redis server, or the in-process fallback"""
+    cache = caches['default']
+    if isinstance(cache, RedisCache):
+        return RedisStore(cache)
+    return _local_store
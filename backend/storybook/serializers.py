@@ -6,7 +6,8 @@ from django.contrib.auth.models import User
 from .models import (
     UserProfile, Story, Character, Comment, Like, Rating, 
     Friendship, Achievement, UserAchievement, Notification,
-    ParentChildRelationship, TeacherStudentRelationship, TeacherClass, Message
+    ParentChildRelationship, TeacherStudentRelationship, TeacherClass, Message,
+    Announcement
 )
 
 
@@ -298,6 +299,35 @@ class NotificationSerializer(serializers.ModelSerializer):
         return None
 
 
+class AnnouncementSerializer(serializers.ModelSerializer):
+    """Serializer for announcements shown in the notification inbox"""
+    notification_type = serializers.SerializerMethodField()
+    is_read = serializers.SerializerMethodField()
+    icon = serializers.SerializerMethodField()
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Announcement
+        fields = [
+            'id', 'notification_type', 'title', 'message', 'target_type',
+            'is_read', 'created_at', 'icon', 'url'
+        ]
+        read_only_fields = fields
+
+    def get_notification_type(self, obj):
+        return 'announcement'
+
+    def get_is_read(self, obj):
+        """is_read is annotated by AnnouncementService.for_user"""
+        return bool(getattr(obj, 'is_read', False))
+
+    def get_icon(self, obj):
+        return 'megaphone'
+
+    def get_url(self, obj):
+        return '/'
+
+
 class ParentChildRelationshipSerializer(serializers.ModelSerializer):
     """Serializer for parent-child relationships"""
     parent_name = serializers.CharField(source='parent.profile.display_name', read_only=True)
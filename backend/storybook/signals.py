@@ -0,0 +1,72 @@
+"""
+Model signals that keep cached counters in sync with the database
+"""
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Notification, Message, Friendship, CollaborationInvite
+
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    """Count new unread notifications once the row is committed"""
+    if created and not instance.is_read:
+        from .inbox_service import NotificationInbox
+        transaction.on_commit(lambda: NotificationInbox.adjust_unread(instance.recipient_id, 1))
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    """Uncount deleted unread notifications"""
+    if not instance.is_read:
+        from .inbox_service import NotificationInbox
+        transaction.on_commit(lambda: NotificationInbox.adjust_unread(instance.recipient_id, -1))
+
+
+# ---------- Badge counters ----------
+
+# model -> (badge counter, tracked field, "is pending" check)
+BADGE_MODELS = {
+    Message: ('messages', 'is_read', lambda obj: not obj.is_read),
+    Friendship: ('friend_requests', 'status', lambda obj: obj.status == 'pending'),
+    CollaborationInvite: ('collab_invites', 'status', lambda obj: obj.status == 'pending'),
+}
+
+
+def _adjust_badge(user_id, counter, delta):
+    from .badge_service import BadgeService
+    transaction.on_commit(lambda: BadgeService.adjust(user_id, counter, delta))
+
+
+@receiver(post_init, sender=Message)
+@receiver(post_init, sender=Friendship)
+@receiver(post_init, sender=CollaborationInvite)
+def badge_remember_state(sender, instance, **kwargs):
+    """Remember whether a loaded row counts towards a badge (no extra query on save)"""
+    _, field, is_pending = BADGE_MODELS[sender]
+    # Deferred field (.only()/.defer()) - reading it would cost a query
+    instance._badge_pending = is_pending(instance) if field in instance.__dict__ else None
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Friendship)
+@receiver(post_save, sender=CollaborationInvite)
+def badge_saved(sender, instance, created, **kwargs):
+    """Adjust the receiver's badge when a row starts or stops counting"""
+    counter, _, is_pending = BADGE_MODELS[sender]
+    pending = is_pending(instance)
+    was_pending = False if created else getattr(instance, '_badge_pending', None)
+
+    if was_pending is not None and pending != was_pending:
+        _adjust_badge(instance.receiver_id, counter, 1 if pending else -1)
+    instance._badge_pending = pending
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Friendship)
+@receiver(post_delete, sender=CollaborationInvite)
+def badge_deleted(sender, instance, **kwargs):
+    """Uncount deleted rows that were still counting towards a badge"""
+    counter, _, is_pending = BADGE_MODELS[sender]
+    if is_pending(instance):
+        _adjust_badge(instance.receiver_id, counter, -1)
@@ -0,0 +1,338 @@
+"""
+Queued AI story generation
+Jobs live in the database; run_story_jobs workers claim them within per-provider concurrency limits
+"""
+import json
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from .models import StoryGenerationJob
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """
+    A provider call failed; retryable failures (rate limits, 5xx, timeouts) are queued
+    again, after retry_after seconds when the provider or our rate limiter said so
+    """
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# ---------- Providers: payload -> chat completion response ----------
+
+def _chat_completion(provider, url, payload, timeout, extra_headers=None):
+    import requests
+    from .ai_http import ProviderHTTP
+    from .ai_rate_limit import AIRateLimiter, RateLimited, retry_after_seconds
+
+    try:
+        api_key = AIRateLimiter.acquire(provider, max_wait=0)  # The queue backs off instead
+    except RateLimited as e:
+        raise ProviderError(str(e), retryable=True, retry_after=e.retry_after)
+    if not api_key:
+        raise ProviderError('API key not configured on the server')
+    try:
+        response = ProviderHTTP.post(
+            url,
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {api_key}',
+                **(extra_headers or {}),
+            },
+            json=payload,
+            timeout=timeout,
+        )
+    except requests.exceptions.RequestException as e:
+        raise ProviderError(f'Request failed: {e}', retryable=True)
+
+    AIRateLimiter.observe(provider, api_key, response.status_code, response.headers)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise ProviderError(
+            f'API error {response.status_code}', retryable=True, retry_after=retry_after_seconds(response.headers)
+        )
+    if not response.ok:
+        raise ProviderError(f'API error {response.status_code}: {response.text[:500]}')
+    return response.json()
+
+
+def _groq(payload):
+    from .ai_proxy_views import GROQ_API_URL
+
+    return _chat_completion('groq', GROQ_API_URL, {
+        'model': payload.get('model') or 'llama-3.3-70b-versatile',
+        'messages': payload['messages'],
+        'temperature': payload.get('temperature', 0.85),
+        'max_tokens': payload.get('max_tokens', 2048),
+        'response_format': {'type': 'json_object'},
+    }, timeout=60)
+
+
+def _openrouter(payload):
+    from .ai_proxy_views import OPENROUTER_API_URL
+
+    return _chat_completion('openrouter', OPENROUTER_API_URL, {
+        'model': payload.get('model') or 'google/gemma-3-27b-it:free',
+        'messages': payload['messages'],
+        'temperature': payload.get('temperature', 0.85),
+        'max_tokens': payload.get('max_tokens', 2048),
+    }, timeout=90, extra_headers={
+        'HTTP-Referer': 'https://pixeltales.app',
+        'X-Title': 'PixelTales',
+    })
+
+
+def _stub(payload):
+    """Offline provider: a canned story shaped like a Groq completion (no network)"""
+    prompt = next(
+        (m.get('content', '') for m in reversed(payload['messages']) if m.get('role') == 'user'), ''
+    )
+    story = {
+        'title': 'The Lighthouse Keeper\'s Cat',
+        'pages': [
+            {'text': 'On a windy island lived a small orange cat who guarded the lighthouse.'},
+            {'text': 'Every night she counted the ships and waved her tail at each one.'},
+            {'text': 'When the lamp went dark, she rang the bell until every ship was safe.'},
+        ],
+        'prompt': prompt[:200],
+    }
+    return {
+        'id': f'stub-{int(time.time() * 1000)}',
+        'model': 'stub',
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': json.dumps(story)},
+            'finish_reason': 'stop',
+        }],
+    }
+
+
+PROVIDERS = {
+    'groq': _groq,
+    'openrouter': _openrouter,
+    'stub': _stub,
+}
+
+
+class ProviderSlots:
+    """
+    Cluster-wide cap on concurrent calls per provider
+
+    Slot i of a provider is held while its cache key exists (cache.add is
+    atomic on Redis), so every worker process shares the same
+    STORY_JOB_CONCURRENCY limits. Keys expire after STORY_JOB_TIMEOUT in case
+    a worker dies holding one.
+    """
+
+    KEY = 'story_job_slot_{provider}_{index}'
+
+    @classmethod
+    def limit(cls, provider):
+        return getattr(settings, 'STORY_JOB_CONCURRENCY', {}).get(provider, 1)
+
+    @classmethod
+    def acquire(cls, provider, holder):
+        """Returns the slot key, or None when the provider is at its limit"""
+        for index in range(cls.limit(provider)):
+            key = cls.KEY.format(provider=provider, index=index)
+            if cache.add(key, holder, StoryJobQueue.timeout()):
+                return key
+        return None
+
+    @classmethod
+    def release(cls, key):
+        cache.delete(key)
+
+
+class StoryJobQueue:
+    """
+    Database-backed queue of story generation jobs
+
+    enqueue() is all the API does; run_story_jobs workers claim queued jobs
+    (oldest first, skipping providers with no free slot), call the provider
+    and store its response. Rate limits and provider outages put the job back
+    in the queue with a backoff; every status change is pushed to the owner
+    as story_job_update on the notifications WebSocket.
+    """
+
+    RETRY_BACKOFF_SECONDS = 10
+    CLAIM_BATCH = 20
+    REQUEUE_EVERY_POLLS = 30  # Stale-job sweeps while running (a dead worker's jobs aren't stuck until a restart)
+
+    @classmethod
+    def timeout(cls):
+        return getattr(settings, 'STORY_JOB_TIMEOUT', 180)
+
+    @classmethod
+    def max_attempts(cls):
+        return getattr(settings, 'STORY_JOB_MAX_ATTEMPTS', 3)
+
+    @classmethod
+    def providers(cls):
+        """Providers jobs can be queued for"""
+        names = ['groq', 'openrouter']
+        if getattr(settings, 'STORY_JOB_STUB_PROVIDER', False):
+            names.append('stub')
+        return names
+
+    @classmethod
+    def enqueue(cls, user, provider, payload):
+        job = StoryGenerationJob.objects.create(user=user, provider=provider, payload=payload)
+        cls.notify(job)
+        return job
+
+    @classmethod
+    def status(cls, job):
+        """What the polling endpoint and the WebSocket push report"""
+        data = {
+            'task_id': str(job.task_id),
+            'provider': job.provider,
+            'status': job.status,
+            'attempts': job.attempts,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
+        if job.status == 'succeeded':
+            data['result'] = job.result
+        elif job.status == 'failed':
+            data['error'] = job.error
+        return data
+
+    @classmethod
+    def notify(cls, job):
+        """Push the job's status over the owner's notifications WebSocket"""
+        try:
+            from channels.layers import get_channel_layer
+            from asgiref.sync import async_to_sync
+
+            channel_layer = get_channel_layer()
+            if channel_layer:
+                async_to_sync(channel_layer.group_send)(
+                    f'notifications_{job.user_id}',
+                    {'type': 'story_job_update', **cls.status(job)}
+                )
+        except Exception:
+            logger.exception('Pushing story job update failed')
+
+    # ---------- Worker side ----------
+
+    @classmethod
+    def claim(cls, worker_id):
+        """
+        Take the oldest queued job whose provider has a free slot
+
+        Returns:
+            (job, slot_key), or (None, None) when nothing can run right now
+        """
+        full = set()
+        queued = StoryGenerationJob.objects.filter(
+            status='queued', available_at__lte=timezone.now()
+        ).order_by('created_at').only('id', 'provider')[:cls.CLAIM_BATCH]
+        for candidate in queued:
+            if candidate.provider in full:
+                continue
+            slot = ProviderSlots.acquire(candidate.provider, worker_id)
+            if slot is None:
+                full.add(candidate.provider)
+                continue
+            # Conditional update: only one worker wins the job
+            claimed = StoryGenerationJob.objects.filter(pk=candidate.pk, status='queued').update(
+                status='running', started_at=timezone.now(), attempts=F('attempts') + 1
+            )
+            if claimed:
+                return StoryGenerationJob.objects.get(pk=candidate.pk), slot
+            ProviderSlots.release(slot)
+        return None, None
+
+    @classmethod
+    def run(cls, job, slot):
+        """Call the job's provider and record the outcome"""
+        try:
+            provider = PROVIDERS.get(job.provider)
+            if provider is None:
+                raise ProviderError(f'Unknown provider {job.provider}')
+            job.result = provider(job.payload)
+            job.status = 'succeeded'
+            job.error = ''
+        except ProviderError as e:
+            job.error = str(e)
+            if e.retryable and job.attempts < cls.max_attempts():
+                job.status = 'queued'
+                backoff = e.retry_after if e.retry_after is not None else cls.RETRY_BACKOFF_SECONDS * job.attempts
+                job.available_at = timezone.now() + timedelta(seconds=backoff)
+            else:
+                job.status = 'failed'
+        except Exception as e:
+            logger.exception('Story job %s failed', job.task_id)
+            job.status = 'failed'
+            job.error = f'Server error: {e}'
+        finally:
+            ProviderSlots.release(slot)
+
+        if job.status != 'queued':
+            job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error', 'available_at', 'finished_at'])
+        cls.notify(job)
+        return job
+
+    @classmethod
+    def requeue_stale(cls):
+        """
+        Jobs left running by a dead worker go back to the queue (or fail after max attempts)
+
+        Owners are notified of the new status like after any other transition.
+        """
+        cutoff = timezone.now() - timedelta(seconds=cls.timeout())
+        stale_ids = list(StoryGenerationJob.objects.filter(
+            status='running', started_at__lt=cutoff
+        ).values_list('id', flat=True))
+        if not stale_ids:
+            return 0, 0
+        # status='running' again: a job finished by a slow (not dead) worker meanwhile is left alone
+        stale = StoryGenerationJob.objects.filter(pk__in=stale_ids, status='running')
+        failed = stale.filter(attempts__gte=cls.max_attempts()).update(
+            status='failed', error='Worker lost the job', finished_at=timezone.now()
+        )
+        requeued = stale.update(status='queued', available_at=timezone.now())
+        for job in StoryGenerationJob.objects.filter(pk__in=stale_ids):
+            cls.notify(job)
+        return requeued, failed
+
+    @classmethod
+    def work(cls, worker_id=None, once=False, poll_seconds=1.0, stop=None):
+        """
+        Worker loop: claim, run, repeat
+
+        Args:
+            once: return as soon as nothing is claimable instead of polling
+            stop: optional threading.Event ending the loop
+        """
+        worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        processed = 0
+        polls = 0
+        while not (stop and stop.is_set()):
+            close_old_connections()
+            polls += 1
+            if polls % cls.REQUEUE_EVERY_POLLS == 0:
+                cls.requeue_stale()
+            job, slot = cls.claim(worker_id)
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_seconds)
+                continue
+            cls.run(job, slot)
+            processed += 1
+        close_old_connections()
+        return processed
@@ -1,5 +1,6 @@
-from django.test import TestCase
-from unittest.mock import patch
+import json
+from django.test import TestCase, override_settings
+from unittest.mock import Mock, patch
 from django.contrib.auth.models import User
 from storybook.models import Story
 
@@ -34,3 +35,556 @@ class AIGenerationTestCase(TestCase):
         )
         
         self.assertEqual(prediction.id, "mock_prediction_123")
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProviderHTTPTestCase(TestCase):
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from storybook.redis_store import get_store
+
+        get_store().clear()
+        self.user = User.objects.create_user(username='proxy_user', password='password123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def test_sessions_are_pooled_per_host(self):
+        from storybook.ai_http import ProviderHTTP
+
+        groq = ProviderHTTP.session('https://api.groq.com/openai/v1/chat/completions')
+
+        self.assertIs(ProviderHTTP.session('https://api.groq.com/openai/v1/models'), groq)
+        self.assertIsNot(ProviderHTTP.session('https://openrouter.ai/api/v1/chat/completions'), groq)
+
+    @override_settings(GROQ_API_KEY='test-key', AI_KEY_POOLS={})
+    def test_groq_proxy_relays_through_async_client(self):
+        import httpx
+        from unittest.mock import AsyncMock
+
+        completion = {'choices': [{'message': {'content': '{"title": "Moon"}'}}]}
+        request = httpx.Request('POST', 'https://api.groq.com/openai/v1/chat/completions')
+        with patch('storybook.ai_http.ProviderHTTP.apost', new=AsyncMock(
+            return_value=httpx.Response(200, json=completion, request=request)
+        )) as apost:
+            response = self.client.post(
+                '/api/ai/groq/generate-story/',
+                data={'messages': [{'role': 'user', 'content': 'A story'}]},
+                content_type='application/json',
+                **self.auth
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), completion)
+        self.assertEqual(apost.call_args.kwargs['json']['messages'][0]['content'], 'A story')
+        self.assertEqual(apost.call_args.kwargs['headers']['Authorization'], 'Bearer test-key')
+
+        with patch('storybook.ai_http.ProviderHTTP.apost', new=AsyncMock(
+            return_value=httpx.Response(429, request=request)
+        )):
+            limited = self.client.post(
+                '/api/ai/groq/generate-story/',
+                data={'messages': [{'role': 'user', 'content': 'A story'}]},
+                content_type='application/json',
+                **self.auth
+            )
+        self.assertEqual(limited.status_code, 429)
+
+    @override_settings(
+        GROQ_API_KEY=None,
+        AI_KEY_POOLS={'groq': 'pool-key', 'gemini': 'gemini-key'},
+        AI_RATE_LIMIT_MAX_WAIT=0,
+    )
+    def test_views_gate_on_the_key_pool(self):
+        import httpx
+        from unittest.mock import AsyncMock
+        from storybook.ai_rate_limit import AIRateLimiter
+
+        request = httpx.Request('POST', 'https://api.groq.com/openai/v1/chat/completions')
+        with patch('storybook.ai_http.ProviderHTTP.apost', new=AsyncMock(
+            return_value=httpx.Response(200, json={'choices': []}, request=request)
+        )) as apost:
+            response = self.client.post(
+                '/api/ai/groq/generate-story/',
+                data={'messages': [{'role': 'user', 'content': 'A story'}]},
+                content_type='application/json',
+                **self.auth
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(apost.call_args.kwargs['headers']['Authorization'], 'Bearer pool-key')
+
+        AIRateLimiter.observe('gemini', 'gemini-key', 429, {'Retry-After': '30'})
+        busy = self.client.post('/api/ai/ocr/process/', data={'image': 'aGk='}, content_type='application/json', **self.auth)
+        self.assertEqual(busy.status_code, 429)
+        self.assertIn('read', busy.json()['error'])
+        self.assertNotIn('stories', busy.json()['error'])
+
+    def test_async_proxy_requires_a_token(self):
+        response = self.client.post('/api/ai/groq/generate-story/', data={}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_middleware_chain_runs_async_views_without_a_thread(self):
+        """Django logs 'Asynchronous handler adapted for middleware ...' when a middleware is sync-only."""
+        from asgiref.sync import async_to_sync
+        from django.core.handlers.asgi import ASGIHandler
+        from django.test import AsyncClient
+
+        with self.settings(DEBUG=True), self.assertNoLogs('django.request', level='DEBUG'):
+            ASGIHandler()  # Only logs adaptations with DEBUG on
+
+        async def options():
+            return await AsyncClient().options('/api/ai/groq/generate-story/')
+
+        preflight = async_to_sync(options)()
+        self.assertEqual(preflight.status_code, 200)
+        self.assertEqual(preflight['Access-Control-Max-Age'], '86400')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    AI_KEY_POOLS={'groq': 'key-one,key-two'},
+    AI_RATE_LIMITS={'groq': 8},  # Buckets of 2 refilling every 7.5 s
+    AI_RATE_LIMIT_MAX_WAIT=0,
+)
+class AIRateLimiterTestCase(TestCase):
+    def setUp(self):
+        from storybook.redis_store import get_store
+
+        get_store().clear()
+
+    def test_requests_spread_over_the_key_pool_until_drained(self):
+        from storybook.ai_rate_limit import AIRateLimiter, RateLimited
+
+        used = [AIRateLimiter.acquire('groq') for _ in range(4)]
+
+        self.assertEqual(sorted(used), ['key-one', 'key-one', 'key-two', 'key-two'])
+        with self.assertRaises(RateLimited) as raised:
+            AIRateLimiter.acquire('groq')
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_retry_after_blocks_the_key(self):
+        from storybook.ai_rate_limit import AIRateLimiter
+
+        AIRateLimiter.observe('groq', 'key-one', 429, {'Retry-After': '30'})
+
+        self.assertEqual({AIRateLimiter.acquire('groq') for _ in range(2)}, {'key-two'})
+        self.assertEqual(AIRateLimiter.status('groq')['blocked_keys'], 1)
+
+    def test_quota_headers(self):
+        from storybook.ai_rate_limit import parse_duration, quota_from_headers
+
+        self.assertAlmostEqual(parse_duration('2m59.56s'), 179.56)
+        self.assertAlmostEqual(parse_duration('850ms'), 0.85)
+        self.assertEqual(
+            quota_from_headers({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '7.5s'}),
+            (0, 7.5)
+        )
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    STORY_JOB_STUB_PROVIDER=True,
+)
+class StoryJobTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from rest_framework.test import APIClient
+
+        cache.clear()
+        self.user = User.objects.create_user(username='job_user', password='password123')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_queued_job_is_generated_by_the_worker(self):
+        from django.core.management import call_command
+        from io import StringIO
+
+        queued = self.api.post('/api/ai/jobs/story/', {
+            'provider': 'stub',
+            'messages': [{'role': 'user', 'content': 'A cat and a lighthouse'}],
+        }, format='json')
+        self.assertEqual(queued.status_code, 202)
+        task_id = queued.data['task_id']
+
+        self.assertEqual(self.api.get(f'/api/ai/jobs/{task_id}/').data['status'], 'queued')
+
+        call_command('run_story_jobs', '--once', '--workers', '1', stdout=StringIO())
+
+        polled = self.api.get(f'/api/ai/jobs/{task_id}/').data
+        self.assertEqual(polled['status'], 'succeeded')
+        story = json.loads(polled['result']['choices'][0]['message']['content'])
+        self.assertIn('A cat and a lighthouse', story['prompt'])
+
+    def test_provider_concurrency_limit_holds_jobs_back(self):
+        from storybook.story_jobs import StoryJobQueue
+
+        with self.settings(STORY_JOB_CONCURRENCY={'stub': 1}):
+            StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'One'}]})
+            StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'Two'}]})
+
+            first, slot = StoryJobQueue.claim('worker-a')
+            self.assertIsNotNone(first)
+            self.assertEqual(StoryJobQueue.claim('worker-b'), (None, None))
+
+            StoryJobQueue.run(first, slot)
+            second, _ = StoryJobQueue.claim('worker-b')
+            self.assertIsNotNone(second)
+            self.assertEqual(second.payload['messages'][0]['content'], 'Two')
+
+    def test_rate_limited_job_is_queued_again(self):
+        from storybook.story_jobs import ProviderError, StoryJobQueue
+
+        job = StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'Busy'}]})
+        claimed, slot = StoryJobQueue.claim('worker-a')
+        with patch.dict('storybook.story_jobs.PROVIDERS', {'stub': Mock(side_effect=ProviderError('API error 429', retryable=True))}):
+            StoryJobQueue.run(claimed, slot)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.available_at, job.created_at)
+        self.assertEqual(StoryJobQueue.claim('worker-a'), (None, None))  # Backing off
+
+    def test_worker_loop_requeues_jobs_of_dead_workers(self):
+        import threading
+        from datetime import timedelta
+        from django.utils import timezone
+        from storybook.models import StoryGenerationJob
+        from storybook.story_jobs import StoryJobQueue
+
+        job = StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'Lost'}]})
+        # Claimed by a worker that died mid-run, long ago
+        StoryGenerationJob.objects.filter(pk=job.pk).update(
+            status='running', attempts=1, started_at=timezone.now() - timedelta(hours=1)
+        )
+
+        stop = threading.Event()
+        original_run = StoryJobQueue.run
+
+        def run_then_stop(claimed, slot):
+            stop.set()
+            return original_run(claimed, slot)
+
+        give_up = threading.Timer(5, stop.set)  # Never sweeping would otherwise poll forever
+        give_up.start()
+        with patch.object(StoryJobQueue, 'REQUEUE_EVERY_POLLS', 3), \
+                patch.object(StoryJobQueue, 'run', side_effect=run_then_stop) as run:
+            processed = StoryJobQueue.work('worker-a', poll_seconds=0.01, stop=stop)
+        give_up.cancel()
+
+        job.refresh_from_db()
+        self.assertEqual(processed, 1)
+        self.assertEqual(run.call_args.args[0].pk, job.pk)
+        self.assertEqual(job.status, 'succeeded')
+
+    def test_owners_hear_about_jobs_of_dead_workers(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from storybook.models import StoryGenerationJob
+        from storybook.story_jobs import StoryJobQueue
+
+        retried = StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'Retry'}]})
+        exhausted = StoryJobQueue.enqueue(self.user, 'stub', {'messages': [{'role': 'user', 'content': 'Give up'}]})
+        long_ago = timezone.now() - timedelta(hours=1)
+        StoryGenerationJob.objects.filter(pk=retried.pk).update(status='running', attempts=1, started_at=long_ago)
+        StoryGenerationJob.objects.filter(pk=exhausted.pk).update(status='running', attempts=3, started_at=long_ago)
+
+        with patch.object(StoryJobQueue, 'notify') as notify:
+            self.assertEqual(StoryJobQueue.requeue_stale(), (1, 1))
+
+        notified = {job.pk: job.status for job in (call.args[0] for call in notify.call_args_list)}
+        self.assertEqual(notified, {retried.pk: 'queued', exhausted.pk: 'failed'})
+
+    def test_unknown_provider_is_rejected(self):
+        response = self.api.post('/api/ai/jobs/story/', {
+            'provider': 'nope', 'messages': [{'role': 'user', 'content': 'Hi'}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    AI_KEY_POOLS={'groq': 'groq-key', 'openrouter': 'openrouter-key', 'gemini': ''},
+    GOOGLE_AI_API_KEY=None,
+    AI_BREAKER_FAILURES=2,
+)
+class AIRouterTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from storybook.redis_store import get_store
+
+        cache.clear()
+        get_store().clear()
+        self.user = User.objects.create_user(username='router_user', password='password123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def fake_providers(self, failing):
+        """apost stand-in: timeouts for the failing host, a completion from the others"""
+        import httpx
+
+        self.calls = []
+
+        async def apost(url, timeout=60, **kwargs):
+            self.calls.append(url)
+            if failing in url:
+                raise httpx.ReadTimeout('timed out')
+            return httpx.Response(200, json={
+                'model': 'test-model',
+                'choices': [{'message': {'content': '{"title": "Moon"}'}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 5},
+            }, request=httpx.Request('POST', url))
+
+        return patch('storybook.ai_http.ProviderHTTP.apost', new=apost)
+
+    def generate(self, provider='groq'):
+        return self.client.post('/api/ai/generate-story/', data={
+            'provider': provider, 'messages': [{'role': 'user', 'content': 'A story'}],
+        }, content_type='application/json', **self.auth)
+
+    def test_fails_over_and_opens_the_breaker(self):
+        with self.fake_providers(failing='groq.com'):
+            first = self.generate().json()
+            second = self.generate().json()
+            third = self.generate().json()
+
+        self.assertEqual(first['provider'], 'openrouter')
+        self.assertEqual(first['content'], '{"title": "Moon"}')
+        self.assertEqual(first['usage'], {'prompt_tokens': 10, 'completion_tokens': 5})
+        self.assertEqual(second['provider'], 'openrouter')
+        # After two timeouts Groq's breaker is open: it gets no request, whatever the ranking
+        self.assertEqual(third['provider'], 'openrouter')
+        self.assertEqual(len([url for url in self.calls if 'groq.com' in url]), 2)
+
+        status_report = self.client.get('/api/ai/status/', **self.auth).json()
+        self.assertEqual(status_report['text_providers']['groq']['state'], 'open')
+        self.assertEqual(status_report['text_providers']['openrouter']['state'], 'closed')
+
+    def test_half_open_probe_is_released_after_a_client_error(self):
+        import time
+        import httpx
+        from unittest.mock import AsyncMock
+        from storybook.ai_router import ProviderHealth
+        from storybook.redis_store import get_store
+
+        # Breaker opened long ago: the next request is the half-open probe
+        get_store().hset(ProviderHealth.KEY.format(provider='groq'), {'opened_at': time.time() - 3600, 'consecutive_failures': 2})
+        request = httpx.Request('POST', 'https://api.groq.com/openai/v1/chat/completions')
+        with patch('storybook.ai_http.ProviderHTTP.apost', new=AsyncMock(
+            return_value=httpx.Response(400, json={'error': 'bad request'}, request=request)
+        )):
+            response = self.client.post(
+                '/api/ai/groq/generate-story/',
+                data={'messages': [{'role': 'user', 'content': 'A story'}]},
+                content_type='application/json',
+                **self.auth
+            )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ProviderHealth.state('groq'), 'half_open')
+        self.assertTrue(ProviderHealth.allow('groq'))  # The probe was given back, not held for a cooldown
+
+    def test_all_providers_down(self):
+        from storybook.ai_router import ProviderHealth
+
+        for provider in ('groq', 'openrouter'):
+            for _ in range(2):
+                ProviderHealth.record_failure(provider, 60)
+
+        response = self.generate()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['code'], 'PROVIDERS_UNAVAILABLE')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    GROQ_API_KEY='groq-key',
+    AI_KEY_POOLS={},
+)
+class StoryStreamingTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from storybook.redis_store import get_store
+
+        cache.clear()
+        get_store().clear()
+        self.user = User.objects.create_user(username='stream_user', password='password123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def fake_stream(self, chunks):
+        """astream stand-in: an SSE completion sending each chunk as one delta"""
+        import httpx
+        from contextlib import asynccontextmanager
+
+        sent = {}
+
+        @asynccontextmanager
+        async def astream(method, url, timeout=60, **kwargs):
+            sent.update(kwargs['json'])
+            lines = [f'data: {json.dumps({"choices": [{"delta": {"content": chunk}}]})}\n\n' for chunk in chunks]
+            lines.append('data: {"choices": [{"delta": {}, "finish_reason": "stop"}]}\n\ndata: [DONE]\n\n')
+            yield httpx.Response(200, content=''.join(lines).encode(), request=httpx.Request(method, url))
+
+        return patch('storybook.ai_http.ProviderHTTP.astream', new=astream), sent
+
+    async def stream(self):
+        from django.test import AsyncClient
+
+        response = await AsyncClient().post('/api/ai/groq/generate-story/', data={
+            'messages': [{'role': 'user', 'content': 'A story'}], 'stream': True,
+        }, content_type='application/json', headers={'Authorization': self.auth['HTTP_AUTHORIZATION']})
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = [
+            (frame.split('\n')[0][len('event: '):], json.loads(frame.split('\n')[1][len('data: '):]))
+            for frame in body.strip().split('\n\n')
+        ]
+        return response, events
+
+    def test_parse_story_json(self):
+        from storybook.ai_streaming import parse_story_json
+
+        story = parse_story_json('Here you go:\n```json\n{"title": "Moon", "pages": [{"text": "Hi"}]}\n```')
+        self.assertEqual(story['title'], 'Moon')
+        thought = parse_story_json('Plan: a {short} story.\n{"title": "Sun", "pages": [{"text": "Hi"},],}')
+        self.assertEqual(thought['title'], 'Sun')
+        with self.assertRaises(ValueError):
+            parse_story_json('{"title": "No pages"}')
+
+    async def test_tokens_are_relayed_then_the_story(self):
+        fake, sent = self.fake_stream(['{"title": "Moon", ', '"pages": [{"text": "Hi"}]}'])
+        with fake:
+            response, events = await self.stream()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(sent['stream'])
+        self.assertNotIn('response_format', sent)  # Groq's JSON mode can't stream
+        self.assertEqual(events[0], ('token', {'text': '{"title": "Moon", '}))
+        self.assertEqual(events[1][0], 'token')
+        name, done = events[2]
+        self.assertEqual(name, 'done')
+        self.assertEqual(done['story'], {'title': 'Moon', 'pages': [{'text': 'Hi'}]})
+        self.assertEqual(done['finish_reason'], 'stop')
+
+    async def test_invalid_story_ends_with_an_error(self):
+        fake, _ = self.fake_stream(['Once upon a time'])
+        with fake:
+            _, events = await self.stream()
+
+        self.assertEqual(events[-1][0], 'error')
+        self.assertEqual(events[-1][1]['content'], 'Once upon a time')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@patch('storybook.ai_proxy_views.POLLINATIONS_API_KEY', 'pollinations-key')
+class ImageCacheTestCase(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from storybook.redis_store import get_store
+
+        get_store().clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        settings_override = override_settings(POLLINATIONS_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @staticmethod
+    def upstream(body=b'\x89PNG fake image'):
+        return Mock(status_code=200, headers={'Content-Type': 'image/png'}, iter_content=lambda chunk_size: iter([body]))
+
+    def fetch_image(self, **headers):
+        return self.client.get('/api/ai/pollinations/fetch-image/', {
+            'prompt': 'A fox in the snow', 'seed': '42', 'width': '512', 'height': '512', 'model': 'flux',
+        }, headers=headers)
+
+    def test_repeat_views_are_served_from_disk(self):
+        with patch('storybook.ai_http.ProviderHTTP.get', return_value=self.upstream()) as get:
+            first = self.fetch_image()
+            second = self.fetch_image()
+            revalidated = self.fetch_image(if_none_match=second['ETag'])
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(b''.join(second.streaming_content), b'\x89PNG fake image')
+        self.assertEqual(second['Content-Type'], 'image/png')
+        self.assertEqual(second['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        import threading
+        from storybook.image_cache import ImageCache
+
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return iter([b'image']), 'image/png'
+
+        results = []
+
+        def view():
+            image, meta, hit = ImageCache.get_or_fetch('coalesced', fetch)
+            results.append(image.read())
+            image.close()
+
+        threads = [threading.Thread(target=view) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while not calls:
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b'image'] * 4)
+
+    @override_settings(POLLINATIONS_CACHE_MAX_MB=1)
+    def test_least_recently_used_images_are_evicted(self):
+        import os
+        from storybook.image_cache import ImageCache
+
+        image = b'x' * 400 * 1024
+        for age, key in enumerate(['read', 'stale', 'new']):
+            ImageCache.put(key, iter([image]), 'image/png')
+            os.utime(ImageCache._paths(key)[0], (1000 + age, 1000 + age))
+        ImageCache.get('read')[0].close()  # Reading an entry makes it the most recently used
+
+        self.assertEqual(ImageCache.evict(), 1)
+        self.assertIsNone(ImageCache.get('stale'))
+        self.assertIsNotNone(ImageCache.get('read'))
+        self.assertIsNotNone(ImageCache.get('new'))
+
+    @override_settings(POLLINATIONS_CACHE_MAX_MB=1)
+    def test_eviction_walks_the_directory_only_when_over_the_cap(self):
+        import os
+        from storybook.image_cache import ImageCache
+
+        ImageCache.evict()  # First pass walks to learn the directory's size
+        with patch('storybook.image_cache.os.walk', wraps=os.walk) as walk:
+            ImageCache.put('small', iter([b'x' * 1024]), 'image/png')
+            self.assertEqual(ImageCache.evict(), 0)
+            self.assertEqual(walk.call_count, 0)
+
+            ImageCache.put('large', iter([b'x' * 1024 * 1024]), 'image/png')
+            self.assertGreater(ImageCache.evict(), 0)
+            self.assertEqual(walk.call_count, 1)
+
+    def test_no_fetch_without_the_lock(self):
+        from storybook.image_cache import ImageCache, ImageFetchTimeout
+        from storybook.redis_store import get_store
+
+        get_store().acquire_lock(ImageCache.LOCK_KEY.format(key='held'), 'other-worker', 60)
+        fetch = Mock()
+        with patch.object(ImageCache, 'LOCK_TIMEOUT', 0.3), patch.object(ImageCache, 'WAIT_POLL_SECONDS', 0.05):
+            with self.assertRaises(ImageFetchTimeout):
+                ImageCache.get_or_fetch('held', fetch)
+
+        fetch.assert_not_called()
@@ -1,6 +1,32 @@
-from django.test import TestCase
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.test import TestCase, override_settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from storybook.models import CollaborationSession, SessionParticipant, DrawingOperation
+from storybook.models import CollaborationSession, SessionParticipant, DrawingOperation, OperationSnapshot
+from storybook.collab_ops import OperationSequencer, OperationBuffer, OperationCompactor, RecentOperations
+from storybook.collab_state import CanvasStore, CollabSessionState, StateLockTimeout
+from storybook.redis_store import get_store
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+INMEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def connect_collaborator(user, session_id, query='', subprotocols=None):
+    """WebSocket communicator for the collaboration consumer, authenticated as user"""
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from storybook.routing import websocket_urlpatterns
+
+    communicator = WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns),
+        f'/ws/collaborate/{session_id}/' + (f'?{query}' if query else ''),
+        subprotocols=subprotocols
+    )
+    communicator.scope['user'] = user
+    return communicator
 
 class CollaborationTestCase(TestCase):
     def setUp(self):
@@ -49,3 +75,1051 @@ class CollaborationTestCase(TestCase):
         
         self.assertEqual(session.operations.count(), 1)
         self.assertEqual(operation.operation_type, "path")
+
+
+@override_settings(CACHES=LOCMEM_CACHES, COLLAB_OP_FLUSH_BATCH_SIZE=3)
+class OperationBufferTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create_user(username='seq_host', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='seq_session', host=self.host)
+
+    def test_sequencer_continues_after_existing_operations(self):
+        """A cold sequencer is seeded from the highest stored sequence number."""
+        DrawingOperation.objects.create(
+            session=self.session, user=self.host, operation_type='path',
+            operation_data={}, sequence_number=7
+        )
+
+        self.assertEqual(OperationSequencer.next('seq_session', self.session.id), 8)
+        self.assertEqual(OperationSequencer.next('seq_session', self.session.id), 9)
+
+    def test_buffer_flushes_in_batches_preserving_order(self):
+        """Operations are written in bulk once the batch fills, and on explicit flush."""
+        async def draw(count):
+            for i in range(count):
+                await OperationBuffer.add('seq_session', self.session.id, self.host.id, 'path', {'i': i})
+            pending = OperationBuffer.pending_count('seq_session')
+            await OperationBuffer.flush('seq_session')
+            return pending
+
+        pending_before_flush = async_to_sync(draw)(4)
+
+        self.assertEqual(pending_before_flush, 1)  # First 3 were flushed as a batch
+        operations = list(self.session.operations.order_by('sequence_number'))
+        self.assertEqual([op.sequence_number for op in operations], [0, 1, 2, 3])
+        self.assertEqual([op.operation_data['i'] for op in operations], [0, 1, 2, 3])
+
+    def test_failed_flush_keeps_the_batch(self):
+        """A failed bulk write puts the operations back and the retry writes them in order."""
+        from unittest.mock import patch
+
+        async def draw():
+            for i in range(2):
+                await OperationBuffer.add('seq_session', self.session.id, self.host.id, 'path', {'i': i})
+            with patch.object(DrawingOperation.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+                with self.assertLogs('storybook.collab_ops', level='ERROR'):
+                    written = await OperationBuffer.flush('seq_session')
+            await OperationBuffer.add('seq_session', self.session.id, self.host.id, 'path', {'i': 2})
+            retry_armed = 'seq_session' in OperationBuffer._timers
+            pending = OperationBuffer.pending_count('seq_session')
+            await OperationBuffer.flush('seq_session')
+            return written, retry_armed, pending
+
+        written, retry_armed, pending = async_to_sync(draw)()
+
+        self.assertEqual(written, 0)
+        self.assertTrue(retry_armed)
+        self.assertEqual(pending, 3)  # Batch is full, but only the retry timer flushes while failing
+        operations = list(self.session.operations.order_by('sequence_number'))
+        self.assertEqual([op.operation_data['i'] for op in operations], [0, 1, 2])
+
+
+class OperationCompactionTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='compact_host', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='compact_session', host=self.host)
+        self.seq = 0
+
+    def _op(self, operation_type, data=None, page_number=0):
+        DrawingOperation.objects.create(
+            session=self.session, user=self.host, operation_type=operation_type,
+            operation_data=data or {}, sequence_number=self.seq, page_number=page_number
+        )
+        self.seq += 1
+
+    def test_compaction_folds_page_history(self):
+        """Strokes before a clear and superseded text edits are folded away."""
+        for i in range(20):
+            self._op('draw', {'stroke': i})
+        self._op('clear')
+        self._op('draw', {'stroke': 'after-clear'})
+        self._op('text_edit', {'text': 'Once'})
+        self._op('text_edit', {'text': 'Once upon a time'})
+
+        folded = OperationCompactor.compact_session(self.session, settle_seconds=0)
+
+        self.assertEqual(folded, 24)
+        self.assertEqual(self.session.operations.count(), 0)
+        snapshot = OperationSnapshot.objects.get(session=self.session, page_number=0)
+        self.assertEqual(snapshot.sequence_number, 23)
+        self.assertEqual(
+            [op['operation_data'] for op in snapshot.operations],
+            [{'stroke': 'after-clear'}, {'text': 'Once upon a time'}]
+        )
+
+    def test_clear_keeps_structural_operations(self):
+        """A clear folds away the page's strokes, not the operations that shaped the story."""
+        ops = [
+            {'operation_type': 'add_page', 'operation_data': {'page_index': 1}},
+            {'operation_type': 'draw', 'operation_data': {'stroke': 1}},
+            {'operation_type': 'transform', 'operation_data': {'id': 'sticker'}},
+            {'operation_type': 'draw', 'operation_data': {'stroke': 'cover', 'is_cover_image': True}},
+            {'operation_type': 'clear', 'operation_data': {}},
+        ]
+
+        folded = OperationCompactor.fold([], ops)
+
+        self.assertEqual(
+            [op['operation_type'] for op in folded], ['add_page', 'transform', 'draw']
+        )
+        self.assertTrue(folded[2]['operation_data']['is_cover_image'])
+
+    def test_replay_endpoint_names_snapshot_operations(self):
+        """Operations folded into a snapshot keep their author's username."""
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        SessionParticipant.objects.create(session=self.session, user=self.host, role='host')
+        self._op('draw', {'stroke': 0})
+        OperationCompactor.compact_session(self.session, settle_seconds=0)
+        self._op('draw', {'stroke': 1})
+
+        response = self.client.get(
+            '/api/collaborate/compact_session/operations/',
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.host).access_token}'
+        ).json()
+
+        self.assertEqual(response['snapshots'][0]['operations'][0]['username'], 'compact_host')
+        self.assertEqual(response['operations'][0]['username'], 'compact_host')
+
+    def test_replay_is_snapshot_plus_tail(self):
+        """Operations recorded after compaction are returned as the tail."""
+        for i in range(5):
+            self._op('draw', {'stroke': i})
+        OperationCompactor.compact_session(self.session, settle_seconds=0)
+        self._op('draw', {'stroke': 'new'})
+
+        snapshots, tail = OperationCompactor.get_replay(self.session)
+
+        self.assertEqual(len(snapshots[0]['operations']), 5)
+        self.assertEqual([op['operation_data'] for op in tail], [{'stroke': 'new'}])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_RESYNC_BUFFER_SIZE=5)
+class DeltaResyncTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.host = User.objects.create_user(username='resync_host', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='resync_session', host=self.host)
+        SessionParticipant.objects.create(session=self.session, user=self.host, role='host')
+
+    def _draw(self, count):
+        async def draw():
+            for i in range(count):
+                await OperationBuffer.add('resync_session', self.session.id, self.host.id, 'draw', {'i': i})
+            await OperationBuffer.flush('resync_session')
+        async_to_sync(draw)()
+
+    def test_missed_operations_come_from_ring_buffer(self):
+        """A client that is a few operations behind gets exactly those operations."""
+        self._draw(4)
+
+        operations, current = RecentOperations.since('resync_session', 1)
+
+        self.assertEqual(current, 3)
+        self.assertEqual([op['sequence_number'] for op in operations], [2, 3])
+
+    def test_large_gap_falls_back_to_snapshot(self):
+        """When the gap exceeds the buffer the caller must send a full snapshot."""
+        self._draw(8)
+
+        operations, current = RecentOperations.since('resync_session', 0)
+
+        self.assertIsNone(operations)
+        self.assertEqual(current, 7)
+
+    def test_reconnect_init_sends_delta_instead_of_canvas(self):
+        """The init message of a reconnect carries missed operations, not canvas data."""
+        self._draw(3)
+
+        async def reconnect():
+            communicator = connect_collaborator(self.host, 'resync_session', 'last_seq=0')
+            connected, _ = await communicator.connect()
+            init = await communicator.receive_json_from()
+            while init['type'] != 'init':
+                init = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return connected, init
+
+        connected, init = async_to_sync(reconnect)()
+
+        self.assertTrue(connected)
+        self.assertTrue(init['delta'])
+        self.assertIsNone(init['canvas_data'])
+        self.assertEqual([op['sequence_number'] for op in init['missed_operations']], [1, 2])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class SessionStateTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.host = User.objects.create_user(username='state_host', password='password123')
+        self.session = CollaborationSession.objects.create(
+            session_id='state_session',
+            host=self.host,
+            story_draft={'title': 'Draft', 'pages': [{'text': 'Once'}], 'genres': ['fantasy']}
+        )
+        SessionParticipant.objects.create(session=self.session, user=self.host, role='host')
+
+    def test_edits_touch_no_rows_until_persist(self):
+        """Typing changes hash fields only; persist writes the assembled draft once."""
+        CollabSessionState.load('state_session')
+
+        with self.assertNumQueries(0):
+            for text in ('O', 'On', 'Once upon'):
+                CollabSessionState.set_page_text('state_session', 0, text)
+            CollabSessionState.set_page_text('state_session', 2, 'The end')
+            CollabSessionState.set_current_page('state_session', 2)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['pages'], [{'text': 'Once'}])
+
+        self.assertTrue(CollabSessionState.persist('state_session'))
+        self.session.refresh_from_db()
+        draft = self.session.story_draft
+        self.assertEqual([page['text'] for page in draft['pages']], ['Once upon', '', 'The end'])
+        self.assertEqual(draft['title'], 'Draft')
+        self.assertEqual(draft['genres'], ['fantasy'])
+        self.assertEqual(self.session.current_page, 2)
+
+        # Nothing changed since - no write
+        with self.assertNumQueries(0):
+            self.assertFalse(CollabSessionState.persist('state_session'))
+
+    def test_pages_keep_ids_across_add_and_delete(self):
+        CollabSessionState.load('state_session')
+        added = CollabSessionState.add_page('state_session', 0)
+        CollabSessionState.set_page_text('state_session', 1, 'second')
+
+        self.assertTrue(CollabSessionState.delete_page('state_session', 0))
+        self.assertFalse(CollabSessionState.delete_page('state_session', 5))
+
+        pages = CollabSessionState.get_draft('state_session')['pages']
+        self.assertEqual([page['text'] for page in pages], ['second'])
+        self.assertNotEqual(pages[0]['id'], added['id'])
+
+    def test_state_lock_is_never_shared_or_stolen(self):
+        """A waiter gives up instead of entering unlocked; release leaves a newer holder's lock alone."""
+        lock_key = CollabSessionState.LOCK_KEY.format(session_id='state_session')
+        store = get_store()
+
+        with CollabSessionState._lock('state_session', timeout=1):
+            with self.assertRaises(StateLockTimeout):
+                with CollabSessionState._lock('state_session', timeout=0.05):
+                    pass
+
+        with CollabSessionState._lock('state_session', timeout=1):
+            # Our lock expired and another worker took it
+            store.delete(lock_key)
+            self.assertTrue(store.acquire_lock(lock_key, 'other-worker', 5))
+        self.assertFalse(store.acquire_lock(lock_key, 'third-worker', 5))
+        self.assertTrue(store.release_lock(lock_key, 'other-worker'))
+
+    def test_text_edit_and_vote_over_websocket(self):
+        """Votes are persisted immediately; draft text when the last client leaves."""
+        async def edit_and_vote():
+            communicator = connect_collaborator(self.host, 'state_session')
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'text_edit', 'page_index': 0, 'text': 'Live text'})
+            await communicator.send_json_to({'type': 'initiate_vote'})
+            await communicator.send_json_to({'type': 'vote_save', 'vote': True})
+            while (await communicator.receive_json_from())['type'] != 'vote_result':
+                pass
+            voting_session = await database_sync_to_async(
+                CollaborationSession.objects.get
+            )(session_id='state_session')
+            await communicator.disconnect()
+            return voting_session
+
+        voting_session = async_to_sync(edit_and_vote)()
+
+        self.assertTrue(voting_session.voting_active)
+        self.assertEqual(voting_session.voting_data, {str(self.host.id): True})
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['pages'][0]['text'], 'Live text')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_STATE_PERSIST_SECONDS=0)
+class AutosaveTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.host = User.objects.create_user(username='autosave_host', password='password123')
+        self.session = CollaborationSession.objects.create(
+            session_id='autosave_session',
+            host=self.host,
+            story_draft={'title': 'Draft', 'pages': [{'id': 'p1', 'text': 'Once'}]},
+            canvas_state={'host_disconnected_at': 'earlier'}
+        )
+
+    def test_canvas_persist_survives_a_redis_restart(self):
+        CanvasStore.set_snapshot('autosave_session', 'p1', False, 'data:p1')
+        CanvasStore.set_state('autosave_session', 'p1', False, {'layers': [1]})
+
+        self.assertTrue(CanvasStore.persist('autosave_session'))
+        with self.assertNumQueries(0):
+            self.assertFalse(CanvasStore.persist('autosave_session'))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.canvas_state['host_disconnected_at'], 'earlier')
+
+        get_store().clear()
+        self.assertEqual(CanvasStore.get_canvas_data('autosave_session'), {'pages': {'p1': 'data:p1'}})
+        self.assertEqual(CanvasStore.get_state('autosave_session', 'p1'), {'layers': [1]})
+
+    def test_only_the_lease_holder_saves(self):
+        from storybook.collab_state import CollabStatePersister
+
+        lease_key = CollabStatePersister.LEASE_KEY.format(session_id='autosave_session')
+        CollabSessionState.set_title('autosave_session', 'Renamed')
+
+        async def tick():
+            CollabStatePersister.schedule('autosave_session')
+            await asyncio.sleep(0.05)
+
+        cache.set(lease_key, 'another-worker')
+        async_to_sync(tick)()
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['title'], 'Draft')
+
+        cache.delete(lease_key)
+        async_to_sync(tick)()
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['title'], 'Renamed')
+        self.assertIsNone(cache.get(lease_key))  # Released once idle
+
+    @override_settings(COLLAB_STATE_PERSIST_SECONDS=60, COLLAB_AUTOSAVE_OPERATIONS=3)
+    def test_saves_after_enough_operations(self):
+        from storybook.collab_state import CollabStatePersister
+
+        async def edit(count):
+            for i in range(count):
+                await database_sync_to_async(CollabSessionState.set_page_text)('autosave_session', 0, f'v{i}')
+                CollabStatePersister.record_operation('autosave_session')
+            await asyncio.sleep(0.05)
+            text = (await database_sync_to_async(CollaborationSession.objects.get)(
+                session_id='autosave_session'
+            )).story_draft['pages'][0]['text']
+            await CollabStatePersister.flush('autosave_session')
+            return text
+
+        self.assertEqual(async_to_sync(edit)(2), 'Once')
+        self.assertEqual(async_to_sync(edit)(3), 'v2')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class CanvasStoreTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.host = User.objects.create_user(username='canvas_host', password='password123')
+        self.session = CollaborationSession.objects.create(
+            session_id='canvas_session',
+            host=self.host,
+            story_draft={'title': 'Canvas', 'pages': [{'id': 'b', 'text': 'B'}, {'id': 'a', 'text': 'A'}]}
+        )
+        SessionParticipant.objects.create(session=self.session, user=self.host, role='host')
+
+    def test_pages_are_independent_fields(self):
+        CanvasStore.set_snapshot('canvas_session', 'a', False, 'data:a1')
+        CanvasStore.set_snapshot('canvas_session', 'b', False, 'data:b1')
+        CanvasStore.set_snapshot('canvas_session', None, True, 'data:cover')
+        CanvasStore.set_snapshot('canvas_session', 'a', False, 'data:a2')
+        CanvasStore.set_state('canvas_session', 'a', False, {'layers': [1]})
+
+        self.assertEqual(CanvasStore.get_canvas_data('canvas_session'), {
+            'cover_image': 'data:cover',
+            'pages': {'a': 'data:a2', 'b': 'data:b1'},
+        })
+        self.assertEqual(CanvasStore.get_state('canvas_session', 'a'), {'layers': [1]})
+        self.assertEqual(
+            CanvasStore.get_states('canvas_session', ['page:a', 'page:b']),
+            {'page:a': {'layers': [1]}, 'page:b': None}
+        )
+
+    def test_old_sessions_fall_back_to_row(self):
+        self.session.canvas_data = {'pages': {'a': 'data:old'}}
+        self.session.canvas_state = {'pages': {'a': {'old': True}}, 'host_disconnected_at': 'x'}
+        self.session.save()
+
+        self.assertEqual(CanvasStore.get_canvas_data('canvas_session'), {'pages': {'a': 'data:old'}})
+        self.assertEqual(CanvasStore.get_state('canvas_session', 'a'), {'old': True})
+
+    def test_finalize_reads_pages_from_hash_in_draft_order(self):
+        import json
+        from storybook.collab_finalize import StoryFinalizer
+        from storybook.models import Story
+
+        CanvasStore.set_snapshot('canvas_session', 'orphan', False, 'data:orphan')
+        CanvasStore.set_snapshot('canvas_session', 'a', False, 'data:a')
+        CanvasStore.set_snapshot('canvas_session', None, True, 'data:cover')
+        CanvasStore.set_snapshot('canvas_session', 'b', False, 'data:b')
+
+        progress = []
+        result = StoryFinalizer.finalize('canvas_session', lambda *args: progress.append(args))
+
+        story = Story.objects.get(id=result['story_id'])
+        self.assertEqual(
+            [(page['id'], page['order']) for page in json.loads(story.canvas_data)],
+            [('cover', -1), ('b', 0), ('a', 1), ('orphan', 2)]
+        )
+        self.assertEqual(story.cover_image, 'data:cover')
+        self.assertEqual([p for p in progress if p[0] == 'pages'][-1], ('pages', 4, 4))
+        self.assertEqual(CanvasStore.get_canvas_data('canvas_session'), {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_CURSOR_TICK_HZ=1000)
+class PageGroupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.users = [
+            User.objects.create_user(username=f'page_user_{i}', password='password123')
+            for i in range(3)
+        ]
+        self.session = CollaborationSession.objects.create(session_id='page_session', host=self.users[0])
+        for i, user in enumerate(self.users):
+            SessionParticipant.objects.create(
+                session=self.session, user=user, role='host' if i == 0 else 'participant'
+            )
+
+    def test_canvas_events_reach_only_viewers_of_the_page(self):
+        async def scenario():
+            clients = [connect_collaborator(user, 'page_session') for user in self.users]
+            for client in clients:
+                await client.connect()
+
+            async def drain(client):
+                while not await client.receive_nothing(timeout=0.05):
+                    await client.receive_json_from()
+
+            # user 0 views page 0, user 1 views page 1, user 2 never says
+            await clients[0].send_json_to({'type': 'page_change', 'page_number': 0})
+            await clients[1].send_json_to({'type': 'page_change', 'page_number': 1})
+            for client in clients:
+                await drain(client)
+
+            await clients[1].send_json_to({
+                'type': 'cursor', 'position': {'x': 1, 'y': 2}, 'page_index': 1
+            })
+            await clients[1].receive_nothing(timeout=0.05)  # Let the cursor tick pass
+            await clients[1].send_json_to({'type': 'title_edit', 'title': 'Shared'})
+
+            received = []
+            for client in (clients[0], clients[2]):
+                types = []
+                while not await client.receive_nothing(timeout=0.05):
+                    types.append((await client.receive_json_from())['type'])
+                received.append(types)
+
+            for client in clients:
+                await client.disconnect()
+            return received
+
+        page_zero_viewer, unscoped = async_to_sync(scenario)()
+
+        self.assertEqual(page_zero_viewer, ['title_edit'])
+        self.assertEqual(unscoped, ['cursor', 'title_edit'])
+
+    def test_viewers_follow_their_page_when_pages_shift(self):
+        """A page added before the viewed one moves the viewer along; deleting it makes them unscoped."""
+        self.session.story_draft = {'pages': [{'text': 'a'}, {'text': 'b'}, {'text': 'c'}]}
+        self.session.save()
+
+        async def scenario():
+            clients = [connect_collaborator(user, 'page_session') for user in self.users]
+            for client in clients:
+                await client.connect()
+
+            async def received(client):
+                types = []
+                while not await client.receive_nothing(timeout=0.05):
+                    types.append((await client.receive_json_from())['type'])
+                return types
+
+            async def draw(page_index):
+                await clients[2].send_json_to({'type': 'draw', 'data': {'x': 1}, 'page_index': page_index})
+                return await received(clients[1])
+
+            # user 1 opens the canvas of page 1 ("b"), then a page is inserted before it
+            await clients[1].send_json_to({'type': 'view_page', 'page_index': 1})
+            for client in clients:
+                await received(client)
+            await clients[0].send_json_to({'type': 'add_page', 'page_index': 0})
+            steps = [await received(clients[1])]
+            steps.append(await draw(1))
+            steps.append(await draw(2))  # "b" is page 2 now
+
+            await clients[0].send_json_to({'type': 'delete_page', 'page_index': 2})
+            steps.append(await received(clients[1]))
+            steps.append(await draw(3))  # Unscoped viewers get every page
+
+            await clients[1].send_json_to({'type': 'view_page', 'page_index': 0})
+            await received(clients[1])
+            steps.append(await draw(1))
+
+            for client in clients:
+                await client.disconnect()
+            return steps
+
+        self.assertEqual(
+            async_to_sync(scenario)(),
+            [['page_added'], [], ['draw'], ['page_deleted'], ['draw'], []]
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class BinaryProtocolTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.json_user = User.objects.create_user(username='json_user', password='password123')
+        self.binary_user = User.objects.create_user(username='binary_user', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='binary_session', host=self.json_user)
+        SessionParticipant.objects.create(session=self.session, user=self.json_user, role='host')
+        SessionParticipant.objects.create(session=self.session, user=self.binary_user, role='participant')
+
+    def test_points_round_trip_as_integer_deltas(self):
+        import msgpack
+        from storybook.collab_protocol import MsgpackCodec, POINTS_EXT
+
+        message = {'type': 'draw_batch', 'batch': [
+            {'points': [{'x': 10.0, 'y': 20.5}, {'x': 10.4, 'y': 21.0}], 'tool': 'brush'},
+            {'points': [{'x': 1.0, 'y': 2.0, 'pressure': 0.5}], 'pts': [1, 2], 'pos': 'literal'},
+        ]}
+
+        frame = MsgpackCodec.encode(message)
+        packed = msgpack.unpackb(frame, raw=False)['batch']
+        self.assertEqual(packed[0]['points'], msgpack.ExtType(POINTS_EXT, msgpack.packb([100, 205, 4, 5])))
+        # Points with extra keys and literal pts/pos keys pass through untouched
+        self.assertEqual(packed[1], message['batch'][1])
+        self.assertEqual(MsgpackCodec.decode(bytes_data=frame), message)
+
+    def test_binary_and_json_clients_share_a_room(self):
+        from storybook.collab_protocol import MSGPACK_SUBPROTOCOL, MsgpackCodec
+
+        points = [{'x': 1.5, 'y': 2.0}, {'x': 3.0, 'y': 4.5}]
+
+        async def scenario():
+            json_client = connect_collaborator(self.json_user, 'binary_session')
+            binary_client = connect_collaborator(
+                self.binary_user, 'binary_session', subprotocols=[MSGPACK_SUBPROTOCOL]
+            )
+            await json_client.connect()
+            _, subprotocol = await binary_client.connect()
+            while not await json_client.receive_nothing(timeout=0.05):
+                await json_client.receive_from()
+            while not await binary_client.receive_nothing(timeout=0.05):
+                await binary_client.receive_from()
+
+            await binary_client.send_to(bytes_data=MsgpackCodec.encode({
+                'type': 'draw_batch', 'page_index': 0,
+                'batch': [{'points': points, 'tool': 'brush'}]
+            }))
+            received_json = await json_client.receive_json_from()
+
+            await json_client.send_json_to({'type': 'draw_batch', 'page_index': 0, 'batch': [{'points': points}]})
+            received_binary = MsgpackCodec.decode(bytes_data=await binary_client.receive_from())
+
+            await json_client.disconnect()
+            await binary_client.disconnect()
+            return subprotocol, received_json, received_binary
+
+        subprotocol, received_json, received_binary = async_to_sync(scenario)()
+
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+        self.assertEqual(received_json['type'], 'draw_batch')
+        self.assertEqual(received_json['batch'][0]['points'], points)
+        self.assertEqual(received_binary['batch'][0]['points'], points)
+
+    def test_json_clients_get_strokes_exactly_as_sent(self):
+        batch = [{'points': [{'x': 1.23456, 'y': 2.5}], 'pts': 'literal', 'tool': 'brush'}]
+
+        async def scenario():
+            sender = connect_collaborator(self.json_user, 'binary_session')
+            receiver = connect_collaborator(self.binary_user, 'binary_session')
+            for client in (sender, receiver):
+                await client.connect()
+            while not await receiver.receive_nothing(timeout=0.05):
+                await receiver.receive_from()
+
+            await sender.send_json_to({'type': 'draw_batch', 'page_index': 0, 'batch': batch})
+            received = await receiver.receive_json_from()
+            await sender.disconnect()
+            await receiver.disconnect()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)()['batch'], batch)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_CURSOR_TICK_HZ=5)
+class CursorCoalescingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.mover = User.objects.create_user(username='cursor_mover', password='password123')
+        self.watcher = User.objects.create_user(username='cursor_watcher', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='cursor_session', host=self.mover)
+        SessionParticipant.objects.create(session=self.session, user=self.mover, role='host')
+        SessionParticipant.objects.create(session=self.session, user=self.watcher, role='participant')
+
+    def test_moves_within_a_tick_arrive_as_latest_position(self):
+        async def scenario():
+            mover = connect_collaborator(self.mover, 'cursor_session')
+            watcher = connect_collaborator(self.watcher, 'cursor_session')
+            await mover.connect()
+            await watcher.connect()
+            while not await watcher.receive_nothing(timeout=0.05):
+                await watcher.receive_json_from()
+
+            for x in range(10):
+                await mover.send_json_to({'type': 'cursor', 'position': {'x': x, 'y': 0}, 'page_index': 0})
+
+            frames = [await watcher.receive_json_from(timeout=2)]
+            while not await watcher.receive_nothing(timeout=0.3):
+                frames.append(await watcher.receive_json_from())
+
+            await mover.disconnect()
+            await watcher.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]['type'], 'cursor')
+        self.assertEqual(frames[0]['position'], {'x': 9, 'y': 0})
+        self.assertTrue(frames[0]['cursor_color'].startswith('#'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_FRAME_BATCH_MS=200)
+class FrameBatchingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.drawer = User.objects.create_user(username='batch_drawer', password='password123')
+        self.watcher = User.objects.create_user(username='batch_watcher', password='password123')
+        self.session = CollaborationSession.objects.create(session_id='batch_session', host=self.drawer)
+        SessionParticipant.objects.create(session=self.session, user=self.drawer, role='host')
+        SessionParticipant.objects.create(session=self.session, user=self.watcher, role='participant')
+
+    def test_events_within_the_window_arrive_as_one_array_frame(self):
+        async def scenario():
+            drawer = connect_collaborator(self.drawer, 'batch_session')
+            watcher = connect_collaborator(self.watcher, 'batch_session', query='batch=1')
+            await drawer.connect()
+            await watcher.connect()
+            while not await watcher.receive_nothing(timeout=0.3):
+                await watcher.receive_json_from()
+
+            for page_index in range(3):
+                await drawer.send_json_to({'type': 'draw_batch', 'page_index': page_index, 'batch': []})
+
+            frames = [await watcher.receive_json_from(timeout=2)]
+            while not await watcher.receive_nothing(timeout=0.3):
+                frames.append(await watcher.receive_json_from())
+
+            await drawer.disconnect()
+            await watcher.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+
+        self.assertEqual(len(frames), 1)
+        self.assertIsInstance(frames[0], list)
+        self.assertEqual([m['page_index'] for m in frames[0]], [0, 1, 2])
+
+    def test_queued_notice_is_sent_before_the_close_frame(self):
+        """kick and host_left close the socket; the batched notice must not be lost or overtaken."""
+        from channels.layers import get_channel_layer
+
+        async def closing_outputs(trigger):
+            drawer = connect_collaborator(self.drawer, 'batch_session')
+            watcher = connect_collaborator(self.watcher, 'batch_session', query='batch=1')
+            await drawer.connect()
+            await watcher.connect()
+            while not await watcher.receive_nothing(timeout=0.3):
+                await watcher.receive_output()
+
+            await trigger(drawer)
+            outputs = []
+            while not outputs or outputs[-1]['type'] != 'websocket.close':
+                outputs.append(await watcher.receive_output(timeout=2))
+            await drawer.disconnect()
+            received = []
+            for output in outputs[:-1]:
+                frame = json.loads(output['text'])
+                received += [message['type'] for message in (frame if isinstance(frame, list) else [frame])]
+            return received + [outputs[-1]['type']]
+
+        async def kick(drawer):
+            await drawer.send_json_to({'type': 'kick_user', 'user_id': self.watcher.id})
+
+        async def host_left(drawer):
+            await get_channel_layer().group_send('collab_batch_session', {
+                'type': 'host_left', 'session_id': 'batch_session', 'username': 'batch_drawer'
+            })
+
+        kicked = async_to_sync(closing_outputs)(kick)
+        self.assertEqual(kicked[-2:], ['user_kicked', 'websocket.close'])
+        left = async_to_sync(closing_outputs)(host_left)
+        self.assertEqual(left[-2:], ['host_left', 'websocket.close'])
+
+    def test_backpressure_drops_superseded_and_ephemeral_events_first(self):
+        from storybook.collab_outbox import FrameBatcher
+        from storybook.collab_protocol import JSONCodec
+
+        sent = []
+
+        async def send_frame(frame, messages):
+            sent.append(messages)
+
+        async def scenario():
+            with self.settings(COLLAB_FRAME_MAX_PENDING=4):
+                batcher = FrameBatcher(JSONCodec(), send_frame)
+            batcher.push({'type': 'cursor', 'user_id': 1, 'position': {'x': 0, 'y': 0}})
+            batcher.push({'type': 'cursor', 'user_id': 1, 'position': {'x': 5, 'y': 5}})
+            batcher.push({'type': 'presence_update', 'user_id': 2})
+            self.assertEqual(len(batcher.pending), 2)
+            self.assertEqual(batcher.pending[0]['position'], {'x': 5, 'y': 5})
+
+            for index in range(3):
+                batcher.push({'type': 'text_op', 'seq': index})
+            await batcher.flush()
+
+        async_to_sync(scenario)()
+
+        self.assertEqual(sent, [[{'type': 'text_op', 'seq': i} for i in range(3)]])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class CollaborativeTextTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.host = User.objects.create_user(username='text_host', password='password123')
+        self.session = CollaborationSession.objects.create(
+            session_id='text_session',
+            host=self.host,
+            story_draft={'title': 'Text', 'pages': [{'text': 'Hello world'}]}
+        )
+        SessionParticipant.objects.create(session=self.session, user=self.host, role='host')
+
+    def test_transform_converges(self):
+        import random
+        from storybook.collab_text import apply, transform
+
+        rng = random.Random(7)
+        for _ in range(200):
+            text = ''.join(rng.choice('ab ') for _ in range(rng.randint(0, 8)))
+            a, b = self._random_op(rng, text), self._random_op(rng, text)
+            a_prime, b_prime = transform(a, b)
+            self.assertEqual(apply(apply(text, a), b_prime), apply(apply(text, b), a_prime))
+
+    def _random_op(self, rng, text):
+        from storybook.collab_text import normalize
+
+        ops, remaining = [], len(text)
+        while remaining:
+            n = rng.randint(1, remaining)
+            ops.append(-n if rng.random() < 0.3 else n)
+            remaining -= n
+            if rng.random() < 0.3:
+                ops.append(rng.choice(['x', 'yz', '!']))
+        return normalize(ops or ['q'])
+
+    def test_lengths_are_utf16_units(self):
+        from storybook.collab_text import apply
+
+        # An emoji is two code units in JavaScript, so clients retain 2 to skip it
+        self.assertEqual(apply('😀a', [2, -1, 'b']), '😀b')
+
+    def test_concurrent_typists_both_land(self):
+        from storybook.collab_text import CollaborativeText
+
+        CollabSessionState.load('text_session')
+        # Both clients edit revision 0 of "Hello world"
+        revision, _ = CollaborativeText.submit('text_session', 0, 0, [5, ',', 6])
+        self.assertEqual(revision, 1)
+        revision, applied = CollaborativeText.submit('text_session', 0, 0, [11, '!'])
+
+        self.assertEqual(revision, 2)
+        self.assertEqual(applied, [12, '!'])
+        self.assertEqual(CollaborativeText.get('text_session', 0), ('Hello, world!', 2))
+
+        CollabSessionState.persist('text_session')
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['pages'][0]['text'], 'Hello, world!')
+
+    def test_full_text_edit_forces_resync(self):
+        from storybook.collab_text import CollaborativeText, RevisionGone
+
+        CollabSessionState.load('text_session')
+        CollaborativeText.replace('text_session', 0, 'Replaced')
+
+        with self.assertRaises(RevisionGone):
+            CollaborativeText.submit('text_session', 0, 0, [11, '!'])
+        self.assertEqual(CollaborativeText.submit('text_session', 0, 1, [8, '!'])[0], 2)
+
+    def test_full_text_edit_waits_for_a_text_op_in_flight(self):
+        import threading
+        import time
+        from unittest.mock import patch
+        from storybook import collab_text
+        from storybook.collab_text import CollaborativeText
+
+        CollabSessionState.load('text_session')
+        applying = threading.Event()
+        original_apply = collab_text.apply
+
+        def slow_apply(text, ops):
+            applying.set()
+            time.sleep(0.1)  # The full-text edit arrives while the op is between read and write
+            return original_apply(text, ops)
+
+        def replace_text():
+            applying.wait(5)
+            CollaborativeText.replace('text_session', 0, 'Replaced')
+
+        replacer = threading.Thread(target=replace_text)
+        replacer.start()
+        with patch('storybook.collab_text.apply', side_effect=slow_apply):
+            revision, _ = CollaborativeText.submit('text_session', 0, 0, [11, '!'])
+        replacer.join(5)
+
+        self.assertEqual(revision, 1)
+        # The replace lands after the op, on its own revision - not under it
+        self.assertEqual(CollaborativeText.get('text_session', 0), ('Replaced', 2))
+
+    def test_text_op_over_websocket(self):
+        async def scenario():
+            client = connect_collaborator(self.host, 'text_session')
+            await client.connect()
+            init = await client.receive_json_from()
+            while init['type'] != 'init':
+                init = await client.receive_json_from()
+            await client.send_json_to({'type': 'text_op', 'page_index': 0, 'revision': 0, 'ops': ['Oh, ', 11]})
+            ack = await client.receive_json_from()
+            await client.send_json_to({'type': 'text_op', 'page_index': 0, 'revision': 0, 'ops': [20]})
+            resync_or_error = await client.receive_json_from()
+            await client.disconnect()
+            return init, ack, resync_or_error
+
+        init, ack, error = async_to_sync(scenario)()
+
+        self.assertEqual(init['text_revisions'], [0])
+        self.assertEqual(ack, {'type': 'text_op_ack', 'page_index': 0, 'revision': 1})
+        self.assertEqual(error['type'], 'error')
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.story_draft['pages'][0]['text'], 'Oh, Hello world')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, COLLAB_MAX_CONNECTIONS=2)
+class ConnectionRegistryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+
+    def test_capacity_is_enforced_and_stale_entries_reaped(self):
+        from storybook.collab_registry import CollabConnectionRegistry as Registry
+
+        meta = {'user_id': 1, 'username': 'one'}
+        self.assertTrue(Registry.register('reg', 'chan.a', meta, now=1000))
+        self.assertTrue(Registry.register('reg', 'chan.b', {'user_id': 2, 'username': 'two'}, now=1000))
+        self.assertFalse(Registry.register('reg', 'chan.c', meta, now=1010))
+
+        # chan.a keeps heartbeating, chan.b's worker died
+        self.assertTrue(Registry.heartbeat('reg', 'chan.a', now=1080))
+        self.assertTrue(Registry.register('reg', 'chan.c', {'user_id': 3, 'username': 'three'}, now=1100))
+
+        self.assertEqual(
+            sorted(c['channel_name'] for c in Registry.connections('reg', now=1100)),
+            ['chan.a', 'chan.c']
+        )
+        self.assertFalse(Registry.heartbeat('reg', 'chan.b', now=1100))
+
+    def test_page_viewers_come_from_the_registry(self):
+        from storybook.collab_registry import CollabConnectionRegistry as Registry
+
+        Registry.register('reg', 'chan.a', {'user_id': 1, 'username': 'one', 'page': 0})
+        Registry.register('reg', 'chan.b', {'user_id': 2, 'username': 'two', 'page': 0})
+        Registry.update('reg', 'chan.b', page=3, cursor_color='#FF6B6B')
+
+        with self.assertNumQueries(0):
+            viewers = Registry.page_viewers('reg')
+
+        self.assertEqual([v['username'] for v in viewers[0]], ['one'])
+        self.assertEqual(viewers[3][0]['cursor_color'], '#FF6B6B')
+        self.assertEqual(Registry.unregister('reg', 'chan.a'), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class StoryFinalizationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_store().clear()
+        self.users = [
+            User.objects.create_user(username=f'final_user_{i}', password='password123')
+            for i in range(3)
+        ]
+        self.session = CollaborationSession.objects.create(
+            session_id='final_session',
+            host=self.users[0],
+            story_draft={'title': 'Together', 'pages': [{'id': 'p1', 'text': 'One'}], 'genres': ['fantasy']}
+        )
+        for i, user in enumerate(self.users):
+            SessionParticipant.objects.create(
+                session=self.session, user=user, role='host' if i == 0 else 'participant'
+            )
+
+    def test_finalizes_in_background_with_progress(self):
+        from storybook.collab_finalize import StoryFinalizer
+        from storybook.models import Story
+
+        async def scenario():
+            host = connect_collaborator(self.users[0], 'final_session')
+            guest = connect_collaborator(self.users[1], 'final_session')
+            for communicator in (host, guest):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            for communicator in (host, guest):
+                while not await communicator.receive_nothing(timeout=0.05):
+                    await communicator.receive_json_from()
+
+            await database_sync_to_async(CanvasStore.set_snapshot)('final_session', 'p1', False, 'data:p1')
+            await host.send_json_to({'type': 'finalize_collaborative_story'})
+            await host.send_json_to({'type': 'finalize_collaborative_story'})
+            await StoryFinalizer.wait('final_session')
+
+            received = []
+            while not await guest.receive_nothing(timeout=0.05):
+                received.append(await guest.receive_json_from())
+            for communicator in (host, guest):
+                await communicator.disconnect()
+            return received
+
+        received = async_to_sync(scenario)()
+
+        types = [message['type'] for message in received]
+        self.assertIn('finalize_progress', types)
+        self.assertLess(types.index('finalize_progress'), types.index('story_finalized'))
+
+        story = Story.objects.get(collaboration_session=self.session)  # The second request made no second story
+        self.assertEqual(story.genres, ['fantasy'])
+        self.assertEqual(set(story.authors.values_list('id', flat=True)), {user.id for user in self.users})
+        self.session.refresh_from_db()
+        self.assertFalse(self.session.is_active)
+        self.assertEqual(self.session.story_id, story.id)
+
+
+class LoadTestCommandTestCase(TestCase):
+    def test_in_memory_run_reports_latency(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('loadtest_collab', sessions=1, participants=2, duration=0.3, rate=20, stdout=out)
+
+        report = out.getvalue()
+        self.assertIn('Connected 2/2', report)
+        self.assertIn('p99 ms', report)
+        self.assertIn('DB queries per operation', report)
+        self.assertFalse(CollaborationSession.objects.filter(session_id__startswith='loadtest_').exists())
+
+    def test_percentile_is_nearest_rank(self):
+        from storybook.management.commands.loadtest_collab import percentile
+
+        hundred = list(range(100, 0, -1))
+        self.assertEqual(percentile(hundred, 95), 95)
+        self.assertEqual(percentile(hundred, 99), 99)
+        self.assertEqual(percentile(hundred, 100), 100)
+        self.assertEqual(percentile(list(range(1, 11)), 50), 5)
+        self.assertEqual(percentile([7], 50), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS, METRICS_TOKEN='scrape-secret')
+class MessageMetricsTestCase(TestCase):
+    def setUp(self):
+        from storybook.ws_metrics import MessageMetrics
+
+        cache.clear()
+        get_store().clear()
+        MessageMetrics.reset()
+        self.users = [
+            User.objects.create_user(username=f'metrics_user_{i}', password='password123')
+            for i in range(2)
+        ]
+        self.session = CollaborationSession.objects.create(
+            session_id='metrics_session', host=self.users[0],
+            story_draft={'title': 'Metrics', 'pages': [{'id': 'p1', 'text': ''}]}
+        )
+        for i, user in enumerate(self.users):
+            SessionParticipant.objects.create(
+                session=self.session, user=user, role='host' if i == 0 else 'participant'
+            )
+
+    def test_handlers_are_measured_per_message_type(self):
+        from storybook.ws_metrics import MessageMetrics
+
+        async def scenario():
+            sender = connect_collaborator(self.users[0], 'metrics_session')
+            receiver = connect_collaborator(self.users[1], 'metrics_session')
+            for communicator in (sender, receiver):
+                await communicator.connect()
+            await sender.send_json_to({'type': 'text_edit', 'page_index': 0, 'page_id': 'p1', 'text': 'Hello'})
+            await sender.send_json_to({'type': 'text_edit', 'page_index': 0, 'page_id': 'p1', 'text': 'Hello!'})
+            await sender.send_json_to({'type': 'no_such_type'})
+            for communicator in (sender, receiver):
+                while not await communicator.receive_nothing(timeout=0.05):
+                    await communicator.receive_from()
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+        stats = MessageMetrics.snapshot()['collaboration']
+        self.assertEqual(stats['text_edit']['count'], 2)
+        self.assertGreater(stats['text_edit']['bytes_in'], 0)
+        self.assertGreater(stats['text_edit']['db_queries'], 0)  # Operation numbering, session lookups
+        self.assertEqual(stats['text_edit']['sent'], 2)  # Broadcast to the other participant
+        self.assertEqual(stats['unknown']['count'], 0)
+        self.assertGreater(stats['unknown']['bytes_in'], 0)
+        self.assertEqual(stats['init']['sent'], 2)
+
+    def test_prometheus_endpoint(self):
+        from storybook.ws_metrics import MessageMetrics
+
+        MessageMetrics.observe('collaboration', 'draw_batch', 0.003, queries=1, bytes_in=120)
+
+        response = self.client.get('/api/admin/system/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('ws_handler_seconds_bucket{consumer="collaboration",type="draw_batch",le="0.005"} 1', body)
+        self.assertIn('ws_handler_db_queries_total{consumer="collaboration",type="draw_batch"} 1', body)
+
+        self.assertEqual(self.client.get('/api/admin/system/metrics/').status_code, 401)
+        self.assertEqual(
+            self.client.get('/api/admin/system/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401
+        )
@@ -0,0 +1,321 @@
+from importlib.util import find_spec
+from unittest import skipUnless
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from channels.layers import get_channel_layer
+from storybook.models import Notification, AnnouncementRead, UserProfile, Message, Friendship
+from storybook.badge_service import BadgeService
+from storybook.inbox_service import NotificationInbox
+from storybook.announcement_service import AnnouncementService
+from storybook.presence_service import PresenceService
+from storybook.channel_utils import group_send_many
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+INMEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class PresenceTestCase(TestCase):
+    def setUp(self):
+        from storybook.redis_store import get_store
+
+        cache.clear()
+        get_store().clear()
+
+    def test_first_connect_is_announced_once(self):
+        """Only the first connection of an offline user is announced to friends."""
+        self.assertTrue(PresenceService.mark_connected(1))
+        self.assertFalse(PresenceService.mark_connected(1))
+
+    def test_reconnect_within_grace_window_is_suppressed(self):
+        """An offline->online flap inside the grace window produces no events."""
+        PresenceService.mark_connected(1)
+        token = PresenceService.schedule_offline(1)
+
+        # User comes back before the grace window ends
+        self.assertFalse(PresenceService.mark_connected(1))
+        self.assertFalse(PresenceService.confirm_offline(1, token))
+
+    def test_offline_confirmed_after_grace_window(self):
+        """A user who stays away is announced offline, then online again on return."""
+        PresenceService.mark_connected(1)
+        token = PresenceService.schedule_offline(1)
+
+        self.assertTrue(PresenceService.confirm_offline(1, token))
+        self.assertTrue(PresenceService.mark_connected(1))
+
+    def test_offline_is_confirmed_once(self):
+        """Two workers confirming the same pending transition announce it once."""
+        PresenceService.mark_connected(1)
+        token = PresenceService.schedule_offline(1)
+
+        self.assertTrue(PresenceService.confirm_offline(1, token))
+        self.assertFalse(PresenceService.confirm_offline(1, token))
+
+    def test_open_connection_blocks_offline(self):
+        """A connection opened on another worker keeps the user online."""
+        PresenceService.mark_connected(1)
+        PresenceService.add_connection(1)
+        token = PresenceService.schedule_offline(1)
+
+        self.assertFalse(PresenceService.confirm_offline(1, token))
+        self.assertEqual(PresenceService.remove_connection(1), 0)
+        self.assertEqual(PresenceService.remove_connection(1), 0)
+
+    def test_group_send_many_reaches_every_group(self):
+        """A batched fan-out delivers the event to each addressed group once."""
+        layer = get_channel_layer()
+
+        async def fan_out():
+            channels = []
+            for friend_id in range(3):
+                channel = await layer.new_channel()
+                await layer.group_add(f'notifications_{friend_id}', channel)
+                channels.append(channel)
+
+            await group_send_many(
+                layer,
+                [f'notifications_{friend_id}' for friend_id in range(3)],
+                {'type': 'friend_online', 'user_id': 99, 'username': 'flaky'}
+            )
+            return [await layer.receive(channel) for channel in channels]
+
+        messages = async_to_sync(fan_out)()
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(m['user_id'] == 99 for m in messages))
+
+    @skipUnless(find_spec('fakeredis') and find_spec('lupa'), 'needs fakeredis with Lua support (lupa)')
+    def test_group_send_many_redis_script(self):
+        """The pipelined read and Lua delivery reach every member on the Redis layer."""
+        import asyncio
+        import fakeredis
+        from channels_redis.core import RedisChannelLayer
+
+        layer = RedisChannelLayer(hosts=[('localhost', 6379)])
+        redis = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+        layer.connection = lambda index: redis
+
+        async def fan_out():
+            channels = []
+            for friend_id in range(3):
+                channel = await layer.new_channel()
+                await layer.group_add(f'notifications_{friend_id}', channel)
+                channels.append(channel)
+            # A member of two addressed groups still gets the event once
+            await layer.group_add('notifications_1', channels[0])
+
+            await group_send_many(
+                layer,
+                [f'notifications_{friend_id}' for friend_id in range(3)],
+                {'type': 'friend_online', 'user_id': 99, 'username': 'flaky'}
+            )
+            messages = [await layer.receive(channel) for channel in channels]
+            try:
+                duplicate = await asyncio.wait_for(layer.receive(channels[0]), 0.2)
+            except asyncio.TimeoutError:
+                duplicate = None
+            return messages, duplicate
+
+        messages, duplicate = async_to_sync(fan_out)()
+        self.assertEqual([m['user_id'] for m in messages], [99, 99, 99])
+        self.assertIsNone(duplicate)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class NotificationInboxTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+
+    def _notify(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Notification.objects.create(
+                    recipient=self.user,
+                    notification_type='story_liked',
+                    title=f'Like {i}',
+                    message='Someone liked your story'
+                )
+                for i in range(count)
+            ]
+
+    def test_unread_counter_tracks_new_notifications(self):
+        """Creating notifications bumps the cached counter without a recount."""
+        self.assertEqual(NotificationInbox.unread_count(self.user.id), 0)
+        self._notify(3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(NotificationInbox.unread_count(self.user.id), 3)
+
+    def test_mark_read_up_to_cursor(self):
+        """Bulk mark-read leaves notifications newer than the cursor unread."""
+        notifications = self._notify(5)
+
+        updated = NotificationInbox.mark_read(self.user, up_to=notifications[2].id)
+
+        self.assertEqual(updated, 3)
+        self.assertEqual(NotificationInbox.unread_count(self.user.id), 2)
+        self.assertEqual(Notification.objects.filter(recipient=self.user, is_read=False).count(), 2)
+
+    def test_cursor_pagination_walks_every_notification_once(self):
+        """Following next_cursor returns each notification exactly once, newest first."""
+        notifications = self._notify(5)
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = NotificationInbox.get_page(self.user, cursor=cursor, limit=2)
+            seen.extend(n.id for n in page)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, sorted((n.id for n in notifications), reverse=True))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class AnnouncementTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.child = User.objects.create_user(username='kid', password='testpass123')
+        UserProfile.objects.create(user=self.child, display_name='Kid', user_type='child')
+        self.teacher = User.objects.create_user(username='teach', password='testpass123')
+        UserProfile.objects.create(user=self.teacher, display_name='Teach', user_type='teacher')
+
+    def test_publish_writes_no_per_user_rows(self):
+        """Publishing stores one announcement and no read markers."""
+        AnnouncementService.publish('Maintenance', 'Back soon')
+
+        self.assertEqual(AnnouncementRead.objects.count(), 0)
+        self.assertEqual(NotificationInbox.unread_count(self.child.id), 1)
+        self.assertEqual(NotificationInbox.unread_count(self.teacher.id), 1)
+
+    def test_targeted_announcement_merged_into_inbox(self):
+        """Announcements appear in the inbox of targeted users only, ordered with notifications."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(
+                recipient=self.teacher, notification_type='story_liked', title='Like', message='Liked'
+            )
+        announcement = AnnouncementService.publish('Teachers', 'New class tools', target_type='teacher')
+
+        items, next_cursor = NotificationInbox.get_page(self.teacher)
+        self.assertIsNone(next_cursor)
+        self.assertEqual([type(item).__name__ for item in items], ['Announcement', 'Notification'])
+        self.assertEqual(items[0].id, announcement.id)
+
+        child_items, _ = NotificationInbox.get_page(self.child)
+        self.assertEqual(child_items, [])
+
+    def test_inbox_pages_through_both_sources(self):
+        """The app's list endpoint pages every announcement and notification once, tagged by kind."""
+        from django.utils import timezone
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from storybook.models import Announcement
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(2):
+                Notification.objects.create(
+                    recipient=self.teacher, notification_type='story_liked', title=f'Like {i}', message='Liked'
+                )
+        for i in range(5):
+            AnnouncementService.publish(f'News {i}', 'Update')
+        # Same timestamp everywhere: order falls back to (kind, id), and the ids of both kinds overlap
+        now = timezone.now()
+        Notification.objects.update(created_at=now)
+        Announcement.objects.update(created_at=now)
+
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.teacher).access_token}'}
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get('/api/notifications/', params, **auth).json()
+            seen.extend((item['kind'], item['id']) for item in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        expected = [('notification', n.id) for n in Notification.objects.order_by('-id')]
+        expected += [('announcement', a.id) for a in Announcement.objects.order_by('-id')]
+        self.assertEqual(seen, expected)
+
+    def test_mark_read_creates_marker_lazily(self):
+        """Reading an announcement creates a single marker and clears it from the badge."""
+        announcement = AnnouncementService.publish('Hello', 'Welcome')
+
+        NotificationInbox.mark_read(self.child, announcement_ids=[announcement.id])
+
+        self.assertEqual(AnnouncementRead.objects.filter(user=self.child).count(), 1)
+        self.assertEqual(NotificationInbox.unread_count(self.child.id), 0)
+        self.assertEqual(NotificationInbox.unread_count(self.teacher.id), 1)
+
+    def test_publish_broadcasts_once_to_group(self):
+        """Connected users in the target group receive the announcement event."""
+        layer = get_channel_layer()
+
+        async def join():
+            channel = await layer.new_channel()
+            for group in AnnouncementService.groups_for('child'):
+                await layer.group_add(group, channel)
+            return channel
+
+        channel = async_to_sync(join)()
+        AnnouncementService.publish('Hi kids', 'Story contest!', target_type='child')
+
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual(message['type'], 'announcement')
+        self.assertEqual(message['announcement']['title'], 'Hi kids')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=INMEMORY_LAYERS)
+class BadgeSummaryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+
+    def test_summary_is_served_from_cache(self):
+        """Once warm, the badge poll costs no database queries."""
+        BadgeService.summary(self.bob.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.alice, receiver=self.bob, content='Hi!')
+            Friendship.objects.create(sender=self.alice, receiver=self.bob)
+
+        with self.assertNumQueries(0):
+            badges = BadgeService.summary(self.bob.id)
+
+        self.assertEqual(badges, {
+            'messages': 1, 'notifications': 0, 'friend_requests': 1, 'collab_invites': 0
+        })
+
+    def test_status_change_updates_counter(self):
+        """Accepting a friend request removes it from the pending badge."""
+        with self.captureOnCommitCallbacks(execute=True):
+            friendship = Friendship.objects.create(sender=self.alice, receiver=self.bob)
+        self.assertEqual(BadgeService.summary(self.bob.id)['friend_requests'], 1)
+
+        friendship = Friendship.objects.get(id=friendship.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            friendship.status = 'accepted'
+            friendship.save()
+
+        self.assertEqual(BadgeService.summary(self.bob.id)['friend_requests'], 0)
+
+    def test_delta_is_pushed_over_websocket_group(self):
+        """Counter changes are pushed to the user's notifications group."""
+        layer = get_channel_layer()
+
+        async def join():
+            channel = await layer.new_channel()
+            await layer.group_add(f'notifications_{self.bob.id}', channel)
+            return channel
+
+        channel = async_to_sync(join)()
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.alice, receiver=self.bob, content='Ping')
+
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual(message['type'], 'badge_update')
+        self.assertEqual((message['counter'], message['delta']), ('messages', 1))
@@ -86,6 +86,10 @@ urlpatterns = [
     # Notification endpoints
     path('notifications/', views.notification_list, name='notification_list'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
+    path('notifications/inbox/', views.notification_inbox, name='notification_inbox'),
+    path('notifications/unread-count/', views.notification_unread_count, name='notification_unread_count'),
+    path('notifications/mark-read/', views.bulk_mark_notifications_read, name='bulk_mark_notifications_read'),
+    path('badges/', views.badge_summary, name='badge_summary'),
     path('notifications/mark-all-read/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     
     # Friendship endpoints (if needed)
@@ -176,6 +180,7 @@ urlpatterns = [
     # Admin endpoints - Analytics
     path('admin/analytics/', admin_features.get_platform_analytics, name='get_platform_analytics'),
     path('admin/system/health/', admin_features.get_system_health, name='get_system_health'),
+    path('admin/system/metrics/', admin_features.get_prometheus_metrics, name='get_prometheus_metrics'),
     
     # Admin endpoints - System Management
     path('admin/announcement/', admin_features.send_announcement, name='send_announcement'),
@@ -225,6 +230,9 @@ urlpatterns = [
     path('ai/status/', ai_proxy_views.check_ai_service_status, name='check_ai_service_status'),
     path('ai/groq/generate-story/', ai_proxy_views.generate_story_with_groq, name='generate_story_with_groq'),
     path('ai/openrouter/generate-story/', ai_proxy_views.generate_story_with_openrouter, name='generate_story_with_openrouter'),
+    path('ai/generate-story/', ai_proxy_views.generate_story, name='generate_story'),
+    path('ai/jobs/story/', ai_proxy_views.enqueue_story_job, name='enqueue_story_job'),
+    path('ai/jobs/<uuid:task_id>/', ai_proxy_views.get_story_job, name='get_story_job'),
     
     # Text-to-Speech Endpoints
     path('tts/synthesize/', tts_views.synthesize_speech, name='synthesize_speech'),
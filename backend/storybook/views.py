@@ -17,15 +17,18 @@ from .models import (
     UserProfile, Story, Character, Comment, Like, Rating, SavedStory,
     Friendship, Achievement, UserAchievement, Notification, Message,
     ParentChildRelationship, TeacherStudentRelationship, StoryRead,
-    CollaborationSession, SessionParticipant, DrawingOperation, CollaborationInvite
+    CollaborationSession, SessionParticipant, CollaborationInvite,
+    Announcement
 )
 from .serializers import (
     UserProfileSerializer, StorySerializer, StoryListSerializer,
     CharacterSerializer, CharacterListSerializer, CommentSerializer,
     LikeSerializer, RatingSerializer, AchievementSerializer, UserAchievementSerializer,
-    NotificationSerializer, FriendshipSerializer, MessageSerializer, ParentChildRelationshipSerializer
+    NotificationSerializer, FriendshipSerializer, MessageSerializer, ParentChildRelationshipSerializer,
+    AnnouncementSerializer
 )
 from .jwt_decorators import jwt_required, api_authentication_required
+from .badge_service import BadgeService
 
 import random
 import string
@@ -892,24 +895,121 @@ def achievement_progress(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def notification_list(request):
-    """Get user's notifications"""
-    notifications = Notification.objects.filter(recipient=request.user).order_by('-created_at')
+    """Get user's notifications and announcements (same cursor-paginated inbox as notification_inbox)"""
+    return _notification_inbox_response(request)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notification_inbox(request):
+    """Get user's notifications with cursor pagination and the cached unread count"""
+    return _notification_inbox_response(request)
+
+
+def _notification_inbox_response(request):
+    """
+    One inbox page: notifications and announcements newest first, each tagged with its kind
+    Pass next_cursor back as ?cursor= for the following page
+    """
+    from .inbox_service import NotificationInbox
     
-    paginator = PageNumberPagination()
-    paginator.page_size = 20
-    result_page = paginator.paginate_queryset(notifications, request)
+    try:
+        items, next_cursor = NotificationInbox.get_page(
+            request.user,
+            cursor=request.GET.get('cursor'),
+            limit=request.GET.get('limit'),
+            unread_only=request.GET.get('unread_only', '').lower() == 'true'
+        )
+    except (TypeError, ValueError):
+        return Response({
+            'error': 'Invalid cursor or limit'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = NotificationSerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    results = [
+        {
+            **(AnnouncementSerializer(item) if isinstance(item, Announcement) else NotificationSerializer(item)).data,
+            'kind': NotificationInbox.kind(item),
+        }
+        for item in items
+    ]
+    return Response({
+        'success': True,
+        'results': results,
+        'next_cursor': next_cursor,
+        'unread_count': NotificationInbox.unread_count(request.user.id)
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notification_unread_count(request):
+    """Get the unread notification badge count (cache read, no query when warm)"""
+    from .inbox_service import NotificationInbox
+    
+    return Response({
+        'success': True,
+        'unread_count': NotificationInbox.unread_count(request.user.id)
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def badge_summary(request):
+    """Get all app badges (messages, notifications, friend requests, collab invites) from the cache"""
+    return Response({
+        'success': True,
+        'badges': BadgeService.summary(request.user.id)
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_mark_notifications_read(request):
+    """
+    Mark notifications as read by id set ({"ids": [...]}) or up to a cursor ({"up_to": id})
+    Announcements are marked with {"announcement_ids": [...]}
+    """
+    from .inbox_service import NotificationInbox
+    
+    ids = request.data.get('ids')
+    up_to = request.data.get('up_to')
+    announcement_ids = request.data.get('announcement_ids')
+    
+    if ids is None and up_to is None and announcement_ids is None:
+        return Response({
+            'error': 'Provide "ids", "up_to" or "announcement_ids"'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if (ids is not None and not isinstance(ids, list)) or \
+            (announcement_ids is not None and not isinstance(announcement_ids, list)):
+        return Response({
+            'error': '"ids" and "announcement_ids" must be lists'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        updated = NotificationInbox.mark_read(
+            request.user, ids=ids, up_to=up_to, announcement_ids=announcement_ids
+        )
+    except (TypeError, ValueError):
+        return Response({
+            'error': 'Notification ids must be integers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'marked_read': updated,
+        'unread_count': NotificationInbox.unread_count(request.user.id)
+    })
 
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def mark_notification_read(request, notification_id):
     """Mark a notification as read"""
+    from .inbox_service import NotificationInbox
+    
     notification = get_object_or_404(Notification, id=notification_id, recipient=request.user)
-    notification.is_read = True
-    notification.save()
+    NotificationInbox.mark_read(request.user, ids=[notification.id])
     
     return Response({
         'success': True,
@@ -921,7 +1021,9 @@ def mark_notification_read(request, notification_id):
 @permission_classes([IsAuthenticated])
 def mark_all_notifications_read(request):
     """Mark all notifications as read"""
-    Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
+    from .inbox_service import NotificationInbox
+    
+    NotificationInbox.mark_all_read(request.user)
     
     return Response({
         'success': True,
@@ -1277,11 +1379,12 @@ def get_messages(request, user_id):
     ).order_by('created_at')
     
     # Mark messages from other user as read
-    Message.objects.filter(
+    marked_read = Message.objects.filter(
         sender=other_user,
         receiver=request.user,
         is_read=False
     ).update(is_read=True)
+    BadgeService.adjust(request.user.id, 'messages', -marked_read)
     
     serializer = MessageSerializer(messages, many=True)
     
@@ -1362,6 +1465,7 @@ def mark_messages_read(request, user_id):
         receiver=request.user,
         is_read=False
     ).update(is_read=True)
+    BadgeService.adjust(request.user.id, 'messages', -updated_count)
     
     return Response({
         'success': True,
@@ -1892,6 +1996,12 @@ def get_collaboration_session(request, session_id):
         
         participants = session.participants.filter(is_active=True).select_related('user')
         
+        # Edits in progress live in the session state hash until they are persisted
+        from .collab_state import CollabSessionState
+        story_draft = CollabSessionState.get_draft(session_id)
+        if story_draft is None:
+            story_draft = session.story_draft
+        
         return Response({
             'success': True,
             'session': {
@@ -1909,8 +2019,8 @@ def get_collaboration_session(request, session_id):
                 'can_join': session.can_join(),
                 'is_lobby_open': session.is_lobby_open,
                 'story_id': session.story_id,
-                'story_draft': session.story_draft,
-                'story_title': session.story_draft.get('title', 'Collaborative Story') if session.story_draft else 'Collaborative Story',
+                'story_draft': story_draft,
+                'story_title': story_draft.get('title', 'Collaborative Story') if story_draft else 'Collaborative Story',
                 'participants': [
                     {
                         'user_id': p.user.id,
@@ -2574,8 +2684,8 @@ def respond_to_collaboration_invite(request, notification_id):
         )
         
         # Mark notification as read
-        notification.is_read = True
-        notification.save()
+        from .inbox_service import NotificationInbox
+        NotificationInbox.mark_read(request.user, ids=[notification.id])
         
         data = notification.data or {}
         session_id = data.get('session_id')
@@ -3911,8 +4021,12 @@ def update_session_draft(request, session_id):
         # Update story draft
         draft_data = request.data.get('story_draft')
         if draft_data:
-            session.story_draft = draft_data
-            session.save()
+            from .collab_state import CollabSessionState
+            # Flush live edits (page, votes) first, then replace the draft and let
+            # connected clients reload the state from the row
+            CollabSessionState.persist(session_id)
+            CollaborationSession.objects.filter(pk=session.pk).update(story_draft=draft_data)
+            CollabSessionState.discard(session_id)
             
             return Response({
                 'success': True,
@@ -3948,9 +4062,12 @@ def get_session_draft(request, session_id):
                 'error': 'You are not a participant in this session'
             }, status=status.HTTP_403_FORBIDDEN)
         
+        from .collab_state import CollabSessionState
+        live_draft = CollabSessionState.get_draft(session_id)
+        
         return Response({
             'success': True,
-            'story_draft': session.story_draft,
+            'story_draft': live_draft if live_draft is not None else session.story_draft,
             'canvas_state': session.canvas_state,
             'current_page': session.current_page
         })
@@ -4110,30 +4227,25 @@ def get_session_operations(request, session_id):
                 'error': 'You are not a participant in this session'
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Get operations, optionally filtered by page
+        # Latest compacted snapshot per page + operations recorded after it
+        from .collab_ops import OperationCompactor
         page_number = request.GET.get('page_number')
-        operations = DrawingOperation.objects.filter(session=session)
-        
-        if page_number is not None:
-            operations = operations.filter(page_number=int(page_number))
-        
-        operations = operations.select_related('user').order_by('sequence_number')
-        
-        operations_data = []
-        for op in operations:
-            operations_data.append({
-                'id': op.id,
-                'user_id': op.user.id,
-                'username': op.user.username,
-                'operation_type': op.operation_type,
-                'operation_data': op.operation_data,
-                'page_number': op.page_number,
-                'sequence_number': op.sequence_number,
-                'timestamp': op.timestamp.isoformat()
-            })
+        snapshots, operations_data = OperationCompactor.get_replay(
+            session,
+            page_number=int(page_number) if page_number is not None else None
+        )
+        
+        # Snapshot operations carry usernames like tail operations do
+        all_operations = operations_data + [op for snapshot in snapshots for op in snapshot['operations']]
+        usernames = dict(
+            User.objects.filter(id__in={op['user_id'] for op in all_operations}).values_list('id', 'username')
+        )
+        for op in all_operations:
+            op['username'] = usernames.get(op['user_id'], '')
         
         return Response({
             'success': True,
+            'snapshots': snapshots,
             'operations': operations_data,
             'total': len(operations_data)
         })
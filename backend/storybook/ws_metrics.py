@@ -0,0 +1,202 @@
+"""
+Per-message-type metrics of the WebSocket consumers
+Handler latency histograms, DB queries and bytes in/out, kept per worker process
+"""
+import threading
+import time
+from contextvars import ContextVar
+from django.db.backends.signals import connection_created
+
+# Histogram bucket upper bounds in seconds (Prometheus 'le' labels; +Inf is implicit)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Queries of the handler running in this context (database_sync_to_async threads inherit it)
+_handler_queries = ContextVar('ws_handler_queries', default=None)
+
+
+class _QueryCount:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _handler_queries.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def _attach_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_attach_counter)
+
+
+class _TypeStats:
+    __slots__ = ('count', 'errors', 'seconds', 'buckets', 'queries', 'bytes_in', 'sent', 'bytes_out')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # Last one is +Inf
+        self.queries = 0
+        self.bytes_in = 0
+        self.sent = 0
+        self.bytes_out = 0
+
+
+class MessageMetrics:
+    """
+    Counters per (consumer, message type) since this process started
+
+    Inbound types get a handler latency histogram, the DB queries their
+    handler ran (counted through a connection execute wrapper, attributed via
+    a context variable) and bytes received; outbound types get frames and
+    bytes sent. Message types outside a consumer's dispatch table are counted
+    as 'unknown' so clients can't grow the label set.
+    """
+
+    _stats = {}  # (consumer, message_type) -> _TypeStats
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get(cls, consumer, message_type):
+        key = (consumer, message_type)
+        stats = cls._stats.get(key)
+        if stats is None:
+            with cls._lock:
+                stats = cls._stats.setdefault(key, _TypeStats())
+        return stats
+
+    @classmethod
+    async def dispatch(cls, consumer, message_type, handler, data, bytes_in):
+        """
+        Run an inbound message's handler, measuring it
+
+        Args:
+            handler: async handler(data) from the consumer's dispatch table, or
+                None for types it doesn't handle (only their bytes are counted)
+        """
+        if handler is None:
+            cls._get(consumer, message_type).bytes_in += bytes_in
+            return
+
+        queries = _QueryCount()
+        token = _handler_queries.set(queries)
+        start = time.perf_counter()
+        failed = False
+        try:
+            await handler(data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _handler_queries.reset(token)
+            cls.observe(consumer, message_type, time.perf_counter() - start, queries.count, bytes_in, failed)
+
+    @classmethod
+    def observe(cls, consumer, message_type, seconds, queries=0, bytes_in=0, failed=False):
+        stats = cls._get(consumer, message_type)
+        stats.count += 1
+        stats.errors += failed
+        stats.seconds += seconds
+        stats.queries += queries
+        stats.bytes_in += bytes_in
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        stats.buckets[index] += 1
+
+    @classmethod
+    def sent(cls, consumer, message_type, nbytes):
+        stats = cls._get(consumer, message_type or 'unknown')
+        stats.sent += 1
+        stats.bytes_out += nbytes
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats = {}
+
+    # ---------- Reports ----------
+
+    @classmethod
+    def snapshot(cls):
+        """{consumer: {message_type: {...}}} for the admin health endpoint, busiest handlers first"""
+        report = {}
+        for (consumer, message_type), stats in sorted(
+            list(cls._stats.items()), key=lambda item: -item[1].seconds
+        ):
+            report.setdefault(consumer, {})[message_type] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'total_ms': round(stats.seconds * 1000, 2),
+                'avg_ms': round(stats.seconds * 1000 / stats.count, 3) if stats.count else 0,
+                'p95_ms': cls._quantile_ms(stats, 0.95),
+                'db_queries': stats.queries,
+                'db_queries_per_message': round(stats.queries / stats.count, 2) if stats.count else 0,
+                'bytes_in': stats.bytes_in,
+                'sent': stats.sent,
+                'bytes_out': stats.bytes_out,
+            }
+        return report
+
+    @staticmethod
+    def _quantile_ms(stats, quantile):
+        """Upper bound of the histogram bucket holding the quantile (None when empty or past the last bound)"""
+        if not stats.count:
+            return None
+        rank = quantile * stats.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            seen += count
+            if seen >= rank:
+                return bound * 1000
+        return None
+
+    @classmethod
+    def prometheus(cls):
+        """Metrics in the Prometheus text exposition format"""
+        items = sorted(list(cls._stats.items()))
+        lines = []
+
+        def family(name, kind, help_text, rows):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(rows)
+
+        def labels(consumer, message_type, **extra):
+            pairs = {'consumer': consumer, 'type': message_type, **extra}
+            return ','.join(f'{key}="{value}"' for key, value in pairs.items())
+
+        received = [(key, stats) for key, stats in items if stats.count]
+        histogram = []
+        for (consumer, message_type), stats in received:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                histogram.append(f'ws_handler_seconds_bucket{{{labels(consumer, message_type, le=bound)}}} {cumulative}')
+            histogram.append(f'ws_handler_seconds_bucket{{{labels(consumer, message_type, le="+Inf")}}} {stats.count}')
+            histogram.append(f'ws_handler_seconds_sum{{{labels(consumer, message_type)}}} {stats.seconds:.6f}')
+            histogram.append(f'ws_handler_seconds_count{{{labels(consumer, message_type)}}} {stats.count}')
+        family('ws_handler_seconds', 'histogram', 'Handler latency of inbound WebSocket messages', histogram)
+
+        for name, attr, help_text in (
+            ('ws_handler_errors_total', 'errors', 'Inbound messages whose handler raised'),
+            ('ws_handler_db_queries_total', 'queries', 'DB queries run by inbound message handlers'),
+            ('ws_received_bytes_total', 'bytes_in', 'Bytes of inbound WebSocket frames'),
+            ('ws_sent_messages_total', 'sent', 'Outbound WebSocket frames'),
+            ('ws_sent_bytes_total', 'bytes_out', 'Bytes of outbound WebSocket frames'),
+        ):
+            family(name, 'counter', help_text, [
+                f'{name}{{{labels(consumer, message_type)}}} {getattr(stats, attr)}'
+                for (consumer, message_type), stats in items if getattr(stats, attr)
+            ])
+        return '\n'.join(lines) + '\n'
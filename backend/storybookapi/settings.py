@@ -48,7 +48,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # CORS first
     'storybook.cors_middleware.CorsPreflightMiddleware',  # Handle OPTIONS before auth
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files
+    'storybook.middleware.AsyncWhiteNoiseMiddleware',  # Serve static files (WhiteNoise, async-capable)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -251,6 +251,9 @@ OCR_SPACE_API_KEY = os.getenv('OCR_SPACE_API_KEY')
 
 # Pollinations AI API Configuration
 POLLINATIONS_API_KEY = os.getenv('POLLINATIONS_API_KEY')
+# Disk cache of fetched Pollinations images (least recently used images are evicted past the size cap)
+POLLINATIONS_CACHE_DIR = os.getenv('POLLINATIONS_CACHE_DIR', os.path.join(MEDIA_ROOT, 'pollinations_cache'))
+POLLINATIONS_CACHE_MAX_MB = int(os.getenv('POLLINATIONS_CACHE_MAX_MB', 512))
 
 # Replicate API Configuration
 REPLICATE_API_TOKEN = os.getenv('REPLICATE_API_TOKEN')
@@ -261,6 +264,47 @@ GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 # OpenRouter API Configuration (server-side — never exposed to browser)
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 
+# Pooled HTTP clients of the AI providers: seconds allowed to connect (read timeouts are
+# per call) and keep-alive connections kept per provider host
+AI_HTTP_CONNECT_TIMEOUT = int(os.getenv('AI_HTTP_CONNECT_TIMEOUT', 5))
+AI_HTTP_POOL_SIZE = int(os.getenv('AI_HTTP_POOL_SIZE', 20))
+
+# AI rate limiting: requests per minute allowed per API key, optional comma-separated key
+# pools (otherwise the single key above), how a pooled key is picked ('least_loaded' or
+# 'round_robin'), and seconds a request may queue for capacity before getting a 429
+AI_RATE_LIMITS = {
+    'groq': int(os.getenv('GROQ_RPM', 30)),
+    'openrouter': int(os.getenv('OPENROUTER_RPM', 20)),
+    'gemini': int(os.getenv('GEMINI_RPM', 15)),
+    'replicate': int(os.getenv('REPLICATE_RPM', 60)),
+}
+AI_KEY_POOLS = {
+    'groq': os.getenv('GROQ_API_KEYS', ''),
+    'openrouter': os.getenv('OPENROUTER_API_KEYS', ''),
+    'gemini': os.getenv('GOOGLE_AI_API_KEYS', ''),
+    'replicate': os.getenv('REPLICATE_API_TOKENS', ''),
+}
+AI_KEY_SELECTION = os.getenv('AI_KEY_SELECTION', 'least_loaded')
+AI_RATE_LIMIT_MAX_WAIT = int(os.getenv('AI_RATE_LIMIT_MAX_WAIT', 5))
+# Text provider failover: consecutive timeouts/5xx that open a provider's circuit breaker,
+# and seconds it stays open before one trial request is let through
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', 3))
+AI_BREAKER_COOLDOWN = int(os.getenv('AI_BREAKER_COOLDOWN', 30))
+
+# Queued story generation (run_story_jobs): concurrent calls allowed per provider across all
+# workers, worker threads per process, seconds before a running job counts as lost, and
+# attempts before a rate-limited job fails
+STORY_JOB_CONCURRENCY = {
+    'groq': int(os.getenv('STORY_JOB_CONCURRENCY_GROQ', 4)),
+    'openrouter': int(os.getenv('STORY_JOB_CONCURRENCY_OPENROUTER', 2)),
+    'stub': 4,
+}
+STORY_JOB_WORKERS = int(os.getenv('STORY_JOB_WORKERS', 4))
+STORY_JOB_TIMEOUT = int(os.getenv('STORY_JOB_TIMEOUT', 180))
+STORY_JOB_MAX_ATTEMPTS = int(os.getenv('STORY_JOB_MAX_ATTEMPTS', 3))
+# Offline 'stub' provider (canned story, no network) for tests and local development
+STORY_JOB_STUB_PROVIDER = os.getenv('STORY_JOB_STUB_PROVIDER', 'False').lower() == 'true'
+
 # Email Configuration
 # Supports Brevo, SendGrid, and Gmail SMTP
 BREVO_API_KEY = os.getenv('BREVO_API_KEY')
@@ -347,6 +391,30 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Presence: how long a user may be disconnected before friends see them go offline
+# (absorbs flaky mobile reconnects so they don't fan out friend_online/friend_offline storms)
+PRESENCE_OFFLINE_GRACE_SECONDS = int(os.getenv('PRESENCE_OFFLINE_GRACE_SECONDS', 10))
+
+# Collaboration: drawing operations are written in batches (write-behind queue)
+COLLAB_OP_FLUSH_INTERVAL_MS = int(os.getenv('COLLAB_OP_FLUSH_INTERVAL_MS', 250))
+COLLAB_OP_FLUSH_BATCH_SIZE = int(os.getenv('COLLAB_OP_FLUSH_BATCH_SIZE', 50))
+# Recent operations kept per session for delta resync of reconnecting clients
+COLLAB_RESYNC_BUFFER_SIZE = int(os.getenv('COLLAB_RESYNC_BUFFER_SIZE', 200))
+# Autosave: live session state (draft, current page, canvases) is written to the database
+# every this many seconds while it changes, or right after this many operations
+COLLAB_STATE_PERSIST_SECONDS = int(os.getenv('COLLAB_STATE_PERSIST_SECONDS', 5))
+COLLAB_AUTOSAVE_OPERATIONS = int(os.getenv('COLLAB_AUTOSAVE_OPERATIONS', 50))
+# Cursor moves are coalesced per room and broadcast this many times per second
+COLLAB_CURSOR_TICK_HZ = int(os.getenv('COLLAB_CURSOR_TICK_HZ', 20))
+# Concurrent WebSocket connections allowed per collaboration session
+COLLAB_MAX_CONNECTIONS = int(os.getenv('COLLAB_MAX_CONNECTIONS', 10))
+# Outbound events of batching clients are sent as one array frame per window; past the
+# pending limit, cursor/presence updates are dropped first
+COLLAB_FRAME_BATCH_MS = int(os.getenv('COLLAB_FRAME_BATCH_MS', 16))
+COLLAB_FRAME_MAX_PENDING = int(os.getenv('COLLAB_FRAME_MAX_PENDING', 256))
+# Bearer token for Prometheus scrapes of /api/admin/system/metrics/ (empty = admin token only)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # ASGI application timeout settings for memory efficiency
 ASGI_APPLICATION = 'storybookapi.asgi.application'
 ASGI_THREADS = 1  # Single thread for ASGI to reduce memory
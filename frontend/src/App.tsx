@@ -60,7 +60,7 @@ function AppContent() {
   const { isAuthenticated, user, checkAuth } = useAuthStore();
   const { initializeTheme, isDarkMode } = useThemeStore();
   const { addCollaborationInviteToFriend } = useSocialStore();
-  const { fetchNotificationCounts, incrementCollaborationInvites } = useNotificationStore();
+  const { fetchNotificationCounts } = useNotificationStore();
   const [isInitializing, setIsInitializing] = useState(true);
   // Removed unused collaborationInvites and onlineUsers state that caused root re-renders
   const [showWaitingScreen, setShowWaitingScreen] = useState(false);
@@ -287,9 +287,7 @@ function AppContent() {
         // Add invitation to friend's profile instead of showing popup
         console.log('🔔 Adding collaboration invite to friend:', invite.inviter_id);
         addCollaborationInviteToFriend(invite.inviter_id, invite);
-        
-        // Increment notification count immediately for instant UI feedback
-        incrementCollaborationInvites();
+        // The badge count arrives as a badge_update event
         
         // Show browser notification if permission granted
         if ('Notification' in window && Notification.permission === 'granted') {
@@ -36,6 +36,12 @@ interface StoryFormData {
   storyLanguage: 'en' | 'tl'; // Language for story content (independent of interface language)
 }
 
+// Readable title and page text of a story JSON that is still streaming in
+const previewStreamedStory = (partial: string) =>
+  Array.from(partial.matchAll(/"(?:title|text)"\s*:\s*"((?:[^"\\]|\\.)*)/g))
+    .map(match => match[1].replace(/\\n/g, ' ').replace(/\\(.)/g, '$1'))
+    .join('\n\n');
+
 const AIStoryModal = ({ isOpen, onClose }: AIStoryModalProps) => {
   const navigate = useNavigate();
   const { isDarkMode } = useThemeStore();
@@ -54,6 +60,7 @@ const AIStoryModal = ({ isOpen, onClose }: AIStoryModalProps) => {
   const [isGenerating, setIsGenerating] = useState(false);
   const [generationStage, setGenerationStage] = useState<string>('');
   const [generationProgress, setGenerationProgress] = useState(0);
+  const [streamedStory, setStreamedStory] = useState(''); // Story JSON received so far (Groq/OpenRouter stream)
   const [imageGenerationWarnings, setImageGenerationWarnings] = useState<string[]>([]);
   const [showWarningModal, setShowWarningModal] = useState(false);
   const [isReady, setIsReady] = useState(false);
@@ -149,6 +156,7 @@ const AIStoryModal = ({ isOpen, onClose }: AIStoryModalProps) => {
     console.log('? Story idea validation passed, starting generation...');
     setIsGenerating(true);
     setGenerationProgress(0);
+    setStreamedStory('');
     
     try {
       console.log('?? INSIDE TRY BLOCK - About to generate story');
@@ -218,6 +226,7 @@ Make sure EVERY page's imagePrompt:
       setGenerationProgress(20);
 
       let storyData: any;
+      const onToken = (text: string) => setStreamedStory(previous => previous + text);
 
       if (aiEngine === 'groq' || aiEngine === 'openrouter') {
         // Structured call — generates text ONLY (~1,500 tokens total)
@@ -232,7 +241,7 @@ Make sure EVERY page's imagePrompt:
                 pageCount: formData.pageCount,
                 language: formData.storyLanguage,
               },
-              { temperature: 0.85, maxTokens: 2048 }
+              { temperature: 0.85, maxTokens: 2048, onToken }
             );
             console.log('[Groq] storyData ready:', storyData.pages?.length, 'pages');
           } else {
@@ -240,6 +249,7 @@ Make sure EVERY page's imagePrompt:
           }
         } catch (error: any) {
           console.log(`[AI] ${aiEngine === 'groq' ? 'Groq failed, falling back to ' : 'Using '}OpenRouter...`);
+          setStreamedStory(''); // Start the preview over with the fallback's story
           const { generateStoryWithOpenRouter } = await import('../../services/openRouterService');
           storyData = await generateStoryWithOpenRouter(
             formData.storyIdea,
@@ -249,7 +259,7 @@ Make sure EVERY page's imagePrompt:
               pageCount: formData.pageCount,
               language: formData.storyLanguage,
             },
-            { temperature: 0.85, maxTokens: 2048 }
+            { temperature: 0.85, maxTokens: 2048, onToken }
           );
           console.log('[OpenRouter] storyData ready:', storyData.pages?.length, 'pages');
         }
@@ -738,6 +748,27 @@ Make sure EVERY page's imagePrompt:
               }} />
             </div>
 
+            {/* Story text as it streams in */}
+            {streamedStory && generationProgress < 40 && (
+              <div style={{
+                maxHeight: '120px',
+                overflowY: 'auto',
+                display: 'flex',
+                flexDirection: 'column-reverse', // Keeps the newest text in view
+                textAlign: 'left',
+                whiteSpace: 'pre-wrap',
+                fontSize: '13px',
+                lineHeight: 1.5,
+                color: isDarkMode ? '#d1d5db' : '#4b5563',
+                backgroundColor: isDarkMode ? '#1f2937' : '#f9fafb',
+                borderRadius: '12px',
+                padding: '12px',
+                marginBottom: '16px'
+              }}>
+                <div>{previewStreamedStory(streamedStory)}</div>
+              </div>
+            )}
+
             {/* Fun Mini Game! */}
             <div style={{ marginBottom: '16px' }}>
               <p style={{ 
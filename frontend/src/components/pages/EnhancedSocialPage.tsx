@@ -52,7 +52,7 @@ import {
 const EnhancedSocialPage = () => {
   const navigate = useNavigate();
   const { user, isAuthenticated } = useAuthStore();
-  const { decrementFriendRequests, fetchNotificationCounts } = useNotificationStore();
+  const { fetchNotificationCounts } = useNotificationStore();
   const isAnonymous = user?.id === 'anonymous' || !isAuthenticated;
   
   // Active tab state
@@ -313,7 +313,6 @@ const EnhancedSocialPage = () => {
     try {
       await socialService.acceptFriendRequest(requestId);
       await loadAllData();
-      decrementFriendRequests();
     } catch (error) {
       console.error('Error accepting friend request:', error);
       alert('Failed to accept friend request');
@@ -324,7 +323,6 @@ const EnhancedSocialPage = () => {
     try {
       await socialService.rejectFriendRequest(requestId);
       setFriendRequests(prev => prev.filter(req => req.id !== requestId));
-      decrementFriendRequests();
     } catch (error) {
       console.error('Error rejecting friend request:', error);
       alert('Failed to reject friend request');
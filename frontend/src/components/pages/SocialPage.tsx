@@ -12,7 +12,7 @@ const SocialPage = () => {
   const navigate = useNavigate();
   const { user, isAuthenticated } = useAuthStore();
   const { t } = useI18nStore();
-  const { decrementFriendRequests, fetchNotificationCounts } = useNotificationStore();
+  const { fetchNotificationCounts } = useNotificationStore();
   const isAnonymous = user?.id === 'anonymous' || !isAuthenticated;
   
   const [isAddFriendsModalOpen, setIsAddFriendsModalOpen] = useState(false);
@@ -142,8 +142,7 @@ const SocialPage = () => {
       await socialService.acceptFriendRequest(requestId);
       // Reload data to update friends list
       await loadSocialData();
-      // Update notification count
-      decrementFriendRequests();
+      // The badge count arrives as a badge_update event
     } catch (error) {
       console.error('Error accepting friend request:', error);
       alert('Failed to accept friend request');
@@ -155,8 +154,7 @@ const SocialPage = () => {
       await socialService.rejectFriendRequest(requestId);
       // Remove from friend requests list
       setFriendRequests(prev => prev.filter(req => req.id !== requestId));
-      // Update notification count
-      decrementFriendRequests();
+      // The badge count arrives as a badge_update event
     } catch (error) {
       console.error('Error rejecting friend request:', error);
       alert('Failed to reject friend request');
@@ -288,6 +288,13 @@ const CanvasDrawingPage: React.FC = () => {
     }
   }, [isCollaborating, collaborationService.isConnected(), pageId, pageIndex, isCoverImage]);
 
+  // Join this page's canvas group while the canvas is open
+  useEffect(() => {
+    if (!isCollaborating) return;
+    collaborationService.viewPage(isCoverImage ? undefined : pageIndex, Boolean(isCoverImage));
+    return () => collaborationService.viewPage();
+  }, [isCollaborating, pageIndex, isCoverImage]);
+
   // Auto-save canvas state to localStorage (solo mode) or backend (collaboration mode)
   useEffect(() => {
     if (!drawingEngineRef.current) return;
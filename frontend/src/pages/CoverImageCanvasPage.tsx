@@ -132,6 +132,13 @@ const CoverImageCanvasPage: React.FC = () => {
       collaborationService.requestCanvasSync('cover_image', undefined, true);
     }
   }, [isCollaborating, collaborationService.isConnected()]);
+
+  // Join the cover's canvas group while the canvas is open
+  useEffect(() => {
+    if (!isCollaborating) return;
+    collaborationService.viewPage(undefined, true);
+    return () => collaborationService.viewPage();
+  }, [isCollaborating]);
   const { getCanvasData, saveCanvasData, currentStory, markAsDraft, updateStory } = useStoryStore();
   const [orientation, setOrientation] = useState<Orientation>('portrait');
   const [activeTool, setActiveTool] = useState<Tool>('brush');
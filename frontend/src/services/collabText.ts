@@ -0,0 +1,223 @@
+/**
+ * Operational transformation for collaborative story text (client side of backend/storybook/collab_text.py)
+ *
+ * An operation walks the whole page text (lengths in UTF-16 code units, i.e. JavaScript
+ * string lengths): positive number = retain, negative number = delete, string = insert.
+ * Typing "!" at the end of "Hi" is [2, "!"]; deleting "i" is [1, -1].
+ */
+
+export type TextOp = Array<number | string>;
+
+const isRetain = (op: number | string): op is number => typeof op === 'number' && op > 0;
+const isDelete = (op: number | string): op is number => typeof op === 'number' && op < 0;
+const isInsert = (op: number | string): op is string => typeof op === 'string';
+
+/** Accumulates components, merging neighbours like the server's _Builder */
+class OpBuilder {
+  ops: TextOp = [];
+
+  retain(n: number): void {
+    if (n <= 0) return;
+    const last = this.ops[this.ops.length - 1];
+    if (last !== undefined && isRetain(last)) this.ops[this.ops.length - 1] = last + n;
+    else this.ops.push(n);
+  }
+
+  insert(s: string): void {
+    if (!s) return;
+    const last = this.ops[this.ops.length - 1];
+    if (last !== undefined && isInsert(last)) {
+      this.ops[this.ops.length - 1] = last + s;
+    } else if (last !== undefined && isDelete(last)) {
+      // Keep inserts before deletes so equal operations look the same
+      const beforeLast = this.ops[this.ops.length - 2];
+      if (beforeLast !== undefined && isInsert(beforeLast)) this.ops[this.ops.length - 2] = beforeLast + s;
+      else this.ops.splice(this.ops.length - 1, 0, s);
+    } else {
+      this.ops.push(s);
+    }
+  }
+
+  delete(n: number): void {
+    if (n <= 0) return;
+    const last = this.ops[this.ops.length - 1];
+    if (last !== undefined && isDelete(last)) this.ops[this.ops.length - 1] = last - n;
+    else this.ops.push(-n);
+  }
+}
+
+export function isNoop(ops: TextOp): boolean {
+  return ops.every(isRetain);
+}
+
+/** Apply an operation to text */
+export function applyOp(text: string, ops: TextOp): string {
+  let index = 0;
+  let result = '';
+  for (const op of ops) {
+    if (isRetain(op)) {
+      result += text.slice(index, index + op);
+      index += op;
+    } else if (isDelete(op)) {
+      index -= op;
+    } else {
+      result += op;
+    }
+  }
+  if (index !== text.length) throw new Error('Text operation length does not match the text');
+  return result;
+}
+
+/**
+ * Transform concurrent operations a and b (same base text)
+ * Returns [a', b'] with apply(apply(t, a), b') === apply(apply(t, b), a'); a's inserts go first on ties.
+ */
+export function transformOps(a: TextOp, b: TextOp): [TextOp, TextOp] {
+  const aPrime = new OpBuilder();
+  const bPrime = new OpBuilder();
+  let i = 0;
+  let j = 0;
+  let op1: number | string | undefined = a[i++];
+  let op2: number | string | undefined = b[j++];
+
+  while (op1 !== undefined || op2 !== undefined) {
+    if (op1 !== undefined && isInsert(op1)) {
+      aPrime.insert(op1);
+      bPrime.retain(op1.length);
+      op1 = a[i++];
+      continue;
+    }
+    if (op2 !== undefined && isInsert(op2)) {
+      aPrime.retain(op2.length);
+      bPrime.insert(op2);
+      op2 = b[j++];
+      continue;
+    }
+    if (op1 === undefined || op2 === undefined) {
+      throw new Error('Text operations do not cover the same text');
+    }
+
+    const n1 = op1 as number;
+    const n2 = op2 as number;
+    if (n1 > 0 && n2 > 0) {
+      const length = Math.min(n1, n2);
+      aPrime.retain(length);
+      bPrime.retain(length);
+      op1 = n1 - length;
+      op2 = n2 - length;
+    } else if (n1 < 0 && n2 < 0) {
+      // Both deleted the same text - nothing left to do for either
+      const length = Math.min(-n1, -n2);
+      op1 = n1 + length;
+      op2 = n2 + length;
+    } else if (n1 < 0) {
+      const length = Math.min(-n1, n2);
+      aPrime.delete(length);
+      op1 = n1 + length;
+      op2 = n2 - length;
+    } else {
+      const length = Math.min(n1, -n2);
+      bPrime.delete(length);
+      op1 = n1 - length;
+      op2 = n2 + length;
+    }
+
+    if (op1 === 0) op1 = a[i++];
+    if (op2 === 0) op2 = b[j++];
+  }
+
+  return [aPrime.ops, bPrime.ops];
+}
+
+const isHighSurrogate = (code: number) => code >= 0xd800 && code <= 0xdbff;
+const isLowSurrogate = (code: number) => code >= 0xdc00 && code <= 0xdfff;
+
+/** The operation turning oldText into newText (one changed span between the common prefix and suffix) */
+export function diffToOp(oldText: string, newText: string): TextOp {
+  let prefix = 0;
+  const maxPrefix = Math.min(oldText.length, newText.length);
+  while (prefix < maxPrefix && oldText[prefix] === newText[prefix]) prefix++;
+  let suffix = 0;
+  const maxSuffix = maxPrefix - prefix;
+  while (suffix < maxSuffix && oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]) suffix++;
+  // Never split a surrogate pair: the server can't decode half an emoji
+  if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) prefix--;
+  if (suffix > 0 && isLowSurrogate(oldText.charCodeAt(oldText.length - suffix))) suffix--;
+
+  const builder = new OpBuilder();
+  builder.retain(prefix);
+  builder.insert(newText.slice(prefix, newText.length - suffix));
+  builder.delete(oldText.length - prefix - suffix);
+  builder.retain(suffix);
+  return builder.ops;
+}
+
+/**
+ * One page's text as this client knows it, following the server's revisions
+ *
+ * At most one operation is in flight; edits made meanwhile wait in the buffer
+ * and are sent against the revision the ack reports. Remote operations are
+ * transformed past both, so local typing is never lost or applied twice.
+ */
+export class PageTextClient {
+  private inflight: TextOp | null = null;
+  private buffer: TextOp[] = [];
+  private earlyAck: number | null = null; // Ack that overtook remote operations before it
+  private send: (revision: number, ops: TextOp) => void;
+  revision: number;
+  text: string;
+
+  constructor(revision: number, text: string, send: (revision: number, ops: TextOp) => void) {
+    this.revision = revision;
+    this.text = text;
+    this.send = send;
+  }
+
+  /** Record the editor's new text; sends (or buffers) the operation */
+  edit(newText: string): void {
+    const ops = diffToOp(this.text, newText);
+    if (isNoop(ops)) return;
+    this.text = newText;
+    if (this.inflight) {
+      this.buffer.push(ops);
+    } else {
+      this.inflight = ops;
+      this.send(this.revision, ops);
+    }
+  }
+
+  /** Our in-flight operation became revision (held back until the remote operations before it arrive) */
+  ack(revision: number): void {
+    if (!this.inflight || revision <= this.revision) return; // Not ours: the page resynced since
+    if (revision !== this.revision + 1) {
+      this.earlyAck = revision;
+      return;
+    }
+    this.revision = revision;
+    this.earlyAck = null;
+    this.inflight = this.buffer.shift() || null;
+    if (this.inflight) this.send(this.revision, this.inflight);
+  }
+
+  /**
+   * Apply another participant's operation
+   *
+   * Returns the new text, or null when a revision is missing and the page must resync.
+   */
+  remote(revision: number, ops: TextOp): string | null {
+    if (revision <= this.revision) return this.text; // Already applied
+    if (revision !== this.revision + 1) return null;
+
+    let incoming = ops;
+    if (this.inflight) [this.inflight, incoming] = transformOps(this.inflight, incoming);
+    this.buffer = this.buffer.map(buffered => {
+      const [transformed, next] = transformOps(buffered, incoming);
+      incoming = next;
+      return transformed;
+    });
+    this.text = applyOp(this.text, incoming);
+    this.revision = revision;
+    if (this.earlyAck === this.revision + 1) this.ack(this.earlyAck);
+    return this.text;
+  }
+}
@@ -4,6 +4,7 @@
  */
 
 import { useStoryStore } from '../stores/storyStore';
+import { PageTextClient } from './collabText';
 
 interface Participant {
   user_id: number;
@@ -53,6 +54,18 @@ export class CollaborationService {
   private isConnecting = false;
   private isReconnecting = false;
   private accessToken: string | null = null;
+  // Last operation sequence number seen in this session, sent back as ?last_seq=
+  // on reconnect so the server only replays what was missed
+  private lastSequenceNumber: number | null = null;
+  private currentUserId: number | null = null;
+  // Canvas page on screen; re-announced on every (re)connect so the server keeps
+  // this connection in that page's group
+  private viewedPage: { page_index?: number; is_cover_image: boolean } | null = null;
+  // Page text as of the server's last revision, per page index (text_op editing).
+  // A page gets one from text_sync; until then edits go out as full text.
+  private textPages: Map<number, PageTextClient> = new Map();
+  private textSyncing: Set<number> = new Set();
+  private textUnsynced: Set<number> = new Set(); // Edited locally before the page synced
   public onReconnectFailed?: () => void;
   public onReconnectStateChange?: (isReconnecting: boolean, attempt: number) => void;
   public onReconnectSuccess?: () => void;
@@ -89,6 +102,10 @@ export class CollaborationService {
     }
 
     this.isConnecting = true;
+    if (this.sessionId !== sessionId) {
+      this.lastSequenceNumber = null;
+      this.viewedPage = null;
+    }
     this.sessionId = sessionId;
     
     // Persist session to sessionStorage for reconnection on refresh
@@ -144,7 +161,11 @@ export class CollaborationService {
       }
     }
 
-    const wsUrl = `${wsProtocol}://${wsHost}/ws/collaborate/${sessionId}/?token=${token}`;
+    // batch=1: the server may send several messages as one JSON array frame
+    let wsUrl = `${wsProtocol}://${wsHost}/ws/collaborate/${sessionId}/?token=${token}&batch=1`;
+    if (this.lastSequenceNumber !== null) {
+      wsUrl += `&last_seq=${this.lastSequenceNumber}`;
+    }
 
     console.log('Connecting to Collaboration WebSocket:', wsUrl.replace(token, '***TOKEN***'));
     console.log('API URL from config:', apiUrl);
@@ -160,13 +181,17 @@ export class CollaborationService {
           isConnected = true;
           this.isConnecting = false;
           this.reconnectAttempts = 0;
+          if (this.viewedPage) {
+            this.send({ type: 'view_page', ...this.viewedPage });
+          }
           resolve();
         };
 
         this.ws.onmessage = (event) => {
           try {
-            const message = JSON.parse(event.data);
-            this.handleMessage(message as CollaborationMessage);
+            const data = JSON.parse(event.data);
+            const messages = Array.isArray(data) ? data : [data];
+            messages.forEach((message) => this.handleMessage(message as CollaborationMessage));
           } catch (error) {
             console.error('Failed to parse WebSocket message:', error);
           }
@@ -237,6 +262,9 @@ export class CollaborationService {
       this.ws = null;
     }
     this.sessionId = null;
+    this.lastSequenceNumber = null;
+    this.viewedPage = null;
+    this.resetTextPages();
     this.messageHandlers.clear();
     this.clearPersistedSession();
   }
@@ -315,15 +343,29 @@ export class CollaborationService {
 
   /**
    * Send text edit operation
-   * Include both page_id (local id) and page_index to help remote clients map correctly.
+   * Once the page is synced only the changed span goes out (text_op); before that the
+   * full text is sent with both page_id (local id) and page_index so remote clients map it.
    */
   sendTextEdit(pageId: number, text: string, pageIndex?: number): void {
+    if (typeof pageIndex === 'number') {
+      const page = this.textPages.get(pageIndex);
+      if (page) {
+        page.edit(text);
+        return;
+      }
+      const syncing = this.textSyncing.has(pageIndex);
+      this.textUnsynced.add(pageIndex);
+      if (syncing) return; // The resync picks the text up from the store
+    }
     this.send({
       type: 'text_edit',
       page_id: pageId,
       page_index: pageIndex,
       text
     });
+    if (typeof pageIndex === 'number') {
+      this.requestTextSync(pageIndex);
+    }
   }
 
   /**
@@ -336,6 +378,17 @@ export class CollaborationService {
     });
   }
 
+  /**
+   * Tell the server which canvas is on screen (nothing: the canvas was closed)
+   * so it only forwards that page's strokes and cursors
+   */
+  viewPage(pageIndex?: number, isCoverImage: boolean = false): void {
+    this.viewedPage = pageIndex === undefined && !isCoverImage
+      ? null
+      : { page_index: pageIndex, is_cover_image: isCoverImage };
+    this.send({ type: 'view_page', page_index: pageIndex, is_cover_image: isCoverImage });
+  }
+
   /**
    * Update presence (cursor + tool + optional activity)
    */
@@ -803,6 +856,85 @@ export class CollaborationService {
     this.send(message);
   }
 
+  private requestTextSync(pageIndex: number): void {
+    if (this.textSyncing.has(pageIndex)) return;
+    this.textSyncing.add(pageIndex);
+    this.send({ type: 'text_sync', page_index: pageIndex });
+  }
+
+  private resetTextPages(): void {
+    this.textPages.clear();
+    this.textSyncing.clear();
+    this.textUnsynced.clear();
+  }
+
+  private storePageText(pageIndex: number): string | undefined {
+    if (!this.currentStoryId) return undefined;
+    const page = useStoryStore.getState().getStory(this.currentStoryId)?.pages[pageIndex];
+    return page ? page.text || '' : undefined;
+  }
+
+  /**
+   * Keep page text in step with the server's revisions (see collabText)
+   * Remote operations and resyncs come out as the text_edit they amount to; null drops the message.
+   */
+  private applyTextMessage(message: CollaborationMessage): CollaborationMessage | null {
+    const pageIndex = message.page_index;
+    switch (message.type) {
+      case 'init':
+      case 'page_added':
+      case 'page_deleted':
+        // New connection or shifted page indices: pages resync on their next edit
+        this.resetTextPages();
+        return message;
+
+      case 'text_edit':
+        // A full-text edit restarts the page's revisions on the server
+        if (typeof pageIndex === 'number' && message.user_id !== this.currentUserId) {
+          this.textPages.delete(pageIndex);
+          this.requestTextSync(pageIndex);
+        }
+        return message;
+
+      case 'text_op_ack':
+        this.textPages.get(pageIndex)?.ack(message.revision);
+        return null;
+
+      case 'text_op': {
+        const page = this.textPages.get(pageIndex);
+        if (page) {
+          // Typing still waiting for the debounce goes first so the remote edit is transformed past it
+          const local = this.storePageText(pageIndex);
+          if (local !== undefined) page.edit(local);
+          const text = page.remote(message.revision, message.ops);
+          if (text !== null) {
+            return { type: 'text_edit', user_id: message.user_id, username: message.username, page_index: pageIndex, text };
+          }
+          this.textPages.delete(pageIndex);
+        }
+        this.requestTextSync(pageIndex);
+        return null;
+      }
+
+      case 'text_resync': {
+        this.textSyncing.delete(pageIndex);
+        const page = new PageTextClient(message.revision, message.text, (revision, ops) => {
+          this.send({ type: 'text_op', page_index: pageIndex, revision, ops });
+        });
+        this.textPages.set(pageIndex, page);
+        const local = this.storePageText(pageIndex);
+        if (this.textUnsynced.delete(pageIndex)) {
+          // Local edits win, as a full-text edit would: they go out as an operation on the server's text
+          if (local !== undefined) page.edit(local);
+          return null;
+        }
+        if (local === message.text) return null;
+        return { type: 'text_edit', page_index: pageIndex, text: message.text };
+      }
+    }
+    return message;
+  }
+
   private syncToStore(message: any): void {
     console.log('syncToStore ENTRY:', message.type, 'currentStoryId:', this.currentStoryId);
     if (!this.currentStoryId) return;
@@ -842,10 +974,57 @@ export class CollaborationService {
     }
   }
 
+  /**
+   * Rebuild the live message a missed operation was broadcast as
+   * (see RecentOperations / OperationCompactor.serialize on the server)
+   */
+  private replayMessage(op: any): CollaborationMessage | null {
+    const data = op.operation_data || {};
+    const base = { sequence_number: op.sequence_number, user_id: op.user_id };
+    const canvas = { page_id: data.page_id, page_index: data.page_index, is_cover_image: data.is_cover_image || false };
+    switch (op.operation_type) {
+      case 'draw':
+        return { ...base, type: 'draw', data: data.drawing_data, ...canvas };
+      case 'clear':
+        return { ...base, type: 'clear', ...canvas };
+      case 'transform':
+      case 'delete':
+        return { ...base, type: op.operation_type, data };
+      case 'text_edit':
+        return { ...base, type: 'text_edit', page_id: data.page_id, page_index: data.page_index, text: data.text };
+      case 'page_change':
+        return { ...base, type: 'page_change', page_number: data.page_number };
+      case 'add_page':
+        return { ...base, type: 'page_added', page_data: data };
+      case 'delete_page':
+        return { ...base, type: 'page_deleted', page_id: data.page_id, page_index: data.page_index };
+      case 'text_edit_advanced':
+        return { ...base, type: 'text_edit_advanced', data: data.text_data };
+      case 'layer_operation':
+        return { ...base, type: 'layer_operation', operation: data.operation, data: data.layer_data };
+      case 'transform_operation':
+        return { ...base, type: 'transform_operation', data: data.transform_data };
+      case 'delete_item':
+        return { ...base, type: 'delete_item', data: data.delete_data };
+      default:
+        return null;
+    }
+  }
+
+  private trackSequence(message: CollaborationMessage): void {
+    const sequenceNumber = message.sequence_number;
+    if (typeof sequenceNumber === 'number' &&
+        (this.lastSequenceNumber === null || sequenceNumber > this.lastSequenceNumber)) {
+      this.lastSequenceNumber = sequenceNumber;
+    }
+  }
+
   private handleMessage(message: CollaborationMessage): void {
     console.log('WS message received:', message.type, message);
+    this.trackSequence(message);
     // Deep clone the message to avoid any reference issues
-    const clonedMessage = JSON.parse(JSON.stringify(message));
+    const clonedMessage = this.applyTextMessage(JSON.parse(JSON.stringify(message)));
+    if (!clonedMessage) return;
 
     this.syncToStore(clonedMessage);
 
@@ -859,6 +1038,26 @@ export class CollaborationService {
     if (allHandlers) {
       allHandlers.forEach(handler => handler(clonedMessage));
     }
+
+    if (clonedMessage.type === 'init') {
+      this.replayMissedOperations(clonedMessage);
+    }
+  }
+
+  /**
+   * After a delta init (reconnect with ?last_seq=), replay what happened while we
+   * were away as the live messages it was sent as. Our own operations were applied
+   * locally when we made them.
+   */
+  private replayMissedOperations(init: CollaborationMessage): void {
+    if (init.current_user_id) {
+      this.currentUserId = init.current_user_id;
+    }
+    if (!init.delta || !Array.isArray(init.missed_operations)) return;
+    init.missed_operations
+      .filter((op: any) => op.user_id !== this.currentUserId)
+      .map((op: any) => this.replayMessage(op))
+      .forEach((missed: CollaborationMessage | null) => missed && this.handleMessage(missed));
   }
 
   private async attemptReconnect(): Promise<void> {
@@ -2,12 +2,16 @@
 // Routes through the secure Django backend proxy — API key never exposed to browser.
 // Backend endpoint: POST /api/ai/groq/generate-story/
 
+import { readStoryStream } from './storyStream';
+
 const BACKEND_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 const GROQ_MODEL = 'llama-3.3-70b-versatile';
 
 export interface GroqGenerationConfig {
   temperature?: number;
   maxTokens?: number;
+  /** Receives story text as it is generated (the backend streams tokens over SSE) */
+  onToken?: (text: string) => void;
 }
 
 
@@ -42,7 +46,7 @@ export async function generateStoryWithGroq(
   colorScheme: string;
   pages: Array<{ text: string; imagePrompt: string }>;
 }> {
-  const { temperature = 0.85, maxTokens = 2048 } = config;
+  const { temperature = 0.85, maxTokens = 2048, onToken } = config;
   const { genres, artStyle, pageCount, language } = options;
 
   const langInstruction =
@@ -132,6 +136,7 @@ Rules:
       ],
       temperature,
       max_tokens: maxTokens,
+      stream: Boolean(onToken),
     }),
   });
 
@@ -145,21 +150,26 @@ Rules:
     throw new Error(errMsg);
   }
 
-  const data = await response.json();
-  const content = data?.choices?.[0]?.message?.content;
-  if (!content) throw new Error('Groq returned an empty response.');
-
-  console.log('[Groq] Raw response length:', content.length, 'chars');
-
-  // Parse JSON
   let storyData: any;
-  try {
-    storyData = JSON.parse(content);
-  } catch {
-    // Try to extract JSON from any surrounding text
-    const match = content.match(/\{[\s\S]*\}/);
-    if (!match) throw new Error('Groq response was not valid JSON. Please try again.');
-    storyData = JSON.parse(match[0]);
+  if (onToken) {
+    // Streamed: the backend assembles and validates the story JSON
+    storyData = await readStoryStream(response, onToken);
+  } else {
+    const data = await response.json();
+    const content = data?.choices?.[0]?.message?.content;
+    if (!content) throw new Error('Groq returned an empty response.');
+
+    console.log('[Groq] Raw response length:', content.length, 'chars');
+
+    // Parse JSON
+    try {
+      storyData = JSON.parse(content);
+    } catch {
+      // Try to extract JSON from any surrounding text
+      const match = content.match(/\{[\s\S]*\}/);
+      if (!match) throw new Error('Groq response was not valid JSON. Please try again.');
+      storyData = JSON.parse(match[0]);
+    }
   }
 
   if (!storyData.pages || !Array.isArray(storyData.pages)) {
@@ -7,33 +7,38 @@ export interface NotificationCounts {
   total: number;
 }
 
+/** Badge counters kept by the backend (GET /badges/, badge_summary / badge_update WebSocket events) */
+export type BadgeCounter = 'messages' | 'notifications' | 'friend_requests' | 'collab_invites';
+
+/** Badge counter -> NotificationCounts field (notifications have their own unread count) */
+export const BADGE_COUNT_FIELDS: Partial<Record<BadgeCounter, keyof Omit<NotificationCounts, 'total'>>> = {
+  messages: 'unread_messages',
+  friend_requests: 'friend_requests',
+  collab_invites: 'collaboration_invites',
+};
+
+export function countsFromBadges(badges: Partial<Record<BadgeCounter, number>>): NotificationCounts {
+  const friendRequests = badges.friend_requests || 0;
+  const unreadMessages = badges.messages || 0;
+  const collaborationInvites = badges.collab_invites || 0;
+  return {
+    friend_requests: friendRequests,
+    unread_messages: unreadMessages,
+    collaboration_invites: collaborationInvites,
+    total: friendRequests + unreadMessages + collaborationInvites,
+  };
+}
+
 class NotificationService {
   /**
    * Get notification counts for all categories
+   * One request served from the backend's cached badge counters; the
+   * notification WebSocket keeps them current between fetches.
    */
   async getNotificationCounts(): Promise<NotificationCounts> {
     try {
-      // Get friend requests count
-      const friendRequestsData: any = await api.get('/friends/requests/');
-      const friendRequestsCount = friendRequestsData?.requests?.length || 0;
-
-      // Get unread messages count
-      const conversationsData: any = await api.get('/messages/conversations/');
-      const conversations = conversationsData?.conversations || [];
-      const unreadMessagesCount = conversations.reduce((total: number, conv: any) => {
-        return total + (conv.unread_count || 0);
-      }, 0);
-
-      // Get collaboration invites count
-      const collabInvitesData: any = await api.get('/collaborate/invites/');
-      const collabInvitesCount = collabInvitesData?.invitations?.length || 0;
-
-      return {
-        friend_requests: friendRequestsCount,
-        unread_messages: unreadMessagesCount,
-        collaboration_invites: collabInvitesCount,
-        total: friendRequestsCount + unreadMessagesCount + collabInvitesCount,
-      };
+      const data: any = await api.get('/badges/');
+      return countsFromBadges(data?.badges || {});
     } catch (error) {
       console.error('Error fetching notification counts:', error);
       return {
@@ -50,8 +55,8 @@ class NotificationService {
    */
   async getFriendRequestsCount(): Promise<number> {
     try {
-      const data: any = await api.get('/friends/requests/');
-      return data?.requests?.length || 0;
+      const data: any = await api.get('/badges/');
+      return data?.badges?.friend_requests || 0;
     } catch (error) {
       console.error('Error fetching friend requests count:', error);
       return 0;
@@ -63,11 +68,8 @@ class NotificationService {
    */
   async getUnreadMessagesCount(): Promise<number> {
     try {
-      const data: any = await api.get('/messages/conversations/');
-      const conversations = data?.conversations || [];
-      return conversations.reduce((total: number, conv: any) => {
-        return total + (conv.unread_count || 0);
-      }, 0);
+      const data: any = await api.get('/badges/');
+      return data?.badges?.messages || 0;
     } catch (error) {
       console.error('Error fetching unread messages count:', error);
       return 0;
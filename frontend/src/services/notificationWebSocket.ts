@@ -1,6 +1,7 @@
 /**
  * WebSocket Service for Real-time Notifications and User Presence
  */
+import { useNotificationStore } from '../stores/notificationStore';
 
 interface NotificationHandler {
   onCollaborationInvite?: (invitation: any) => void;
@@ -290,6 +291,15 @@ class NotificationWebSocketService {
         }));
         break;
 
+      case 'badge_summary':
+        // All badge counts, sent on connect
+        useNotificationStore.getState().applyBadges(message.badges || {});
+        break;
+
+      case 'badge_update':
+        useNotificationStore.getState().applyBadgeUpdate(message.counter, message.delta, message.count);
+        break;
+
       case 'pong':
         // Pong received, connection is alive
         break;
@@ -2,6 +2,8 @@
 // Routes through the secure Django backend proxy — API key never exposed to browser.
 // Backend endpoint: POST /api/ai/openrouter/generate-story/
 
+import { readStoryStream } from './storyStream';
+
 const BACKEND_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 // Free chat models verified to work with /chat/completions on OpenRouter:
 //   google/gemma-4-27b-it:free  ← current default (instruction-tuned, returns clean JSON)
@@ -14,6 +16,8 @@ export interface OpenRouterGenerationConfig {
   temperature?: number;
   maxTokens?: number;
   model?: string;
+  /** Receives story text as it is generated (the backend streams tokens over SSE) */
+  onToken?: (text: string) => void;
 }
 
 /**
@@ -40,7 +44,7 @@ export async function generateStoryWithOpenRouter(
   colorScheme: string;
   pages: Array<{ text: string; imagePrompt: string }>;
 }> {
-  const { temperature = 0.85, maxTokens = 2048, model = OPENROUTER_MODEL } = config;
+  const { temperature = 0.85, maxTokens = 2048, model = OPENROUTER_MODEL, onToken } = config;
   const { genres, artStyle, pageCount, language } = options;
 
   const langInstruction =
@@ -131,6 +135,7 @@ Rules:
       ],
       temperature,
       max_tokens: maxTokens,
+      stream: Boolean(onToken),
     }),
   });
 
@@ -144,57 +149,61 @@ Rules:
     throw new Error(errMsg);
   }
 
-  const data = await response.json();
-  const content = data?.choices?.[0]?.message?.content;
-  if (!content) throw new Error('OpenRouter returned an empty response.');
-
-  console.log('[OpenRouter] Raw response length:', content.length, 'chars');
-
-  // ── Robust JSON Extraction ──────────────────────────────────────────
-  // Some free models (especially reasoning/thinking ones) output chain-of-thought
-  // before the final JSON. We scan backwards from the last '}' to find the
-  // last complete top-level JSON object in the response.
   let storyData: any;
-
-  function extractLastJson(raw: string): string | null {
-    // Strip markdown code fences first
-    const fenceMatch = raw.match(/```(?:json)?\s*([\s\S]*?)\s*```/);
-    if (fenceMatch) return fenceMatch[1].trim();
-
-    // Find the LAST closing brace and walk backwards to its matching opener
-    const lastClose = raw.lastIndexOf('}');
-    if (lastClose === -1) return null;
-
-    let depth = 0;
-    for (let i = lastClose; i >= 0; i--) {
-      if (raw[i] === '}') depth++;
-      if (raw[i] === '{') depth--;
-      if (depth === 0) return raw.substring(i, lastClose + 1);
+  if (onToken) {
+    // Streamed: the backend assembles and validates the story JSON
+    storyData = await readStoryStream(response, onToken);
+  } else {
+    const data = await response.json();
+    const content = data?.choices?.[0]?.message?.content;
+    if (!content) throw new Error('OpenRouter returned an empty response.');
+
+    console.log('[OpenRouter] Raw response length:', content.length, 'chars');
+
+    // ── Robust JSON Extraction ──────────────────────────────────────────
+    // Some free models (especially reasoning/thinking ones) output chain-of-thought
+    // before the final JSON. We scan backwards from the last '}' to find the
+    // last complete top-level JSON object in the response.
+    function extractLastJson(raw: string): string | null {
+      // Strip markdown code fences first
+      const fenceMatch = raw.match(/```(?:json)?\s*([\s\S]*?)\s*```/);
+      if (fenceMatch) return fenceMatch[1].trim();
+
+      // Find the LAST closing brace and walk backwards to its matching opener
+      const lastClose = raw.lastIndexOf('}');
+      if (lastClose === -1) return null;
+
+      let depth = 0;
+      for (let i = lastClose; i >= 0; i--) {
+        if (raw[i] === '}') depth++;
+        if (raw[i] === '{') depth--;
+        if (depth === 0) return raw.substring(i, lastClose + 1);
+      }
+      return null;
     }
-    return null;
-  }
 
-  function sanitizeJson(raw: string): string {
-    return raw
-      .replace(/,\s*([}\]])/g, '$1') // trailing commas
-      .replace(/[\u0000-\u0008\u000B\u000C\u000E-\u001F]/g, ' ') // control chars (keep \t \n \r)
-      .replace(/^\uFEFF/, '') // BOM
-      .trim();
-  }
+    function sanitizeJson(raw: string): string {
+      return raw
+        .replace(/,\s*([}\]])/g, '$1') // trailing commas
+        .replace(/[\u0000-\u0008\u000B\u000C\u000E-\u001F]/g, ' ') // control chars (keep \t \n \r)
+        .replace(/^\uFEFF/, '') // BOM
+        .trim();
+    }
 
-  const extracted = extractLastJson(content);
-  if (!extracted) {
-    console.error('[OpenRouter] No JSON object found. Raw output:', content);
-    throw new Error('OpenRouter response contained no JSON. Please try again.');
-  }
+    const extracted = extractLastJson(content);
+    if (!extracted) {
+      console.error('[OpenRouter] No JSON object found. Raw output:', content);
+      throw new Error('OpenRouter response contained no JSON. Please try again.');
+    }
 
-  const jsonText = sanitizeJson(extracted);
+    const jsonText = sanitizeJson(extracted);
 
-  try {
-    storyData = JSON.parse(jsonText);
-  } catch (e) {
-    console.error('[OpenRouter] JSON parse failed after extraction. Sanitized text:', jsonText);
-    throw new Error('OpenRouter response was not valid JSON. Please try again.');
+    try {
+      storyData = JSON.parse(jsonText);
+    } catch (e) {
+      console.error('[OpenRouter] JSON parse failed after extraction. Sanitized text:', jsonText);
+      throw new Error('OpenRouter response was not valid JSON. Please try again.');
+    }
   }
 
   if (!storyData.pages || !Array.isArray(storyData.pages)) {
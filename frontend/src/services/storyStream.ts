@@ -0,0 +1,33 @@
+// Reader for the backend's story SSE stream (Groq and OpenRouter story proxies with stream: true)
+
+/**
+ * Read the backend's story SSE stream: `token` events until `done` carries
+ * the validated story, or `error` says why there is none.
+ */
+export async function readStoryStream(response: Response, onToken: (text: string) => void): Promise<any> {
+  if (!response.body) throw new Error('Streaming is not supported by this browser.');
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = frame.match(/^event: (.*)$/m)?.[1];
+      const data = frame.match(/^data: (.*)$/m)?.[1];
+      if (!event || !data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload.text);
+      else if (event === 'done') return payload.story;
+      else if (event === 'error') throw new Error(payload.error || 'Story stream failed.');
+    }
+  }
+  throw new Error('Story stream ended early. Please try again.');
+}
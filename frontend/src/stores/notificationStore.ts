@@ -1,5 +1,11 @@
 import { create } from 'zustand';
-import { notificationService, NotificationCounts } from '../services/notification.service';
+import {
+  notificationService,
+  NotificationCounts,
+  BadgeCounter,
+  BADGE_COUNT_FIELDS,
+  countsFromBadges,
+} from '../services/notification.service';
 
 interface NotificationState {
   counts: NotificationCounts;
@@ -8,6 +14,8 @@ interface NotificationState {
   
   // Actions
   fetchNotificationCounts: () => Promise<void>;
+  applyBadges: (badges: Partial<Record<BadgeCounter, number>>) => void;
+  applyBadgeUpdate: (counter: BadgeCounter, delta: number, count: number | null) => void;
   incrementFriendRequests: () => void;
   decrementFriendRequests: () => void;
   incrementCollaborationInvites: () => void;
@@ -41,6 +49,27 @@ export const useNotificationStore = create<NotificationState>((set, get) => ({
     }
   },
 
+  // Seed from the badge_summary sent when the notification WebSocket connects
+  applyBadges: (badges) => {
+    set({ counts: countsFromBadges(badges), lastUpdated: new Date() });
+  },
+
+  // badge_update: the server's count when it has one, else the delta
+  applyBadgeUpdate: (counter, delta, count) => {
+    const field = BADGE_COUNT_FIELDS[counter];
+    if (!field) return;
+    const currentCounts = get().counts;
+    const value = Math.max(0, count ?? currentCounts[field] + delta);
+    set({
+      counts: {
+        ...currentCounts,
+        [field]: value,
+        total: Math.max(0, currentCounts.total + value - currentCounts[field]),
+      },
+      lastUpdated: new Date(),
+    });
+  },
+
   incrementFriendRequests: () => {
     const currentCounts = get().counts;
     set({